@@ -8,11 +8,13 @@ from schemas import ErrorResponse # Import ErrorResponse
 from exceptions import APIKeyError # Import custom exception
 from utils import audit_log_action
 
-from crud import get_db, create_api_key_for_user, get_api_key_by_value, get_api_keys_for_user, delete_api_key_for_user, update_api_key_for_user, create_dhcp_pool, get_dhcp_pool_by_name, get_all_dhcp_pools, update_dhcp_pool, delete_dhcp_pool, get_all_vms_status
+from crud import create_api_key_for_user, get_api_key_by_value, get_api_keys_for_user, delete_api_key_for_user, update_api_key_for_user, create_dhcp_pool, get_dhcp_pool_by_name, get_all_dhcp_pools, update_dhcp_pool, delete_dhcp_pool, get_all_vms_status
+from config import get_async_db
 from auth import admin_only
 from models import APIKey as DBAPIKey, DHCPPool, VMNetworkConfig, VMPortRule
 from schemas import APIKeyCreate, APIKeyResponse, APIKeyUpdate, DHCPPoolCreate, DHCPPoolResponse, DHCPPoolUpdate, ErrorResponse
 from vyos_core import get_vyos_nat_rules, vyos_api_call, generate_port_forward_commands # Changed from vyos to vyos_core
+from vyos_compiler import compile_against_router
 
 router = APIRouter()
 
@@ -21,7 +23,7 @@ router = APIRouter()
                  status.HTTP_401_UNAUTHORIZED: {"model": ErrorResponse, "description": "Unauthorized"},
                  status.HTTP_403_FORBIDDEN: {"model": ErrorResponse, "description": "Forbidden"}
              })
-async def create_new_api_key(req: APIKeyCreate, db: AsyncSession = Depends(get_db)): # Changed to async def and AsyncSession
+async def create_new_api_key(req: APIKeyCreate, db: AsyncSession = Depends(get_async_db)): # Changed to async def and AsyncSession
     """
     Create a new API key. Requires admin privileges.
     """
@@ -46,7 +48,7 @@ async def create_new_api_key(req: APIKeyCreate, db: AsyncSession = Depends(get_d
                 status.HTTP_401_UNAUTHORIZED: {"model": ErrorResponse, "description": "Unauthorized"},
                 status.HTTP_403_FORBIDDEN: {"model": ErrorResponse, "description": "Forbidden"}
             })
-async def read_api_keys(db: AsyncSession = Depends(get_db)): # Changed to async def and AsyncSession
+async def read_api_keys(db: AsyncSession = Depends(get_async_db)): # Changed to async def and AsyncSession
     """
     Retrieve all API keys. Requires admin privileges.
     """
@@ -64,7 +66,7 @@ async def read_api_keys(db: AsyncSession = Depends(get_db)): # Changed to async
                 status.HTTP_403_FORBIDDEN: {"model": ErrorResponse, "description": "Forbidden"},
                 status.HTTP_404_NOT_FOUND: {"model": ErrorResponse, "description": "API Key Not Found"}
             })
-async def read_api_key(api_key_value: str, db: AsyncSession = Depends(get_db)): # Changed to async def and AsyncSession
+async def read_api_key(api_key_value: str, db: AsyncSession = Depends(get_async_db)): # Changed to async def and AsyncSession
     """
     Retrieve a specific API key by its value. Requires admin privileges.
     """
@@ -84,7 +86,7 @@ async def read_api_key(api_key_value: str, db: AsyncSession = Depends(get_db)):
                 status.HTTP_403_FORBIDDEN: {"model": ErrorResponse, "description": "Forbidden"},
                 status.HTTP_404_NOT_FOUND: {"model": ErrorResponse, "description": "API Key Not Found"}
             })
-async def update_existing_api_key(api_key_value: str, req: APIKeyUpdate, db: AsyncSession = Depends(get_db)): # Changed to async def and AsyncSession
+async def update_existing_api_key(api_key_value: str, req: APIKeyUpdate, db: AsyncSession = Depends(get_async_db)): # Changed to async def and AsyncSession
     """
     Update an existing API key. Requires admin privileges.
     """
@@ -110,7 +112,7 @@ async def update_existing_api_key(api_key_value: str, req: APIKeyUpdate, db: Asy
                 status.HTTP_403_FORBIDDEN: {"model": ErrorResponse, "description": "Forbidden"},
                 status.HTTP_404_NOT_FOUND: {"model": ErrorResponse, "description": "API Key Not Found"}
             })
-async def delete_existing_api_key(api_key_value: str, db: AsyncSession = Depends(get_db)): # Changed to async def and AsyncSession
+async def delete_existing_api_key(api_key_value: str, db: AsyncSession = Depends(get_async_db)): # Changed to async def and AsyncSession
     """
     Delete an API key. Requires admin privileges.
     """
@@ -131,7 +133,7 @@ async def delete_existing_api_key(api_key_value: str, db: AsyncSession = Depends
                  status.HTTP_403_FORBIDDEN: {"model": ErrorResponse, "description": "Forbidden"},
                  status.HTTP_400_BAD_REQUEST: {"model": ErrorResponse, "description": "Bad Request"}
              })
-async def create_new_dhcp_pool(req: DHCPPoolCreate, db: AsyncSession = Depends(get_db)):
+async def create_new_dhcp_pool(req: DHCPPoolCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Create a new DHCP pool. Requires admin privileges.
     """
@@ -152,7 +154,7 @@ async def create_new_dhcp_pool(req: DHCPPoolCreate, db: AsyncSession = Depends(g
                  status.HTTP_401_UNAUTHORIZED: {"model": ErrorResponse, "description": "Unauthorized"},
                  status.HTTP_403_FORBIDDEN: {"model": ErrorResponse, "description": "Forbidden"}
              })
-async def read_dhcp_pools(db: AsyncSession = Depends(get_db)):
+async def read_dhcp_pools(db: AsyncSession = Depends(get_async_db)):
     """
     Retrieve all DHCP pools. Requires admin privileges.
     """
@@ -170,7 +172,7 @@ async def read_dhcp_pools(db: AsyncSession = Depends(get_db)):
                  status.HTTP_403_FORBIDDEN: {"model": ErrorResponse, "description": "Forbidden"},
                  status.HTTP_404_NOT_FOUND: {"model": ErrorResponse, "description": "DHCP Pool Not Found"}
              })
-async def read_dhcp_pool(name: str, db: AsyncSession = Depends(get_db)):
+async def read_dhcp_pool(name: str, db: AsyncSession = Depends(get_async_db)):
     """
     Retrieve a specific DHCP pool by its name. Requires admin privileges.
     """
@@ -190,7 +192,7 @@ async def read_dhcp_pool(name: str, db: AsyncSession = Depends(get_db)):
                  status.HTTP_403_FORBIDDEN: {"model": ErrorResponse, "description": "Forbidden"},
                  status.HTTP_404_NOT_FOUND: {"model": ErrorResponse, "description": "DHCP Pool Not Found"}
              })
-async def update_existing_dhcp_pool(name: str, req: DHCPPoolUpdate, db: AsyncSession = Depends(get_db)):
+async def update_existing_dhcp_pool(name: str, req: DHCPPoolUpdate, db: AsyncSession = Depends(get_async_db)):
     """
     Update an existing DHCP pool. Requires admin privileges.
     """
@@ -212,7 +214,7 @@ async def update_existing_dhcp_pool(name: str, req: DHCPPoolUpdate, db: AsyncSes
                  status.HTTP_403_FORBIDDEN: {"model": ErrorResponse, "description": "Forbidden"},
                  status.HTTP_404_NOT_FOUND: {"model": ErrorResponse, "description": "DHCP Pool Not Found"}
              })
-async def delete_existing_dhcp_pool(name: str, db: AsyncSession = Depends(get_db)):
+async def delete_existing_dhcp_pool(name: str, db: AsyncSession = Depends(get_async_db)):
     """
     Delete a DHCP pool. Requires admin privileges.
     """
@@ -233,7 +235,7 @@ async def delete_existing_dhcp_pool(name: str, db: AsyncSession = Depends(get_db
                  status.HTTP_403_FORBIDDEN: {"model": ErrorResponse, "description": "Forbidden"},
                  status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": ErrorResponse, "description": "Internal Server Error"}
              })
-async def sync_vyos_config(db: AsyncSession = Depends(get_db)):
+async def sync_vyos_config(db: AsyncSession = Depends(get_async_db)):
     """
     Synchronize VyOS NAT rules with the database. Requires admin privileges.
     This endpoint compares the current NAT rules on the VyOS router with the
@@ -281,6 +283,7 @@ async def sync_vyos_config(db: AsyncSession = Depends(get_db)):
                 }
 
         commands_to_apply = []
+        updated_rule_scopes = []
         sync_report = {"added": [], "deleted": [], "updated": [], "no_change": []}
 
         # Check DB rules against VyOS rules
@@ -320,13 +323,16 @@ async def sync_vyos_config(db: AsyncSession = Depends(get_db)):
                     needs_update = True
 
                 if needs_update:
-                    commands_to_apply.extend(generate_port_forward_commands(
+                    rule_commands = generate_port_forward_commands(
                         machine_id, db_details["internal_ip"], db_details["external_port"],
-                        db_details["nat_rule_number"], port_type, "set", # Use "set" to update all fields
+                        db_details["nat_rule_number"], port_type, "set", # Full desired state; compiled to a leaf diff below
                         protocol=db_details.get("protocol"),
                         source_ip=db_details.get("source_ip"),
                         custom_description=db_details.get("custom_description")
-                    ))
+                    )
+                    if rule_commands:
+                        commands_to_apply.extend(rule_commands)
+                        updated_rule_scopes.append(("nat", "destination", "rule", str(db_details["nat_rule_number"])))
                     sync_report["updated"].append(f"VM {machine_id} Port {port_type} (Rule {db_details['nat_rule_number']}) - Updated")
                 else:
                     sync_report["no_change"].append(f"VM {machine_id} Port {port_type} (Rule {db_details['nat_rule_number']})")
@@ -340,6 +346,7 @@ async def sync_vyos_config(db: AsyncSession = Depends(get_db)):
                 ))
                 sync_report["deleted"].append(f"VM {vm_name} Port {port_type} (Rule {vyos_rule['rule_number']})")
 
+        commands_to_apply = await compile_against_router(commands_to_apply, scopes=updated_rule_scopes)
         if commands_to_apply:
             await vyos_api_call(commands_to_apply)
             message = "VyOS configuration synchronized successfully."
@@ -11,9 +11,13 @@ import schemas # Import schemas module
 import crud # Import crud module
 from schemas import Token, UserCreate, UserResponse, LoginRequest, UserUpdate, TokenData # Keep specific imports if preferred
 from crud import get_user_by_username, create_user, get_all_users, update_user, delete_user # Keep specific imports if preferred
-from utils import verify_password, hash_password, audit_log_action
+from utils import hash_password, audit_log_action
 from config import get_async_db
 from models import User
+from utils_password import get_password_hasher
+from utils_principal_cache import Principal, credential_key, get_principal_cache
+from utils_rbac import get_permission_compiler, has_all, has_any, registry, roles_mask
+from vyos_plan import set_plan_owner
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -45,6 +49,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cache = get_principal_cache()
+    cache_key = credential_key("jwt", token)
+    principal = cache.get(cache_key)
+    if principal is not None:
+        return await principal.to_user(db)
+    generation = cache.generation
     try:
         payload = pyjwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         username: str = payload.get("sub")
@@ -70,34 +80,59 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     # Attach roles from token to user object for this request context if needed,
     # or rely on user.roles from DB. For RBAC, user.roles from DB is authoritative.
     # For simplicity, we'll use user.roles from the DB object.
+    user.permission_mask = await get_permission_compiler().compile_user(db, user)
+    token_exp = datetime.utcfromtimestamp(payload["exp"]) if payload.get("exp") else None
+    cache.put(cache_key, Principal.from_user(user, expires_at=token_exp), generation)
     return user
 
 # Placeholder for active status if implemented in User model later
 async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     # if not current_user.is_active: # Assuming an is_active field in User model
     #     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
+    set_plan_owner(current_user.id)  # A dry run's plan belongs to its caller
     return current_user
 
 
+def _permission_mask(user: User) -> int:
+    # Set by get_current_user / get_api_key_auth; fall back to the role bits for users resolved elsewhere.
+    if user.permission_mask is None:
+        user.permission_mask = get_permission_compiler().compile_roles(user.roles)
+    return user.permission_mask
+
+
 class RoleChecker:
+    """Allow users holding any of `allowed_roles`; a single AND against the user's compiled permission mask."""
+
     def __init__(self, allowed_roles: List[str]):
         self.allowed_roles = allowed_roles
+        self.required = roles_mask(allowed_roles)
 
     async def __call__(self, current_user: User = Depends(get_current_active_user)):
-        user_roles = current_user.roles # Access the hybrid property
-        
-        #logger.debug(f"User {current_user.username} roles: {user_roles}, Allowed roles: {self.allowed_roles}")
-
-        if not any(role in user_roles for role in self.allowed_roles):
+        if not has_any(_permission_mask(current_user), self.required):
             logger.warning(
-                f"User {current_user.username} with roles {user_roles} "
+                f"User {current_user.username} with roles {current_user.roles} "
                 f"attempted action requiring one of {self.allowed_roles}."
             )
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Operation not permitted. Requires one of roles: {', '.join(self.allowed_roles)}",
             )
-        #logger.info(f"User {current_user.username} authorized with roles {user_roles} for roles {self.allowed_roles}")
+
+
+class PermissionChecker:
+    """Allow users whose roles grant every permission in `required_permissions` (e.g. "network.write")."""
+
+    def __init__(self, required_permissions: List[str]):
+        self.required_permissions = required_permissions
+        self.required = registry.mask(required_permissions)
+
+    async def __call__(self, current_user: User = Depends(get_current_active_user)):
+        if not has_all(_permission_mask(current_user), self.required):
+            logger.warning(f"User {current_user.username} lacks permissions {self.required_permissions}.")
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Operation not permitted. Requires permissions: {', '.join(self.required_permissions)}",
+            )
 
 
 # Define role requirements
@@ -107,7 +142,7 @@ admin_or_owner = RoleChecker(["admin", "user"]) # For owner check, logic needs t
 @router.post("/token", response_model=Token)  # Path will be /v1/auth/token
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     user = await get_user_by_username(db, form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if not user or not await get_password_hasher().verify_login(form_data.password, user.hashed_password):
         audit_log_action(user=form_data.username, action="login", result="failure", details={"reason": "bad credentials"})
         logger.warning(f"Failed login attempt for username: {form_data.username}")  # Log failed login
         raise HTTPException(
@@ -290,7 +325,14 @@ async def get_api_key_auth(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authenticated with API Key"
         )
-    
+
+    cache = get_principal_cache()
+    cache_key = credential_key("api_key", api_key_value)
+    principal = cache.get(cache_key)
+    if principal is not None:
+        return await principal.to_user(db)
+    generation = cache.generation
+
     db_api_key = await crud.get_api_key_by_value(db, api_key_value=api_key_value)
     
     if not db_api_key:
@@ -307,17 +349,16 @@ async def get_api_key_auth(
             detail="API Key has expired"
         )
     
-    # Fetch the user associated with this API key
-    # The APIKey model should have a user relationship loaded or accessible via user_id
-    # Assuming db_api_key.user is available if relationships are configured for eager/lazy loading
-    # or we fetch it explicitly.
-    user = await get_user_by_username(db, db_api_key.user.username) # Assuming user relationship is loaded
+    # Load the owner by primary key; lazy-loading db_api_key.user is not possible on an AsyncSession.
+    user = await db.get(User, db_api_key.user_id)
     if not user:
         logger.error(f"API Key {db_api_key.id} has no associated user or user not found.")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="API Key configuration error."
         )
+    user.permission_mask = await get_permission_compiler().compile_user(db, user)
+    cache.put(cache_key, Principal.from_user(user, api_key_id=db_api_key.id, expires_at=db_api_key.expires_at), generation)
     return user # Return the user model, which includes roles
 
 # Example of how to protect an endpoint with the new API key auth:
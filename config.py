@@ -1,19 +1,54 @@
 from sqlalchemy import create_engine  # Added this import
 from sqlalchemy.exc import OperationalError
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
+import json
 import os
 
+from utils_db import build_async_engine, build_read_engine, session_routing_options
+
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./vyos.db")  # Standard sync URL
+# e.g. postgresql+asyncpg://vyos:secret@db:5432/vyos (postgres:// and postgresql:// are mapped to asyncpg)
 ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", "sqlite+aiosqlite:///./vyos_async.db")  # Async URL
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-async_engine = create_async_engine(ASYNC_DATABASE_URL, connect_args={"check_same_thread": False})  # Async engine
+# Async engine pool settings (see utils_db.py); they apply per worker process.
+def get_database_config():
+    return {
+        "POOL_SIZE": int(os.getenv("DB_POOL_SIZE", 10)),
+        "MAX_OVERFLOW": int(os.getenv("DB_MAX_OVERFLOW", 20)),
+        "POOL_TIMEOUT": float(os.getenv("DB_POOL_TIMEOUT", 30.0)),
+        # Recycle connections before server/proxy idle timeouts close them underneath us.
+        "POOL_RECYCLE": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        "POOL_PRE_PING": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+        "POOL_USE_LIFO": os.getenv("DB_POOL_USE_LIFO", "true").lower() in ("1", "true", "yes"),
+        # Prepared statement cache per connection (PostgreSQL); 0 behind PgBouncer transaction pooling.
+        "STATEMENT_CACHE_SIZE": int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100)),
+        "COMMAND_TIMEOUT": float(os.getenv("DB_COMMAND_TIMEOUT", 60.0)),
+        "APPLICATION_NAME": os.getenv("DB_APPLICATION_NAME", "vyos-api"),
+        "ECHO": os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes"),
+        # SQLite file databases only. Single-writer mode is opt-in: every session that writes holds the only
+        # writer connection until it closes, so callers must close their sessions promptly.
+        "SQLITE_SINGLE_WRITER": os.getenv("DB_SQLITE_SINGLE_WRITER", "false").lower() in ("1", "true", "yes"),
+        # How long a session waits for the writer connection before failing with WriterTimeoutError
+        "SQLITE_WRITER_TIMEOUT": float(os.getenv("DB_SQLITE_WRITER_TIMEOUT", 5.0)),
+        "SQLITE_READ_POOL_SIZE": int(os.getenv("DB_SQLITE_READ_POOL_SIZE", 4)),
+        "SQLITE_JOURNAL_MODE": os.getenv("DB_SQLITE_JOURNAL_MODE", "WAL"),
+        "SQLITE_SYNCHRONOUS": os.getenv("DB_SQLITE_SYNCHRONOUS", "NORMAL"),
+        "SQLITE_BUSY_TIMEOUT_MS": int(os.getenv("DB_SQLITE_BUSY_TIMEOUT_MS", 5000)),
+        "SQLITE_MMAP_SIZE": int(os.getenv("DB_SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+        "SQLITE_CACHE_SIZE_KB": int(os.getenv("DB_SQLITE_CACHE_SIZE_KB", 64 * 1024)),
+    }
+
+# Sync engine for scripts, migrations and tests only; request handling uses the async engine.
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {})
+async_engine = build_async_engine(ASYNC_DATABASE_URL, get_database_config())  # Async engine (the writer on SQLite)
+async_read_engine = build_read_engine(ASYNC_DATABASE_URL, get_database_config())  # SQLite single-writer mode only
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 AsyncSessionLocal = sessionmaker(
-    autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession
+    autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession,
+    **session_routing_options(async_read_engine)
 )  # Async session maker
 
 # VyOS API config
@@ -25,6 +60,192 @@ def get_vyos_config():
         "VYOS_API_KEY": os.getenv("VYOS_API_KEY", "changeme"),
     }
 
+# Shared VyOS HTTP client pool settings (see vyos_client.py)
+def get_vyos_client_config():
+    default_timeout = float(os.getenv("VYOS_TIMEOUT_DEFAULT", 30.0))
+    return {
+        "MAX_CONNECTIONS": int(os.getenv("VYOS_POOL_MAX_CONNECTIONS", 10)),
+        "MAX_KEEPALIVE_CONNECTIONS": int(os.getenv("VYOS_POOL_MAX_KEEPALIVE", 5)),
+        "KEEPALIVE_EXPIRY": float(os.getenv("VYOS_POOL_KEEPALIVE_EXPIRY", 60.0)),
+        "HTTP2": os.getenv("VYOS_HTTP2", "false").lower() in ("1", "true", "yes"),
+        "VERIFY_SSL": os.getenv("VYOS_VERIFY_SSL", "true").lower() in ("1", "true", "yes"),
+        "CONNECT_TIMEOUT": float(os.getenv("VYOS_TIMEOUT_CONNECT", 5.0)),
+        "TIMEOUTS": {
+            "default": default_timeout,
+            "config": float(os.getenv("VYOS_TIMEOUT_CONFIG", default_timeout)),
+            "retrieve": float(os.getenv("VYOS_TIMEOUT_RETRIEVE", 10.0)),
+            "backup": float(os.getenv("VYOS_TIMEOUT_BACKUP", 60.0)),
+            "restore": float(os.getenv("VYOS_TIMEOUT_RESTORE", 120.0)),
+        },
+    }
+
+# Commit coalescing for vyos_api_call (see vyos_coalescer.py)
+def get_vyos_coalescer_config():
+    return {
+        "ENABLED": os.getenv("VYOS_COALESCE_ENABLED", "true").lower() in ("1", "true", "yes"),
+        "MAX_WAIT_MS": float(os.getenv("VYOS_COALESCE_MAX_WAIT_MS", 20.0)),
+        "MAX_BATCH_COMMANDS": int(os.getenv("VYOS_COALESCE_MAX_BATCH_COMMANDS", 200)),
+    }
+
+# In-memory mirror of the router config tree (see vyos_config_mirror.py)
+def get_vyos_mirror_config():
+    return {
+        "TTL_SECONDS": float(os.getenv("VYOS_MIRROR_TTL_SECONDS", 30.0)),
+        # Number of path tokens used to pick the subtree re-fetched after a write, e.g. 'nat destination rule'.
+        "INVALIDATION_DEPTH": int(os.getenv("VYOS_MIRROR_INVALIDATION_DEPTH", 3)),
+    }
+
+# External port / NAT rule number reservations (see utils_port_allocator.py)
+def get_port_allocator_config():
+    return {
+        # Safety net for reservations not bound to a DB session; bound ones end with their transaction.
+        "RESERVATION_TTL_SECONDS": float(os.getenv("PORT_RESERVATION_TTL_SECONDS", 3600)),
+    }
+
+# Persistent background job engine (see utils_job_engine.py)
+def get_job_engine_config():
+    return {
+        "WORKERS": int(os.getenv("JOB_WORKERS", 4)),
+        "POLL_INTERVAL": float(os.getenv("JOB_POLL_INTERVAL", 2.0)),
+        "RESULT_TTL_SECONDS": int(os.getenv("JOB_RESULT_TTL_SECONDS", 86400)),
+        # Running jobs without a heartbeat for this long are treated as interrupted (e.g. by a restart).
+        "STALE_AFTER_SECONDS": int(os.getenv("JOB_STALE_AFTER_SECONDS", 600)),
+    }
+
+# Transactional outbox for router changes (see vyos_outbox.py)
+def get_vyos_outbox_config():
+    return {
+        "POLL_INTERVAL": float(os.getenv("VYOS_OUTBOX_POLL_INTERVAL", 2.0)),
+        "BATCH_MAX_ENTRIES": int(os.getenv("VYOS_OUTBOX_BATCH_MAX_ENTRIES", 50)),
+        "BATCH_MAX_COMMANDS": int(os.getenv("VYOS_OUTBOX_BATCH_MAX_COMMANDS", 200)),
+        "MAX_ATTEMPTS": int(os.getenv("VYOS_OUTBOX_MAX_ATTEMPTS", 8)),
+        "RETRY_BASE_SECONDS": float(os.getenv("VYOS_OUTBOX_RETRY_BASE_SECONDS", 2.0)),
+        "RETRY_MAX_SECONDS": float(os.getenv("VYOS_OUTBOX_RETRY_MAX_SECONDS", 300.0)),
+        # A 'sending' claim older than this is assumed abandoned by a crashed drainer.
+        "LEASE_SECONDS": int(os.getenv("VYOS_OUTBOX_LEASE_SECONDS", 120)),
+        "RETENTION_SECONDS": int(os.getenv("VYOS_OUTBOX_RETENTION_SECONDS", 7 * 86400)),
+    }
+
+# Drift detection between DB and router (see vyos_drift.py)
+def get_vyos_drift_config():
+    return {
+        "ENABLED": os.getenv("VYOS_DRIFT_ENABLED", "true").lower() == "true",
+        "INTERVAL_SECONDS": float(os.getenv("VYOS_DRIFT_INTERVAL_SECONDS", 60.0)),
+        "AUTO_RECONCILE": os.getenv("VYOS_DRIFT_AUTO_RECONCILE", "true").lower() == "true",
+        # Router-only objects inside a managed subtree are reported; deleting them is opt-in.
+        "PRUNE_UNMANAGED": os.getenv("VYOS_DRIFT_PRUNE_UNMANAGED", "false").lower() == "true",
+    }
+
+# Dry-run plans for router-mutating endpoints (see vyos_plan.py)
+def get_vyos_plan_config():
+    return {
+        "TTL_SECONDS": int(os.getenv("VYOS_PLAN_TTL_SECONDS", 3600)),
+    }
+
+# Batched change journal writer (see utils_journal_writer.py)
+def get_journal_writer_config():
+    return {
+        "ENABLED": os.getenv("JOURNAL_WRITER_ENABLED", "true").lower() == "true",
+        "MAX_BATCH": int(os.getenv("JOURNAL_WRITER_MAX_BATCH", 500)),
+        "MAX_DELAY_MS": float(os.getenv("JOURNAL_WRITER_MAX_DELAY_MS", 20.0)),
+        # Wait for the journal batch to commit before the API responds (unless the caller says otherwise).
+        "DURABLE": os.getenv("JOURNAL_WRITER_DURABLE", "true").lower() == "true",
+    }
+
+def get_journal_archive_config():
+    return {
+        "ENABLED": os.getenv("JOURNAL_ARCHIVE_ENABLED", "true").lower() == "true",
+        # Months (including the current one) kept in the hot change_journal table
+        "HOT_MONTHS": int(os.getenv("JOURNAL_ARCHIVE_HOT_MONTHS", 2)),
+        # Months kept in the database at all; older months are exported to ARCHIVE_DIR and dropped
+        "ARCHIVE_AFTER_MONTHS": int(os.getenv("JOURNAL_ARCHIVE_AFTER_MONTHS", 12)),
+        "ARCHIVE_DIR": os.getenv("JOURNAL_ARCHIVE_DIR", "./journal_archive"),
+        "INTERVAL_SECONDS": float(os.getenv("JOURNAL_ARCHIVE_INTERVAL_SECONDS", 3600)),
+        # Lease held by the worker running a pass; other workers skip their pass until it is released or expires
+        "LEASE_SECONDS": float(os.getenv("JOURNAL_ARCHIVE_LEASE_SECONDS", 3600)),
+    }
+
+def get_journal_delta_config():
+    return {
+        # Delta-encode journal payloads during each archiver pass (see utils_journal_delta.py)
+        "ENABLED": os.getenv("JOURNAL_DELTA_ENABLED", "true").lower() == "true",
+        # Rows younger than this stay untouched, so consumers reading fresh entries get full documents
+        "SETTLE_SECONDS": float(os.getenv("JOURNAL_DELTA_SETTLE_SECONDS", 300)),
+        # A full checkpoint row at least every N rows of a resource bounds reconstruction cost
+        "CHECKPOINT_INTERVAL": int(os.getenv("JOURNAL_DELTA_CHECKPOINT_INTERVAL", 16)),
+        "BATCH_SIZE": int(os.getenv("JOURNAL_DELTA_BATCH_SIZE", 5000)),
+    }
+
+def get_journal_replay_config():
+    return {
+        "ENABLED": os.getenv("JOURNAL_REPLAY_ENABLED", "true").lower() == "true",
+        # Journal events between replay snapshots; bounds the events folded per point-in-time query
+        "SNAPSHOT_EVERY": int(os.getenv("JOURNAL_REPLAY_SNAPSHOT_EVERY", 10000)),
+        # Events younger than this are not snapshotted yet, so late inserts still land before the cut
+        "SETTLE_SECONDS": float(os.getenv("JOURNAL_REPLAY_SETTLE_SECONDS", 300)),
+        "INTERVAL_SECONDS": float(os.getenv("JOURNAL_REPLAY_INTERVAL_SECONDS", 300)),
+    }
+
+def get_change_feed_config():
+    return {
+        # Long-polls and SSE streams re-check the journal this often for entries written by other workers
+        "POLL_INTERVAL": float(os.getenv("CHANGE_FEED_POLL_INTERVAL", 1.0)),
+        # How long a gap in journal ids is treated as an insert still in flight before it is skipped
+        "VISIBILITY_LAG_MS": float(os.getenv("CHANGE_FEED_VISIBILITY_LAG_MS", 2000)),
+        "MAX_BATCH": int(os.getenv("CHANGE_FEED_MAX_BATCH", 1000)),
+        "MAX_WAIT_SECONDS": float(os.getenv("CHANGE_FEED_MAX_WAIT_SECONDS", 60)),
+        "SSE_HEARTBEAT_SECONDS": float(os.getenv("CHANGE_FEED_SSE_HEARTBEAT_SECONDS", 15)),
+    }
+
+def get_principal_cache_config():
+    return {
+        "ENABLED": os.getenv("PRINCIPAL_CACHE_ENABLED", "true").lower() == "true",
+        "MAX_ENTRIES": int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", 10000)),
+        # Upper bound on how long another worker can keep serving a principal after a user/key change
+        "TTL_SECONDS": float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60)),
+    }
+
+def get_password_hash_config():
+    return {
+        # bcrypt threads; 0 means one per CPU core
+        "POOL_SIZE": int(os.getenv("PASSWORD_HASH_POOL_SIZE", 0)),
+        # Logins verifying or queued for a hash thread at once; 0 means twice POOL_SIZE
+        "LOGIN_CONCURRENCY": int(os.getenv("PASSWORD_HASH_LOGIN_CONCURRENCY", 0)),
+        "LOGIN_QUEUE_TIMEOUT_SECONDS": float(os.getenv("PASSWORD_HASH_LOGIN_QUEUE_TIMEOUT_SECONDS", 5)),
+    }
+
+def get_api_key_config():
+    return {
+        # HMAC key for the API key checksum (see utils_api_keys.py); changing it invalidates issued keys
+        "CHECKSUM_SECRET": os.getenv("API_KEY_CHECKSUM_SECRET", os.getenv("VYOS_JWT_SECRET", "changeme_jwt_secret")),
+        # Accept keys issued before the prefixed format (one indexed lookup by hash each)
+        "ALLOW_LEGACY": os.getenv("API_KEY_ALLOW_LEGACY", "true").lower() == "true",
+    }
+
+# Default per-route policies; the first policy matching method and path prefix applies
+_DEFAULT_RATE_LIMIT_POLICIES = json.dumps([
+    {"name": "login", "path": "/v1/auth/token", "methods": ["POST"], "rate": 5, "period": 60, "key": "ip"},
+    {"name": "register", "path": "/v1/auth/users", "methods": ["POST"], "rate": 5, "period": 60, "key": "ip"},
+])
+
+# GCRA rate limiting middleware (see utils_ratelimit.py)
+def get_rate_limit_config():
+    return {
+        "ENABLED": os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true",
+        # "memory" (per worker) or "sqlite" (shared by the workers on a host through SQLITE_PATH)
+        "BACKEND": os.getenv("RATE_LIMIT_BACKEND", "memory"),
+        "SQLITE_PATH": os.getenv("RATE_LIMIT_SQLITE_PATH", "./ratelimit.db"),
+        "MAX_KEYS": int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000)),
+        # JSON list of {"name", "path", "methods", "rate", "period", "burst", "key": ip|principal|tenant}
+        "POLICIES": os.getenv("RATE_LIMIT_POLICIES", _DEFAULT_RATE_LIMIT_POLICIES),
+        # Everything else
+        "DEFAULT_RATE": int(os.getenv("RATE_LIMIT_DEFAULT_RATE", 600)),
+        "DEFAULT_PERIOD_SECONDS": float(os.getenv("RATE_LIMIT_DEFAULT_PERIOD_SECONDS", 60)),
+        "DEFAULT_BURST": int(os.getenv("RATE_LIMIT_DEFAULT_BURST", 100)),
+        "DEFAULT_KEY": os.getenv("RATE_LIMIT_DEFAULT_KEY", "principal"),
+        "JWT_SECRET": os.getenv("VYOS_JWT_SECRET", "changeme_jwt_secret"),
+    }
+
 # New async DB session dependency
 async def get_async_db():
     async with AsyncSessionLocal() as session:
@@ -1,29 +1,31 @@
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
+from sqlalchemy.orm import selectinload
 from models import DHCPPool, VMNetworkConfig, VMPortRule, PortType, PortStatus, User, APIKey, FirewallPolicy, FirewallRule, StaticRoute, ChangeJournal
-from schemas import UserCreate, UserUpdate, FirewallPolicyCreate, FirewallPolicyUpdate, FirewallRuleCreate, FirewallRuleUpdate, StaticRouteCreate, StaticRouteUpdate, ChangeJournalCreate
-from utils import hash_password, audit_log_action
+from schemas import VMProvisionRequest, UserCreate, UserUpdate, FirewallPolicyCreate, FirewallPolicyUpdate, FirewallRuleCreate, FirewallRuleUpdate, StaticRouteCreate, StaticRouteUpdate, ChangeJournalCreate
+from utils import audit_log_action
 from datetime import datetime
 from typing import List, Optional, Tuple, Dict, Any
+import asyncio
+import hmac
 import logging
-from config import SessionLocal, AsyncSessionLocal, get_async_db
-from exceptions import ResourceAllocationError, VyOSAPIError
-from vyos_core import vyos_api_call, generate_firewall_policy_commands, generate_firewall_rule_commands, generate_static_route_vyos_commands
+from config import AsyncSessionLocal, get_async_db
+from exceptions import PortExhaustedError, ResourceAllocationError
+from vyos_core import generate_firewall_policy_commands, generate_firewall_rule_commands, generate_static_route_vyos_commands
+from utils_ip_allocator import ip_allocator
+from utils_port_allocator import port_allocator, Reservation
+from utils_api_keys import get_api_key_codec, hash_api_key
+from utils_password import hash_password_async
+from utils_principal_cache import get_principal_cache
+from vyos_outbox import enqueue_vyos_commands
+from utils_unit_of_work import current_unit_of_work, is_dry_run, transactional
 from fastapi import HTTPException, status
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Utility: shared DB session dependency (original sync version, might be deprecated or used for sync-specific tasks)
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # Use string type hints for all model references in function signatures
 async def get_vm_by_machine_id(db: AsyncSession, machine_id: str) -> 'Optional[VMNetworkConfig]':
     result = await db.execute(select(VMNetworkConfig).filter(VMNetworkConfig.machine_id == machine_id))
@@ -37,6 +39,7 @@ async def get_dhcp_pool_by_name(db: AsyncSession, name: str) -> 'Optional[DHCPPo
     result = await db.execute(select(DHCPool).filter(DHCPool.name == name))
     return result.scalars().first()
 
+@transactional
 async def create_dhcp_pool(db: AsyncSession, name: str, subnet: str, ip_range_start: str, ip_range_end: str, gateway: Optional[str] = None, dns_servers: Optional[str] = None, domain_name: Optional[str] = None, lease_time: Optional[int] = 86400) -> 'DHCPPool':
     pool = DHCPPool(
         name=name,
@@ -52,8 +55,7 @@ async def create_dhcp_pool(db: AsyncSession, name: str, subnet: str, ip_range_st
         updated_at=datetime.utcnow()
     )
     db.add(pool)
-    await db.commit()
-    await db.refresh(pool)
+    await db.flush()
     audit_log_action(user="system", action="create_dhcp_pool", result="success", details={"name": name, "subnet": subnet})
     return pool
 
@@ -61,6 +63,7 @@ async def get_all_dhcp_pools(db: AsyncSession) -> 'List[DHCPPool]':
     result = await db.execute(select(DHCPool))
     return result.scalars().all()
 
+@transactional
 async def update_dhcp_pool(db: AsyncSession, pool: 'DHCPPool', name: Optional[str] = None, subnet: Optional[str] = None, ip_range_start: Optional[str] = None, ip_range_end: Optional[str] = None, gateway: Optional[str] = None, dns_servers: Optional[str] = None, domain_name: Optional[str] = None, lease_time: Optional[int] = None, is_active: Optional[bool] = None) -> 'DHCPPool':
     if name is not None:
         pool.name = name
@@ -81,8 +84,10 @@ async def update_dhcp_pool(db: AsyncSession, pool: 'DHCPPool', name: Optional[st
     if is_active is not None:
         pool.is_active = is_active
     pool.updated_at = datetime.utcnow()
-    await db.commit()
-    await db.refresh(pool)
+    await db.flush()
+    pool_id = pool.id
+    # Range may have changed; rebuild the bitmap on next allocation
+    current_unit_of_work(db).after_commit(lambda: ip_allocator.invalidate(pool_id))
     return pool
 
 async def is_dhcp_pool_in_use(db: AsyncSession, pool_id: int) -> bool:
@@ -91,14 +96,17 @@ async def is_dhcp_pool_in_use(db: AsyncSession, pool_id: int) -> bool:
     result = await db.execute(stmt)
     return result.scalars().first() is not None
 
+@transactional
 async def delete_dhcp_pool(db: AsyncSession, pool: 'DHCPPool'):
     """Deletes a DHCP pool from the database. Assumes usage check has been performed by the caller."""
     pool_name = pool.name # For logging
     pool_id = pool.id # For logging
     await db.delete(pool)
-    await db.commit()
+    await db.flush()
+    current_unit_of_work(db).after_commit(lambda: ip_allocator.invalidate(pool_id))
     logger.info(f"DHCP Pool {pool_name} (ID: {pool_id}) deleted from database successfully.")
 
+@transactional
 async def create_vm(db: AsyncSession, machine_id: str, mac_address: str, internal_ip: Optional[str] = None, dhcp_pool_id: Optional[int] = None, hostname: Optional[str] = None, user_id: Optional[int] = None) -> VMNetworkConfig:
     # Quota enforcement: Only if user_id is provided
     if user_id is not None:
@@ -123,16 +131,15 @@ async def create_vm(db: AsyncSession, machine_id: str, mac_address: str, interna
         updated_at=datetime.utcnow()
     )
     db.add(vm)
-    await db.commit()
-    await db.refresh(vm)
+    await db.flush()
+    current_unit_of_work(db).after_commit(lambda: ip_allocator.mark_used([internal_ip]))
 
-    # Increment quota usage after successful creation
+    # VM row, quota usage and journal entry are committed together by the unit of work.
     if user_id is not None and quota:
         await update_quota(db, quota, usage=quota.usage + 1)
 
-    # After successful creation, log to journal
-    from crud_journal import create_journal_entry
-    await create_journal_entry(db, ChangeJournalCreate(
+    from crud_journal import record_change
+    await record_change(db, ChangeJournalCreate(
         user_id=user_id,
         resource_type="vm",
         resource_id=vm.machine_id,
@@ -149,6 +156,7 @@ async def create_vm(db: AsyncSession, machine_id: str, mac_address: str, interna
     ))
     return vm
 
+@transactional
 async def add_port_rule(db: AsyncSession, vm: VMNetworkConfig, port_type: PortType, external_port: int, nat_rule_number: int, status: PortStatus = PortStatus.enabled) -> VMPortRule:
     rule = VMPortRule(
         vm_id=vm.id, # Ensure vm_id is used if vm object is not directly linkable before commit in async
@@ -158,19 +166,209 @@ async def add_port_rule(db: AsyncSession, vm: VMNetworkConfig, port_type: PortTy
         status=status
     )
     db.add(rule)
-    await db.commit()
-    await db.refresh(rule)
+    await db.flush()
+    current_unit_of_work(db).after_commit(lambda: port_allocator.mark_used([external_port], [nat_rule_number]))
     # If vm object was passed and relationship is set up, rule.vm = vm might be needed
     # or ensure vm object is refreshed if rule.vm is accessed later.
     # For now, assuming vm_id is sufficient for linking.
     return rule
 
+async def bulk_provision_vms(db: AsyncSession, requests: List[VMProvisionRequest], user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Provision many VMs at once: IPs, ports and NAT rule numbers are allocated in one pass, and all rows
+    and every router change are written in a single transaction (router commands through the outbox).
+    Returns one result dict per request, in request order. Items that fail validation are reported
+    individually; an allocation or DB failure rolls back and fails every remaining item.
+    """
+    results: List[Dict[str, Any]] = [{"vm_name": req.vm_name, "status": "pending", "internal_ip": None,
+                                      "external_ports": {}, "nat_rule_numbers": {},
+                                      "dhcp_pool_name": req.dhcp_pool_name, "error": None} for req in requests]
+
+    def fail(index: int, error: str):
+        results[index]["status"] = "error"
+        results[index]["error"] = error
+
+    # One query each for existing names/MACs/IPs and the referenced pools.
+    names = [req.vm_name for req in requests]
+    macs = [req.mac_address for req in requests if req.mac_address]
+    static_ips = [req.ip_address for req in requests if req.ip_address and not req.dhcp_pool_name]
+    existing = await db.execute(select(VMNetworkConfig.machine_id, VMNetworkConfig.mac_address, VMNetworkConfig.internal_ip).filter(
+        (VMNetworkConfig.machine_id.in_(names)) | (VMNetworkConfig.mac_address.in_(macs)) | (VMNetworkConfig.internal_ip.in_(static_ips))
+    ))
+    taken_names, taken_macs, taken_ips = set(), set(), set()
+    for machine_id, mac, ip in existing.all():
+        taken_names.add(machine_id)
+        taken_macs.add(mac)
+        taken_ips.add(ip)
+    pool_names = {req.dhcp_pool_name for req in requests if req.dhcp_pool_name}
+    pools = {}
+    if pool_names:
+        pool_result = await db.execute(select(DHCPPool).filter(DHCPPool.name.in_(pool_names)))
+        pools = {pool.name: pool for pool in pool_result.scalars().all()}
+
+    quota = None
+    remaining_quota = None
+    if user_id is not None:
+        from crud_quota import get_quota
+        quota = await get_quota(db, user_id=user_id, resource_type="vm")
+        if quota and quota.limit is not None:
+            remaining_quota = quota.limit - quota.usage
+
+    # Validation pass
+    accepted: List[int] = []
+    port_types: Dict[int, List[PortType]] = {}
+    for i, req in enumerate(requests):
+        if req.vm_name in taken_names:
+            fail(i, f"VM with machine_id '{req.vm_name}' already exists.")
+            continue
+        if not req.mac_address:
+            fail(i, "mac_address is required.")
+            continue
+        if req.mac_address in taken_macs:
+            fail(i, f"MAC address {req.mac_address} is already in use.")
+            continue
+        if req.dhcp_pool_name:
+            if req.dhcp_pool_name not in pools:
+                fail(i, f"DHCP Pool '{req.dhcp_pool_name}' not found")
+                continue
+        elif not req.ip_address:
+            fail(i, "Either dhcp_pool_name or ip_address must be provided.")
+            continue
+        elif req.ip_address in taken_ips:
+            fail(i, f"IP address {req.ip_address} is already assigned.")
+            continue
+        try:
+            port_types[i] = list(dict.fromkeys(PortType[name.lower()] for name in (req.ports_to_open or ["ssh"])))
+        except KeyError as e:
+            fail(i, f"Invalid port type {e}.")
+            continue
+        if remaining_quota is not None and len(accepted) >= remaining_quota:
+            fail(i, f"Quota exceeded: limit={quota.limit}, usage={quota.usage + len(accepted)}")
+            continue
+        taken_names.add(req.vm_name)
+        taken_macs.add(req.mac_address)
+        if req.ip_address and not req.dhcp_pool_name:
+            taken_ips.add(req.ip_address)
+            results[i]["internal_ip"] = req.ip_address
+        accepted.append(i)
+
+    if not accepted:
+        return results
+
+    nested = current_unit_of_work(db) is not None
+    try:
+        await _write_bulk_provision(db, requests, accepted, port_types, pools, quota, results, user_id)
+    except Exception as e:
+        if nested:
+            raise  # Part of a larger unit of work, which rolls back as a whole
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        if not isinstance(e, ResourceAllocationError):
+            logger.error(f"Bulk provisioning of {len(accepted)} VMs failed: {detail}")
+            detail = f"Bulk provisioning rolled back: {detail}"
+        for i in accepted:
+            results[i]["external_ports"], results[i]["nat_rule_numbers"] = {}, {}
+            fail(i, detail)
+        return results
+
+    for i in accepted:
+        results[i]["status"] = "success"
+    logger.info(f"Bulk provisioned {len(accepted)} VMs with one DB commit.")
+    return results
+
+@transactional
+async def _write_bulk_provision(db: AsyncSession, requests: List[VMProvisionRequest], accepted: List[int],
+                                port_types: Dict[int, List[PortType]], pools: Dict[str, DHCPPool], quota,
+                                results: List[Dict[str, Any]], user_id: Optional[int]) -> None:
+    """Allocation and write pass of bulk_provision_vms, committed once or rolled back as a whole.
+
+    IPs, ports and NAT rule numbers are reserved against this transaction, so a rollback (including a
+    cancelled request) returns them to the allocators; journal hand-off and notifications run only after
+    the commit.
+    """
+    from vyos_core import generate_port_forward_commands, generate_static_mapping_commands
+    from crud_journal import notify_journal_batch, spawn_notification
+    from utils_journal_writer import JournalRecord, get_running_journal_writer
+
+    # Allocation pass: one bitmap reservation per pool, one port/NAT reservation for the whole batch.
+    by_pool: Dict[str, List[int]] = {}
+    for i in accepted:
+        if requests[i].dhcp_pool_name:
+            by_pool.setdefault(requests[i].dhcp_pool_name, []).append(i)
+    for pool_name, indexes in by_pool.items():
+        ips = await ip_allocator.reserve(db, pools[pool_name], len(indexes))
+        for i, ip in zip(indexes, ips):
+            results[i]["internal_ip"] = ip
+    total_ports = sum(len(port_types[i]) for i in accepted)
+    reservation = await reserve_ports_and_nat_rules(db, ports=total_ports, nat_rules=total_ports)
+
+    # Write pass: rows, quota, journal entries and outbox entries all go into this transaction.
+    now = datetime.utcnow()
+    journal_rows: List[ChangeJournal] = []
+    journal_writer = None if is_dry_run(db) else get_running_journal_writer()
+    ports_iter = iter(zip(reservation.ports, reservation.nat_rule_numbers))
+    for i in accepted:
+        req = requests[i]
+        pool = pools.get(req.dhcp_pool_name) if req.dhcp_pool_name else None
+        vm = VMNetworkConfig(machine_id=req.vm_name, mac_address=req.mac_address, internal_ip=results[i]["internal_ip"],
+                             dhcp_pool_id=pool.id if pool else None, hostname=req.hostname, created_at=now, updated_at=now)
+        db.add(vm)
+        await db.flush()
+        vyos_commands: List[str] = []
+        for port_type in port_types[i]:
+            external_port, nat_rule_number = next(ports_iter)
+            db.add(VMPortRule(vm_id=vm.id, port_type=port_type, external_port=external_port,
+                              nat_rule_number=nat_rule_number, status=PortStatus.enabled))
+            results[i]["external_ports"][port_type.value] = external_port
+            results[i]["nat_rule_numbers"][port_type.value] = nat_rule_number
+            # generate_port_forward_commands is still a stub that returns no commands: the NAT rules are
+            # recorded in the DB but not sent to the router (drift reports them as unmodeled).
+            vyos_commands.extend(generate_port_forward_commands(
+                req.vm_name, vm.internal_ip, external_port, nat_rule_number, port_type.value, "set"))
+        if pool and req.hostname:
+            vyos_commands.extend(generate_static_mapping_commands(mac=req.mac_address, ip=vm.internal_ip, description=req.hostname))
+        # The drainer sends the entries of the whole batch to the router in as few commits as it can.
+        enqueue_vyos_commands(db, vyos_commands, resource_type="vm", resource_id=req.vm_name)
+        journal = ChangeJournal(user_id=user_id, resource_type="vm", resource_id=req.vm_name, operation="create",
+                                before=None, after={"machine_id": req.vm_name, "mac_address": req.mac_address,
+                                                    "internal_ip": vm.internal_ip, "dhcp_pool_id": vm.dhcp_pool_id,
+                                                    "hostname": req.hostname},
+                                comment="VM created (bulk provisioning)", timestamp=now)
+        if journal_writer is None:
+            db.add(journal)
+        journal_rows.append(journal)
+    if quota is not None:
+        quota.usage = (quota.usage or 0) + len(accepted)
+    await db.flush()
+    # Detached copies of the journal rows for the notifications, readable without this session.
+    journal_records = [JournalRecord(j.id, {c.key: getattr(j, c.key) for c in ChangeJournal.__table__.columns})
+                       for j in journal_rows] if journal_writer is None else []
+    static_ips = [results[i]["internal_ip"] for i in accepted if not requests[i].dhcp_pool_name]
+
+    async def after_commit():
+        ip_allocator.mark_used(static_ips)
+        if journal_writer is not None:
+            # One batched journal insert; notifications go out from the writer, once per batch.
+            futures = [journal_writer.submit({c.key: getattr(j, c.key) for c in ChangeJournal.__table__.columns if c.key != "id"})
+                       for j in journal_rows]
+            if journal_writer.durable:
+                outcomes = await asyncio.gather(*futures, return_exceptions=True)
+                unwritten = [j for j, outcome in zip(journal_rows, outcomes) if isinstance(outcome, Exception)]
+                if unwritten:  # The VMs are committed; write their journal rows directly rather than lose them.
+                    db.add_all(unwritten)
+                    await db.commit()
+        else:
+            # Fire-and-forget, through the writer's batch path: one rule lookup on a session of its own.
+            spawn_notification(notify_journal_batch(journal_records))
+
+    current_unit_of_work(db).after_commit(after_commit)
+
 async def get_port_rule_by_vm_and_type(db: AsyncSession, vm_id: int, port_type: PortType) -> Optional[VMPortRule]:
     result = await db.execute(
         select(VMPortRule).filter_by(vm_id=vm_id, port_type=port_type)
     )
     return result.scalars().first()
 
+@transactional
 async def set_port_status(db: AsyncSession, vm: VMNetworkConfig, port_type: PortType, status: PortStatus):
     # Assuming vm object has its ID populated
     rule = await get_port_rule_by_vm_and_type(db, vm.id, port_type) # Use the new helper
@@ -181,26 +379,26 @@ async def set_port_status(db: AsyncSession, vm: VMNetworkConfig, port_type: Port
         # vm_instance = await db.get(VMNetworkConfig, vm.id) # Example if needed
         # if vm_instance:
         #     vm_instance.updated_at = datetime.utcnow()
-        await db.commit()
-        await db.refresh(rule)
+        await db.flush()
     return rule
     
+@transactional
 async def delete_port_rule_by_id(db: AsyncSession, rule_id: int):
     rule = await db.get(VMPortRule, rule_id)
     if rule:
         await db.delete(rule)
-        await db.commit()
+        await db.flush()
+        current_unit_of_work(db).after_commit(lambda: port_allocator.release([rule.external_port], [rule.nat_rule_number]))
 
-async def get_vm_ports_status(db: AsyncSession, vm: VMNetworkConfig) -> Dict[str, Dict[str, Any]]:
-    # Assuming vm object has its ID populated
-    result = await db.execute(select(VMPortRule).filter_by(vm_id=vm.id))
-    rules = result.scalars().all()
+def _ports_status(rules: List[VMPortRule]) -> Dict[str, Dict[str, Any]]:
     ports = {}
     for r in rules:
         ports[r.port_type.value] = {
             "status": r.status.value,
             "external_port": r.external_port,
-            "nat_rule_number": r.nat_rule_number
+            "nat_rule_number": r.nat_rule_number,
+            "protocol": r.protocol.value if r.protocol else None,
+            "source_ip": r.source_ip
         }
     # Ensure all port types are present
     for p_type in PortType: # Iterate over Enum members
@@ -209,18 +407,66 @@ async def get_vm_ports_status(db: AsyncSession, vm: VMNetworkConfig) -> Dict[str
             ports[p_val] = {"status": "not_active", "external_port": None, "nat_rule_number": None}
     return ports
 
-async def get_all_vms_status(db: AsyncSession) -> List[Dict[str, Any]]:
-    result = await db.execute(select(VMNetworkConfig))
+async def get_vm_ports_status(db: AsyncSession, vm: VMNetworkConfig) -> Dict[str, Dict[str, Any]]:
+    # Assuming vm object has its ID populated
+    result = await db.execute(select(VMPortRule).filter_by(vm_id=vm.id))
+    return _ports_status(result.scalars().all())
+
+def _vm_status(vm: VMNetworkConfig) -> Dict[str, Any]:
+    """Status dict for a VM whose ports and dhcp_pool relationships are already loaded."""
+    return {
+        "id": vm.id,
+        "machine_id": vm.machine_id,
+        "internal_ip": vm.internal_ip,
+        "hostname": vm.hostname,
+        "dhcp_pool_name": vm.dhcp_pool.name if vm.dhcp_pool else None,
+        "ports": _ports_status(vm.ports)
+    }
+
+def _vms_status_query(after_id: Optional[int] = None, machine_id_prefix: Optional[str] = None, hostname: Optional[str] = None,
+                      dhcp_pool_id: Optional[int] = None, ip_prefix: Optional[str] = None,
+                      port_type: Optional[PortType] = None, port_status: Optional[PortStatus] = None):
+    # Ports and DHCP pools are loaded with one IN query each per page instead of one query per VM.
+    query = select(VMNetworkConfig).options(
+        selectinload(VMNetworkConfig.ports), selectinload(VMNetworkConfig.dhcp_pool)
+    ).order_by(VMNetworkConfig.id)
+    if after_id is not None:
+        query = query.where(VMNetworkConfig.id > after_id)
+    if machine_id_prefix:
+        query = query.where(VMNetworkConfig.machine_id.startswith(machine_id_prefix, autoescape=True))
+    if hostname:
+        query = query.where(VMNetworkConfig.hostname.contains(hostname, autoescape=True))
+    if dhcp_pool_id is not None:
+        query = query.where(VMNetworkConfig.dhcp_pool_id == dhcp_pool_id)
+    if ip_prefix:
+        query = query.where(VMNetworkConfig.internal_ip.startswith(ip_prefix, autoescape=True))
+    if port_type is not None or port_status is not None:
+        port_filter = VMPortRule.vm_id == VMNetworkConfig.id
+        if port_type is not None:
+            port_filter = port_filter & (VMPortRule.port_type == port_type)
+        if port_status is not None:
+            port_filter = port_filter & (VMPortRule.status == port_status)
+        query = query.where(select(VMPortRule.id).where(port_filter).exists())
+    return query
+
+async def get_vms_status_page(db: AsyncSession, limit: int = 100, after_id: Optional[int] = None, **filters) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """One keyset page of VM status ordered by VM id; returns (items, cursor for the next page or None)."""
+    result = await db.execute(_vms_status_query(after_id=after_id, **filters).limit(limit + 1))
     vms = result.scalars().all()
-    response_data = []
-    for vm_instance in vms:
-        ports_status = await get_vm_ports_status(db, vm_instance)
-        response_data.append({
-            "machine_id": vm_instance.machine_id,
-            "internal_ip": vm_instance.internal_ip,
-            "ports": ports_status
-        })
-    return response_data
+    next_cursor = vms[limit - 1].id if len(vms) > limit else None
+    return [_vm_status(vm) for vm in vms[:limit]], next_cursor
+
+async def iter_vms_status(db: AsyncSession, batch_size: int = 500, after_id: Optional[int] = None, **filters):
+    """Yield status dicts for every matching VM, fetching `batch_size` VMs per round trip."""
+    while True:
+        items, after_id = await get_vms_status_page(db, limit=batch_size, after_id=after_id, **filters)
+        for item in items:
+            yield item
+        if after_id is None:
+            return
+
+async def get_all_vms_status(db: AsyncSession) -> List[Dict[str, Any]]:
+    return [item async for item in iter_vms_status(db)]
 
 def get_configured_ip_range() -> Tuple[str, int, int]:
     # Example: get from environment or config file
@@ -239,65 +485,40 @@ def get_configured_port_range() -> Tuple[int, int]:
 async def find_next_available_ip(db: AsyncSession, dhcp_pool: DHCPPool) -> str:
     """
     Find the next available IP in the given DHCP pool's range.
+    The address is reserved until `db` commits (kept) or its transaction ends without a commit (released).
     """
-    # Convert IP range to a list of all possible IPs
-    from ipaddress import ip_network, ip_address # Import here to avoid top-level if not always needed
-
-    # Assuming range_start and range_stop are full IP addresses
-    start_ip = ip_address(dhcp_pool.range_start)
-    end_ip = ip_address(dhcp_pool.range_stop)
-
-    result = await db.execute(select(VMNetworkConfig.internal_ip).filter(VMNetworkConfig.dhcp_pool_id == dhcp_pool.id))
-    used_ips_in_pool = {ip[0] for ip in result.all() if ip[0]} # Filter out None IPs
+    return (await allocate_ips_from_pool(db, dhcp_pool, 1))[0]
 
-    # Also consider IPs used by VMs that might have been statically assigned within this pool's network,
-    # but not explicitly linked to the pool. This is a more complex scenario.
-    # For now, we only check IPs of VMs explicitly linked to this pool or statically assigned IPs
-    # that fall within the pool's broader network range if the pool's network is defined.
-    
-    # A simpler approach for now: iterate from start_ip to end_ip
-    current_ip = start_ip
-    while current_ip <= end_ip:
-        ip_str = str(current_ip)
-        if ip_str not in used_ips_in_pool:
-            # Double check this IP is not used by any VM, even if not linked to this pool
-            # This check is important if static IPs can be assigned from within a DHCP range
-            # without being formally part of the pool's dynamic assignment.
-            existing_vm_with_ip_stmt = select(VMNetworkConfig).filter(VMNetworkConfig.internal_ip == ip_str)
-            existing_vm_result = await db.execute(existing_vm_with_ip_stmt)
-            if not existing_vm_result.scalars().first():
-                 return ip_str
-        current_ip += 1
-    
-    raise ResourceAllocationError(detail=f"No available IPs in DHCP pool '{dhcp_pool.name}' range {dhcp_pool.range_start}-{dhcp_pool.range_stop}")
+async def allocate_ips_from_pool(db: AsyncSession, dhcp_pool: DHCPPool, count: int) -> List[str]:
+    """
+    Reserve `count` IPs from the DHCP pool's range in one call, bound to the transaction of `db`.
+    Any VM address inside the range is treated as used, including static IPs not linked to the pool.
+    """
+    return await ip_allocator.reserve(db, dhcp_pool, count)
 
 async def find_next_available_port(db: AsyncSession, port_range: Dict[str, Any] = None) -> int:
     """
     Find the next available port in the given range. If port_range is None, use default config/env.
     port_range: {"start": 32000, "end": 33000}
+    The port is reserved until `db` commits (kept) or rolls back (returned to the free-list).
     """
+    return (await reserve_ports_and_nat_rules(db, ports=1, port_range=port_range)).ports[0]
+
+async def find_next_nat_rule_number(db: AsyncSession) -> int:
+    """Reserve the next free destination NAT rule number (10000-19999) for the current transaction."""
+    return (await reserve_ports_and_nat_rules(db, nat_rules=1)).nat_rule_numbers[0]
+
+async def reserve_ports_and_nat_rules(db: AsyncSession, ports: int = 0, nat_rules: int = 0, port_range: Dict[str, Any] = None) -> Reservation:
+    """Reserve external ports and NAT rule numbers in one batch, bound to the transaction of `db`."""
     if port_range:
         port_start = int(port_range.get("start", 32000))
         port_end = int(port_range.get("end", 33000))
     else:
         port_start, port_end = get_configured_port_range() # This is sync
-
-    result = await db.execute(select(VMPortRule.external_port)) # Select only the column
-    used_ports = {port[0] for port in result.all()} # result.all() gives list of tuples
-
-    for port in range(port_start, port_end + 1):
-        if port not in used_ports:
-            return port
-    raise ResourceAllocationError(detail=f"No available external ports in {port_start}-{port_end} range")
-
-async def find_next_nat_rule_number(db: AsyncSession) -> int:
-    result = await db.execute(select(VMPortRule.nat_rule_number)) # Select only the column
-    used_rules = {rule_num[0] for rule_num in result.all()} # result.all() gives list of tuples
-    base = 10000
-    for rule in range(base, base + 10000):
-        if rule not in used_rules:
-            return rule
-    raise ResourceAllocationError(detail="No available NAT rule numbers")
+    try:
+        return await port_allocator.reserve(db, ports=ports, nat_rules=nat_rules, port_range=(port_start, port_end))
+    except PortExhaustedError:
+        raise PortExhaustedError(detail=f"No available external ports in {port_start}-{port_end} range")
 
 # Example error-handling wrapper for DB operations
 async def safe_commit(db: AsyncSession):
@@ -312,7 +533,7 @@ async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User
     return result.scalars().first()
 
 async def create_user(db: AsyncSession, username: str, password: str, roles: List[str]) -> User:
-    hashed_pass = hash_password(password) # Hash the password before storing
+    hashed_pass = await hash_password_async(password) # Hash the password before storing (off the event loop)
     db_user = User(
         username=username,
         hashed_password=hashed_pass,
@@ -336,9 +557,9 @@ async def update_user(db: AsyncSession, user_to_update: User, username_new: Opti
         user_to_update.username = username_new
         updated_fields.append("username")
     if password_new is not None:
-        user_to_update.hashed_password = hash_password(password_new)
+        user_to_update.hashed_password = await hash_password_async(password_new)
         updated_fields.append("password")
-    if roles_new is not None and user_to_update.roles_list != roles_new: # Compare with list form
+    if roles_new is not None and user_to_update.roles != roles_new: # Compare with list form
         user_to_update.roles = roles_new
         updated_fields.append("roles")
     
@@ -346,6 +567,7 @@ async def update_user(db: AsyncSession, user_to_update: User, username_new: Opti
         user_to_update.updated_at = datetime.utcnow()
         await db.commit()
         await db.refresh(user_to_update)
+        get_principal_cache().invalidate_user(user_to_update.id)
         logger.info(f"User {user_to_update.username} (ID: {user_to_update.id}) updated. Fields changed: {', '.join(updated_fields)}.") # Log user update
     else:
         logger.info(f"No update performed for user {user_to_update.username} (ID: {user_to_update.id}) as no new data provided or data is the same.")
@@ -356,15 +578,16 @@ async def delete_user(db: AsyncSession, user_to_delete: User):
     user_id = user_to_delete.id
     await db.delete(user_to_delete)
     await db.commit()
+    get_principal_cache().invalidate_user(user_id)
     logger.info(f"User {username} (ID: {user_id}) deleted successfully.") # Log user deletion
 
 # API Key CRUD operations
 async def create_api_key_for_user(db: AsyncSession, user_id: int, description: Optional[str] = None, expires_at: Optional[datetime] = None) -> APIKey:
-    # Generate a unique API key string (e.g., using secrets module)
-    import secrets
-    new_key_value = secrets.token_urlsafe(32)
+    # Only the prefix and hash are stored; the plaintext key is attached to the returned object for this response only.
+    new_key_value, key_prefix, key_hash = get_api_key_codec().generate()
     db_api_key = APIKey(
-        api_key=new_key_value,
+        key_prefix=key_prefix,
+        key_hash=key_hash,
         user_id=user_id,
         description=description,
         created_at=datetime.utcnow(),
@@ -373,7 +596,8 @@ async def create_api_key_for_user(db: AsyncSession, user_id: int, description: O
     db.add(db_api_key)
     await db.commit()
     await db.refresh(db_api_key)
-    logger.info(f"API Key created for user ID {user_id}.")
+    db_api_key.api_key = new_key_value
+    logger.info(f"API Key {key_prefix} created for user ID {user_id}.")
     return db_api_key
 
 async def get_api_keys_for_user(db: AsyncSession, user_id: int) -> List[APIKey]:
@@ -381,8 +605,18 @@ async def get_api_keys_for_user(db: AsyncSession, user_id: int) -> List[APIKey]:
     return result.scalars().all()
 
 async def get_api_key_by_value(db: AsyncSession, api_key_value: str) -> Optional[APIKey]:
-    result = await db.execute(select(APIKey).filter(APIKey.api_key == api_key_value))
-    return result.scalars().first()
+    codec = get_api_key_codec()
+    key_prefix = codec.parse(api_key_value)
+    if key_prefix is not None:
+        result = await db.execute(select(APIKey).filter(APIKey.key_prefix == key_prefix))
+        api_key = result.scalars().first()
+        if api_key is not None and hmac.compare_digest(api_key.key_hash, hash_api_key(api_key_value)):
+            return api_key
+        return None
+    if codec.is_legacy(api_key_value):
+        result = await db.execute(select(APIKey).filter(APIKey.key_hash == hash_api_key(api_key_value)))
+        return result.scalars().first()
+    return None  # Malformed or forged: rejected without a query
 
 async def get_api_key_by_id_and_user(db: AsyncSession, api_key_id: int, user_id: int) -> Optional[APIKey]:
     result = await db.execute(select(APIKey).filter(APIKey.id == api_key_id, APIKey.user_id == user_id))
@@ -393,6 +627,7 @@ async def delete_api_key_for_user(db: AsyncSession, api_key_id: int, user_id: in
     if api_key:
         await db.delete(api_key)
         await db.commit()
+        get_principal_cache().invalidate_api_key(api_key_id)
         logger.info(f"API Key ID {api_key_id} for user ID {user_id} deleted.")
         return True
     logger.warning(f"Attempt to delete non-existent API Key ID {api_key_id} for user ID {user_id} or key does not belong to user.")
@@ -409,16 +644,47 @@ async def update_api_key_for_user(db: AsyncSession, api_key_id: int, user_id: in
     api_key.updated_at = datetime.utcnow()
     await db.commit()
     await db.refresh(api_key)
+    get_principal_cache().invalidate_api_key(api_key_id)
     logger.info(f"API Key ID {api_key_id} for user ID {user_id} updated.")
     return api_key
 
 # Firewall Policy CRUD operations
+# Router changes are staged in the VyOS outbox in the same transaction as the DB change and applied
+# by the outbox drainer (see vyos_outbox.py), so these functions never wait on the router.
+def _firewall_policy_scope(policy_name: str) -> Tuple[str, ...]:
+    return ("firewall", "name", policy_name)
+
+def firewall_policy_vyos_commands(db_policy: FirewallPolicy, rules: List[FirewallRule]) -> List[str]:
+    """Full desired router state for a policy and the given rules."""
+    commands = generate_firewall_policy_commands(
+        policy_name=db_policy.name,
+        default_action=db_policy.default_action,
+        description=db_policy.description,
+        action="set"
+    )
+    for rule in rules:
+        commands.extend(generate_firewall_rule_commands(
+            policy_name=db_policy.name,
+            rule_number=rule.rule_number,
+            rule_data=rule.to_dict(),
+            action="set"
+        ))
+    return commands
+
+async def _firewall_policy_vyos_commands(db: AsyncSession, db_policy: FirewallPolicy) -> List[str]:
+    return firewall_policy_vyos_commands(db_policy, await get_firewall_rules_for_policy(db, db_policy.id))
+
+@transactional
 async def create_firewall_policy(db: AsyncSession, policy: FirewallPolicyCreate, user_id: int) -> FirewallPolicy:
     # Check for existing policy with the same name for this user
     existing_policy = await get_firewall_policy_by_name(db, policy.name, user_id)
     if existing_policy:
         raise ResourceAllocationError(detail=f"Firewall policy named '{policy.name}' already exists for this user.")
 
+    rule_numbers = [rule_data.rule_number for rule_data in policy.rules or []]
+    if len(rule_numbers) != len(set(rule_numbers)):
+        raise ResourceAllocationError(detail=f"Duplicate rule numbers in firewall policy '{policy.name}'.")
+
     db_policy = FirewallPolicy(
         name=policy.name,
         description=policy.description,
@@ -428,12 +694,16 @@ async def create_firewall_policy(db: AsyncSession, policy: FirewallPolicyCreate,
         updated_at=datetime.utcnow()
     )
     db.add(db_policy)
-    await db.commit()
-    await db.refresh(db_policy)
-
-    # Journal entry for firewall policy creation
-    from crud_journal import create_journal_entry
-    await create_journal_entry(db, ChangeJournalCreate(
+    await db.flush()
+    db_rules = [_build_firewall_rule(rule_data, db_policy.id) for rule_data in policy.rules or []]
+    db.add_all(db_rules)
+    await db.flush()
+
+    # Policy, rules, the router change and the journal entry commit (or roll back) together.
+    enqueue_vyos_commands(db, await _firewall_policy_vyos_commands(db, db_policy), resource_type="firewall_policy",
+                          resource_id=db_policy.id, scopes=[_firewall_policy_scope(db_policy.name)])
+    from crud_journal import record_change
+    await record_change(db, ChangeJournalCreate(
         user_id=user_id,
         resource_type="firewall_policy",
         resource_id=str(db_policy.id),
@@ -446,36 +716,17 @@ async def create_firewall_policy(db: AsyncSession, policy: FirewallPolicyCreate,
         },
         comment="Firewall policy created"
     ))
-
-    # Apply to VyOS
-    vyos_commands = generate_firewall_policy_commands(
-        policy_name=db_policy.name,
-        default_action=db_policy.default_action,
-        description=db_policy.description,
-        action="set"
-    )
-    try:
-        await vyos_api_call(vyos_commands)
-        logger.info(f"Firewall Policy '{db_policy.name}' successfully applied to VyOS.")
-    except VyOSAPIError as e:
-        logger.error(f"Failed to apply Firewall Policy '{db_policy.name}' to VyOS: {e.detail}. Rolling back DB changes.")
-        # Rollback DB entry if VyOS call fails
-        await db.delete(db_policy)
-        await db.commit()
-        raise # Re-raise the VyOSAPIError to inform the client
-
-    if policy.rules:
-        for rule_data in policy.rules:
-            try:
-                await create_firewall_rule(db, rule_data, db_policy.id, db_policy.name) # Pass policy_name for VyOS
-            except (ResourceAllocationError, VyOSAPIError) as e_rule:
-                logger.error(f"Failed to create rule for policy '{db_policy.name}' due to: {e_rule}. Policy created, but this rule failed.")
-                # Decide on rollback strategy: either policy is created without this rule, or policy creation fails entirely.
-                # For now, let's assume policy is created, but problematic rules are skipped and error logged.
-                # A more robust solution might involve a full transaction rollback for the policy if any rule fails.
-
-    await db.refresh(db_policy) # Refresh to load the rules relationship if any were successfully created
-    logger.info(f"Firewall Policy '{db_policy.name}' created in DB for user ID {user_id}. VyOS application attempted.")
+    for db_rule in db_rules:
+        await record_change(db, ChangeJournalCreate(
+            user_id=user_id,
+            resource_type="firewall_rule",
+            resource_id=str(db_rule.id),
+            operation="create",
+            before=None,
+            after=_firewall_rule_journal_state(db_rule, db_policy.name),
+            comment="Firewall rule created"
+        ))
+    logger.info(f"Firewall Policy '{db_policy.name}' created in DB for user ID {user_id} with {len(rule_numbers)} rules; VyOS update queued.")
     return db_policy
 
 async def get_firewall_policy(db: AsyncSession, policy_id: int, user_id: int) -> Optional[FirewallPolicy]:
@@ -496,6 +747,7 @@ async def get_all_firewall_policies_for_user(db: AsyncSession, user_id: int) ->
     )
     return result.scalars().all()
 
+@transactional
 async def update_firewall_policy(db: AsyncSession, policy_id: int, policy_update: FirewallPolicyUpdate, user_id: int) -> Optional[FirewallPolicy]:
     db_policy = await get_firewall_policy(db, policy_id, user_id)
     if not db_policy:
@@ -514,17 +766,12 @@ async def update_firewall_policy(db: AsyncSession, policy_id: int, policy_update
         existing_policy_with_new_name = await get_firewall_policy_by_name(db, update_data["name"], user_id)
         if existing_policy_with_new_name and existing_policy_with_new_name.id != policy_id:
             raise ResourceAllocationError(detail=f"Another firewall policy named '{update_data['name']}' already exists.")
-        # If name changes, old policy needs to be deleted from VyOS and new one created
-        # This is complex as rules are tied to the name. Simpler: disallow name change or handle carefully.
-        # For now, let's assume name change means recreating on VyOS. This is a simplification.
-        # A more robust approach would be to rename if VyOS supports it, or update rules individually.
-        # VyOS typically requires deleting the old named policy and creating a new one.
-        logger.warning(f"Changing firewall policy name from '{original_name}' to '{update_data['name']}'. This may involve deleting and recreating the policy in VyOS.")
-        # Add commands to delete old policy from VyOS (rules are part of the named policy)
+        # VyOS rules are tied to the policy name, so a rename deletes the old named policy and
+        # recreates it (with all rules) under the new name.
+        logger.warning(f"Changing firewall policy name from '{original_name}' to '{update_data['name']}'. The policy will be recreated in VyOS.")
         vyos_commands_to_run.extend(generate_firewall_policy_commands(original_name, original_default_action, original_description, action="delete"))
         db_policy.name = update_data["name"]
         updated_fields_db.append("name")
-        # New policy will be set up later with all rules
 
     if "description" in update_data and db_policy.description != update_data["description"]:
         db_policy.description = update_data["description"]
@@ -536,11 +783,14 @@ async def update_firewall_policy(db: AsyncSession, policy_id: int, policy_update
 
     if updated_fields_db:
         db_policy.updated_at = datetime.utcnow()
-        await db.commit()
-        await db.refresh(db_policy)
+        await db.flush()
+        # The drainer diffs the full policy against the router, so only changed leaves are sent.
+        vyos_commands_to_run.extend(await _firewall_policy_vyos_commands(db, db_policy))
+        enqueue_vyos_commands(db, vyos_commands_to_run, resource_type="firewall_policy", resource_id=db_policy.id,
+                              scopes=[_firewall_policy_scope(db_policy.name)])
         # Journal entry for firewall policy update
-        from crud_journal import create_journal_entry
-        await create_journal_entry(db, ChangeJournalCreate(
+        from crud_journal import record_change
+        await record_change(db, ChangeJournalCreate(
             user_id=user_id,
             resource_type="firewall_policy",
             resource_id=str(db_policy.id),
@@ -557,77 +807,38 @@ async def update_firewall_policy(db: AsyncSession, policy_id: int, policy_update
             },
             comment="Firewall policy updated"
         ))
-
-        # Apply changes to VyOS
-        # If name changed, the old policy was deleted. Now, create the new one with all its rules.
-        # Otherwise, just update the existing policy.
-        current_rules = await get_firewall_rules_for_policy(db, db_policy.id)
-        
-        vyos_policy_set_commands = generate_firewall_policy_commands(
-            policy_name=db_policy.name, # Use potentially new name
-            default_action=db_policy.default_action,
-            description=db_policy.description,
-            action="set"
-        )
-        vyos_commands_to_run.extend(vyos_policy_set_commands)
-
-        for rule in current_rules:
-            rule_data_for_vyos = rule.to_dict() # Assumes a to_dict() method on the model
-            vyos_commands_to_run.extend(generate_firewall_rule_commands(
-                policy_name=db_policy.name, # Use potentially new name
-                rule_number=rule.rule_number,
-                rule_data=rule_data_for_vyos,
-                action="set"
-            ))
-        
-        if vyos_commands_to_run:
-            try:
-                await vyos_api_call(vyos_commands_to_run)
-                logger.info(f"Firewall Policy '{db_policy.name}' successfully updated/recreated in VyOS.")
-            except VyOSAPIError as e:
-                logger.error(f"Failed to update Firewall Policy '{db_policy.name}' in VyOS: {e.detail}. DB changes were made but VyOS update failed. Manual sync may be needed.")
-                # Rollback is complex here as DB is already committed. This indicates a need for a two-phase commit or careful error handling.
-                # For now, we log the error. The DB is updated, but VyOS might be out of sync.
-                # Consider raising an error to inform the user of the partial success/failure.
-                raise VyOSAPIError(detail=f"Policy '{db_policy.name}' updated in DB, but failed to apply to VyOS: {e.detail}. Manual sync may be required.", status_code=e.status_code)
+        logger.info(f"Firewall Policy '{db_policy.name}' updated in DB; VyOS update queued.")
     else:
         logger.info(f"No update performed for Firewall Policy '{db_policy.name}' (ID: {db_policy.id}).")
     
     return db_policy
 
+@transactional
 async def delete_firewall_policy(db: AsyncSession, policy_id: int, user_id: int) -> bool:
     db_policy = await get_firewall_policy(db, policy_id, user_id)
     if db_policy:
         policy_name = db_policy.name # For logging and VyOS command
-        
-        # Delete from VyOS first
-        vyos_commands = generate_firewall_policy_commands(policy_name, db_policy.default_action, db_policy.description, action="delete")
-        try:
-            await vyos_api_call(vyos_commands)
-            logger.info(f"Firewall Policy '{policy_name}' successfully deleted from VyOS.")
-        except VyOSAPIError as e:
-            logger.error(f"Failed to delete Firewall Policy '{policy_name}' from VyOS: {e.detail}. DB deletion will proceed, but VyOS may be out of sync.")
-            # Decide if DB deletion should proceed if VyOS fails. For now, it does.
-            # Consider raising an error to inform the user of the partial success/failure.
-            # raise VyOSAPIError(detail=f"Failed to delete policy '{policy_name}' from VyOS: {e.detail}. DB deletion not performed.", status_code=e.status_code)
+        policy_before = {
+            "name": policy_name,
+            "description": db_policy.description,
+            "default_action": db_policy.default_action
+        }
 
+        vyos_commands = generate_firewall_policy_commands(policy_name, db_policy.default_action, db_policy.description, action="delete")
+        enqueue_vyos_commands(db, vyos_commands, resource_type="firewall_policy", resource_id=policy_id)
         # Rules are cascade deleted by the relationship setting in DB
         await db.delete(db_policy)
-        await db.commit()
-        logger.info(f"Firewall Policy '{policy_name}' (ID: {policy_id}) deleted from DB for user ID {user_id}.")
+        await db.flush()
+        logger.info(f"Firewall Policy '{policy_name}' (ID: {policy_id}) deleted from DB for user ID {user_id}; VyOS delete queued.")
         # Journal entry for firewall policy deletion
-        from crud_journal import create_journal_entry
+        from crud_journal import record_change
         from schemas import ChangeJournalCreate
-        await create_journal_entry(db, ChangeJournalCreate(
+        await record_change(db, ChangeJournalCreate(
             user_id=user_id,
             resource_type="firewall_policy",
             resource_id=str(policy_id),
             operation="delete",
-            before={
-                "name": policy_name,
-                "description": db_policy.description,
-                "default_action": db_policy.default_action
-            },
+            before=policy_before,
             after=None,
             comment="Firewall policy deleted"
         ))
@@ -637,14 +848,7 @@ async def delete_firewall_policy(db: AsyncSession, policy_id: int, user_id: int)
     return False
 
 # Firewall Rule CRUD operations
-async def create_firewall_rule(db: AsyncSession, rule: FirewallRuleCreate, policy_id: int, policy_name: str) -> FirewallRule: # Added policy_name
-    # Check if rule number already exists for this policy
-    existing_rule_check = await db.execute(
-        select(FirewallRule).filter_by(policy_id=policy_id, rule_number=rule.rule_number)
-    )
-    if existing_rule_check.scalars().first():
-        raise ResourceAllocationError(detail=f"Firewall rule number {rule.rule_number} already exists in policy ID {policy_id}.")
-
+def _build_firewall_rule(rule: FirewallRuleCreate, policy_id: int) -> FirewallRule:
     rule_dict = rule.dict()
     # Convert enums to their values if necessary for model instantiation, though Pydantic usually handles this.
     if hasattr(rule_dict.get('action'), 'value'):
@@ -658,28 +862,58 @@ async def create_firewall_rule(db: AsyncSession, rule: FirewallRuleCreate, polic
     )
     db_rule.created_at = datetime.utcnow()
     db_rule.updated_at = datetime.utcnow()
+    return db_rule
+
+async def _resolve_policy_name(db: AsyncSession, policy_id: int, policy_name: Optional[str]) -> str:
+    if policy_name:
+        return policy_name
+    result = await db.execute(select(FirewallPolicy.name).filter(FirewallPolicy.id == policy_id))
+    name = result.scalar_one_or_none()
+    if name is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Firewall policy ID {policy_id} not found.")
+    return name
+
+def _firewall_rule_scope(policy_name: str, rule_number: int) -> Tuple[str, ...]:
+    return ("firewall", "name", policy_name, "rule", str(rule_number))
+
+def _firewall_rule_journal_state(rule: FirewallRule, policy_name: str) -> Dict[str, Any]:
+    state = {k: v for k, v in rule.to_dict().items() if k not in ("id", "created_at", "updated_at")}
+    state["policy_name"] = policy_name
+    return state
+
+@transactional
+async def create_firewall_rule(db: AsyncSession, rule: FirewallRuleCreate, policy_id: int, policy_name: Optional[str] = None) -> FirewallRule:
+    policy_name = await _resolve_policy_name(db, policy_id, policy_name)
+    # Check if rule number already exists for this policy
+    existing_rule_check = await db.execute(
+        select(FirewallRule).filter_by(policy_id=policy_id, rule_number=rule.rule_number)
+    )
+    if existing_rule_check.scalars().first():
+        raise ResourceAllocationError(detail=f"Firewall rule number {rule.rule_number} already exists in policy ID {policy_id}.")
 
+    db_rule = _build_firewall_rule(rule, policy_id)
     db.add(db_rule)
-    await db.commit()
-    await db.refresh(db_rule)
+    await db.flush()
 
-    # Apply to VyOS
     vyos_commands = generate_firewall_rule_commands(
         policy_name=policy_name,
         rule_number=db_rule.rule_number,
-        rule_data=db_rule.to_dict(), # Assumes a to_dict() method on the model
+        rule_data=db_rule.to_dict(),
         action="set"
     )
-    try:
-        await vyos_api_call(vyos_commands)
-        logger.info(f"Firewall Rule {db_rule.rule_number} for policy '{policy_name}' successfully applied to VyOS.")
-    except VyOSAPIError as e:
-        logger.error(f"Failed to apply Firewall Rule {db_rule.rule_number} for policy '{policy_name}' to VyOS: {e.detail}. Rolling back DB changes.")
-        await db.delete(db_rule)
-        await db.commit()
-        raise
+    enqueue_vyos_commands(db, vyos_commands, resource_type="firewall_rule", resource_id=db_rule.id,
+                          scopes=[_firewall_rule_scope(policy_name, db_rule.rule_number)])
+    from crud_journal import record_change
+    await record_change(db, ChangeJournalCreate(
+        resource_type="firewall_rule",
+        resource_id=str(db_rule.id),
+        operation="create",
+        before=None,
+        after=_firewall_rule_journal_state(db_rule, policy_name),
+        comment="Firewall rule created"
+    ))
 
-    logger.info(f"Firewall Rule {db_rule.rule_number} created in DB for policy ID {policy_id}. VyOS application attempted.")
+    logger.info(f"Firewall Rule {db_rule.rule_number} created in DB for policy ID {policy_id}; VyOS update queued.")
     return db_rule
 
 async def get_firewall_rule(db: AsyncSession, rule_id: int, policy_id: int) -> Optional[FirewallRule]:
@@ -695,10 +929,14 @@ async def get_firewall_rules_for_policy(db: AsyncSession, policy_id: int) -> Lis
     )
     return result.scalars().all()
 
-async def update_firewall_rule(db: AsyncSession, rule_id: int, rule_update: FirewallRuleUpdate, policy_id: int, policy_name: str) -> Optional[FirewallRule]: # Added policy_name
+@transactional
+async def update_firewall_rule(db: AsyncSession, rule_id: int, rule_update: FirewallRuleUpdate, policy_id: int, policy_name: Optional[str] = None) -> Optional[FirewallRule]:
     db_rule = await get_firewall_rule(db, rule_id, policy_id)
     if not db_rule:
         return None
+    policy_name = await _resolve_policy_name(db, policy_id, policy_name)
+    original_rule_number = db_rule.rule_number
+    rule_before = _firewall_rule_journal_state(db_rule, policy_name)
 
     update_data = rule_update.dict(exclude_unset=True)
     updated_fields_db = []
@@ -724,52 +962,74 @@ async def update_firewall_rule(db: AsyncSession, rule_id: int, rule_update: Fire
 
     if updated_fields_db:
         db_rule.updated_at = datetime.utcnow()
-        await db.commit()
-        await db.refresh(db_rule)
-        logger.info(f"Firewall Rule {db_rule.rule_number} (ID: {db_rule.id}) in policy '{policy_name}' updated in DB. Fields changed: {', '.join(updated_fields_db)}.")
+        await db.flush()
 
-        # Apply changes to VyOS
-        vyos_commands = generate_firewall_rule_commands(
+        vyos_commands = []
+        if db_rule.rule_number != original_rule_number:
+            vyos_commands.extend(generate_firewall_rule_commands(policy_name, original_rule_number, {}, action="delete"))
+        vyos_commands.extend(generate_firewall_rule_commands(
             policy_name=policy_name,
             rule_number=db_rule.rule_number,
-            rule_data=db_rule.to_dict(), # Assumes a to_dict() method
+            rule_data=db_rule.to_dict(),
             action="set"
-        )
-        try:
-            await vyos_api_call(vyos_commands)
-            logger.info(f"Firewall Rule {db_rule.rule_number} for policy '{policy_name}' successfully updated in VyOS.")
-        except VyOSAPIError as e:
-            logger.error(f"Failed to update Firewall Rule {db_rule.rule_number} for policy '{policy_name}' in VyOS: {e.detail}. DB changes were made but VyOS update failed. Manual sync may be needed.")
-            # Similar to policy update, rollback is complex. Log and potentially raise.
-            raise VyOSAPIError(detail=f"Rule {db_rule.rule_number} in policy '{policy_name}' updated in DB, but failed to apply to VyOS: {e.detail}. Manual sync may be required.", status_code=e.status_code)
+        ))
+        enqueue_vyos_commands(db, vyos_commands, resource_type="firewall_rule", resource_id=db_rule.id,
+                              scopes=[_firewall_rule_scope(policy_name, db_rule.rule_number)])
+        from crud_journal import record_change
+        await record_change(db, ChangeJournalCreate(
+            resource_type="firewall_rule",
+            resource_id=str(db_rule.id),
+            operation="update",
+            before=rule_before,
+            after=_firewall_rule_journal_state(db_rule, policy_name),
+            comment="Firewall rule updated"
+        ))
+        logger.info(f"Firewall Rule {db_rule.rule_number} (ID: {db_rule.id}) in policy '{policy_name}' updated in DB; VyOS update queued. Fields changed: {', '.join(updated_fields_db)}.")
     else:
         logger.info(f"No update performed for Firewall Rule {db_rule.rule_number} (ID: {db_rule.id}) in policy '{policy_name}'.")
     return db_rule
 
-async def delete_firewall_rule(db: AsyncSession, rule_id: int, policy_id: int, policy_name: str) -> bool: # Added policy_name
+@transactional
+async def delete_firewall_rule(db: AsyncSession, rule_id: int, policy_id: int, policy_name: Optional[str] = None) -> bool:
     db_rule = await get_firewall_rule(db, rule_id, policy_id)
     if db_rule:
+        policy_name = await _resolve_policy_name(db, policy_id, policy_name)
         rule_number = db_rule.rule_number # For logging and VyOS command
 
-        # Delete from VyOS first
-        vyos_commands = generate_firewall_rule_commands(policy_name, rule_number, {}, action="delete") # Empty dict for rule_data on delete
-        try:
-            await vyos_api_call(vyos_commands)
-            logger.info(f"Firewall Rule {rule_number} for policy '{policy_name}' successfully deleted from VyOS.")
-        except VyOSAPIError as e:
-            logger.error(f"Failed to delete Firewall Rule {rule_number} for policy '{policy_name}' from VyOS: {e.detail}. DB deletion will proceed.")
-            # Decide if DB deletion should proceed. For now, it does.
-            # Consider raising an error to inform the user of the partial success/failure.
+        rule_before = _firewall_rule_journal_state(db_rule, policy_name)
 
+        vyos_commands = generate_firewall_rule_commands(policy_name, rule_number, {}, action="delete") # Empty dict for rule_data on delete
+        enqueue_vyos_commands(db, vyos_commands, resource_type="firewall_rule", resource_id=rule_id)
         await db.delete(db_rule)
-        await db.commit()
-        logger.info(f"Firewall Rule {rule_number} (ID: {rule_id}) deleted from DB for policy ID {policy_id}.")
+        await db.flush()
+        from crud_journal import record_change
+        await record_change(db, ChangeJournalCreate(
+            resource_type="firewall_rule",
+            resource_id=str(rule_id),
+            operation="delete",
+            before=rule_before,
+            after=None,
+            comment="Firewall rule deleted"
+        ))
+        logger.info(f"Firewall Rule {rule_number} (ID: {rule_id}) deleted from DB for policy ID {policy_id}; VyOS delete queued.")
         return True
         
     logger.warning(f"Attempt to delete non-existent Firewall Rule ID {rule_id} from policy ID {policy_id} or rule does not belong to policy.")
     return False
 
 # CRUD operations for Static Routes
+def _static_route_scope(route: StaticRouteCreate) -> Tuple[str, ...]:
+    return ("protocols", "static", "route", route.destination, "next-hop", route.next_hop)
+
+def _static_route_journal_state(route: 'StaticRoute') -> Dict[str, Any]:
+    return {
+        "destination": route.destination,
+        "next_hop": route.next_hop,
+        "description": route.description,
+        "distance": route.distance
+    }
+
+@transactional
 async def create_static_route(db: AsyncSession, route: StaticRouteCreate, user_id: int) -> 'StaticRoute':
     existing_route_check = await db.execute(
         select(StaticRoute).where(
@@ -781,15 +1041,6 @@ async def create_static_route(db: AsyncSession, route: StaticRouteCreate, user_i
     if existing_route_check.scalars().first():
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Static route with this destination and next-hop already exists for this user.")
 
-    vyos_commands = await generate_static_route_vyos_commands(route, "set")
-    try:
-        # Assuming vyos_api_call returns a dict and success is indicated by no exception
-        await vyos_api_call(vyos_commands) 
-        logger.info(f"Static route {route.destination} -> {route.next_hop} successfully applied to VyOS.")
-    except VyOSAPIError as e:
-        logger.error(f"Failed to apply static route {route.destination} -> {route.next_hop} to VyOS: {e.detail}")
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Failed to apply static route to VyOS: {e.detail}")
-
     db_route = StaticRoute(
         **route.model_dump(), 
         user_id=user_id,
@@ -797,8 +1048,21 @@ async def create_static_route(db: AsyncSession, route: StaticRouteCreate, user_i
         updated_at=datetime.utcnow()
     )
     db.add(db_route)
-    await db.commit()
-    await db.refresh(db_route)
+    await db.flush()
+    vyos_commands = await generate_static_route_vyos_commands(route, "set")
+    enqueue_vyos_commands(db, vyos_commands, resource_type="static_route", resource_id=db_route.id,
+                          scopes=[_static_route_scope(route)])
+    logger.info(f"Static route {route.destination} -> {route.next_hop} created in DB; VyOS update queued.")
+    from crud_journal import record_change
+    await record_change(db, ChangeJournalCreate(
+        user_id=user_id,
+        resource_type="static_route",
+        resource_id=str(db_route.id),
+        operation="create",
+        before=None,
+        after=_static_route_journal_state(db_route),
+        comment="Static route created"
+    ))
     return db_route
 
 async def get_static_route(db: AsyncSession, route_id: int, user_id: Optional[int] = None) -> 'Optional[StaticRoute]':
@@ -821,6 +1085,7 @@ async def get_all_static_routes(db: AsyncSession, skip: int = 0, limit: int = 10
     result = await db.execute(select(StaticRoute).offset(skip).limit(limit))
     return result.scalars().all()
 
+@transactional
 async def update_static_route(db: AsyncSession, route_id: int, route_update: StaticRouteUpdate, requesting_user_id: int, is_admin: bool) -> 'Optional[StaticRoute]':
     db_route = await get_static_route(db, route_id)
     if not db_route:
@@ -853,48 +1118,35 @@ async def update_static_route(db: AsyncSession, route_id: int, route_update: Sta
         distance=final_route_data.get('distance')
     )
 
+    vyos_commands = []
     if old_vyos_route_schema:
-        vyos_delete_commands = await generate_static_route_vyos_commands(old_vyos_route_schema, "delete")
-        try:
-            await vyos_api_call(vyos_delete_commands)
-            logger.info(f"Old static route {old_vyos_route_schema.destination} -> {old_vyos_route_schema.next_hop} successfully deleted from VyOS.")
-        except VyOSAPIError as e:
-            logger.error(f"Failed to delete old static route from VyOS: {e.detail}")
-            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Failed to delete old static route from VyOS: {e.detail}")
-
-    vyos_set_commands = await generate_static_route_vyos_commands(vyos_payload_for_set_command, "set")
-    try:
-        await vyos_api_call(vyos_set_commands)
-        logger.info(f"Updated static route {vyos_payload_for_set_command.destination} -> {vyos_payload_for_set_command.next_hop} successfully applied to VyOS.")
-    except VyOSAPIError as e:
-        logger.error(f"Failed to apply updated static route to VyOS: {e.detail}")
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Failed to apply updated static route to VyOS: {e.detail}")
+        vyos_commands.extend(await generate_static_route_vyos_commands(old_vyos_route_schema, "delete"))
+    vyos_commands.extend(await generate_static_route_vyos_commands(vyos_payload_for_set_command, "set"))
 
+    route_before = _static_route_journal_state(db_route)
     for key, value in update_data.items():
         setattr(db_route, key, value)
     db_route.updated_at = datetime.utcnow()
-    await db.commit()
-    await db.refresh(db_route)
+    enqueue_vyos_commands(db, vyos_commands, resource_type="static_route", resource_id=db_route.id,
+                          scopes=[_static_route_scope(vyos_payload_for_set_command)])
+    await db.flush()
+    logger.info(f"Static route {vyos_payload_for_set_command.destination} -> {vyos_payload_for_set_command.next_hop} updated in DB; VyOS update queued.")
 
     # After DB update, log to journal
-    from crud_journal import create_journal_entry
+    from crud_journal import record_change
     from schemas import ChangeJournalCreate
-    await create_journal_entry(db, ChangeJournalCreate(
+    await record_change(db, ChangeJournalCreate(
         user_id=db_route.user_id,
         resource_type="static_route",
         resource_id=str(db_route.id),
         operation="update",
-        before={
-            "destination": db_route.destination,
-            "next_hop": db_route.next_hop,
-            "description": db_route.description,
-            "distance": db_route.distance
-        },
+        before=route_before,
         after=update_data,
         comment="Static route updated"
     ))
     return db_route
 
+@transactional
 async def delete_static_route(db: AsyncSession, route_id: int, requesting_user_id: int, is_admin: bool) -> 'Optional[StaticRoute]':
     db_route = await get_static_route(db, route_id)
     if not db_route:
@@ -910,19 +1162,14 @@ async def delete_static_route(db: AsyncSession, route_id: int, requesting_user_i
         distance=db_route.distance
     )
     vyos_commands = await generate_static_route_vyos_commands(route_schema_for_vyos, "delete")
-    try:
-        await vyos_api_call(vyos_commands)
-        logger.info(f"Static route {db_route.destination} -> {db_route.next_hop} successfully deleted from VyOS.")
-    except VyOSAPIError as e:
-        logger.error(f"Failed to delete static route from VyOS: {e.detail}. DB entry not deleted to maintain consistency.")
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Failed to delete static route from VyOS: {e.detail}. DB entry not deleted.")
-
+    enqueue_vyos_commands(db, vyos_commands, resource_type="static_route", resource_id=route_id)
     await db.delete(db_route)
-    await db.commit()
+    await db.flush()
+    logger.info(f"Static route {db_route.destination} -> {db_route.next_hop} deleted from DB; VyOS delete queued.")
     # Journal entry for static route deletion
-    from crud_journal import create_journal_entry
+    from crud_journal import record_change
     from schemas import ChangeJournalCreate
-    await create_journal_entry(db, ChangeJournalCreate(
+    await record_change(db, ChangeJournalCreate(
         user_id=db_route.user_id,
         resource_type="static_route",
         resource_id=str(route_id),
@@ -938,21 +1185,40 @@ async def delete_static_route(db: AsyncSession, route_id: int, requesting_user_i
     ))
     return db_route
 
+@transactional
 async def delete_vm(db: AsyncSession, machine_id: str):
-    from vyos_core import vyos_api_call, generate_port_forward_commands
+    from vyos_core import generate_port_forward_commands
     vm = await get_vm_by_machine_id(db, machine_id)
     if not vm:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="VM not found")
-    # Remove NAT rules from VyOS and DB
+    # Remove NAT rules from DB and queue their removal from VyOS in the same transaction
+    freed_ports = [rule.external_port for rule in vm.ports]
+    freed_nat_rules = [rule.nat_rule_number for rule in vm.ports]
+    vyos_commands = []
     for rule in vm.ports:
-        # Remove NAT rule from VyOS
-        try:
-            commands = generate_port_forward_commands(vm.internal_ip, rule.external_port, rule.port_type, action="delete")
-            await vyos_api_call(commands)
-        except Exception as e:
-            logger.warning(f"Failed to remove NAT rule {rule.nat_rule_number} from VyOS: {e}")
+        vyos_commands.extend(generate_port_forward_commands(vm.internal_ip, rule.external_port, rule.port_type, action="delete"))
         await db.delete(rule)
+    enqueue_vyos_commands(db, vyos_commands, resource_type="vm", resource_id=machine_id)
     # Delete VM
     await db.delete(vm)
-    await db.commit()
+    await db.flush()
+    freed_ip = vm.internal_ip
+    uow = current_unit_of_work(db)
+    uow.after_commit(lambda: ip_allocator.release([freed_ip]))
+    uow.after_commit(lambda: port_allocator.release(freed_ports, freed_nat_rules))
+    from crud_journal import record_change
+    await record_change(db, ChangeJournalCreate(
+        resource_type="vm",
+        resource_id=machine_id,
+        operation="delete",
+        before={
+            "machine_id": vm.machine_id,
+            "mac_address": vm.mac_address,
+            "internal_ip": vm.internal_ip,
+            "dhcp_pool_id": vm.dhcp_pool_id,
+            "hostname": vm.hostname
+        },
+        after=None,
+        comment="VM deleted"
+    ))
     logger.info(f"VM {machine_id} and all associated NAT rules deleted.")
@@ -1,14 +1,28 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from models import ChangeJournal
+from models import ChangeJournal, NotificationHistory
 from schemas import ChangeJournalEntry, ChangeJournalCreate
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Tuple
+from config import AsyncSessionLocal
 from crud_notifications import get_notification_rules, create_notification_history
 from utils_notifications import send_webhook, send_email
+from utils_unit_of_work import current_unit_of_work, is_dry_run, transactional
+from utils_journal_archive import JournalQuery, query_journal
+from utils_journal_feed import get_change_feed
 import os
 import asyncio
 
+# Fire-and-forget notification deliveries, held here so they are not garbage-collected mid-flight.
+_notification_tasks: "set[asyncio.Task]" = set()
+
+def spawn_notification(coro) -> asyncio.Task:
+    """Run a notification coroutine in the background, keeping a reference until it finishes."""
+    task = asyncio.create_task(coro)
+    _notification_tasks.add(task)
+    task.add_done_callback(_notification_tasks.discard)
+    return task
+
+@transactional
 async def create_journal_entry(db: AsyncSession, entry: ChangeJournalCreate) -> ChangeJournal:
     journal = ChangeJournal(
         user_id=entry.user_id,
@@ -21,13 +35,76 @@ async def create_journal_entry(db: AsyncSession, entry: ChangeJournalCreate) ->
         timestamp=datetime.utcnow()
     )
     db.add(journal)
-    await db.commit()
-    await db.refresh(journal)
+    await db.flush()
+
+    # Notification trigger: fire-and-forget, once the entry (and the change it records) is committed.
+    # Delivery runs on its own session; the caller's session may be in use or closed by then.
+    journal_id = journal.id
 
-    # Notification trigger: fire-and-forget
-    asyncio.create_task(trigger_notifications_for_event(db, journal))
+    async def notify():
+        get_change_feed().notify()
+        spawn_notification(notify_journal_entry(journal_id))
+
+    current_unit_of_work(db).after_commit(notify)
     return journal
 
+async def record_change(db: AsyncSession, entry: ChangeJournalCreate, durable: Optional[bool] = None) -> None:
+    """Journal a change made in `db`'s unit of work.
+
+    With the journal writer running, the entry is handed to it once the change has committed and is written
+    in the next batch; `durable` (default: JOURNAL_WRITER_DURABLE) makes the caller wait for that batch.
+    Otherwise, and always in a dry run, the entry is inserted in the same transaction as the change.
+    """
+    from utils_journal_writer import get_running_journal_writer
+    writer = get_running_journal_writer()
+    if writer is None or is_dry_run(db):
+        # A dry run's entry stays in its transaction and is rolled back with the change.
+        await create_journal_entry(db, entry)
+        return
+    async def submit():
+        try:
+            await writer.write(entry, durable=durable)
+        except Exception:
+            # The change itself is committed; do not lose its journal entry to a failed batch.
+            await create_journal_entry(db, entry)
+
+    uow = current_unit_of_work(db)
+    if uow is None:
+        await submit()
+    else:
+        uow.after_commit(submit)
+
+async def _deliver_notification(rule, journal) -> Tuple[str, Optional[str]]:
+    error = None
+    if rule.delivery_method == "webhook":
+        error = await send_webhook(rule.target, {
+            "event": journal.operation,
+            "resource_type": journal.resource_type,
+            "resource_id": journal.resource_id,
+            "user_id": journal.user_id,
+            "comment": journal.comment,
+            "timestamp": str(journal.timestamp)
+        })
+    elif rule.delivery_method == "email":
+        smtp_host = os.getenv("SMTP_HOST", "localhost")
+        smtp_port = int(os.getenv("SMTP_PORT", "465"))
+        smtp_user = os.getenv("SMTP_USER", "noreply@example.com")
+        smtp_pass = os.getenv("SMTP_PASS", "changeme")
+        subject = f"VyOS API Notification: {journal.operation} on {journal.resource_type}"
+        body = f"Event: {journal.operation}\nResource: {journal.resource_type}\nID: {journal.resource_id}\nUser: {journal.user_id}\nComment: {journal.comment}\nTime: {journal.timestamp}"
+        error = send_email(smtp_host, smtp_port, smtp_user, smtp_pass, rule.target, subject, body)
+    return ("failed" if error else "delivered"), error
+
+def _rule_matches(rule, journal) -> bool:
+    if rule.event_type != journal.operation:
+        return False
+    # Match resource_type/resource_id if specified
+    if rule.resource_type and rule.resource_type != journal.resource_type:
+        return False
+    if rule.resource_id and rule.resource_id != journal.resource_id:
+        return False
+    return True
+
 async def trigger_notifications_for_event(db: AsyncSession, journal: ChangeJournal):
     # Find matching notification rules
     rules = await get_notification_rules(
@@ -36,35 +113,9 @@ async def trigger_notifications_for_event(db: AsyncSession, journal: ChangeJourn
         is_active=True
     )
     for rule in rules:
-        # Match resource_type/resource_id if specified
-        if rule.resource_type and rule.resource_type != journal.resource_type:
+        if not _rule_matches(rule, journal):
             continue
-        if rule.resource_id and rule.resource_id != journal.resource_id:
-            continue
-        status = "delivered"
-        error = None
-        # Real delivery
-        if rule.delivery_method == "webhook":
-            error = await send_webhook(rule.target, {
-                "event": journal.operation,
-                "resource_type": journal.resource_type,
-                "resource_id": journal.resource_id,
-                "user_id": journal.user_id,
-                "comment": journal.comment,
-                "timestamp": str(journal.timestamp)
-            })
-            if error:
-                status = "failed"
-        elif rule.delivery_method == "email":
-            smtp_host = os.getenv("SMTP_HOST", "localhost")
-            smtp_port = int(os.getenv("SMTP_PORT", "465"))
-            smtp_user = os.getenv("SMTP_USER", "noreply@example.com")
-            smtp_pass = os.getenv("SMTP_PASS", "changeme")
-            subject = f"VyOS API Notification: {journal.operation} on {journal.resource_type}"
-            body = f"Event: {journal.operation}\nResource: {journal.resource_type}\nID: {journal.resource_id}\nUser: {journal.user_id}\nComment: {journal.comment}\nTime: {journal.timestamp}"
-            error = send_email(smtp_host, smtp_port, smtp_user, smtp_pass, rule.target, subject, body)
-            if error:
-                status = "failed"
+        status, error = await _deliver_notification(rule, journal)
         # Record notification history
         await create_notification_history(
             db,
@@ -79,6 +130,35 @@ async def trigger_notifications_for_event(db: AsyncSession, journal: ChangeJourn
             error=error
         )
 
+async def notify_journal_entry(journal_id: int, session_factory=None) -> None:
+    """Deliver the notifications of one committed journal entry on a session of its own."""
+    session_factory = session_factory or AsyncSessionLocal
+    async with session_factory() as db:
+        journal = await db.get(ChangeJournal, journal_id)
+        if journal is not None:
+            await trigger_notifications_for_event(db, journal)
+
+async def notify_journal_batch(records: list, session_factory=None) -> None:
+    """Journal writer consumer: one rule lookup and one history commit for a whole batch of entries."""
+    session_factory = session_factory or AsyncSessionLocal
+    async with session_factory() as db:
+        rules = await get_notification_rules(db, is_active=True)
+        if not rules:
+            return
+        now = datetime.utcnow()
+        for journal in records:
+            for rule in rules:
+                if not _rule_matches(rule, journal):
+                    continue
+                status, error = await _deliver_notification(rule, journal)
+                db.add(NotificationHistory(
+                    rule_id=rule.id, event_type=journal.operation, resource_type=journal.resource_type,
+                    resource_id=journal.resource_id, delivery_method=rule.delivery_method, target=rule.target,
+                    status=status, message={"journal_id": journal.id, "comment": journal.comment},
+                    timestamp=now, error=error,
+                ))
+        await db.commit()
+
 async def get_journal_entries(
     db: AsyncSession,
     resource_type: Optional[str] = None,
@@ -86,17 +166,11 @@ async def get_journal_entries(
     user_id: Optional[int] = None,
     operation: Optional[str] = None,
     skip: int = 0,
-    limit: int = 100
+    limit: int = 100,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
 ) -> List[ChangeJournal]:
-    query = select(ChangeJournal)
-    if resource_type:
-        query = query.filter(ChangeJournal.resource_type == resource_type)
-    if resource_id:
-        query = query.filter(ChangeJournal.resource_id == resource_id)
-    if user_id:
-        query = query.filter(ChangeJournal.user_id == user_id)
-    if operation:
-        query = query.filter(ChangeJournal.operation == operation)
-    query = query.order_by(ChangeJournal.timestamp.desc()).offset(skip).limit(limit)
-    result = await db.execute(query)
-    return result.scalars().all()
+    # Spans the hot table, monthly tables and (when since/until reach them) archive files; see utils_journal_archive.py
+    query = JournalQuery(resource_type=resource_type, resource_id=resource_id, user_id=user_id,
+                         operation=operation, since=since, until=until)
+    return await query_journal(db, query, skip=skip, limit=limit)
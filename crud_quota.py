@@ -1,12 +1,13 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from models import Quota
+from utils_unit_of_work import transactional
 
+@transactional
 async def create_quota(db: AsyncSession, **kwargs):
     quota = Quota(**kwargs)
     db.add(quota)
-    await db.commit()
-    await db.refresh(quota)
+    await db.flush()
     return quota
 
 async def get_quota(db: AsyncSession, user_id: int, resource_type: str):
@@ -20,11 +21,11 @@ async def list_quotas(db: AsyncSession, user_id: int = None):
     result = await db.execute(query)
     return result.scalars().all()
 
+@transactional
 async def update_quota(db: AsyncSession, quota: Quota, limit: int = None, usage: int = None):
     if limit is not None:
         quota.limit = limit
     if usage is not None:
         quota.usage = usage
-    await db.commit()
-    await db.refresh(quota)
+    await db.flush()
     return quota
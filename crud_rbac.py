@@ -1,12 +1,15 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from models import Role, Permission, UserRoleAssignment
+from utils_principal_cache import get_principal_cache
+from utils_rbac import get_permission_compiler
 
 async def create_role(db: AsyncSession, name: str, description: str, permissions: list[str]):
     role = Role(name=name, description=description, permissions=','.join(permissions))
     db.add(role)
     await db.commit()
     await db.refresh(role)
+    get_permission_compiler().invalidate()
     return role
 
 async def get_role_by_name(db: AsyncSession, name: str):
@@ -22,6 +25,30 @@ async def assign_role_to_user(db: AsyncSession, user_id: int, role_id: int):
     db.add(assignment)
     await db.commit()
     await db.refresh(assignment)
+    get_principal_cache().invalidate_user(user_id)
     return assignment
 
+async def update_role(db: AsyncSession, name: str, description: str = None, permissions: list[str] = None):
+    role = await get_role_by_name(db, name)
+    if role is None:
+        return None
+    if description is not None:
+        role.description = description
+    if permissions is not None:
+        role.permissions = ','.join(permissions)
+    await db.commit()
+    await db.refresh(role)
+    get_permission_compiler().invalidate()
+    return role
+
+async def remove_role_from_user(db: AsyncSession, user_id: int, role_id: int) -> bool:
+    result = await db.execute(select(UserRoleAssignment).where(UserRoleAssignment.user_id == user_id, UserRoleAssignment.role_id == role_id))
+    assignment = result.scalars().first()
+    if assignment is None:
+        return False
+    await db.delete(assignment)
+    await db.commit()
+    get_principal_cache().invalidate_user(user_id)
+    return True
+
 # ...more CRUD for permissions and assignments as needed...
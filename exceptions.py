@@ -8,6 +8,12 @@ class ResourceAllocationError(HTTPException):
     def __init__(self, detail: str, status_code: int = status.HTTP_507_INSUFFICIENT_STORAGE):
         super().__init__(status_code=status_code, detail=detail)
 
+class PortExhaustedError(ResourceAllocationError):
+    """No free external port left in the requested range."""
+
+class NATRuleExhaustedError(ResourceAllocationError):
+    """No free destination NAT rule number left."""
+
 class VMNotFoundError(HTTPException):
     def __init__(self, detail: str = "VM not found", status_code: int = status.HTTP_404_NOT_FOUND):
         super().__init__(status_code=status_code, detail=detail)
@@ -18,4 +24,21 @@ class PortRuleNotFoundError(HTTPException):
 
 class APIKeyError(HTTPException):
     def __init__(self, detail: str, status_code: int = status.HTTP_401_UNAUTHORIZED):
-        super().__init__(status_code=status_code, detail=detail)
\ No newline at end of file
+        super().__init__(status_code=status_code, detail=detail)
+
+class JobError(HTTPException):
+    def __init__(self, detail: str, status_code: int = status.HTTP_400_BAD_REQUEST):
+        super().__init__(status_code=status_code, detail=detail)
+
+class PlanError(HTTPException):
+    def __init__(self, detail: str, status_code: int = status.HTTP_400_BAD_REQUEST):
+        super().__init__(status_code=status_code, detail=detail)
+
+class PlanStaleError(HTTPException):
+    def __init__(self, detail: str = "Router or DB state changed since the plan was made", status_code: int = status.HTTP_409_CONFLICT):
+        super().__init__(status_code=status_code, detail=detail)
+
+class LoginThrottledError(HTTPException):
+    def __init__(self, detail: str = "Too many logins in progress, retry shortly", status_code: int = status.HTTP_503_SERVICE_UNAVAILABLE,
+                 retry_after: int = 1):
+        super().__init__(status_code=status_code, detail=detail, headers={"Retry-After": str(retry_after)})
@@ -44,6 +44,14 @@ from routers.bulk_operations import router as bulk_operations_router
 from routers.dhcp_templates import router as dhcp_templates_router
 from routers.topology import router as topology_router
 from utils_metrics import start_metrics_tasks
+from vyos_client import start_vyos_client, close_vyos_client
+from utils_job_engine import start_job_engine, stop_job_engine
+from vyos_outbox import start_outbox_drainer, stop_outbox_drainer
+from vyos_drift import start_drift_detector, stop_drift_detector
+from utils_journal_writer import start_journal_writer, stop_journal_writer
+from utils_journal_archive import start_journal_archiver, stop_journal_archiver
+from utils_journal_replay import start_replay_engine, stop_replay_engine
+from utils_password import stop_password_hasher
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
@@ -163,6 +171,7 @@ async def custom_http_exception_handler(request: Request, exc: HTTPException):
                 "path": str(request.url),
             }
         },
+        headers=getattr(exc, "headers", None),  # Keep Retry-After / WWW-Authenticate
     )
 
 
@@ -193,7 +202,7 @@ async def root():
 
 @app.post("/v1/auth/token_example", tags=["Authentication"])
 async def login_for_access_token_example(form_data: schemas.LoginRequest = Depends()):
-    async with config.get_async_db() as db_session:  # Use config.get_async_db
+    async with config.AsyncSessionLocal() as db_session:
         user = await auth.authenticate_user(
             db=db_session, username=form_data.username, password=form_data.password
         )
@@ -213,7 +222,8 @@ async def login_for_access_token_example(form_data: schemas.LoginRequest = Depen
 
 from utils_ratelimit import RateLimiter
 
-app.add_middleware(RateLimiter, max_requests=5, window_seconds=60)
+if config.get_rate_limit_config()["ENABLED"]:
+    app.add_middleware(RateLimiter)
 
 import asyncio
 from utils_scheduled_runner import scheduled_task_runner
@@ -230,6 +240,97 @@ async def startup_event():
     start_metrics_tasks()
 
 
+# Shared VyOS HTTP connection pool lives for the lifetime of the app
+@app.on_event("startup")
+async def start_vyos_client_pool():
+    await start_vyos_client()
+
+
+@app.on_event("shutdown")
+async def close_vyos_client_pool():
+    await close_vyos_client()
+
+
+# Background job workers (see utils_job_engine.py); also started lazily on first task submit
+@app.on_event("startup")
+async def start_job_workers():
+    await start_job_engine()
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await stop_job_engine()
+
+
+# Applies router changes queued by CRUD functions (see vyos_outbox.py)
+@app.on_event("startup")
+async def start_vyos_outbox():
+    await start_outbox_drainer()
+
+
+@app.on_event("shutdown")
+async def stop_vyos_outbox():
+    await stop_outbox_drainer()
+
+
+# Periodically compares DB state with the router and queues corrections (see vyos_drift.py)
+@app.on_event("startup")
+async def start_vyos_drift():
+    await start_drift_detector()
+
+
+@app.on_event("shutdown")
+async def stop_vyos_drift():
+    await stop_drift_detector()
+
+
+# Batches change journal inserts and notifications (see utils_journal_writer.py)
+@app.on_event("startup")
+async def start_change_journal_writer():
+    await start_journal_writer()
+
+
+@app.on_event("shutdown")
+async def stop_change_journal_writer():
+    await stop_journal_writer()
+
+
+# Moves old journal months into monthly tables and compressed archive files (see utils_journal_archive.py)
+@app.on_event("startup")
+async def start_change_journal_archiver():
+    await start_journal_archiver()
+
+
+@app.on_event("shutdown")
+async def stop_change_journal_archiver():
+    await stop_journal_archiver()
+
+
+# Snapshots the journal replay view for point-in-time queries (see utils_journal_replay.py)
+@app.on_event("startup")
+async def start_journal_replay_engine():
+    await start_replay_engine()
+
+
+@app.on_event("shutdown")
+async def stop_journal_replay_engine():
+    await stop_replay_engine()
+
+
+# bcrypt thread pool used by login and user writes (see utils_password.py)
+@app.on_event("shutdown")
+async def stop_password_hash_pool():
+    stop_password_hasher()
+
+
+# Close pooled DB connections once the background workers above have stopped
+@app.on_event("shutdown")
+async def dispose_db_engine():
+    await config.async_engine.dispose()
+    if config.async_read_engine is not None:
+        await config.async_read_engine.dispose()
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from schemas import MCPRequest, MCPResponse, VMProvisionRequest, VMDecommissionRequest
-from crud import get_db
+from config import get_async_db
 from sqlalchemy.ext.asyncio import AsyncSession
 import routers
 from models import User # Assuming MCP operations might need a user context, even if mocked
@@ -8,7 +8,7 @@ from models import User # Assuming MCP operations might need a user context, eve
 router = APIRouter()
 
 @router.post("/provision", response_model=MCPResponse)
-async def mcp_provision(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_provision(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     """
     MCP endpoint to provision a VM.
     Translates MCP input to VMProvisionRequest and calls the core provisioning logic.
@@ -33,7 +33,7 @@ async def mcp_provision(req: MCPRequest, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Provisioning Error: {e}")
 
 @router.post("/decommission", response_model=MCPResponse)
-async def mcp_decommission(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_decommission(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     """
     MCP endpoint to decommission a VM.
     Translates MCP input to VMDecommissionRequest and calls the core decommissioning logic.
@@ -51,7 +51,7 @@ async def mcp_decommission(req: MCPRequest, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Decommissioning Error: {e}")
 
 @router.post("/static-routes/create", response_model=MCPResponse)
-async def mcp_create_static_route(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_create_static_route(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     """
     MCP endpoint to create a static route.
     """
@@ -69,7 +69,7 @@ async def mcp_create_static_route(req: MCPRequest, db: AsyncSession = Depends(ge
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Create Static Route Error: {e}")
 
 @router.get("/static-routes/list", response_model=MCPResponse)
-async def mcp_list_static_routes(db: AsyncSession = Depends(get_db)):
+async def mcp_list_static_routes(db: AsyncSession = Depends(get_async_db)):
     """
     MCP endpoint to list all static routes.
     """
@@ -81,7 +81,7 @@ async def mcp_list_static_routes(db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP List Static Routes Error: {e}")
 
 @router.post("/static-routes/update", response_model=MCPResponse)
-async def mcp_update_static_route(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_update_static_route(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     """
     MCP endpoint to update a static route.
     """
@@ -99,7 +99,7 @@ async def mcp_update_static_route(req: MCPRequest, db: AsyncSession = Depends(ge
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Update Static Route Error: {e}")
 
 @router.post("/static-routes/delete", response_model=MCPResponse)
-async def mcp_delete_static_route(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_delete_static_route(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     """
     MCP endpoint to delete a static route.
     """
@@ -115,7 +115,7 @@ async def mcp_delete_static_route(req: MCPRequest, db: AsyncSession = Depends(ge
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Delete Static Route Error: {e}")
 
 @router.post("/firewall/policies/create", response_model=MCPResponse)
-async def mcp_create_firewall_policy(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_create_firewall_policy(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     """
     MCP endpoint to create a firewall policy.
     """
@@ -132,7 +132,7 @@ async def mcp_create_firewall_policy(req: MCPRequest, db: AsyncSession = Depends
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Create Firewall Policy Error: {e}")
 
 @router.get("/firewall/policies/list", response_model=MCPResponse)
-async def mcp_list_firewall_policies(db: AsyncSession = Depends(get_db)):
+async def mcp_list_firewall_policies(db: AsyncSession = Depends(get_async_db)):
     """
     MCP endpoint to list all firewall policies.
     """
@@ -145,7 +145,7 @@ async def mcp_list_firewall_policies(db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP List Firewall Policies Error: {e}")
 
 @router.post("/firewall/policies/update", response_model=MCPResponse)
-async def mcp_update_firewall_policy(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_update_firewall_policy(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     """
     MCP endpoint to update a firewall policy.
     """
@@ -163,7 +163,7 @@ async def mcp_update_firewall_policy(req: MCPRequest, db: AsyncSession = Depends
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Update Firewall Policy Error: {e}")
 
 @router.post("/firewall/policies/delete", response_model=MCPResponse)
-async def mcp_delete_firewall_policy(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_delete_firewall_policy(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     """
     MCP endpoint to delete a firewall policy.
     """
@@ -179,7 +179,7 @@ async def mcp_delete_firewall_policy(req: MCPRequest, db: AsyncSession = Depends
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Delete Firewall Policy Error: {e}")
 
 @router.post("/quota/create", response_model=MCPResponse)
-async def mcp_create_quota(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_create_quota(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     """
     MCP endpoint to create a quota.
     """
@@ -195,7 +195,7 @@ async def mcp_create_quota(req: MCPRequest, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Create Quota Error: {e}")
 
 @router.get("/quota/list", response_model=MCPResponse)
-async def mcp_list_quotas(db: AsyncSession = Depends(get_db)):
+async def mcp_list_quotas(db: AsyncSession = Depends(get_async_db)):
     """
     MCP endpoint to list all quotas.
     """
@@ -207,7 +207,7 @@ async def mcp_list_quotas(db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP List Quotas Error: {e}")
 
 @router.post("/quota/update", response_model=MCPResponse)
-async def mcp_update_quota(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_update_quota(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     """
     MCP endpoint to update a quota.
     """
@@ -228,7 +228,7 @@ async def mcp_update_quota(req: MCPRequest, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Update Quota Error: {e}")
 
 @router.post("/notifications/rules/create", response_model=MCPResponse)
-async def mcp_create_notification_rule(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_create_notification_rule(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     from schemas import NotificationRuleCreate
     from crud_notifications import create_notification_rule
     try:
@@ -241,7 +241,7 @@ async def mcp_create_notification_rule(req: MCPRequest, db: AsyncSession = Depen
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Create Notification Rule Error: {e}")
 
 @router.get("/notifications/rules/list", response_model=MCPResponse)
-async def mcp_list_notification_rules(db: AsyncSession = Depends(get_db)):
+async def mcp_list_notification_rules(db: AsyncSession = Depends(get_async_db)):
     from crud_notifications import list_notification_rules
     try:
         rules = await list_notification_rules(db)
@@ -250,7 +250,7 @@ async def mcp_list_notification_rules(db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP List Notification Rules Error: {e}")
 
 @router.post("/notifications/rules/delete", response_model=MCPResponse)
-async def mcp_delete_notification_rule(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_delete_notification_rule(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     from crud_notifications import delete_notification_rule
     try:
         rule_id = req.input.get("id")
@@ -262,7 +262,7 @@ async def mcp_delete_notification_rule(req: MCPRequest, db: AsyncSession = Depen
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Delete Notification Rule Error: {e}")
 
 @router.get("/analytics/usage", response_model=MCPResponse)
-async def mcp_analytics_usage(db: AsyncSession = Depends(get_db)):
+async def mcp_analytics_usage(db: AsyncSession = Depends(get_async_db)):
     from routers.analytics import get_usage_summary
     try:
         result = await get_usage_summary(db=db)
@@ -271,7 +271,7 @@ async def mcp_analytics_usage(db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Analytics Usage Error: {e}")
 
 @router.get("/analytics/activity", response_model=MCPResponse)
-async def mcp_analytics_activity(db: AsyncSession = Depends(get_db)):
+async def mcp_analytics_activity(db: AsyncSession = Depends(get_async_db)):
     from routers.analytics import get_activity_report
     try:
         result = await get_activity_report(db=db)
@@ -280,7 +280,7 @@ async def mcp_analytics_activity(db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Analytics Activity Error: {e}")
 
 @router.post("/integrations/create", response_model=MCPResponse)
-async def mcp_create_integration(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_create_integration(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     from schemas import IntegrationCreate
     from crud_integrations import create_integration
     try:
@@ -293,7 +293,7 @@ async def mcp_create_integration(req: MCPRequest, db: AsyncSession = Depends(get
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP Create Integration Error: {e}")
 
 @router.get("/integrations/list", response_model=MCPResponse)
-async def mcp_list_integrations(db: AsyncSession = Depends(get_db)):
+async def mcp_list_integrations(db: AsyncSession = Depends(get_async_db)):
     from crud_integrations import get_integrations
     try:
         integrations = await get_integrations(db)
@@ -302,7 +302,7 @@ async def mcp_list_integrations(db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"MCP List Integrations Error: {e}")
 
 @router.post("/integrations/delete", response_model=MCPResponse)
-async def mcp_delete_integration(req: MCPRequest, db: AsyncSession = Depends(get_db)):
+async def mcp_delete_integration(req: MCPRequest, db: AsyncSession = Depends(get_async_db)):
     from crud_integrations import delete_integration
     try:
         integration_id = req.input.get("id")
@@ -0,0 +1,48 @@
+"""add_vyos_outbox_table
+
+Revision ID: 5c81f4a9e6d3
+Revises: 3b5e0d7c2a19
+Create Date: 2026-10-17 10:09:47.201366
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c81f4a9e6d3'
+down_revision: Union[str, None] = '3b5e0d7c2a19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('vyos_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('resource_type', sa.String(), nullable=True),
+    sa.Column('resource_id', sa.String(), nullable=True),
+    sa.Column('operation', sa.String(), nullable=False),
+    sa.Column('commands', sa.JSON(), nullable=False),
+    sa.Column('scopes', sa.JSON(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('claimed_by', sa.String(), nullable=True),
+    sa.Column('claimed_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+    sa.Column('applied_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_vyos_outbox_id'), 'vyos_outbox', ['id'], unique=False)
+    op.create_index('ix_vyos_outbox_status_id', 'vyos_outbox', ['status', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_vyos_outbox_status_id', table_name='vyos_outbox')
+    op.drop_index(op.f('ix_vyos_outbox_id'), table_name='vyos_outbox')
+    op.drop_table('vyos_outbox')
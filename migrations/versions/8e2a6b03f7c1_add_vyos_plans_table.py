@@ -0,0 +1,47 @@
+"""add_vyos_plans_table
+
+Revision ID: 8e2a6b03f7c1
+Revises: 5c81f4a9e6d3
+Create Date: 2026-10-17 10:15:03.874129
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e2a6b03f7c1'
+down_revision: Union[str, None] = '5c81f4a9e6d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('vyos_plans',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('method', sa.String(), nullable=False),
+    sa.Column('path', sa.String(), nullable=False),
+    sa.Column('query', sa.String(), nullable=True),
+    sa.Column('body', sa.Text(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('operations', sa.JSON(), nullable=False),
+    sa.Column('commands', sa.JSON(), nullable=False),
+    sa.Column('diff', sa.JSON(), nullable=True),
+    sa.Column('cost', sa.JSON(), nullable=True),
+    sa.Column('subtree_digests', sa.JSON(), nullable=True),
+    sa.Column('result', sa.JSON(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.Column('applied_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('vyos_plans')
@@ -0,0 +1,52 @@
+"""hash_api_keys
+
+Revision ID: a7c3e91f0b24
+Revises: d1c8c35fd605
+Create Date: 2026-10-17 09:12:40.118204
+
+"""
+import hashlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c3e91f0b24'
+down_revision: Union[str, None] = 'd1c8c35fd605'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('api_keys', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('key_prefix', sa.String(length=16), nullable=True))
+        batch_op.add_column(sa.Column('key_hash', sa.String(length=64), nullable=True))
+
+    # Existing raw keys keep working as legacy keys (no prefix, looked up by hash).
+    conn = op.get_bind()
+    api_keys = sa.table('api_keys', sa.column('id', sa.Integer), sa.column('api_key', sa.String), sa.column('key_hash', sa.String))
+    for key_id, raw_key in conn.execute(sa.select(api_keys.c.id, api_keys.c.api_key)).all():
+        conn.execute(api_keys.update().where(api_keys.c.id == key_id)
+                     .values(key_hash=hashlib.sha256(raw_key.encode()).hexdigest()))
+
+    with op.batch_alter_table('api_keys', schema=None) as batch_op:
+        batch_op.alter_column('key_hash', existing_type=sa.String(length=64), nullable=False)
+        batch_op.create_unique_constraint('uq_api_keys_key_prefix', ['key_prefix'])
+        batch_op.create_unique_constraint('uq_api_keys_key_hash', ['key_hash'])
+        batch_op.drop_column('api_key')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Raw keys cannot be recovered from their hashes: every key has to be reissued after a downgrade.
+    op.execute("DELETE FROM api_keys")
+    with op.batch_alter_table('api_keys', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('api_key', sa.String(), nullable=False))
+        batch_op.create_unique_constraint('uq_api_keys_api_key', ['api_key'])
+        batch_op.drop_constraint('uq_api_keys_key_hash', type_='unique')
+        batch_op.drop_constraint('uq_api_keys_key_prefix', type_='unique')
+        batch_op.drop_column('key_hash')
+        batch_op.drop_column('key_prefix')
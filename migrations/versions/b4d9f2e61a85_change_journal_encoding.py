@@ -0,0 +1,49 @@
+"""change_journal_encoding
+
+Revision ID: b4d9f2e61a85
+Revises: 8e2a6b03f7c1
+Create Date: 2026-10-17 10:31:26.940217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4d9f2e61a85'
+down_revision: Union[str, None] = '8e2a6b03f7c1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # change_journal predates the migration history: databases built from the migrations alone do not have it.
+    if not sa.inspect(op.get_bind()).has_table('change_journal'):
+        op.create_table('change_journal',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('resource_type', sa.String(), nullable=False),
+        sa.Column('resource_id', sa.String(), nullable=False),
+        sa.Column('operation', sa.String(), nullable=False),
+        sa.Column('before', sa.JSON(), nullable=True),
+        sa.Column('after', sa.JSON(), nullable=True),
+        sa.Column('comment', sa.Text(), nullable=True),
+        sa.Column('encoding', sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    else:
+        with op.batch_alter_table('change_journal', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('encoding', sa.String(), nullable=True))
+    op.create_index('ix_change_journal_resource_id_seq', 'change_journal', ['resource_type', 'resource_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_change_journal_resource_id_seq', table_name='change_journal')
+    with op.batch_alter_table('change_journal', schema=None) as batch_op:
+        batch_op.drop_column('encoding')
@@ -0,0 +1,40 @@
+"""add_journal_snapshots_table
+
+Revision ID: c6a18e3d94f2
+Revises: b4d9f2e61a85
+Create Date: 2026-10-17 10:38:52.417930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6a18e3d94f2'
+down_revision: Union[str, None] = 'b4d9f2e61a85'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('journal_snapshots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('taken_at', sa.DateTime(), nullable=False),
+    sa.Column('last_journal_id', sa.Integer(), nullable=True),
+    sa.Column('event_count', sa.Integer(), nullable=False),
+    sa.Column('state', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_journal_snapshots_taken_at'), 'journal_snapshots', ['taken_at'], unique=False)
+    op.create_index('ix_change_journal_timestamp', 'change_journal', ['timestamp'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_change_journal_timestamp', table_name='change_journal')
+    op.drop_index(op.f('ix_journal_snapshots_taken_at'), table_name='journal_snapshots')
+    op.drop_table('journal_snapshots')
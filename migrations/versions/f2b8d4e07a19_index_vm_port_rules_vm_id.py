@@ -0,0 +1,28 @@
+"""index_vm_port_rules_vm_id
+
+Revision ID: f2b8d4e07a19
+Revises: e3f7a1c94b52
+Create Date: 2026-10-17 15:03:41.927318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2b8d4e07a19'
+down_revision: Union[str, None] = 'e3f7a1c94b52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_vm_port_rules_vm_id'), 'vm_port_rules', ['vm_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_vm_port_rules_vm_id'), table_name='vm_port_rules')
@@ -61,7 +61,7 @@ class VMNetworkConfig(Base):
 class VMPortRule(Base):
     __tablename__ = "vm_port_rules"
     id = Column(Integer, primary_key=True)
-    vm_id = Column(Integer, ForeignKey("vms_network_config.id"))
+    vm_id = Column(Integer, ForeignKey("vms_network_config.id"), index=True)
     port_type = Column(Enum(PortType))
     external_port = Column(Integer, unique=True)
     status = Column(Enum(PortStatus), default=PortStatus.enabled)
@@ -79,7 +79,10 @@ class VMPortRule(Base):
 class APIKey(Base):
     __tablename__ = "api_keys"
     id = Column(Integer, primary_key=True)
-    api_key = Column(String, unique=True, nullable=False)
+    # Public lookup prefix and SHA-256 of the full key (see utils_api_keys.py); the key itself is never stored.
+    # Keys issued before the prefixed format have no prefix and are found by key_hash.
+    key_prefix = Column(String(16), unique=True, nullable=True)
+    key_hash = Column(String(64), unique=True, nullable=False)
     description = Column(String, nullable=True)
     created_at = Column(DateTime)
     expires_at = Column(DateTime, nullable=True)
@@ -152,6 +155,9 @@ class User(Base):
         "Integration", back_populates="user"
     )  # New: relationship to Integration
 
+    # Compiled permission bitmask, set by auth for the current request (see utils_rbac.py); not a column.
+    permission_mask = None
+
     @hybrid_property
     def roles(self) -> List[str]:
         if self._roles:
@@ -394,8 +400,34 @@ class ChangeJournal(Base):
     before = Column(JSON, nullable=True)
     after = Column(JSON, nullable=True)
     comment = Column(Text, nullable=True)
+    # NULL until compacted; "checkpoint"/"delta" rows hold full documents / JSON patches (see utils_journal_delta.py)
+    encoding = Column(String, nullable=True)
     user = relationship("User", back_populates="change_journal_entries")
 
+    __table_args__ = (
+        Index("ix_change_journal_resource_id_seq", "resource_type", "resource_id", "id"),
+        Index("ix_change_journal_timestamp", "timestamp"),
+    )
+
+
+class JournalSnapshot(Base):
+    """Materialized view of journaled resources, covering every journal entry before `taken_at` (see utils_journal_replay.py)."""
+    __tablename__ = "journal_snapshots"
+    id = Column(Integer, primary_key=True)
+    taken_at = Column(DateTime, nullable=False, index=True)
+    last_journal_id = Column(Integer, nullable=True)
+    event_count = Column(Integer, default=0, nullable=False)  # Journal entries folded in since the beginning
+    state = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ServiceLease(Base):
+    """Lease on a background pass that must only run in one worker at a time (see utils_journal_archive.py)."""
+    __tablename__ = "service_leases"
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=True)  # Process/worker holding the lease
+    expires_at = Column(DateTime, nullable=True)  # A crashed holder's lease can be taken over after this time
+
 
 class NotificationRule(Base):
     __tablename__ = "notification_rules"
@@ -448,6 +480,73 @@ class ScheduledTask(Base):
     user = relationship("User", back_populates="scheduled_tasks")
 
 
+class Job(Base):
+    """Persistent background job (see utils_job_engine.py)."""
+    __tablename__ = "jobs"
+    id = Column(String, primary_key=True)  # UUID
+    job_type = Column(String, nullable=False)
+    params = Column(JSON, nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    status = Column(
+        String, default="queued", nullable=False
+    )  # queued, running, success, error, cancelled
+    progress = Column(Integer, default=0)  # Percent complete, 0-100
+    progress_message = Column(String, nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    cancel_requested = Column(Boolean, default=False)
+    worker_id = Column(String, nullable=True)  # Process/worker that claimed the job
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True)  # Finished jobs are evicted after this time
+
+    __table_args__ = (Index("ix_jobs_status_created_at", "status", "created_at"),)
+
+
+class VyOSOutbox(Base):
+    """Router commands written in the same transaction as the DB change (see vyos_outbox.py)."""
+    __tablename__ = "vyos_outbox"
+    id = Column(Integer, primary_key=True, index=True)  # Entries are applied in id order
+    resource_type = Column(String, nullable=True)  # e.g. firewall_policy, firewall_rule, static_route
+    resource_id = Column(String, nullable=True)
+    operation = Column(String, default="set", nullable=False)
+    commands = Column(JSON, nullable=False)  # Desired 'set'/'delete' CLI commands
+    scopes = Column(JSON, nullable=True)  # Subtrees owned by the commands, for the minimal-diff compiler
+    status = Column(String, default="pending", nullable=False)  # pending, sending, applied, failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    claimed_by = Column(String, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    applied_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (Index("ix_vyos_outbox_status_id", "status", "id"),)
+
+
+class VyOSPlan(Base):
+    """Router changes computed by a dry run, stored so they can be applied later (see vyos_plan.py)."""
+    __tablename__ = "vyos_plans"
+    id = Column(String, primary_key=True)  # UUID
+    method = Column(String, nullable=False)  # Request that produced the plan, replayed on apply
+    path = Column(String, nullable=False)
+    query = Column(String, nullable=True)
+    body = Column(Text, nullable=True)
+    status = Column(String, default="planned", nullable=False)  # planned, applied, stale, failed
+    operations = Column(JSON, nullable=False)  # [{via, commands, scopes, compiled}] in call order
+    commands = Column(JSON, nullable=False)  # Compiled commands that will be sent, flattened
+    diff = Column(JSON, nullable=True)
+    cost = Column(JSON, nullable=True)
+    subtree_digests = Column(JSON, nullable=True)  # Router digests of touched subtrees when planned
+    result = Column(JSON, nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # Caller of the dry run
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=True)
+    applied_at = Column(DateTime, nullable=True)
+
+
 class Secret(Base):
     __tablename__ = "secrets"
     id = Column(Integer, primary_key=True)
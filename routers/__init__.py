@@ -1,26 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body, Path
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Path, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from typing import List, Optional, Dict, Any
+import json
 import crud
 import models
 import schemas
 from auth import get_current_active_user, RoleChecker
-from config import get_async_db
+from config import AsyncSessionLocal, async_engine, async_read_engine, get_async_db
 from vyos_core import (
     vyos_api_call, generate_port_forward_commands, get_vyos_nat_rules, 
     generate_dhcp_pool_commands, generate_delete_dhcp_pool_commands,
     generate_static_mapping_commands, generate_delete_static_mapping_commands, get_dhcp_leases,
-    generate_vpn_commands, backup_config, restore_config, submit_task, get_task_status
+    generate_vpn_commands, backup_config, restore_config, submit_task, get_task_status, cancel_task
 )
 from exceptions import VyOSAPIError, ResourceAllocationError, VMNotFoundError, PortRuleNotFoundError
 from schemas import StaticMappingRequest, StaticMappingResponse, VPNCreate, VPNResponse, ConfigRestoreRequest, TaskSubmitRequest
 from utils import audit_log_action
 from utils_notify_dispatch import dispatch_notifications
+from vyos_client import get_vyos_client
+from vyos_coalescer import get_coalescer_stats
+from vyos_config_mirror import get_config_mirror
+from utils_ip_allocator import ip_allocator
+from utils_job_engine import get_job_engine
+from vyos_outbox import get_outbox_drainer
+from vyos_drift import get_drift_detector
+from utils_db import get_pool_stats
+from utils_api_keys import get_api_key_codec
+from utils_password import get_password_hasher
+from utils_principal_cache import get_principal_cache
+from utils_rbac import get_permission_compiler
+from utils_ratelimit import get_rate_limiter
+from vyos_plan import PlannableRoute, get_plan_store, get_plannable_db
 from routers import rbac, quota, journal, notifications, scheduled, secrets, integrations, hadr, analytics
 import httpx
 
-router = APIRouter()
+router = APIRouter(route_class=PlannableRoute)
 
 # Register routers
 router.include_router(journal.router)
@@ -53,9 +69,115 @@ async def health_check(db: AsyncSession = Depends(get_async_db)):
     status["status"] = "ok" if all(v == "ok" for v in status.values()) else "degraded"
     return status
 
+@router.get("/vyos/client-stats", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def vyos_client_stats():
+    """Connection pool occupancy, latency and per-operation timeout stats for the shared VyOS client."""
+    return get_vyos_client().stats()
+
+@router.get("/vyos/coalescer-stats", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def vyos_coalescer_stats():
+    """Batch size, queueing delay and commit-rate stats for the VyOS commit coalescer."""
+    return get_coalescer_stats()
+
+@router.get("/vyos/outbox", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def vyos_outbox_stats():
+    """Queue depth, oldest pending age and drain counters for the VyOS change outbox."""
+    return await get_outbox_drainer().stats()
+
+@router.get("/vyos/outbox/entries", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def vyos_outbox_entries(status: Optional[str] = None, limit: int = 100):
+    """Most recent outbox entries, optionally filtered by status (pending, sending, applied, failed)."""
+    return await get_outbox_drainer().list_entries(status=status, limit=min(limit, 1000))
+
+@router.post("/vyos/outbox/{entry_id}/retry", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def vyos_outbox_retry(entry_id: int):
+    """Re-queue an outbox entry that exhausted its retries."""
+    if not await get_outbox_drainer().retry(entry_id):
+        raise HTTPException(status_code=404, detail="No failed outbox entry with this ID")
+    audit_log_action(user="system", action="retry_vyos_outbox_entry", result="success", details={"entry_id": entry_id})
+    return {"status": "queued", "entry_id": entry_id}
+
+@router.get("/vyos/drift", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def vyos_drift_report():
+    """Result of the last drift check between DB state and the router, plus detector counters."""
+    return get_drift_detector().stats()
+
+@router.post("/vyos/drift/reconcile", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def vyos_drift_reconcile(dry_run: bool = False):
+    """Run a drift check now; unless dry_run, queue corrections for drifted subtrees in the outbox."""
+    report = await get_drift_detector().run_once(reconcile=not dry_run)
+    audit_log_action(user="system", action="reconcile_vyos_drift", result="success",
+                     details={"drifted": len(report["drifted"]), "queued": report.get("queued", 0), "dry_run": dry_run})
+    return report
+
+@router.get("/vyos/plans/stats", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def vyos_plan_stats():
+    """Counters for dry-run plans created, applied and rejected as stale."""
+    return get_plan_store().stats()
+
+async def _get_owned_plan(plan_id: str, current_user: models.User) -> Dict[str, Any]:
+    """The plan if it exists and was made by the caller (admins see every plan); 404 otherwise."""
+    plan = await get_plan_store().get(plan_id)
+    if plan is None or ("admin" not in current_user.roles and plan["user_id"] != current_user.id):
+        raise HTTPException(status_code=404, detail="Plan not found")
+    return plan
+
+@router.get("/vyos/plans/{plan_id}", tags=["Plans"])
+async def get_vyos_plan(plan_id: str, current_user: models.User = Depends(get_current_active_user)):
+    """A stored dry-run plan: compiled commands, diff against the router, estimated cost and apply result."""
+    return await _get_owned_plan(plan_id, current_user)
+
+@router.post("/vyos/plans/{plan_id}/apply", tags=["Plans"])
+async def apply_vyos_plan(plan_id: str, request: Request, current_user: models.User = Depends(get_current_active_user)):
+    """Apply a stored plan: the planned request is replayed with the caller's credentials and the stored commands."""
+    await _get_owned_plan(plan_id, current_user)
+    plan = await get_plan_store().apply(plan_id, request)
+    if plan is None:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    audit_log_action(user=current_user.username, action="apply_vyos_plan", result=plan["status"], details={"plan_id": plan_id})
+    return plan
+
+@router.get("/db/pool-stats", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def db_pool_stats():
+    """Connection pool occupancy and checkout wait/hold times of this worker's async DB engine."""
+    stats = get_pool_stats(async_engine)
+    if async_read_engine is not None:  # SQLite single-writer mode: the engine above is the writer
+        stats["read_pool"] = get_pool_stats(async_read_engine)
+    return stats
+
+@router.get("/auth/principal-cache", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def principal_cache_stats():
+    """Size and hit/miss/eviction/invalidation counters for the authenticated-principal cache."""
+    return get_principal_cache().stats()
+
+@router.get("/auth/api-key-stats", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def api_key_stats():
+    """Keys issued, accepted and rejected before any DB access (malformed or bad checksum)."""
+    return get_api_key_codec().stats()
+
+@router.get("/auth/rbac-stats", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def rbac_stats():
+    """Permission bits registered, compiled roles and role/user mask compilation counters."""
+    return get_permission_compiler().stats()
+
+@router.get("/ratelimit/stats", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def rate_limit_stats():
+    """Rate limit policies, allowed/limited counters and bucket counts of this worker's limiter."""
+    return get_rate_limiter().stats()
+
+@router.get("/auth/password-hash-stats", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def password_hash_stats():
+    """Thread pool size, in-flight and queued hashes, rejected logins and hash latency."""
+    return get_password_hasher().stats()
+
+@router.get("/vyos/mirror-stats", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def vyos_mirror_stats():
+    """Freshness, index size and hit/refresh counters for the in-memory VyOS config mirror."""
+    return get_config_mirror().stats()
+
 # --- Dynamic-to-Static IP Provisioning ---
 @router.post("/dhcp/dynamic-to-static", response_model=StaticMappingResponse)
-async def dynamic_to_static_provision(req: StaticMappingRequest, db: AsyncSession = Depends(get_async_db)):
+async def dynamic_to_static_provision(req: StaticMappingRequest, db: AsyncSession = Depends(get_plannable_db)):
     """Assign a static IP to a MAC address from DHCP leases and update DB."""
     leases = await get_dhcp_leases()
     if not any(mac == req.mac and ip == req.ip for mac, ip in leases):
@@ -68,8 +190,11 @@ async def dynamic_to_static_provision(req: StaticMappingRequest, db: AsyncSessio
         vm = await db.execute(models.VMNetworkConfig.__table__.select().where(models.VMNetworkConfig.mac_address == req.mac))
         vm_obj = vm.scalars().first()
         if vm_obj:
+            previous_ip = vm_obj.internal_ip
             vm_obj.internal_ip = req.ip
             await db.commit()
+            ip_allocator.release([previous_ip])
+            ip_allocator.mark_used([req.ip])
         audit_log_action(user="system", action="dynamic_to_static", result="success", details={"mac": req.mac, "ip": req.ip})
         return StaticMappingResponse(status="success", mac=req.mac, ip=req.ip, message="Static mapping applied.")
     except Exception as e:
@@ -129,23 +254,88 @@ async def restore(request: ConfigRestoreRequest):
         return {"status": "error", "message": str(e)}
 
 # --- Task Management (Async Ops) ---
+# Task types that act on the whole router config; only admins may submit them.
+ADMIN_TASK_TYPES = {"config_sync", "config_backup"}
+
+async def _get_owned_task(task_id: str, current_user: models.User) -> Dict[str, Any]:
+    """The task if it exists and belongs to the caller (admins see every task); 404 otherwise."""
+    task = await get_task_status(task_id)
+    if task["status"] == "not_found" or ("admin" not in current_user.roles and task.get("user_id") != current_user.id):
+        raise HTTPException(status_code=404, detail="Task not found")
+    return task
+
 @router.post("/tasks/submit")
-async def submit_task_api(request: TaskSubmitRequest):
+async def submit_task_api(request: TaskSubmitRequest, current_user: models.User = Depends(get_current_active_user)):
     """Submit an async task."""
-    task_id = await submit_task(request.task_type, request.params)
-    audit_log_action(user="system", action="submit_task", result="submitted", details={"task_id": task_id, "task_type": request.task_type})
+    if request.task_type in ADMIN_TASK_TYPES and "admin" not in current_user.roles:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Task type '{request.task_type}' requires the admin role")
+    task_id = await submit_task(request.task_type, request.params, user_id=current_user.id)
+    audit_log_action(user=current_user.username, action="submit_task", result="submitted", details={"task_id": task_id, "task_type": request.task_type})
     return {"task_id": task_id}
 
 @router.get("/tasks/status/{task_id}")
-async def get_task_status_api(task_id: str):
-    """Get status of an async task."""
-    status = await get_task_status(task_id)
-    audit_log_action(user="system", action="get_task_status", result=status["status"], details={"task_id": task_id})
-    return status
+async def get_task_status_api(task_id: str, current_user: models.User = Depends(get_current_active_user)):
+    """Get status of an async task owned by the caller (any task for admins)."""
+    task = await _get_owned_task(task_id, current_user)
+    audit_log_action(user=current_user.username, action="get_task_status", result=task["status"], details={"task_id": task_id})
+    return task
+
+@router.post("/tasks/{task_id}/cancel")
+async def cancel_task_api(task_id: str, current_user: models.User = Depends(get_current_active_user)):
+    """Cancel a queued or running async task owned by the caller (any task for admins)."""
+    await _get_owned_task(task_id, current_user)
+    task = await cancel_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    audit_log_action(user=current_user.username, action="cancel_task", result=task["status"], details={"task_id": task_id})
+    return task
+
+@router.get("/tasks/stats", tags=["Health"], dependencies=[Depends(RoleChecker(["admin"]))])
+async def task_engine_stats():
+    """Worker pool and completion counters for the background job engine in this process."""
+    return get_job_engine().stats()
 
 # --- VM Management ---
+@router.get("/vms/status", response_model=schemas.VMStatusPage, tags=["VMs"],
+            responses={200: {"content": {"application/x-ndjson": {}}}})
+async def vms_status(
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[int] = Query(None, description="Cursor from the previous page's next_cursor"),
+    machine_id_prefix: Optional[str] = None,
+    hostname: Optional[str] = Query(None, description="Substring match on hostname"),
+    dhcp_pool_id: Optional[int] = None,
+    ip_prefix: Optional[str] = None,
+    port_type: Optional[models.PortType] = None,
+    port_status: Optional[models.PortStatus] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$", description="'ndjson' streams every matching VM, one per line"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_active_user),
+):
+    """Status of VMs and their NAT ports, keyset-paginated by VM id, or as a full NDJSON export."""
+    filters = dict(machine_id_prefix=machine_id_prefix, hostname=hostname, dhcp_pool_id=dhcp_pool_id,
+                   ip_prefix=ip_prefix, port_type=port_type, port_status=port_status)
+    if format == "ndjson":
+        async def export():
+            # The request's session is closed before the body streams; the export uses its own.
+            async with AsyncSessionLocal() as export_db:
+                async for item in crud.iter_vms_status(export_db, after_id=after, **filters):
+                    yield json.dumps(item) + "\n"
+        return StreamingResponse(export(), media_type="application/x-ndjson")
+    items, next_cursor = await crud.get_vms_status_page(db, limit=limit, after_id=after, **filters)
+    return {"items": items, "next_cursor": next_cursor}
+
+@router.post("/vms/provision/bulk", response_model=schemas.BulkVMProvisionResponse, tags=["VMs"],
+             dependencies=[Depends(RoleChecker(["admin", "user"]))])
+async def bulk_provision_vms_endpoint(req: schemas.BulkVMProvisionRequest, db: AsyncSession = Depends(get_plannable_db), current_user: models.User = Depends(get_current_active_user)):
+    """Provision many VMs in one DB transaction and one VyOS commit, reporting success or failure per item."""
+    results = await crud.bulk_provision_vms(db, req.vms, user_id=current_user.id)
+    successful = sum(1 for r in results if r["status"] == "success")
+    audit_log_action(user=current_user.username, action="bulk_provision_vms", result="success" if successful == len(results) else "partial" if successful else "failure",
+                     details={"total_requested": len(results), "total_successful": successful})
+    return schemas.BulkVMProvisionResponse(results=results, total_requested=len(results), total_successful=successful, total_failed=len(results) - successful)
+
 @router.delete("/vms/{machine_id}", status_code=204, tags=["VMs"])
-async def delete_vm_endpoint(machine_id: str = Path(...), db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_active_user)):
+async def delete_vm_endpoint(machine_id: str = Path(...), db: AsyncSession = Depends(get_plannable_db), current_user: models.User = Depends(get_current_active_user)):
     """Delete a VM and its NAT rules."""
     # Only admin or owner can delete
     vm = await crud.get_vm_by_machine_id(db, machine_id)
@@ -2,10 +2,11 @@ from fastapi import APIRouter, Depends, Query, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import func, select, and_
 from typing import List, Optional
-from models import ChangeJournal, Quota, ScheduledTask, NotificationRule, User, SubnetTrafficMetrics, Subnet
+from models import Quota, ScheduledTask, NotificationRule, User, SubnetTrafficMetrics, Subnet
 from config import get_async_db
 from datetime import datetime, timedelta
 from auth import get_current_active_user, RoleChecker
+from utils_journal_archive import journal_activity
 from schemas import SubnetTrafficMetricsResponse, SubnetTrafficSummary, SubnetTrafficTimeSeries, TimeSeriesDataPoint
 
 router = APIRouter(
@@ -36,14 +37,7 @@ async def get_activity_report(
     db: AsyncSession = Depends(get_async_db)
 ):
     since = datetime.utcnow() - timedelta(days=days)
-    query = select(ChangeJournal).where(ChangeJournal.timestamp >= since)
-    result = await db.execute(query)
-    entries = result.scalars().all()
-    per_day = {}
-    for entry in entries:
-        day = entry.timestamp.date().isoformat()
-        per_day[day] = per_day.get(day, 0) + 1
-    return per_day
+    return await journal_activity(db, since)
 
 @router.get("/subnet-traffic/summary", response_model=List[SubnetTrafficSummary])
 async def get_subnet_traffic_summary(
@@ -7,12 +7,14 @@ import models
 import schemas
 from auth import get_api_key_auth, RoleChecker
 from config import get_async_db
+from vyos_plan import PlannableRoute, get_plannable_db
 from exceptions import ResourceAllocationError
 
 router = APIRouter(
     prefix="/firewall",
     tags=["Firewall Management"],
-    dependencies=[Depends(get_api_key_auth)] # All firewall endpoints require API key auth
+    dependencies=[Depends(get_api_key_auth)],  # All firewall endpoints require API key auth
+    route_class=PlannableRoute,
 )
 
 # --- Firewall Policy Endpoints ---
@@ -26,7 +28,7 @@ router = APIRouter(
 )
 async def create_firewall_policy(
     policy: schemas.FirewallPolicyCreate,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: models.User = Depends(get_api_key_auth),
 ):
     """
@@ -92,7 +94,7 @@ async def get_firewall_policy(
 async def update_firewall_policy(
     policy_id: int,
     policy_update: schemas.FirewallPolicyUpdate,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: models.User = Depends(get_api_key_auth),
 ):
     """
@@ -122,7 +124,7 @@ async def update_firewall_policy(
 )
 async def delete_firewall_policy(
     policy_id: int,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: models.User = Depends(get_api_key_auth),
 ):
     """
@@ -148,7 +150,7 @@ async def delete_firewall_policy(
 async def create_firewall_rule_for_policy(
     policy_id: int,
     rule: schemas.FirewallRuleCreate,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: models.User = Depends(get_api_key_auth),
 ):
     """
@@ -230,7 +232,7 @@ async def update_firewall_rule_in_policy(
     policy_id: int,
     rule_id: int,
     rule_update: schemas.FirewallRuleUpdate,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: models.User = Depends(get_api_key_auth),
 ):
     """
@@ -259,7 +261,7 @@ async def update_firewall_rule_in_policy(
 async def delete_firewall_rule_from_policy(
     policy_id: int,
     rule_id: int,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: models.User = Depends(get_api_key_auth),
 ):
     """
@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Depends, Query
+import json
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from auth import RoleChecker
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
+from datetime import datetime
 from crud_journal import create_journal_entry, get_journal_entries
-from schemas import ChangeJournalEntry, ChangeJournalCreate
-from config import get_async_db
+from schemas import ChangeFeedPage, ChangeJournalEntry, ChangeJournalCreate
+from config import AsyncSessionLocal, get_async_db, get_change_feed_config
+from utils_journal_writer import get_journal_writer
+from utils_journal_archive import find_journal_entry, get_journal_archiver, resource_state_at
+from utils_journal_replay import get_replay_engine
+from utils_journal_feed import get_change_feed
 
 router = APIRouter(prefix="/journal", tags=["Change Journal"])
 
@@ -14,12 +23,120 @@ async def add_journal_entry(
 ):
     return await create_journal_entry(db, entry)
 
+@router.get("/writer-stats", dependencies=[Depends(RoleChecker(["admin"]))])
+async def journal_writer_stats():
+    """Buffer depth, batch sizes and failures of the batched journal writer in this worker."""
+    return get_journal_writer().stats()
+
+@router.get("/archive-stats", dependencies=[Depends(RoleChecker(["admin"]))])
+async def journal_archive_stats():
+    """Hot window, archive files and rotation counters of the journal archiver in this worker."""
+    return get_journal_archiver().stats()
+
+@router.get("/entries/{entry_id}", response_model=ChangeJournalEntry)
+async def get_journal_entry(entry_id: int, db: AsyncSession = Depends(get_async_db)):
+    """One journal entry with full before/after documents, whether stored whole or as a delta."""
+    entry = await find_journal_entry(db, entry_id)
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Journal entry not found")
+    return entry
+
+@router.get("/state/{resource_type}/{resource_id}", dependencies=[Depends(RoleChecker(["admin"]))])
+async def get_resource_state(
+    resource_type: str,
+    resource_id: str,
+    at: Optional[datetime] = Query(None, description="Point in time (UTC); defaults to now"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Materialized state of a resource as recorded by the journal at a point in time."""
+    entry = await resource_state_at(db, resource_type, resource_id, at)
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No journal history for this resource at that time")
+    return {
+        "resource_type": resource_type,
+        "resource_id": resource_id,
+        "journal_id": entry.id,
+        "timestamp": entry.timestamp,
+        "operation": entry.operation,
+        "state": entry.after,
+    }
+
+@router.get("/replay/state", dependencies=[Depends(RoleChecker(["admin"]))])
+async def get_replayed_state(
+    at: Optional[datetime] = Query(None, description="Point in time (UTC); defaults to now"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """VMs, firewall policies/rules and static routes as the journal recorded them at a point in time."""
+    return (await get_replay_engine().state_at(db, at)).to_dict()
+
+@router.get("/replay/rollback", dependencies=[Depends(RoleChecker(["admin"]))])
+async def get_rollback_commands(
+    to: datetime = Query(..., description="Point in time (UTC) to roll the firewall and static route config back to"),
+    against_router: bool = Query(False, description="Diff against the router's current config and return only the changes"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """VyOS commands that restore the firewall and static route config recorded at `to`; nothing is applied."""
+    return await get_replay_engine().rollback_to(db, to, against_router=against_router)
+
+@router.get("/replay/stats", dependencies=[Depends(RoleChecker(["admin"]))])
+async def journal_replay_stats():
+    return get_replay_engine().stats()
+
+@router.get("/changes", response_model=ChangeFeedPage, dependencies=[Depends(RoleChecker(["admin"]))])
+async def read_changes(
+    after: int = Query(0, ge=0, description="Cursor: next_cursor of the previous page (0 to start from the beginning)"),
+    limit: int = Query(100, ge=1, le=1000),
+    resource_type: Optional[str] = Query(None),
+    wait: float = Query(0, ge=0, description="Seconds to long-poll when no entries are ready yet"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Change-data-capture feed: journal entries after the cursor, in commit-safe id order."""
+    wait = min(wait, get_change_feed_config()["MAX_WAIT_SECONDS"])
+    changes, next_cursor, has_more = await get_change_feed().read(db, after, limit, resource_type, wait=wait)
+    return {"changes": changes, "next_cursor": next_cursor, "has_more": has_more}
+
+@router.get("/changes/stream", responses={200: {"content": {"text/event-stream": {}}}}, dependencies=[Depends(RoleChecker(["admin"]))])
+async def stream_changes(
+    request: Request,
+    after: int = Query(0, ge=0, description="Cursor to start after; the Last-Event-ID header takes precedence on reconnect"),
+    batch_size: int = Query(100, ge=1, le=1000),
+    resource_type: Optional[str] = Query(None),
+    last_event_id: Optional[int] = Header(None)
+):
+    """Server-sent events tail of the change feed; each event's id is its cursor, so reconnects resume."""
+    feed = get_change_feed()
+    heartbeat = get_change_feed_config()["SSE_HEARTBEAT_SECONDS"]
+    cursor = last_event_id if last_event_id is not None else after
+
+    async def events():
+        nonlocal cursor
+        async with AsyncSessionLocal() as db:
+            while not await request.is_disconnected():
+                changes, next_cursor, has_more = await feed.read(db, cursor, batch_size, resource_type, wait=heartbeat)
+                for change in changes:
+                    yield f"id: {change['id']}\nevent: change\ndata: {json.dumps(jsonable_encoder(change))}\n\n"
+                if next_cursor != cursor and not changes:
+                    # Filtered-out entries still move the cursor, so a reconnect does not rescan them.
+                    yield f"id: {next_cursor}\nevent: cursor\ndata: {next_cursor}\n\n"
+                elif not changes:
+                    yield ": keep-alive\n\n"
+                cursor = next_cursor
+                await db.rollback()  # Release the connection between batches
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.get("/changes/stats", dependencies=[Depends(RoleChecker(["admin"]))])
+async def change_feed_stats():
+    return get_change_feed().stats()
+
 @router.get("/", response_model=List[ChangeJournalEntry])
 async def list_journal_entries(
     resource_type: Optional[str] = Query(None),
     resource_id: Optional[str] = Query(None),
     user_id: Optional[int] = Query(None),
     operation: Optional[str] = Query(None),
+    since: Optional[datetime] = Query(None, description="Only entries at or after this time (UTC); required to reach archived months"),
+    until: Optional[datetime] = Query(None, description="Only entries before this time (UTC)"),
     skip: int = 0,
     limit: int = 100,
     db: AsyncSession = Depends(get_async_db)
@@ -31,5 +148,7 @@ async def list_journal_entries(
         user_id=user_id,
         operation=operation,
         skip=skip,
-        limit=limit
+        limit=limit,
+        since=since,
+        until=until
     )
@@ -6,6 +6,7 @@ from typing import List, Optional
 from models import SubnetPortMapping, Subnet, User
 from schemas import SubnetPortMappingCreate, SubnetPortMappingUpdate, SubnetPortMappingResponse
 from config import get_async_db
+from vyos_plan import PlannableRoute, get_plannable_db
 from auth import get_current_active_user, RoleChecker
 from utils import audit_log_action
 from vyos_core import vyos_api_call, generate_port_forward_commands
@@ -14,7 +15,8 @@ from datetime import datetime
 router = APIRouter(
     prefix="/port-mappings",
     tags=["Port Mappings"],
-    dependencies=[Depends(get_current_active_user)]
+    dependencies=[Depends(get_current_active_user)],
+    route_class=PlannableRoute,
 )
 
 admin_netadmin_roles = RoleChecker(["admin", "netadmin"])
@@ -22,7 +24,7 @@ admin_netadmin_roles = RoleChecker(["admin", "netadmin"])
 @router.post("/", response_model=SubnetPortMappingResponse, status_code=status.HTTP_201_CREATED)
 async def create_port_mapping(
     mapping: SubnetPortMappingCreate,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: User = Depends(admin_netadmin_roles)
 ):
     """
@@ -136,7 +138,7 @@ async def get_port_mapping(
 async def update_port_mapping(
     mapping_id: int,
     mapping_update: SubnetPortMappingUpdate,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: User = Depends(admin_netadmin_roles)
 ):
     """
@@ -225,7 +227,7 @@ async def update_port_mapping(
 @router.delete("/{mapping_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_port_mapping(
     mapping_id: int,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: User = Depends(admin_netadmin_roles)
 ):
     """
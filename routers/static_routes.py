@@ -7,12 +7,14 @@ import schemas
 import models 
 from auth import get_current_active_user, RoleChecker 
 from config import get_async_db
+from vyos_plan import PlannableRoute, get_plannable_db
 
 router = APIRouter(
     prefix="/routing/static-routes",
     tags=["Static Routes"],
     dependencies=[Depends(get_current_active_user)],
     responses={404: {"description": "Not found"}},
+    route_class=PlannableRoute,
 )
 
 # Role-based access control:
@@ -27,7 +29,7 @@ admin_role = RoleChecker(["admin"])
 @router.post("/", response_model=schemas.StaticRouteResponse, status_code=status.HTTP_201_CREATED)
 async def create_static_route(
     route: schemas.StaticRouteCreate, 
-    db: AsyncSession = Depends(get_async_db), # Changed to get_async_db
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
     """
@@ -91,7 +93,7 @@ async def read_static_route(
 async def update_static_route(
     route_id: int, 
     route_update: schemas.StaticRouteUpdate, 
-    db: AsyncSession = Depends(get_async_db), # Changed to get_async_db
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
     """
@@ -115,7 +117,7 @@ async def update_static_route(
 @router.delete("/{route_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_static_route(
     route_id: int, 
-    db: AsyncSession = Depends(get_async_db), # Changed to get_async_db
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
     """
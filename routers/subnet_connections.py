@@ -6,6 +6,7 @@ from typing import List, Optional
 from models import SubnetConnectionRule, Subnet, User
 from schemas import SubnetConnectionRuleCreate, SubnetConnectionRuleUpdate, SubnetConnectionRuleResponse
 from config import get_async_db
+from vyos_plan import PlannableRoute, get_plannable_db
 from auth import get_current_active_user, RoleChecker
 from utils import audit_log_action
 from vyos_core import vyos_api_call, generate_subnet_connection_commands
@@ -14,7 +15,8 @@ from datetime import datetime
 router = APIRouter(
     prefix="/subnet-connections",
     tags=["Subnet Connections"],
-    dependencies=[Depends(get_current_active_user)]
+    dependencies=[Depends(get_current_active_user)],
+    route_class=PlannableRoute,
 )
 
 admin_netadmin_roles = RoleChecker(["admin", "netadmin"])
@@ -22,7 +24,7 @@ admin_netadmin_roles = RoleChecker(["admin", "netadmin"])
 @router.post("/", response_model=SubnetConnectionRuleResponse, status_code=status.HTTP_201_CREATED)
 async def create_subnet_connection_rule(
     rule: SubnetConnectionRuleCreate,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: User = Depends(admin_netadmin_roles)
 ):
     """
@@ -195,7 +197,7 @@ async def get_subnet_connection_rule(
 async def update_subnet_connection_rule(
     rule_id: int,
     rule_update: SubnetConnectionRuleUpdate,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: User = Depends(admin_netadmin_roles)
 ):
     """
@@ -295,7 +297,7 @@ async def update_subnet_connection_rule(
 @router.delete("/{rule_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_subnet_connection_rule(
     rule_id: int,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: User = Depends(admin_netadmin_roles)
 ):
     """
@@ -6,6 +6,7 @@ from typing import List, Optional
 from models import Subnet, User
 from schemas import SubnetCreate, SubnetUpdate, SubnetResponse
 from config import get_async_db
+from vyos_plan import PlannableRoute, get_plannable_db
 from auth import get_current_active_user, RoleChecker
 from utils import audit_log_action
 from vyos_core import vyos_api_call, generate_subnet_isolation_rules
@@ -14,7 +15,8 @@ from datetime import datetime
 router = APIRouter(
     prefix="/subnets",
     tags=["Subnets"],
-    dependencies=[Depends(get_current_active_user)]
+    dependencies=[Depends(get_current_active_user)],
+    route_class=PlannableRoute,
 )
 
 admin_netadmin_roles = RoleChecker(["admin", "netadmin"])
@@ -22,7 +24,7 @@ admin_netadmin_roles = RoleChecker(["admin", "netadmin"])
 @router.post("/", response_model=SubnetResponse, status_code=status.HTTP_201_CREATED)
 async def create_subnet(
     subnet: SubnetCreate,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: User = Depends(admin_netadmin_roles)
 ):
     """
@@ -119,7 +121,7 @@ async def get_subnet(
 async def update_subnet(
     subnet_id: int,
     subnet_update: SubnetUpdate,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: User = Depends(admin_netadmin_roles)
 ):
     """
@@ -187,7 +189,7 @@ async def update_subnet(
 @router.delete("/{subnet_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_subnet(
     subnet_id: int,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_plannable_db),
     current_user: User = Depends(admin_netadmin_roles)
 ):
     """
@@ -164,6 +164,11 @@ async def provision_vm(req: VMProvisionRequest, db: AsyncSession = Depends(get_a
         internal_ip = None
         dhcp_pool = None
 
+        existing_vm = await crud.get_vm_by_machine_id(db, machine_id)
+        if existing_vm:
+            raise HTTPException(status_code=400, detail=f"VM with machine_id '{machine_id}' already exists.")
+
+        # Validate everything before reserving an address; the reservation is released if nothing commits.
         if req.dhcp_pool_name:
             dhcp_pool = await crud.get_dhcp_pool_by_name(db, req.dhcp_pool_name)
             if not dhcp_pool:
@@ -175,10 +180,6 @@ async def provision_vm(req: VMProvisionRequest, db: AsyncSession = Depends(get_a
         else:
             raise HTTPException(status_code=400, detail="Either dhcp_pool_name (with optional assign_static_ip_from_pool) or ip_address must be provided.")
 
-        existing_vm = await crud.get_vm_by_machine_id(db, machine_id)
-        if existing_vm:
-            raise HTTPException(status_code=400, detail=f"VM with machine_id '{machine_id}' already exists.")
-
         vm = await crud.create_vm(db, machine_id, mac_address, internal_ip, dhcp_pool_id=dhcp_pool.id if dhcp_pool else None, hostname=req.hostname, user_id=current_user.id)
 
         if dhcp_pool and internal_ip and req.hostname:
@@ -16,6 +16,8 @@ class VMProvisionRequest(BaseModel):
     # ip_range and port_range might be deprecated in favor of pool-based allocation
     ip_range: Optional[Dict[str, Any]] = Field(None, deprecated=True) 
     port_range: Optional[Dict[str, Any]] = Field(None, deprecated=True)
+    ip_address: Optional[str] = None # Static IP, used when no dhcp_pool_name is given
+    ports_to_open: Optional[List[str]] = None # Port types to forward, e.g. ["ssh", "http"]; defaults to ["ssh"]
 
 class VMProvisionResponse(BaseModel):
     status: str
@@ -25,6 +27,24 @@ class VMProvisionResponse(BaseModel):
     hostname: Optional[str] = None
     dhcp_pool_name: Optional[str] = None
 
+class BulkVMProvisionRequest(BaseModel):
+    vms: List[VMProvisionRequest]
+
+class BulkVMProvisionItemResult(BaseModel):
+    vm_name: str
+    status: str # "success" or "error"
+    internal_ip: Optional[str] = None
+    external_ports: Dict[str, int] = {}
+    nat_rule_numbers: Dict[str, int] = {}
+    dhcp_pool_name: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkVMProvisionResponse(BaseModel):
+    results: List[BulkVMProvisionItemResult]
+    total_requested: int
+    total_successful: int
+    total_failed: int
+
 class VMStatusResponse(BaseModel):
     ssh: str
     http: str
@@ -34,14 +54,21 @@ class VMPortDetail(BaseModel):
     status: str
     external_port: int | None
     nat_rule_number: int | None
+    protocol: Optional[str] = None
+    source_ip: Optional[str] = None
 
 class AllVMStatusResponse(BaseModel):
+    id: Optional[int] = None
     machine_id: str
-    internal_ip: str
+    internal_ip: Optional[str] = None
     hostname: Optional[str] = None
     dhcp_pool_name: Optional[str] = None
     ports: dict[str, VMPortDetail]
 
+class VMStatusPage(BaseModel):
+    items: List[AllVMStatusResponse]
+    next_cursor: Optional[int] = None  # Pass as `after` to fetch the next page; None on the last page
+
 class VMPortStatus(BaseModel):
     port_type: str
     status: str
@@ -136,7 +163,8 @@ class APIKeyCreate(APIKeyBase):
 
 class APIKeyResponse(APIKeyBase):
     id: int
-    api_key: str # The key itself will be shown on creation, then perhaps only partially or not at all
+    api_key: Optional[str] = None # Only returned once, on creation; only its hash is stored
+    key_prefix: Optional[str] = None # Public part of the key, identifies it in listings
     user_id: int
     created_at: datetime
 
@@ -428,6 +456,11 @@ class ChangeJournalEntry(BaseModel):
     class Config:
         orm_mode = True
 
+class ChangeFeedPage(BaseModel):
+    changes: List[ChangeJournalEntry]
+    next_cursor: int  # Pass as `after` to resume; never moves backwards
+    has_more: bool  # More entries are ready now; fetch again without waiting
+
 class ChangeJournalCreate(BaseModel):
     user_id: Optional[int] = None
     resource_type: str
@@ -1,14 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from config import SessionLocal
 import crud
 from schemas import VMStatusResponse, AllVMStatusResponse, VMPortDetail
 
 router = APIRouter()
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
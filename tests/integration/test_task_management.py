@@ -1,10 +1,15 @@
 import pytest
 from httpx import AsyncClient, ASGITransport
 from main import app
+from auth import get_current_active_user
+from models import User
 import asyncio
 
 @pytest.mark.asyncio
 async def test_task_management():
+    user = User(id=1, username="tasks")
+    user.roles = ["user"]
+    app.dependency_overrides[get_current_active_user] = lambda: user
     transport = ASGITransport(app=app)
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
         # Submit a task
@@ -26,3 +31,4 @@ async def test_task_management():
             await asyncio.sleep(1)
         else:
             assert False, "Task did not complete in time"
+    app.dependency_overrides.pop(get_current_active_user, None)
@@ -0,0 +1,80 @@
+import secrets
+import uuid
+from datetime import datetime
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import utils_api_keys
+from models import APIKey, User
+from utils_api_keys import APIKeyCodec, hash_api_key
+
+
+@pytest_asyncio.fixture
+async def session_factory(test_db_engine, monkeypatch):
+    monkeypatch.setattr(utils_api_keys, "_api_key_codec", APIKeyCodec("test-secret"))
+    yield sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def _user(db):
+    user = User(username=f"ak-{uuid.uuid4().hex[:8]}", hashed_password="x", created_at=datetime.utcnow())
+    db.add(user)
+    await db.commit()
+    return user
+
+
+def test_checksum_rejects_malformed_and_forged_keys():
+    codec = APIKeyCodec("test-secret")
+    plaintext, prefix, key_hash = codec.generate()
+    assert plaintext.startswith(f"vyk_{prefix}_") and key_hash == hash_api_key(plaintext)
+    assert codec.parse(plaintext) == prefix
+
+    forged = plaintext[:-1] + ("0" if plaintext[-1] != "0" else "1")
+    assert codec.parse(forged) is None
+    assert APIKeyCodec("other-secret").parse(plaintext) is None
+    assert codec.parse("garbage") is None and codec.parse("") is None
+    assert codec.stats()["rejected_checksum"] == 1 and codec.stats()["rejected_malformed"] == 2
+
+
+@pytest.mark.asyncio
+async def test_keys_are_stored_hashed_and_found_by_prefix(session_factory):
+    async with session_factory() as db:
+        user = await _user(db)
+        created = await crud.create_api_key_for_user(db, user_id=user.id, description="ci")
+        plaintext = created.api_key  # Shown once, on creation
+        assert plaintext.startswith("vyk_")
+
+    async with session_factory() as db:
+        stored = (await crud.get_api_keys_for_user(db, user_id=user.id))[0]
+        assert stored.key_hash == hash_api_key(plaintext) and plaintext not in (stored.key_prefix, stored.key_hash)
+        assert getattr(stored, "api_key", None) is None
+
+        found = await crud.get_api_key_by_value(db, plaintext)
+        assert found.id == created.id
+        # Same prefix, wrong secret (re-signed so it passes the checksum): the hash comparison still fails.
+        codec = utils_api_keys.get_api_key_codec()
+        body = plaintext[:plaintext.index("_", 4) + 1] + "0" * 48
+        assert await crud.get_api_key_by_value(db, body + codec._checksum(body)) is None
+
+
+@pytest.mark.asyncio
+async def test_invalid_keys_never_reach_the_database(session_factory):
+    # db=None: any query would fail, so a None result means the key was rejected up front.
+    assert await crud.get_api_key_by_value(None, "vyk_" + "a" * 80) is None
+    assert await crud.get_api_key_by_value(None, "' OR 1=1 --") is None
+
+
+@pytest.mark.asyncio
+async def test_legacy_keys_are_found_by_hash_until_disabled(session_factory):
+    legacy = secrets.token_urlsafe(32)
+    async with session_factory() as db:
+        user = await _user(db)
+        db.add(APIKey(key_hash=hash_api_key(legacy), user_id=user.id, created_at=datetime.utcnow()))
+        await db.commit()
+        assert (await crud.get_api_key_by_value(db, legacy)).user_id == user.id
+
+        utils_api_keys.get_api_key_codec().allow_legacy = False
+        assert await crud.get_api_key_by_value(None, legacy) is None
@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+from models import DHCPPool, VMNetworkConfig, VMPortRule, VyOSOutbox
+from utils_ip_allocator import ip_allocator
+from schemas import VMProvisionRequest
+
+
+async def _make_pool(db: AsyncSession, name: str, start: str, end: str) -> DHCPPool:
+    pool = DHCPPool(name=name, ip_range_start=start, ip_range_end=end, created_at=datetime.utcnow(), updated_at=datetime.utcnow())
+    db.add(pool)
+    await db.commit()
+    return pool
+
+
+@pytest.mark.asyncio
+async def test_bulk_provision_single_commit_and_per_item_results(async_db_session: AsyncSession):
+    await _make_pool(async_db_session, "bulk-pool", "10.60.0.10", "10.60.0.20")
+    requests = [
+        VMProvisionRequest(vm_name="bulk-vm-1", mac_address="02:00:00:00:60:01", dhcp_pool_name="bulk-pool", hostname="vm1", ports_to_open=["ssh", "http"]),
+        VMProvisionRequest(vm_name="bulk-vm-2", mac_address="02:00:00:00:60:02", dhcp_pool_name="bulk-pool"),
+        VMProvisionRequest(vm_name="bulk-vm-3", mac_address="02:00:00:00:60:03", ip_address="10.61.0.5"),
+        VMProvisionRequest(vm_name="bulk-vm-1", mac_address="02:00:00:00:60:04", dhcp_pool_name="bulk-pool"),
+        VMProvisionRequest(vm_name="bulk-vm-5", mac_address="02:00:00:00:60:05", dhcp_pool_name="missing-pool"),
+    ]
+    with patch("crud_journal.notify_journal_batch", new_callable=AsyncMock) as notify, \
+         patch.object(async_db_session, "commit", wraps=async_db_session.commit) as commit:
+        results = await crud.bulk_provision_vms(async_db_session, requests)
+        await asyncio.sleep(0)
+
+    assert [r["status"] for r in results] == ["success", "success", "success", "error", "error"]
+    assert "already exists" in results[3]["error"] and "not found" in results[4]["error"]
+    assert results[0]["internal_ip"] != results[1]["internal_ip"]
+    assert set(results[0]["external_ports"]) == {"ssh", "http"}
+    all_ports = [p for r in results[:3] for p in r["external_ports"].values()]
+    assert len(all_ports) == len(set(all_ports)) == 4
+    assert commit.await_count == 1
+    # The router change is staged in the same transaction instead of being sent before the commit.
+    outbox = await async_db_session.execute(select(VyOSOutbox).filter(VyOSOutbox.resource_id.like("bulk-vm-%")))
+    assert [(e.resource_id, e.commands[0]) for e in outbox.scalars().all()] == [
+        ("bulk-vm-1", f"set service dhcp-server static-mapping 02:00:00:00:60:01 ip-address {results[0]['internal_ip']}")]
+    # Notifications get detached journal records, not rows of the request's session.
+    records = notify.await_args.args[0]
+    assert [r.resource_id for r in records] == ["bulk-vm-1", "bulk-vm-2", "bulk-vm-3"] and all(r.id for r in records)
+    count = await async_db_session.execute(select(func.count()).select_from(VMPortRule).filter(VMPortRule.external_port.in_(all_ports)))
+    assert count.scalar() == 4
+
+
+@pytest.mark.asyncio
+async def test_bulk_provision_rolls_back_when_the_write_fails(async_db_session: AsyncSession):
+    pool_id = (await _make_pool(async_db_session, "bulk-pool-2", "10.62.0.10", "10.62.0.20")).id
+    requests = [VMProvisionRequest(vm_name=f"bulk-rb-{i}", mac_address=f"02:00:00:00:62:0{i}", dhcp_pool_name="bulk-pool-2",
+                                   hostname=f"rb{i}") for i in range(3)]
+    with patch("crud.enqueue_vyos_commands", side_effect=RuntimeError("outbox unavailable")):
+        results = await crud.bulk_provision_vms(async_db_session, requests)
+
+    assert all(r["status"] == "error" and "outbox unavailable" in r["error"] for r in results)
+    remaining = await async_db_session.execute(select(VMNetworkConfig).filter(VMNetworkConfig.machine_id.like("bulk-rb-%")))
+    assert remaining.scalars().all() == []
+    assert ip_allocator.stats()[pool_id]["used"] == 0  # The reserved addresses went back with the rollback
+
+
+@pytest.mark.asyncio
+async def test_cancelled_bulk_provision_rolls_back_and_releases_addresses(async_db_session: AsyncSession):
+    pool_id = (await _make_pool(async_db_session, "bulk-pool-3", "10.63.0.10", "10.63.0.20")).id
+    requests = [VMProvisionRequest(vm_name=f"bulk-cx-{i}", mac_address=f"02:00:00:00:63:0{i}", dhcp_pool_name="bulk-pool-3",
+                                   hostname=f"cx{i}") for i in range(2)]
+    with patch("crud.enqueue_vyos_commands", side_effect=asyncio.CancelledError()):
+        with pytest.raises(asyncio.CancelledError):
+            await crud.bulk_provision_vms(async_db_session, requests)
+
+    remaining = await async_db_session.execute(select(VMNetworkConfig).filter(VMNetworkConfig.machine_id.like("bulk-cx-%")))
+    assert remaining.scalars().all() == []
+    assert ip_allocator.stats()[pool_id]["used"] == 0
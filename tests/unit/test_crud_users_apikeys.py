@@ -6,7 +6,7 @@ from crud import (
     get_api_key_by_value, delete_api_key_for_user, get_api_keys_for_user,
 )
 from models import User
-from auth import hash_password, verify_password
+from utils import hash_password, verify_password
 from datetime import datetime, timedelta
 
 @pytest.mark.asyncio
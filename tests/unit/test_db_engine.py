@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from config import get_database_config
+from utils_db import (InstrumentedAsyncPool, WriterTimeoutError, build_async_engine, build_read_engine,
+                      get_pool_stats, normalize_async_url, session_routing_options)
+
+
+def test_postgres_urls_use_asyncpg():
+    assert make_url(normalize_async_url("postgres://u:p@db/vyos")).drivername == "postgresql+asyncpg"
+    assert make_url(normalize_async_url("postgresql+psycopg2://u:p@db/vyos")).drivername == "postgresql+asyncpg"
+    assert normalize_async_url("sqlite+aiosqlite:///./x.db") == "sqlite+aiosqlite:///./x.db"
+
+
+@pytest.mark.asyncio
+async def test_pool_reports_checkouts_and_waits(tmp_path):
+    settings = {**get_database_config(), "POOL_SIZE": 1, "MAX_OVERFLOW": 0, "POOL_TIMEOUT": 5.0}
+    engine = build_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}", settings)
+    assert isinstance(engine.sync_engine.pool, InstrumentedAsyncPool)
+
+    async def query():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await asyncio.sleep(0.02)
+
+    try:
+        await asyncio.gather(query(), query(), query())
+        stats = get_pool_stats(engine)
+    finally:
+        await engine.dispose()
+    assert stats["pool_size"] == 1 and stats["checked_out"] == 0
+    assert stats["checkouts"] >= 3 and stats["connects"] == 1
+    assert stats["checkouts_waited"] >= 2 and stats["wait_max_ms"] >= 10
+    assert stats["hold_max_ms"] >= 20
+
+
+@pytest.mark.asyncio
+async def test_sqlite_single_writer_routes_reads_and_serializes_writes(tmp_path):
+    url = f"sqlite+aiosqlite:///{tmp_path / 'edge.db'}"
+    settings = {**get_database_config(), "SQLITE_SINGLE_WRITER": True, "SQLITE_READ_POOL_SIZE": 2}
+    writer, reader = build_async_engine(url, settings), build_read_engine(url, settings)
+    counters = Table("counters", MetaData(), Column("id", Integer, primary_key=True), Column("n", Integer))
+    session_factory = sessionmaker(bind=writer, class_=AsyncSession, **session_routing_options(reader))
+    try:
+        async with writer.begin() as conn:
+            await conn.run_sync(counters.create)
+            assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+            assert (await conn.execute(text("PRAGMA synchronous"))).scalar() == 1  # NORMAL
+
+        async def unit_of_work(i):
+            # Several commits per request, like create_vm -> quota -> journal.
+            async with session_factory() as db:
+                for _ in range(3):
+                    await db.execute(select(counters))
+                    await db.execute(counters.insert().values(n=i))
+                    assert len((await db.execute(select(counters).where(counters.c.n == i))).all()) >= 1
+                    await db.commit()
+
+        await asyncio.gather(*(unit_of_work(i) for i in range(8)))
+        async with session_factory() as db:
+            assert len((await db.execute(select(counters))).all()) == 24
+        writer_stats, reader_stats = get_pool_stats(writer), get_pool_stats(reader)
+        async with reader.connect() as conn:
+            with pytest.raises(Exception, match="readonly"):
+                await conn.execute(counters.insert().values(n=0))
+    finally:
+        await writer.dispose()
+        await reader.dispose()
+    assert writer_stats["pool_size"] == 1 and writer_stats["connects"] == 1 and writer_stats["checkout_timeouts"] == 0
+    assert reader_stats["checkouts"] >= 25  # One read per commit cycle plus the final count
+    assert build_read_engine("sqlite+aiosqlite:///:memory:", settings) is None
+
+
+@pytest.mark.asyncio
+async def test_sqlite_writer_checkout_times_out_with_a_clear_error(tmp_path):
+    settings = {**get_database_config(), "SQLITE_SINGLE_WRITER": True, "SQLITE_WRITER_TIMEOUT": 0.1}
+    writer = build_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'held.db'}", settings)
+    try:
+        async with writer.connect():  # A session that never lets go of the writer
+            with pytest.raises(WriterTimeoutError, match="SQLite writer connection"):
+                async with writer.connect():
+                    pass
+    finally:
+        await writer.dispose()
+    assert get_pool_stats(writer)["checkout_timeouts"] == 1
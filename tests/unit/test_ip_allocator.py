@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from exceptions import ResourceAllocationError
+from models import DHCPPool, VMNetworkConfig
+from utils_ip_allocator import IPBitmap, PoolIPAllocator
+
+
+def test_bitmap_allocates_lowest_free_and_reuses_released():
+    bitmap = IPBitmap("10.0.0.10", "10.0.0.29")
+    bitmap.mark_used("10.0.0.10")
+    bitmap.mark_used("10.0.0.12")
+    assert bitmap.allocate(3) == ["10.0.0.11", "10.0.0.13", "10.0.0.14"]
+    bitmap.release("10.0.0.11")
+    assert bitmap.allocate() == ["10.0.0.11"]
+    assert bitmap.used == 5
+    assert not bitmap.mark_used("10.0.1.1")  # Outside the range
+
+
+def test_bitmap_batch_reservation_is_all_or_nothing():
+    bitmap = IPBitmap("10.0.0.1", "10.0.0.4")
+    bitmap.allocate(3)
+    with pytest.raises(ResourceAllocationError):
+        bitmap.allocate(2)
+    assert bitmap.used == 3
+    assert bitmap.allocate() == ["10.0.0.4"]
+
+
+@pytest.mark.asyncio
+async def test_pool_allocator_builds_from_db_and_is_concurrency_safe(async_db_session: AsyncSession):
+    pool = DHCPPool(name="alloc-pool", ip_range_start="10.50.0.10", ip_range_end="10.50.0.59",
+                    created_at=datetime.utcnow(), updated_at=datetime.utcnow())
+    async_db_session.add(pool)
+    async_db_session.add(VMNetworkConfig(machine_id="alloc-vm", mac_address="00:aa:bb:cc:dd:01", internal_ip="10.50.0.10"))
+    await async_db_session.commit()
+
+    allocator = PoolIPAllocator()
+    results = await asyncio.gather(*[allocator.allocate(async_db_session, pool, 5) for _ in range(9)])
+    allocated = [ip for batch in results for ip in batch]
+    assert len(allocated) == len(set(allocated)) == 45
+    assert "10.50.0.10" not in allocated
+    with pytest.raises(ResourceAllocationError):
+        await allocator.allocate(async_db_session, pool, 5)
+    allocator.release(allocated[:2])
+    assert sorted(await allocator.allocate(async_db_session, pool, 2)) == sorted(allocated[:2])
+
+
+@pytest.mark.asyncio
+async def test_reservations_are_released_unless_the_transaction_commits(test_db_engine):
+    session_factory = sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as db:
+        pool = DHCPPool(name="reserve-pool", ip_range_start="10.51.0.1", ip_range_end="10.51.0.9",
+                        created_at=datetime.utcnow(), updated_at=datetime.utcnow())
+        db.add(pool)
+        await db.commit()
+
+    allocator = PoolIPAllocator()
+    async with session_factory() as db:
+        assert await allocator.reserve(db, pool) == ["10.51.0.1"]
+        await db.rollback()
+    async with session_factory() as db:
+        assert await allocator.reserve(db, pool) == ["10.51.0.1"]  # Closed without a commit
+    async with session_factory() as db:
+        ip = (await allocator.reserve(db, pool))[0]
+        db.add(VMNetworkConfig(machine_id="reserve-vm", mac_address="00:aa:bb:cc:dd:51", internal_ip=ip))
+        await db.commit()
+    assert ip == "10.51.0.1" and allocator.stats()[pool.id]["used"] == 1
+
+
+@pytest.mark.asyncio
+async def test_rollback_rebuilds_the_bitmap_with_addresses_committed_elsewhere(test_db_engine):
+    session_factory = sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as db:
+        pool = DHCPPool(name="resync-pool", ip_range_start="10.52.0.1", ip_range_end="10.52.0.9",
+                        created_at=datetime.utcnow(), updated_at=datetime.utcnow())
+        db.add(pool)
+        await db.commit()
+
+    allocator = PoolIPAllocator()
+    async with session_factory() as db, session_factory() as other_db:
+        held = await allocator.reserve(other_db, pool)
+        first = await allocator.reserve(db, pool)
+        # Another worker commits the same address; this process's insert would fail and roll back.
+        async with session_factory() as worker:
+            worker.add(VMNetworkConfig(machine_id="resync-vm", mac_address="00:aa:bb:cc:dd:52", internal_ip=first[0]))
+            await worker.commit()
+        await db.rollback()
+        retry = await allocator.reserve(db, pool)
+        assert allocator.resyncs == 1
+        assert retry != first and retry != held  # The other transaction's address survived the rebuild
+        await db.rollback()
@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from fastapi import HTTPException
+from unittest.mock import patch
+
+import routers
+from exceptions import JobError
+from models import Job, User
+from schemas import TaskSubmitRequest
+from utils_job_engine import JobEngine, register_job_handler
+
+
+@register_job_handler("test_progress")
+async def _progress_job(params, ctx):
+    await ctx.report_progress(40, "halfway")
+    return {"echo": params}
+
+
+@register_job_handler("test_fail")
+async def _failing_job(params, ctx):
+    raise ValueError("boom")
+
+
+@register_job_handler("test_slow")
+async def _slow_job(params, ctx):
+    await asyncio.sleep(30)
+    return {"done": True}
+
+
+async def _wait_for(engine, job_id, statuses, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        job = await engine.get(job_id)
+        if job["status"] in statuses or asyncio.get_running_loop().time() > deadline:
+            return job
+        await asyncio.sleep(0.05)
+
+
+@pytest_asyncio.fixture
+async def engine(test_db_engine):
+    job_engine = JobEngine(sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False),
+                           workers=2, poll_interval=0.1, result_ttl_seconds=60)
+    await job_engine.start()
+    yield job_engine
+    await job_engine.stop()
+
+
+@pytest.mark.asyncio
+async def test_jobs_run_to_success_or_error(engine):
+    ok_id = await engine.submit("test_progress", {"a": 1})
+    fail_id = await engine.submit("test_fail")
+    ok = await _wait_for(engine, ok_id, ("success",))
+    failed = await _wait_for(engine, fail_id, ("error",))
+    assert ok["status"] == "success" and ok["result"] == {"echo": {"a": 1}} and ok["progress"] == 100
+    assert ok["progress_message"] == "halfway" and ok["expires_at"] is not None
+    assert failed["status"] == "error" and failed["result"] == {"error": "boom"}
+    with pytest.raises(JobError):
+        await engine.submit("no_such_job")
+
+
+@pytest.mark.asyncio
+async def test_cancel_queued_and_running_jobs(engine):
+    running_id = await engine.submit("test_slow")
+    assert (await _wait_for(engine, running_id, ("running",)))["status"] == "running"
+    assert (await engine.cancel(running_id))["task_id"] == running_id
+    cancelled = await _wait_for(engine, running_id, ("cancelled",))
+    assert cancelled["status"] == "cancelled"
+    assert await engine.cancel("missing") is None
+
+
+@pytest.mark.asyncio
+async def test_expired_results_are_evicted(engine):
+    job_id = await engine.submit("test_progress")
+    await _wait_for(engine, job_id, ("success",))
+    async with engine.session_factory() as db:
+        await db.execute(update(Job).where(Job.id == job_id).values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+        await db.commit()
+    assert await engine.evict_expired() >= 1
+    assert await engine.get(job_id) is None
+
+
+def _user(user_id, username, role):
+    user = User(id=user_id, username=username)
+    user.roles = [role]
+    return user
+
+
+@pytest.mark.asyncio
+async def test_task_endpoints_are_scoped_to_the_owner(engine):
+    alice, bob, admin = _user(101, "alice", "user"), _user(102, "bob", "user"), _user(103, "root", "admin")
+    with patch("vyos_core.get_job_engine", return_value=engine):
+        task_id = (await routers.submit_task_api(TaskSubmitRequest(task_type="test_slow", params={}), current_user=alice))["task_id"]
+        assert (await engine.get(task_id))["user_id"] == alice.id
+        assert (await routers.get_task_status_api(task_id, current_user=alice))["task_id"] == task_id
+        assert (await routers.get_task_status_api(task_id, current_user=admin))["task_id"] == task_id
+        for endpoint in (routers.get_task_status_api, routers.cancel_task_api):
+            with pytest.raises(HTTPException) as exc:
+                await endpoint(task_id, current_user=bob)
+            assert exc.value.status_code == 404
+        assert (await routers.cancel_task_api(task_id, current_user=alice))["task_id"] == task_id
+
+        with pytest.raises(HTTPException) as exc:
+            await routers.submit_task_api(TaskSubmitRequest(task_type="config_sync", params={}), current_user=alice)
+        assert exc.value.status_code == 403
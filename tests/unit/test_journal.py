@@ -1,5 +1,8 @@
+import asyncio
 import pytest
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+import crud_journal
 from models import ChangeJournal
 from schemas import ChangeJournalCreate
 from crud_journal import create_journal_entry, get_journal_entries
@@ -24,3 +27,22 @@ async def test_create_and_query_journal_entry(async_db_session: AsyncSession):
     # Query the journal
     results = await get_journal_entries(async_db_session, resource_type="test_resource", resource_id="res-123")
     assert any(j.resource_id == "res-123" and j.operation == "create" for j in results)
+
+
+@pytest.mark.asyncio
+async def test_notifications_run_on_their_own_session(async_db_session: AsyncSession, test_db_engine, monkeypatch):
+    delivered = []
+
+    async def trigger(db, journal):
+        delivered.append((db, journal.id))
+
+    monkeypatch.setattr(crud_journal, "AsyncSessionLocal", sessionmaker(bind=test_db_engine, class_=AsyncSession))
+    monkeypatch.setattr(crud_journal, "trigger_notifications_for_event", trigger)
+    created = await create_journal_entry(async_db_session, ChangeJournalCreate(
+        user_id=1, resource_type="test_resource", resource_id="res-456", operation="update", comment="notify"))
+    for _ in range(50):
+        if delivered:
+            break
+        await asyncio.sleep(0.01)
+    assert [journal_id for _, journal_id in delivered] == [created.id]
+    assert delivered[0][0] is not async_db_session
@@ -0,0 +1,99 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from models import ChangeJournal, ServiceLease
+from utils_journal_archive import ARCHIVER_LEASE, JournalArchiver, JournalQuery, journal_activity, list_archives, list_partitions, partition_table, query_journal
+
+
+@pytest_asyncio.fixture
+async def journal(test_db_engine, tmp_path):
+    session_factory = sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as db:
+        await db.execute(delete(ChangeJournal))
+        for name in (await list_partitions(db)).values():
+            await db.run_sync(lambda s, table=partition_table(name): table.drop(s.connection()))
+        # Two entries in each of Jan..Jun 2024, on the 10th and the 20th
+        for month in range(1, 7):
+            for day in (10, 20):
+                db.add(ChangeJournal(timestamp=datetime(2024, month, day), user_id=1, resource_type="vm",
+                                     resource_id=f"ja-{month}-{day}", operation="create" if day == 10 else "update"))
+        await db.commit()
+    archiver = JournalArchiver(session_factory, hot_months=2, archive_after_months=4, archive_dir=str(tmp_path))
+    yield archiver, session_factory
+    async with session_factory() as db:
+        await db.execute(delete(ServiceLease))
+        await db.execute(delete(ChangeJournal))
+        for name in (await list_partitions(db)).values():
+            await db.run_sync(lambda s, table=partition_table(name): table.drop(s.connection()))
+        await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_rotation_moves_old_months_to_tables_and_archives(journal):
+    archiver, session_factory = journal
+    report = await archiver.run_once(now=datetime(2024, 6, 25))
+
+    # May/June stay hot; Mar/Apr become monthly tables; Jan/Feb are exported and dropped.
+    assert report["partitioned"] == ["change_journal_202401", "change_journal_202402", "change_journal_202403", "change_journal_202404"]
+    assert report["archived"] == ["change_journal_202401", "change_journal_202402"]
+    assert sorted(os.path.basename(p) for p in list_archives(archiver.archive_dir).values()) == [
+        "change_journal_202401.ndjson.gz", "change_journal_202402.ndjson.gz"]
+    async with session_factory() as db:
+        assert sorted((await list_partitions(db)).values()) == ["change_journal_202403", "change_journal_202404"]
+        hot = (await db.execute(select(ChangeJournal.resource_id))).scalars().all()
+    assert sorted(hot) == ["ja-5-10", "ja-5-20", "ja-6-10", "ja-6-20"]
+    assert archiver.rows_moved == 8 and archiver.months_archived == 2
+
+    # A second pass has nothing left to do.
+    assert (await archiver.run_once(now=datetime(2024, 6, 25)))["archived"] == []
+
+
+@pytest.mark.asyncio
+async def test_pass_is_skipped_while_another_worker_holds_the_lease(journal):
+    archiver, session_factory = journal
+    other = JournalArchiver(session_factory, hot_months=2, archive_after_months=4, archive_dir=archiver.archive_dir)
+    assert await other._acquire_lease()
+
+    report = await archiver.run_once(now=datetime(2024, 6, 25))
+    assert report["skipped"] and report["partitioned"] == [] and archiver.passes_skipped == 1
+    async with session_factory() as db:
+        assert await list_partitions(db) == {}
+
+    # A lease left behind by a crashed worker is taken over once it expires.
+    async with session_factory() as db:
+        await db.execute(update(ServiceLease).values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+        await db.commit()
+    report = await archiver.run_once(now=datetime(2024, 6, 25))
+    assert "skipped" not in report and report["archived"] == ["change_journal_202401", "change_journal_202402"]
+    async with session_factory() as db:
+        assert (await db.get(ServiceLease, ARCHIVER_LEASE)).holder is None
+
+
+@pytest.mark.asyncio
+async def test_queries_span_hot_partitioned_and_archived_data(journal):
+    archiver, session_factory = journal
+    await archiver.run_once(now=datetime(2024, 6, 25))
+    archive_dir = archiver.archive_dir
+    async with session_factory() as db:
+        # Without a time range only the database is read: hot table first, then monthly tables, newest first.
+        entries = await query_journal(db, JournalQuery(), limit=100, archive_dir=archive_dir)
+        assert [e.resource_id for e in entries] == [f"ja-{m}-{d}" for m in (6, 5, 4, 3) for d in (20, 10)]
+
+        # A range that reaches back into archived months reads the archive files too.
+        since = datetime(2024, 1, 15)
+        entries = await query_journal(db, JournalQuery(since=since, until=datetime(2024, 5, 15)), limit=100, archive_dir=archive_dir)
+        assert [e.resource_id for e in entries] == ["ja-5-10", "ja-4-20", "ja-4-10", "ja-3-20", "ja-3-10", "ja-2-20", "ja-2-10", "ja-1-20"]
+
+        # Pagination and filters carry across source boundaries.
+        page = await query_journal(db, JournalQuery(operation="update", since=datetime(2024, 1, 1)), skip=3, limit=2,
+                                   archive_dir=archive_dir)
+        assert [e.resource_id for e in page] == ["ja-3-20", "ja-2-20"]
+
+        activity = await journal_activity(db, since=datetime(2024, 2, 1), archive_dir=archive_dir)
+    assert activity == {f"2024-{m:02d}-{d}": 1 for m in range(2, 7) for d in (10, 20)}
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi import FastAPI
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from auth import get_current_user
+from models import ChangeJournal, User
+from routers import journal as journal_routes
+from utils_journal_archive import JournalArchiver, JournalQuery, find_journal_entry, query_journal, resource_state_at
+from utils_journal_delta import apply_patch, compact_journal, make_patch
+
+
+def _policy(revision):
+    rules = [{"id": i, "action": "accept", "port": 1000 + i, "comment": "x" * 40} for i in range(30)]
+    rules[revision % 30]["action"] = "drop"
+    return {"name": "edge", "revision": revision, "rules": {str(r["id"]): r for r in rules}}
+
+
+@pytest_asyncio.fixture
+async def journal(test_db_engine, tmp_path):
+    session_factory = sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as db:
+        await db.execute(delete(ChangeJournal))
+        start = datetime(2024, 3, 1)
+        db.add(ChangeJournal(timestamp=start, resource_type="firewall_policy", resource_id="edge", operation="create",
+                             before=None, after=_policy(0)))
+        for revision in range(1, 40):
+            db.add(ChangeJournal(timestamp=start + timedelta(hours=revision), resource_type="firewall_policy",
+                                 resource_id="edge", operation="update", before=_policy(revision - 1), after=_policy(revision)))
+        db.add(ChangeJournal(timestamp=start + timedelta(hours=40), resource_type="firewall_policy", resource_id="edge",
+                             operation="delete", before=_policy(39), after=None))
+        await db.commit()
+    yield session_factory, tmp_path
+    async with session_factory() as db:
+        await db.execute(delete(ChangeJournal))
+        await db.commit()
+
+
+def test_patch_round_trip():
+    source = {"a": 1, "b": {"c": [1, 2], "d/e": "x"}, "gone": True}
+    target = {"a": 2, "b": {"c": [1, 2, 3], "d/e": "y"}, "new": None}
+    assert apply_patch(source, make_patch(source, target)) == target
+    assert apply_patch(None, make_patch(None, target)) == target
+    assert apply_patch(source, make_patch(source, None)) is None
+    assert make_patch(source, source) == []
+
+
+@pytest.mark.asyncio
+async def test_compaction_shrinks_payloads_and_reads_stay_whole(journal):
+    session_factory, archive_dir = journal
+    async with session_factory() as db:
+        report = await compact_journal(db, settled_before=datetime(2024, 4, 1), checkpoint_interval=16)
+        assert report["rows"] == 41
+        assert report["checkpoints"] == 3 and report["deltas"] == 38  # Rows 1, 17 and 33 start a chain
+        assert report["bytes_after"] * 5 < report["bytes_before"]
+        encodings = (await db.execute(select(ChangeJournal.encoding).order_by(ChangeJournal.id))).scalars().all()
+        assert encodings.count("checkpoint") == 3 and encodings.count("delta") == 38
+        # A second pass finds nothing left to compact.
+        assert (await compact_journal(db, settled_before=datetime(2024, 4, 1)))["rows"] == 0
+
+        entries = await query_journal(db, JournalQuery(resource_id="edge"), limit=100, archive_dir=str(archive_dir))
+        assert len(entries) == 41
+        for entry in entries:
+            revision = int((entry.timestamp - datetime(2024, 3, 1)).total_seconds() // 3600)
+            assert entry.after == (_policy(revision) if revision < 40 else None)
+            assert entry.before == (_policy(revision - 1) if revision > 0 else None)
+
+        entry = await find_journal_entry(db, entries[10].id)
+        assert entry.after == entries[10].after
+        state = await resource_state_at(db, "firewall_policy", "edge", at=datetime(2024, 3, 2, 1, 30))
+        assert state.operation == "update" and state.after == _policy(25)
+        assert (await resource_state_at(db, "firewall_policy", "edge")).after is None
+
+
+@pytest.mark.asyncio
+async def test_delta_chains_survive_rotation_and_archiving(journal):
+    session_factory, archive_dir = journal
+    async with session_factory() as db:
+        # Keep the hot table's newest row outside March so the whole month can move.
+        db.add(ChangeJournal(timestamp=datetime(2024, 9, 1), resource_type="vm", resource_id="other", operation="create"))
+        await db.commit()
+    archiver = JournalArchiver(session_factory, hot_months=1, archive_after_months=6, archive_dir=str(archive_dir))
+    report = await archiver.run_once(now=datetime(2024, 9, 15))
+    assert report["compacted"]["deltas"] == 38
+    assert report["archived"] == ["change_journal_202403"]
+    async with session_factory() as db:
+        entries = await query_journal(db, JournalQuery(resource_id="edge", since=datetime(2024, 3, 1)), limit=5,
+                                      archive_dir=str(archive_dir))
+        assert [e.operation for e in entries] == ["delete", "update", "update", "update", "update"]
+        assert entries[0].before == _policy(39) and entries[1].after == _policy(39)
+        state = await resource_state_at(db, "firewall_policy", "edge", at=datetime(2024, 3, 1, 10),
+                                        archive_dir=str(archive_dir))
+    assert state.after == _policy(10)
+
+
+
+@pytest.mark.asyncio
+async def test_resource_state_endpoint_is_admin_only():
+    app = FastAPI()
+    app.include_router(journal_routes.router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver") as client:
+        assert (await client.get("/journal/state/vm/vm-1")).status_code == 401
+        user = User(id=1, username="viewer")
+        user.roles = ["user"]
+        app.dependency_overrides[get_current_user] = lambda: user
+        assert (await client.get("/journal/state/vm/vm-1")).status_code == 403
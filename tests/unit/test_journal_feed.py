@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi import FastAPI
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from auth import get_current_user
+from config import get_async_db
+from models import ChangeJournal, User
+from routers import journal
+from utils_journal_feed import ChangeFeed
+
+
+def _entry(entry_id, resource_type="vm", timestamp=None):
+    return ChangeJournal(id=entry_id, timestamp=timestamp or datetime(2024, 6, 1) + timedelta(seconds=entry_id),
+                         resource_type=resource_type, resource_id=f"cdc-{entry_id}", operation="create", after={"n": entry_id})
+
+
+@pytest_asyncio.fixture
+async def session_factory(test_db_engine):
+    factory = sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as db:
+        await db.execute(delete(ChangeJournal))
+        await db.commit()
+    yield factory
+    async with factory() as db:
+        await db.execute(delete(ChangeJournal))
+        await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_cursor_pages_cover_every_entry_once(session_factory):
+    feed = ChangeFeed()
+    async with session_factory() as db:
+        db.add_all([_entry(i, "vm" if i % 5 else "static_route") for i in range(1, 26)])
+        await db.commit()
+
+        seen, cursor, has_more = [], 0, True
+        while has_more:
+            changes, cursor, has_more = await feed.read_once(db, cursor, limit=10)
+            seen.extend(change["id"] for change in changes)
+        assert seen == list(range(1, 26)) and cursor == 25
+        assert "encoding" not in changes[-1] and changes[-1]["after"] == {"n": 25}
+
+        # A filtered read still moves the cursor past the entries it skipped.
+        changes, cursor, has_more = await feed.read_once(db, 0, limit=10, resource_type="static_route")
+        assert [c["id"] for c in changes] == [5, 10, 15, 20, 25] and cursor == 25 and not has_more
+
+
+@pytest.mark.asyncio
+async def test_recent_id_gap_is_held_back_until_it_settles(session_factory):
+    feed = ChangeFeed(visibility_lag_ms=60000)
+    async with session_factory() as db:
+        db.add_all([_entry(i) for i in range(1, 4)])
+        db.add(_entry(5, timestamp=datetime.utcnow()))  # id 4 is "still in flight"
+        await db.commit()
+        changes, cursor, has_more = await feed.read_once(db, 0, limit=10)
+        assert [c["id"] for c in changes] == [1, 2, 3] and cursor == 3
+        assert feed.stats()["held_back_reads"] == 1
+
+        feed.visibility_lag = timedelta(0)  # Once the gap is older than the lag it is skipped
+        changes, cursor, _ = await feed.read_once(db, cursor, limit=10)
+        assert [c["id"] for c in changes] == [5] and cursor == 5
+
+
+@pytest.mark.asyncio
+async def test_long_poll_wakes_on_notify(session_factory):
+    feed = ChangeFeed(poll_interval=30)
+    async with session_factory() as db:
+        db.add(_entry(1))
+        await db.commit()
+
+    async def consumer():
+        async with session_factory() as db:
+            return await feed.read(db, after=1, limit=10, wait=10)
+
+    task = asyncio.create_task(consumer())
+    await asyncio.sleep(0.1)
+    assert not task.done() and feed.stats()["waiting"] == 1
+    async with session_factory() as db:
+        db.add(_entry(2))
+        await db.commit()
+    feed.notify()
+    changes, cursor, _ = await asyncio.wait_for(task, timeout=2)
+    assert [c["id"] for c in changes] == [2] and cursor == 2
+
+
+
+def _user(role):
+    user = User(id=1, username=role)
+    user.roles = [role]
+    return user
+
+
+@pytest.mark.asyncio
+async def test_change_feed_endpoints_are_admin_only(session_factory):
+    app = FastAPI()
+    app.include_router(journal.router)
+
+    async def override_get_async_db():
+        async with session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver") as client:
+        for path in ("/journal/changes", "/journal/changes/stream"):
+            assert (await client.get(path)).status_code == 401
+        app.dependency_overrides[get_current_user] = lambda: _user("user")
+        for path in ("/journal/changes", "/journal/changes/stream"):
+            assert (await client.get(path)).status_code == 403
+        app.dependency_overrides[get_current_user] = lambda: _user("admin")
+        assert (await client.get("/journal/changes")).json()["changes"] == []
@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi import FastAPI
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import crud
+from auth import get_current_user
+from models import ChangeJournal, JournalSnapshot, StaticRoute, User, VyOSOutbox
+from routers import journal
+from schemas import StaticRouteCreate, StaticRouteUpdate
+from utils_journal_replay import JournalReplayEngine, MaterializedView, rollback_commands
+
+T0 = datetime(2024, 5, 1, 12, 0)
+RULE = {"policy_id": 1, "policy_name": "wan-in", "rule_number": 10, "action": "accept", "protocol": "tcp",
+        "destination_port": "22", "is_enabled": True}
+
+
+def _event(minutes, resource_type, resource_id, operation, before=None, after=None):
+    return ChangeJournal(timestamp=T0 + timedelta(minutes=minutes), resource_type=resource_type, resource_id=resource_id,
+                         operation=operation, before=before, after=after)
+
+
+@pytest_asyncio.fixture
+async def engine(test_db_engine):
+    session_factory = sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as db:
+        for model in (ChangeJournal, JournalSnapshot, StaticRoute, VyOSOutbox):
+            await db.execute(delete(model))
+        db.add_all([
+            _event(0, "firewall_policy", "1", "create", after={"name": "wan-in", "description": None, "default_action": "drop"}),
+            _event(0, "firewall_rule", "7", "create", after=RULE),
+            _event(1, "static_route", "3", "create", after={"destination": "10.1.0.0/16", "next_hop": "192.0.2.1",
+                                                            "description": None, "distance": 1}),
+            _event(2, "vm", "vm-a", "create", after={"machine_id": "vm-a", "internal_ip": "10.0.0.5"}),
+            _event(3, "subnet", "9", "create", after={"name": "ignored"}),
+            # --- T0 + 5 min is the rollback target ---
+            _event(10, "firewall_policy", "1", "update", before={"default_action": "drop"}, after={"default_action": "accept"}),
+            _event(11, "firewall_rule", "7", "delete", before=RULE),
+            _event(12, "static_route", "3", "update", after={"distance": 20}),
+            _event(13, "static_route", "4", "create", after={"destination": "10.2.0.0/16", "next_hop": "192.0.2.2"}),
+            _event(14, "vm", "vm-a", "delete", before={"machine_id": "vm-a"}),
+        ])
+        await db.commit()
+    yield JournalReplayEngine(session_factory, snapshot_every=3, settle_seconds=0), session_factory
+    async with session_factory() as db:
+        for model in (ChangeJournal, JournalSnapshot, StaticRoute, VyOSOutbox):
+            await db.execute(delete(model))
+        await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_point_in_time_state_is_the_same_with_and_without_snapshots(engine):
+    replay, session_factory = engine
+    async with session_factory() as db:
+        before_snapshots = {m: (await replay.state_at(db, T0 + timedelta(minutes=m))).resources for m in (0, 5, 12, 60)}
+
+    assert await replay.run_once(now=T0 + timedelta(hours=1)) == 2  # Every 3 events, never inside one timestamp
+    async with session_factory() as db:
+        assert await db.scalar(select(func.count()).select_from(JournalSnapshot)) == 2
+        for minutes, expected in before_snapshots.items():
+            assert (await replay.state_at(db, T0 + timedelta(minutes=minutes))).resources == expected
+
+        at_5 = await replay.state_at(db, T0 + timedelta(minutes=5))
+        assert at_5.resources["firewall_policy"]["1"]["default_action"] == "drop"
+        assert list(at_5.resources["firewall_rule"]) == ["7"]
+        assert at_5.resources["vm"]["vm-a"]["internal_ip"] == "10.0.0.5"
+        now = await replay.state_at(db)
+        assert now.resources["firewall_policy"]["1"]["default_action"] == "accept"
+        assert now.resources["firewall_rule"] == {} and now.resources["vm"] == {}
+        assert now.resources["static_route"]["3"] == {"destination": "10.1.0.0/16", "next_hop": "192.0.2.1",
+                                                      "description": None, "distance": 20}
+    assert replay.stats()["avg_events_replayed"] < 10
+
+
+@pytest.mark.asyncio
+async def test_rollback_commands_restore_the_earlier_config(engine):
+    replay, session_factory = engine
+    async with session_factory() as db:
+        plan = await replay.rollback_to(db, T0 + timedelta(minutes=5))
+    assert plan["commands"] == [
+        "delete firewall name wan-in",
+        "delete protocols static route 10.2.0.0/16 next-hop 192.0.2.2",
+        "delete protocols static route 10.1.0.0/16 next-hop 192.0.2.1",
+        "set firewall name wan-in default-action drop",
+        "set firewall name wan-in rule 10 action accept",
+        "set firewall name wan-in rule 10 protocol tcp",
+        "set firewall name wan-in rule 10 destination port '22'",
+        "delete firewall name wan-in rule 10 disable",
+        "set protocols static route 10.1.0.0/16 next-hop 192.0.2.1",
+        "set protocols static route 10.1.0.0/16 next-hop 192.0.2.1 distance '1'",
+    ]
+    assert await rollback_commands(MaterializedView(), MaterializedView()) == []
+
+
+@pytest.mark.asyncio
+async def test_static_route_crud_is_replayable(engine):
+    replay, session_factory = engine
+    async with session_factory() as db:
+        await db.execute(delete(ChangeJournal))
+        await db.commit()
+        route = await crud.create_static_route(db, StaticRouteCreate(destination="10.9.0.0/24", next_hop="192.0.2.9"), user_id=1)
+        created_at = datetime.utcnow()
+        await crud.update_static_route(db, route.id, StaticRouteUpdate(description="uplink"), requesting_user_id=1, is_admin=True)
+        update = (await db.execute(select(ChangeJournal).where(ChangeJournal.operation == "update"))).scalars().one()
+        assert update.before["description"] is None and update.after == {"description": "uplink"}
+
+        routes_then = (await replay.state_at(db, created_at)).resources["static_route"]
+        routes_now = (await replay.state_at(db)).resources["static_route"]
+    assert routes_then[str(route.id)]["description"] is None
+    assert routes_now[str(route.id)]["description"] == "uplink"
+
+
+
+@pytest.mark.asyncio
+async def test_replay_endpoints_are_admin_only():
+    app = FastAPI()
+    app.include_router(journal.router)
+    paths = ("/journal/replay/state", "/journal/replay/rollback?to=2024-05-01T12:00:00")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver") as client:
+        for path in paths:
+            assert (await client.get(path)).status_code == 401
+        user = User(id=1, username="viewer")
+        user.roles = ["user"]
+        app.dependency_overrides[get_current_user] = lambda: user
+        for path in paths:
+            assert (await client.get(path)).status_code == 403
@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import patch
+
+import crud
+from models import ChangeJournal, Quota, VMNetworkConfig
+from schemas import ChangeJournalCreate
+from utils_journal_writer import JournalWriter
+
+
+@pytest_asyncio.fixture
+async def writer(test_db_engine):
+    session_factory = sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as db:
+        for model in (ChangeJournal, VMNetworkConfig, Quota):
+            await db.execute(delete(model))
+        await db.commit()
+    journal_writer = JournalWriter(session_factory, max_batch=100, max_delay_ms=20)
+    batches = []
+
+    async def consumer(records):
+        batches.append(records)
+
+    journal_writer.add_consumer(consumer)
+    await journal_writer.start()
+    yield journal_writer, session_factory, batches
+    await journal_writer.stop()
+
+
+def _entry(i):
+    return ChangeJournalCreate(user_id=1, resource_type="vm", resource_id=f"jw-{i}", operation="create", after={"i": i})
+
+
+@pytest.mark.asyncio
+async def test_concurrent_entries_share_one_batch(writer):
+    journal_writer, session_factory, batches = writer
+    records = await asyncio.gather(*(journal_writer.write(_entry(i), durable=True) for i in range(40)))
+    assert journal_writer.batches_total == 1 and journal_writer.entries_written == 40
+    assert [r.resource_id for r in records] == [f"jw-{i}" for i in range(40)]
+    async with session_factory() as db:
+        rows = (await db.execute(select(ChangeJournal).order_by(ChangeJournal.id))).scalars().all()
+    assert [row.id for row in rows] == [r.id for r in records]
+
+    await asyncio.sleep(0)  # Let the consumer task run
+    assert len(batches) == 1 and len(batches[0]) == 40
+
+    assert await journal_writer.write(_entry(40), durable=False) is None
+    assert journal_writer.stats()["buffered"] == 1
+    await journal_writer.stop()
+    assert journal_writer.entries_written == 41
+
+
+@pytest.mark.asyncio
+async def test_crud_journal_goes_through_the_writer_after_commit(writer):
+    journal_writer, session_factory, _ = writer
+    with patch("utils_journal_writer.get_running_journal_writer", return_value=journal_writer), \
+            patch("crud.ip_allocator.mark_used"):
+        async with session_factory() as db:
+            await crud.create_vm(db, "jw-vm", "00:11:22:33:55:01", internal_ip="10.8.0.1", user_id=1)
+    assert journal_writer.entries_written == 1
+    async with session_factory() as db:
+        journal = (await db.execute(select(ChangeJournal))).scalars().one()
+    assert journal.resource_id == "jw-vm" and journal.after["internal_ip"] == "10.8.0.1"
+
+
+
+@pytest.mark.asyncio
+async def test_entries_are_timestamped_when_their_batch_is_inserted(writer):
+    journal_writer, session_factory, _ = writer
+    recorded = datetime.utcnow() - timedelta(seconds=30)  # e.g. recorded before a slow transaction committed
+    before_flush = datetime.utcnow()
+    record = await journal_writer.write({**_entry(0).dict(), "timestamp": recorded}, durable=True)
+    async with session_factory() as db:
+        row = await db.get(ChangeJournal, record.id)
+    assert row.timestamp >= before_flush and record.timestamp == row.timestamp
@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+import pytest
+from passlib.context import CryptContext
+
+from exceptions import LoginThrottledError
+from utils_password import PasswordHasher
+
+
+class SlowContext:
+    """Stands in for bcrypt: blocks its thread for `delay` seconds per call."""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def hash(self, password):
+        time.sleep(self.delay)
+        return f"hashed:{password}"
+
+    def verify(self, password, hashed):
+        time.sleep(self.delay)
+        return hashed == f"hashed:{password}"
+
+
+@pytest.mark.asyncio
+async def test_hashing_runs_in_parallel_off_the_event_loop():
+    hasher = PasswordHasher(pool_size=4, context=SlowContext(0.2))
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticking = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    hashes = await asyncio.gather(*(hasher.hash(f"pw{n}") for n in range(4)))
+    elapsed = time.perf_counter() - started
+    ticking.cancel()
+    hasher.shutdown()
+
+    assert hashes == [f"hashed:pw{n}" for n in range(4)]
+    assert elapsed < 0.6 and ticks >= 10  # Four 200 ms hashes at once, and the loop kept running
+    assert hasher.stats()["hashes"] == 4 and hasher.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_login_burst_beyond_the_cap_is_rejected():
+    hasher = PasswordHasher(pool_size=1, login_concurrency=1, login_queue_timeout=0.05, context=SlowContext(0.3))
+    first = asyncio.create_task(hasher.verify_login("pw", "hashed:pw"))
+    await asyncio.sleep(0.01)
+    with pytest.raises(LoginThrottledError) as exc:
+        await hasher.verify_login("pw", "hashed:pw")
+    assert exc.value.status_code == 503 and exc.value.headers["Retry-After"] == "1"
+    assert await first is True
+    assert await hasher.verify_login("pw", "hashed:other") is False  # The slot was released
+    assert hasher.stats()["logins_rejected"] == 1
+    hasher.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_round_trip_with_a_passlib_context():
+    hasher = PasswordHasher(pool_size=1, context=CryptContext(schemes=["sha256_crypt"]))
+    hashed = await hasher.hash("s3cret")
+    assert await hasher.verify("s3cret", hashed) and not await hasher.verify("wrong", hashed)
+    hasher.shutdown()
@@ -0,0 +1,108 @@
+import uuid
+from datetime import datetime
+
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import auth
+import crud_rbac
+import utils_principal_cache
+import utils_rbac
+from models import Role, User
+from utils_principal_cache import PrincipalCache
+from utils_rbac import PermissionCompiler, has_all, has_any, registry, roles_mask
+
+
+@pytest_asyncio.fixture
+async def session_factory(test_db_engine, monkeypatch):
+    monkeypatch.setattr(utils_principal_cache, "_principal_cache", PrincipalCache())
+    monkeypatch.setattr(utils_rbac, "_permission_compiler", PermissionCompiler())
+    yield sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def _user(db, roles):
+    user = User(username=f"rb-{uuid.uuid4().hex[:8]}", hashed_password="x", created_at=datetime.utcnow())
+    user.roles = roles
+    db.add(user)
+    await db.commit()
+    return user
+
+
+async def _allowed(checker, user) -> bool:
+    try:
+        await checker(current_user=user)
+        return True
+    except HTTPException as exc:
+        assert exc.status_code == 403
+        return False
+
+
+def test_mask_checks():
+    user_mask = roles_mask(["user"]) | registry.mask(["network.read"])
+    assert has_any(user_mask, roles_mask(["admin", "user"])) and not has_any(user_mask, roles_mask(["admin"]))
+    assert has_all(user_mask, registry.mask(["network.read"]))
+    assert not has_all(user_mask, registry.mask(["network.read", "network.write"]))
+    assert has_all(registry.mask(["*"]), registry.mask(["network.write"]))
+
+
+@pytest.mark.asyncio
+async def test_roles_and_assignments_compile_into_one_mask(session_factory):
+    netops = f"netops-{uuid.uuid4().hex[:6]}"
+    async with session_factory() as db:
+        role = await crud_rbac.create_role(db, netops, "network operators", ["network.read", "network.write"])
+        user = await _user(db, ["user"])
+        await crud_rbac.assign_role_to_user(db, user.id, role.id)
+        token = auth.create_access_token({"sub": user.username})
+
+    async with session_factory() as db:
+        current = await auth.get_current_user(token=token, db=db)
+        assert await _allowed(auth.RoleChecker(["admin", "user"]), current)
+        assert await _allowed(auth.RoleChecker([netops]), current)  # Assigned roles count as roles too
+        assert not await _allowed(auth.RoleChecker(["admin"]), current)
+        assert await _allowed(auth.PermissionChecker(["network.read", "network.write"]), current)
+        assert not await _allowed(auth.PermissionChecker(["user.manage"]), current)
+
+    # Editing the role drops cached masks, so the next request is recompiled.
+    async with session_factory() as db:
+        await crud_rbac.update_role(db, netops, permissions=["network.read"])
+        current = await auth.get_current_user(token=token, db=db)
+        assert not await _allowed(auth.PermissionChecker(["network.write"]), current)
+        await crud_rbac.remove_role_from_user(db, user.id, role.id)
+        current = await auth.get_current_user(token=token, db=db)
+        assert not await _allowed(auth.PermissionChecker(["network.read"]), current)
+    assert utils_rbac.get_permission_compiler().stats()["role_compilations"] == 2
+
+
+@pytest.mark.asyncio
+async def test_cached_principal_keeps_its_mask(session_factory):
+    async with session_factory() as db:
+        user = await _user(db, ["netadmin"])
+        token = auth.create_access_token({"sub": user.username})
+    for _ in range(2):
+        async with session_factory() as db:
+            current = await auth.get_current_user(token=token, db=db)
+            assert await _allowed(auth.RoleChecker(["admin", "netadmin"]), current)
+    assert utils_principal_cache.get_principal_cache().hits == 1
+    assert utils_rbac.get_permission_compiler().user_compilations == 1
+
+
+
+@pytest.mark.asyncio
+async def test_role_masks_expire_after_the_principal_cache_ttl(session_factory):
+    ops = f"ops-{uuid.uuid4().hex[:6]}"
+    compiler = PermissionCompiler(ttl=60)
+    async with session_factory() as db:
+        await crud_rbac.create_role(db, ops, "operators", ["network.write"])
+        assert has_all((await compiler.role_masks(db))[ops], registry.mask(["network.write"]))
+        # Another worker revokes the permission: this process is not invalidated.
+        await db.execute(update(Role).where(Role.name == ops).values(permissions="network.read"))
+        await db.commit()
+        assert has_all((await compiler.role_masks(db))[ops], registry.mask(["network.write"]))
+        compiler._compiled_at -= 60
+        masks = await compiler.role_masks(db)
+    assert not has_all(masks[ops], registry.mask(["network.write"])) and has_all(masks[ops], registry.mask(["network.read"]))
+    assert compiler.role_compilations == 2
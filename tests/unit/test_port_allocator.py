@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from exceptions import NATRuleExhaustedError, PortExhaustedError, ResourceAllocationError
+from models import VMPortRule, PortType
+from utils_port_allocator import PortAllocator, RangeFreeList
+
+
+def test_free_list_hands_out_lowest_values_and_reuses_released():
+    free_list = RangeFreeList(100, 105, used=[100, 102])
+    assert free_list.take(2) == [101, 103]
+    free_list.release([101])
+    assert free_list.take(1) == [101]
+    with pytest.raises(ResourceAllocationError):
+        free_list.take(3)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reservations_never_overlap(async_db_session: AsyncSession):
+    async_db_session.add(VMPortRule(port_type=PortType.ssh, external_port=41000))
+    await async_db_session.commit()
+    existing_nat = {row[0] for row in (await async_db_session.execute(select(VMPortRule.nat_rule_number))).all()}
+
+    allocator = PortAllocator()
+    reservations = await asyncio.gather(*[
+        allocator.reserve(async_db_session, ports=3, nat_rules=3, port_range=(41000, 41020)) for _ in range(5)
+    ])
+    ports = [p for r in reservations for p in r.ports]
+    nat_rules = [n for r in reservations for n in r.nat_rule_numbers]
+    assert len(set(ports)) == 15 and 41000 not in ports
+    assert len(set(nat_rules)) == 15 and not existing_nat & set(nat_rules)
+    for r in reservations:
+        r.release()
+
+
+@pytest.mark.asyncio
+async def test_reservation_follows_session_commit_and_rollback(async_db_session: AsyncSession):
+    allocator = PortAllocator()
+    rolled_back = await allocator.reserve(async_db_session, ports=1, nat_rules=1, port_range=(42000, 42010))
+    await async_db_session.rollback()
+    assert rolled_back.done
+    again = await allocator.reserve(async_db_session, ports=1, port_range=(42000, 42010))
+    assert again.ports == rolled_back.ports  # Released value is handed out again
+
+    await async_db_session.commit()
+    assert again.done
+    after_commit = await allocator.reserve(async_db_session, ports=1, port_range=(42000, 42010))
+    assert after_commit.ports != again.ports
+    assert allocator.stats()["port_ranges"]["42000-42010"]["used"] >= 1
+    after_commit.release()
+
+
+@pytest.mark.asyncio
+async def test_exhaustion_errors_tell_ports_from_nat_rules(test_db_engine):
+    session_factory = sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+    allocator = PortAllocator()
+    async with session_factory() as db:
+        with pytest.raises(PortExhaustedError):
+            await allocator.reserve(db, ports=3, port_range=(43000, 43001))
+        allocator._nat_rules.reserved.update(range(10000, 20000))  # Every NAT rule number is taken
+        with pytest.raises(NATRuleExhaustedError):
+            await allocator.reserve(db, ports=1, nat_rules=1, port_range=(43000, 43001))
+        assert allocator.stats()["port_ranges"]["43000-43001"]["reserved"] == 0  # The port went back
+
+
+@pytest.mark.asyncio
+async def test_session_bound_reservations_do_not_expire_and_end_with_the_session(test_db_engine):
+    session_factory = sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+    allocator = PortAllocator(ttl=0)
+    async with session_factory() as db:
+        held = await allocator.reserve(db, ports=1, port_range=(43100, 43101))
+        other = await allocator.reserve(db, ports=1, port_range=(43100, 43101))  # Runs the expiry sweep
+        assert not held.done and other.ports != held.ports
+    assert held.done and other.done  # Closed without a commit: both released
+    assert allocator.stats()["open_reservations"] == 0
+
+
+@pytest.mark.asyncio
+async def test_rollback_resyncs_with_values_committed_by_another_worker(test_db_engine):
+    session_factory = sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+    allocator = PortAllocator()
+    async with session_factory() as db, session_factory() as other_db:
+        held = await allocator.reserve(other_db, ports=1, nat_rules=1, port_range=(43200, 43210))
+        first = await allocator.reserve(db, ports=1, nat_rules=1, port_range=(43200, 43210))
+        # Another worker commits the same values; this process's insert would fail and roll back.
+        async with session_factory() as worker:
+            worker.add(VMPortRule(port_type=PortType.ssh, external_port=first.ports[0], nat_rule_number=first.nat_rule_numbers[0]))
+            await worker.commit()
+        await db.rollback()
+        retry = await allocator.reserve(db, ports=1, nat_rules=1, port_range=(43200, 43210))
+        assert allocator.stats()["resyncs"] == 1
+        assert retry.ports != first.ports and retry.nat_rule_numbers != first.nat_rule_numbers
+        # The open reservation of the other session survived the rebuild.
+        assert retry.ports != held.ports and retry.nat_rule_numbers != held.nat_rule_numbers
+        await db.rollback()
+        async with session_factory() as cleanup:
+            await cleanup.execute(delete(VMPortRule).where(VMPortRule.external_port == first.ports[0]))
+            await cleanup.commit()
@@ -0,0 +1,93 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import auth
+import crud
+import utils_principal_cache
+from models import User
+from utils_principal_cache import Principal, PrincipalCache
+
+
+@pytest_asyncio.fixture
+async def session_factory(test_db_engine, monkeypatch):
+    cache = PrincipalCache(max_entries=100, ttl_seconds=60)
+    monkeypatch.setattr(utils_principal_cache, "_principal_cache", cache)
+    yield sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def _user(db, roles=("user",)):
+    user = User(username=f"pc-{uuid.uuid4().hex[:8]}", hashed_password="x", created_at=datetime.utcnow())
+    user.roles = list(roles)
+    db.add(user)
+    await db.commit()
+    return user
+
+
+@pytest.mark.asyncio
+async def test_jwt_principal_is_cached_until_the_user_changes(session_factory):
+    cache = utils_principal_cache.get_principal_cache()
+    async with session_factory() as db:
+        user = await _user(db)
+        token = auth.create_access_token({"sub": user.username})
+
+    async with session_factory() as db:
+        first = await auth.get_current_user(token=token, db=db)
+    async with session_factory() as db:
+        cached = await auth.get_current_user(token=token, db=db)
+        assert cached.id == user.id and cached.roles == ["user"] and cached in db
+    assert (cache.hits, cache.misses) == (1, 1) and first.username == user.username
+
+    async with session_factory() as db:
+        await crud.update_user(db, await crud.get_user_by_username(db, user.username), roles_new=["user", "admin"])
+        refreshed = await auth.get_current_user(token=token, db=db)
+    assert refreshed.roles == ["user", "admin"]
+    assert cache.stats()["invalidations"] == 1 and cache.misses == 2
+
+    async with session_factory() as db:
+        await crud.delete_user(db, await crud.get_user_by_username(db, user.username))
+        with pytest.raises(HTTPException) as exc:
+            await auth.get_current_user(token=token, db=db)
+    assert exc.value.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_api_key_principal_is_dropped_when_the_key_is_deleted(session_factory):
+    cache = utils_principal_cache.get_principal_cache()
+    async with session_factory() as db:
+        user = await _user(db)
+        key = await crud.create_api_key_for_user(db, user_id=user.id)
+
+    for _ in range(3):
+        async with session_factory() as db:
+            assert (await auth.get_api_key_auth(api_key_value=key.api_key, db=db)).id == user.id
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert key.api_key not in "".join(cache._entries)  # Only the digest is kept
+
+    async with session_factory() as db:
+        assert await crud.delete_api_key_for_user(db, api_key_id=key.id, user_id=user.id)
+        with pytest.raises(HTTPException) as exc:
+            await auth.get_api_key_auth(api_key_value=key.api_key, db=db)
+    assert exc.value.detail == "Invalid API Key"
+
+
+def test_entries_are_bounded_by_size_expiry_and_invalidation():
+    cache = PrincipalCache(max_entries=2, ttl_seconds=60)
+    for n in range(3):
+        cache.put(f"k{n}", Principal(n, f"u{n}", ["user"]))
+    assert cache.get("k0") is None and cache.get("k2").user_id == 2 and cache.stats()["evictions"] == 1
+
+    # A credential that has already expired is never served, whatever the TTL says.
+    cache.put("old", Principal(5, "u5", [], expires_at=datetime.utcnow() - timedelta(seconds=1)))
+    assert cache.get("old") is None
+
+    # A principal loaded before an invalidation is not cached afterwards.
+    generation = cache.generation
+    cache.invalidate_user(2)
+    cache.put("k2", Principal(2, "u2", ["user"]), generation)
+    assert cache.get("k2") is None
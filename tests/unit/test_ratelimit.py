@@ -0,0 +1,92 @@
+import jwt as pyjwt
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from utils_api_keys import get_api_key_codec
+from utils_ratelimit import MemoryBackend, RateLimitEngine, RateLimiter, RatePolicy, SQLiteBackend
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _app(engine):
+    app = FastAPI()
+    app.add_middleware(RateLimiter, engine=engine)
+
+    @app.post("/v1/auth/token")
+    async def login():
+        return {"ok": True}
+
+    @app.get("/v1/things")
+    async def things():
+        return {"ok": True}
+
+    return app
+
+
+@pytest.mark.asyncio
+async def test_gcra_allows_the_burst_then_refills_at_the_rate():
+    policy = RatePolicy("p", rate=60, period=60, burst=3)  # One request per second, bursts of 3
+    backend = MemoryBackend()
+    results = [await backend.hit("k", policy, 100.0) for _ in range(4)]
+    assert [allowed for allowed, _, _ in results] == [True, True, True, False]
+    assert [remaining for _, _, remaining in results[:3]] == [2, 1, 0]
+    assert results[3][1] == pytest.approx(1.0)  # retry after
+    assert (await backend.hit("k", policy, 101.0))[0] and not (await backend.hit("k", policy, 101.0))[0]
+
+
+@pytest.mark.asyncio
+async def test_idle_buckets_are_evicted_and_the_key_count_is_capped():
+    policy = RatePolicy("p", rate=10, period=10)
+    backend = MemoryBackend(max_keys=3)
+    for n in range(3):
+        await backend.hit(f"k{n}", policy, 100.0)
+    await backend.hit("k3", policy, 100.0)
+    assert backend.stats()["keys"] == 3 and backend.forced_evictions == 1
+    await backend.hit("k4", policy, 200.0)  # Everything else has refilled by now
+    assert backend.stats()["keys"] <= 2 and backend.idle_evictions == 2
+
+
+@pytest.mark.asyncio
+async def test_sqlite_backend_is_shared_between_workers(tmp_path):
+    policy = RatePolicy("p", rate=2, period=60)
+    worker_a, worker_b = SQLiteBackend(str(tmp_path / "rl.db")), SQLiteBackend(str(tmp_path / "rl.db"))
+    assert (await worker_a.hit("k", policy, 100.0))[0]
+    assert (await worker_b.hit("k", policy, 100.0))[0]
+    assert not (await worker_a.hit("k", policy, 100.0))[0]
+    assert worker_b.stats()["keys"] == 1
+
+
+def test_route_policies_and_principal_keys():
+    clock = Clock()
+    engine = RateLimitEngine([
+        RatePolicy("login", rate=2, period=60, key="ip", path_prefix="/v1/auth/token", methods=["POST"]),
+        RatePolicy("default", rate=3, period=60, key="principal"),
+    ], MemoryBackend(), jwt_secret="s", clock=clock)
+    client = TestClient(_app(engine))
+
+    assert [client.post("/v1/auth/token").status_code for _ in range(3)] == [200, 200, 429]
+    limited = client.post("/v1/auth/token")
+    assert int(limited.headers["Retry-After"]) >= 1 and limited.headers["X-RateLimit-Remaining"] == "0"
+    assert client.get("/v1/things").status_code == 200  # Another policy, another budget
+
+    # Each API key and each user has its own budget, whatever the client IP.
+    alice = {"Authorization": "Bearer " + pyjwt.encode({"sub": "alice"}, "s", algorithm="HS256")}
+    keys = [{"X-API-Key": get_api_key_codec().generate()[0]} for _ in range(2)]
+    for headers in (*keys, alice):
+        assert [client.get("/v1/things", headers=headers).status_code for _ in range(4)] == [200, 200, 200, 429]
+    # A token with a bad signature is not trusted as a principal: it shares the IP bucket used above.
+    forged = {"Authorization": "Bearer " + pyjwt.encode({"sub": "bob"}, "wrong", algorithm="HS256")}
+    assert [client.get("/v1/things", headers=forged).status_code for _ in range(3)] == [200, 200, 429]
+    # So is a key without a valid checksum: a fresh random key per request does not buy a fresh budget.
+    assert [client.get("/v1/things", headers={"X-API-Key": f"random-{i}"}).status_code for i in range(2)] == [429, 429]
+
+    clock.now += 60
+    assert client.get("/v1/things", headers=alice).status_code == 200
+    assert engine.stats()["limited"] == {"login": 2, "default": 6}
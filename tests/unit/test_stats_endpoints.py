@@ -0,0 +1,41 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import routers
+from auth import get_current_user
+from models import User
+
+
+# Operational stats expose internals (queue contents, key and login counters, pool sizes), so only admins read them.
+ADMIN_ONLY_STATS = [
+    "/vyos/outbox",
+    "/vyos/client-stats",
+    "/vyos/coalescer-stats",
+    "/vyos/mirror-stats",
+    "/tasks/stats",
+    "/vyos/plans/stats",
+    "/db/pool-stats",
+    "/journal/writer-stats",
+    "/journal/archive-stats",
+    "/journal/replay/stats",
+    "/journal/changes/stats",
+    "/auth/principal-cache",
+    "/auth/password-hash-stats",
+    "/auth/api-key-stats",
+    "/auth/rbac-stats",
+    "/ratelimit/stats",
+]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path", ADMIN_ONLY_STATS)
+async def test_stats_endpoint_is_admin_only(path):
+    app = FastAPI()
+    app.include_router(routers.router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver") as client:
+        assert (await client.get(path)).status_code == 401
+        user = User(id=1, username="user")
+        user.roles = ["user"]
+        app.dependency_overrides[get_current_user] = lambda: user
+        assert (await client.get(path)).status_code == 403
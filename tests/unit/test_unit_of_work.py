@@ -0,0 +1,71 @@
+import pytest
+from sqlalchemy import delete, event, select
+from unittest.mock import patch
+
+import crud
+from models import ChangeJournal, Quota, VMNetworkConfig
+from utils_unit_of_work import unit_of_work
+
+
+@pytest.fixture
+def commits(async_db_session):
+    counter = {"n": 0}
+
+    def on_commit(session):
+        counter["n"] += 1
+
+    event.listen(async_db_session.sync_session, "after_commit", on_commit)
+    yield counter
+    event.remove(async_db_session.sync_session, "after_commit", on_commit)
+
+
+async def _reset(db):
+    for model in (ChangeJournal, VMNetworkConfig, Quota):
+        await db.execute(delete(model))
+    db.add(Quota(user_id=1, resource_type="vm", limit=5, usage=0))
+    await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_create_vm_commits_vm_quota_and_journal_once(async_db_session, commits):
+    await _reset(async_db_session)
+    commits["n"] = 0
+    with patch("crud.ip_allocator.mark_used") as mark_used:
+        vm = await crud.create_vm(async_db_session, "uow-vm-1", "00:11:22:33:44:01", internal_ip="10.9.0.1", user_id=1)
+        mark_used.assert_called_once_with(["10.9.0.1"])
+    assert commits["n"] == 1
+    assert vm.machine_id == "uow-vm-1"
+    quota = (await async_db_session.execute(select(Quota))).scalars().one()
+    assert quota.usage == 1
+    journal = (await async_db_session.execute(select(ChangeJournal))).scalars().one()
+    assert journal.resource_id == "uow-vm-1" and journal.operation == "create"
+
+
+@pytest.mark.asyncio
+async def test_failure_rolls_back_the_whole_operation(async_db_session, commits):
+    await _reset(async_db_session)
+    commits["n"] = 0
+    with patch("crud_journal.ChangeJournal", side_effect=RuntimeError("journal down")), \
+         patch("crud.ip_allocator.mark_used") as mark_used:
+        with pytest.raises(RuntimeError):
+            await crud.create_vm(async_db_session, "uow-vm-2", "00:11:22:33:44:02", internal_ip="10.9.0.2", user_id=1)
+        mark_used.assert_not_called()
+    assert commits["n"] == 0
+    assert (await async_db_session.execute(select(VMNetworkConfig))).scalars().all() == []
+    assert (await async_db_session.execute(select(Quota))).scalars().one().usage == 0
+
+
+@pytest.mark.asyncio
+async def test_operations_in_an_outer_unit_of_work_share_its_commit(async_db_session, commits):
+    await _reset(async_db_session)
+    commits["n"] = 0
+    with patch("crud.ip_allocator.mark_used"):
+        async with unit_of_work(async_db_session) as uow:
+            for i in range(3):
+                vm = await crud.create_vm(async_db_session, f"uow-vm-{10 + i}", f"00:11:22:33:44:{10 + i}",
+                                          internal_ip=f"10.9.0.{10 + i}", user_id=1)
+                uow.refresh(vm)
+            assert commits["n"] == 0
+    assert commits["n"] == 1
+    assert (await async_db_session.execute(select(Quota))).scalars().one().usage == 3
+    assert len((await async_db_session.execute(select(ChangeJournal))).scalars().all()) == 3
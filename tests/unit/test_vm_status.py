@@ -0,0 +1,69 @@
+import json
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import routers
+from models import PortStatus, PortType, VMNetworkConfig, VMPortRule
+
+
+async def _seed(db: AsyncSession, count: int):
+    if await crud.get_vm_by_machine_id(db, "status-test-00"):
+        return
+    for i in range(count):
+        vm = VMNetworkConfig(machine_id=f"status-test-{i:02d}", mac_address=f"02:00:00:aa:00:{i:02x}",
+                             internal_ip=f"10.77.0.{i + 1}", hostname=f"web-{i}" if i % 2 else f"db-{i}")
+        db.add(vm)
+        await db.flush()
+        db.add(VMPortRule(vm_id=vm.id, port_type=PortType.ssh, external_port=45000 + i, nat_rule_number=15000 + i,
+                          status=PortStatus.enabled if i % 3 == 0 else PortStatus.disabled))
+    await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_status_pages_load_ports_without_per_vm_queries(async_db_session: AsyncSession):
+    await _seed(async_db_session, 12)
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(async_db_session.bind.sync_engine, "before_cursor_execute", listener)
+    try:
+        page, cursor = await crud.get_vms_status_page(async_db_session, limit=5, machine_id_prefix="status-test-")
+    finally:
+        event.remove(async_db_session.bind.sync_engine, "before_cursor_execute", listener)
+    assert len(statements) <= 3  # VMs, ports and DHCP pools: one query each
+    assert [vm["machine_id"] for vm in page] == [f"status-test-{i:02d}" for i in range(5)]
+    assert page[0]["ports"]["ssh"] == {"status": "enabled", "external_port": 45000, "nat_rule_number": 15000,
+                                       "protocol": "tcp", "source_ip": None}
+    assert page[0]["ports"]["http"]["status"] == "not_active"
+
+    seen = [vm["machine_id"] for vm in page]
+    while cursor is not None:
+        page, cursor = await crud.get_vms_status_page(async_db_session, limit=5, after_id=cursor, machine_id_prefix="status-test-")
+        seen.extend(vm["machine_id"] for vm in page)
+    assert seen == [f"status-test-{i:02d}" for i in range(12)]
+
+
+@pytest.mark.asyncio
+async def test_status_filters_and_full_export(async_db_session: AsyncSession):
+    await _seed(async_db_session, 12)
+    exported = [vm async for vm in crud.iter_vms_status(async_db_session, batch_size=4, machine_id_prefix="status-test-")]
+    assert len(exported) == 12
+    enabled_ssh = [vm async for vm in crud.iter_vms_status(
+        async_db_session, machine_id_prefix="status-test-", port_type=PortType.ssh, port_status=PortStatus.enabled)]
+    assert [vm["machine_id"] for vm in enabled_ssh] == [f"status-test-{i:02d}" for i in (0, 3, 6, 9)]
+    web, _ = await crud.get_vms_status_page(async_db_session, hostname="web-", ip_prefix="10.77.0.")
+    assert all(vm["hostname"].startswith("web-") for vm in web) and len(web) == 6
+
+
+@pytest.mark.asyncio
+async def test_ndjson_export_streams_on_its_own_session(async_db_session: AsyncSession, test_db_engine, monkeypatch):
+    await _seed(async_db_session, 12)
+    monkeypatch.setattr(routers, "AsyncSessionLocal", sessionmaker(bind=test_db_engine, class_=AsyncSession))
+    # db=None: by the time the body streams, the request's session has been closed.
+    response = await routers.vms_status(limit=100, after=None, machine_id_prefix="status-test-", hostname=None,
+                                        dhcp_pool_id=None, ip_prefix=None, port_type=None, port_status=None,
+                                        format="ndjson", db=None, current_user=None)
+    lines = [chunk async for chunk in response.body_iterator]
+    assert [json.loads(line)["machine_id"] for line in lines] == [f"status-test-{i:02d}" for i in range(12)]
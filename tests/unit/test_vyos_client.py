@@ -0,0 +1,58 @@
+import json
+import pytest
+import httpx
+
+from config import get_vyos_client_config
+from vyos_client import VyOSClient
+
+
+def _make_client(handler):
+    return VyOSClient(settings=get_vyos_client_config(), transport=httpx.MockTransport(handler))
+
+
+@pytest.mark.asyncio
+async def test_client_reuses_single_pool_and_tracks_stats():
+    seen_paths = []
+
+    def handler(request: httpx.Request):
+        seen_paths.append(request.url.path)
+        return httpx.Response(200, json={"success": True, "data": json.loads(request.content)["commands"]})
+
+    client = _make_client(handler)
+    await client.start()
+    underlying = client._client
+    for _ in range(3):
+        response = await client.post("/config", {"commands": ["set foo"]}, operation="config")
+        assert response.json()["success"] is True
+    assert client._client is underlying  # No new client per call
+    stats = client.stats()
+    assert stats["requests_total"] == 3
+    assert stats["errors_total"] == 0
+    assert stats["in_flight"] == 0
+    assert stats["operations"]["config"]["requests"] == 3
+    assert stats["operations"]["config"]["timeout_seconds"] == client.timeout_for("config")
+    assert seen_paths == ["/config"] * 3
+    await client.close()
+    assert client.stats()["started"] is False
+
+
+@pytest.mark.asyncio
+async def test_client_raises_http_status_errors():
+    client = _make_client(lambda request: httpx.Response(400, json={"error": {"message": "bad path"}}))
+    with pytest.raises(httpx.HTTPStatusError):
+        await client.post("/retrieve", {"path": []}, operation="retrieve")
+    assert client.stats()["errors_total"] == 1
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_vyos_api_call_uses_shared_client(monkeypatch):
+    import vyos_client
+    import vyos_core
+
+    client = _make_client(lambda request: httpx.Response(200, json={"success": True}))
+    monkeypatch.setattr(vyos_client, "_vyos_client", client)
+    result = await vyos_core.vyos_api_call(["set system host-name test"])
+    assert result == {"success": True}
+    assert client.stats()["operations"]["config"]["requests"] == 1
+    await client.close()
@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+
+from exceptions import VyOSAPIError
+from vyos_coalescer import CommitCoalescer
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_commit():
+    sent = []
+
+    async def send(commands, operation):
+        sent.append((list(commands), operation))
+        return {"success": True}
+
+    coalescer = CommitCoalescer(send, max_wait_ms=10, max_batch_commands=100)
+    results = await asyncio.gather(*[coalescer.submit([f"set cmd {i}"]) for i in range(5)])
+    assert results == [{"success": True}] * 5
+    assert len(sent) == 1
+    assert sorted(sent[0][0]) == [f"set cmd {i}" for i in range(5)]
+    stats = coalescer.stats()
+    assert stats["commits_total"] == 1
+    assert stats["callers_total"] == 5
+    assert stats["commits_saved"] == 4
+    assert stats["avg_batch_size"] == 5
+
+
+@pytest.mark.asyncio
+async def test_batch_size_cap_flushes_early_and_operations_are_separate():
+    sent = []
+
+    async def send(commands, operation):
+        sent.append((list(commands), operation))
+        return {"success": True}
+
+    coalescer = CommitCoalescer(send, max_wait_ms=1000, max_batch_commands=2)
+    await asyncio.wait_for(asyncio.gather(coalescer.submit(["set a"]), coalescer.submit(["set b"])), timeout=0.5)
+    assert sent == [(["set a", "set b"], "set")]
+    coalescer.max_wait = 0.01
+    await asyncio.gather(coalescer.submit(["set c"]), coalescer.submit(["delete d"], operation="delete"))
+    assert {op for _, op in sent[1:]} == {"set", "delete"}
+
+
+@pytest.mark.asyncio
+async def test_batches_are_sent_in_arrival_order_one_at_a_time():
+    sent = []
+    in_flight = 0
+
+    async def send(commands, operation):
+        nonlocal in_flight
+        in_flight += 1
+        assert in_flight == 1
+        await asyncio.sleep(0.01)
+        sent.append((list(commands), operation))
+        in_flight -= 1
+        return {"success": True}
+
+    coalescer = CommitCoalescer(send, max_wait_ms=100, max_batch_commands=3)
+    # The delete fills its batch first, but the set that arrived before it must still be sent first.
+    await asyncio.wait_for(asyncio.gather(
+        coalescer.submit(["set x"]),
+        coalescer.submit(["delete x", "delete y", "delete z"], operation="delete"),
+        coalescer.submit(["set x"]),
+    ), timeout=1.0)
+    assert sent == [(["set x"], "set"), (["delete x", "delete y", "delete z"], "delete"), (["set x"], "set")]
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_replayed_per_caller():
+    async def send(commands, operation):
+        if "set bad" in commands:
+            raise VyOSAPIError(detail="invalid command")
+        return {"success": True, "commands": commands}
+
+    coalescer = CommitCoalescer(send, max_wait_ms=10)
+    good, bad = await asyncio.gather(coalescer.submit(["set good"]), coalescer.submit(["set bad"]), return_exceptions=True)
+    assert good == {"success": True, "commands": ["set good"]}
+    assert isinstance(bad, VyOSAPIError)
+    stats = coalescer.stats()
+    assert stats["fallback_batches_total"] == 1
+    assert stats["failed_callers_total"] == 1
+    assert stats["commits_total"] == 3
@@ -0,0 +1,74 @@
+import pytest
+
+from vyos_compiler import compile_against_router, compile_minimal_commands
+from vyos_core import generate_firewall_rule_commands
+
+TREE = {
+    "firewall": {"name": {"WAN_IN": {"default-action": "drop", "rule": {
+        "10": {"action": "accept", "protocol": "tcp", "description": "old", "destination": {"port": "22"}},
+        "20": {"action": "drop"},
+    }}}},
+    "protocols": {"static": {"route": {"10.1.0.0/24": {"next-hop": {"192.168.1.1": {"description": "lab", "distance": "5"}}}}}},
+}
+
+
+def test_unchanged_leaves_are_dropped():
+    desired = generate_firewall_rule_commands("WAN_IN", 10, {
+        "action": "accept", "protocol": "tcp", "destination_port": "22", "description": "new", "is_enabled": True})
+    desired += generate_firewall_rule_commands("WAN_IN", 20, {"action": "drop", "is_enabled": True})
+    assert compile_minimal_commands(desired, TREE, scopes=[("firewall", "name", "WAN_IN", "rule")]) == [
+        "set firewall name WAN_IN rule 10 description 'new'"
+    ]
+
+
+def test_scoped_leaves_missing_from_desired_state_are_deleted():
+    desired = generate_firewall_rule_commands("WAN_IN", 10, {"action": "drop", "protocol": "tcp", "destination_port": "22"})
+    assert compile_minimal_commands(desired, TREE, scopes=[("firewall", "name", "WAN_IN", "rule")]) == [
+        "delete firewall name WAN_IN rule 10 description",
+        "delete firewall name WAN_IN rule 20",
+        "set firewall name WAN_IN rule 10 action drop",
+    ]
+
+
+def test_delete_then_recreate_is_reduced_to_leaf_changes():
+    desired = [
+        "delete protocols static route 10.1.0.0/24 next-hop 192.168.1.1",
+        "set protocols static route 10.1.0.0/24 next-hop 192.168.1.1",
+        "set protocols static route 10.1.0.0/24 next-hop 192.168.1.1 distance '10'",
+        "delete protocols static route 10.9.0.0/24",
+    ]
+    assert compile_minimal_commands(desired, TREE) == [
+        "delete protocols static route 10.1.0.0/24 next-hop 192.168.1.1 description",
+        "set protocols static route 10.1.0.0/24 next-hop 192.168.1.1 distance '10'",
+    ]
+
+
+def test_recreating_a_bare_node_keeps_it_and_drops_only_its_children():
+    desired = [
+        "delete protocols static route 10.1.0.0/24 next-hop 192.168.1.1",
+        "set protocols static route 10.1.0.0/24 next-hop 192.168.1.1",
+    ]
+    # Every leaf under the next-hop is stale, but the next-hop itself is desired: it must not be deleted.
+    assert compile_minimal_commands(desired, TREE) == [
+        "delete protocols static route 10.1.0.0/24 next-hop 192.168.1.1 description",
+        "delete protocols static route 10.1.0.0/24 next-hop 192.168.1.1 distance",
+    ]
+    scope = ("protocols", "static", "route", "10.1.0.0/24")
+    assert compile_minimal_commands(desired[1:], TREE, scopes=[scope]) == [
+        "delete protocols static route 10.1.0.0/24 next-hop 192.168.1.1 description",
+        "delete protocols static route 10.1.0.0/24 next-hop 192.168.1.1 distance",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_full_commands_when_router_state_unavailable(monkeypatch):
+    import vyos_config_mirror
+    from exceptions import VyOSAPIError
+
+    async def unreachable(self, path):
+        raise VyOSAPIError(detail="connection refused")
+
+    monkeypatch.setattr(vyos_config_mirror, "_config_mirror", vyos_config_mirror.VyOSConfigMirror())
+    monkeypatch.setattr(vyos_config_mirror.VyOSConfigMirror, "_retrieve", unreachable)
+    desired = ["set firewall name WAN_IN default-action drop"]
+    assert await compile_against_router(desired) == desired
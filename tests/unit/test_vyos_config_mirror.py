@@ -0,0 +1,114 @@
+import json
+import pytest
+import httpx
+
+from config import get_vyos_client_config
+from vyos_client import VyOSClient
+from vyos_config_mirror import VyOSConfigMirror, command_path
+
+TREE = {
+    "nat": {"destination": {"rule": {
+        "10001": {"description": "vm1 SSH", "inbound-interface": "eth0", "destination": {"port": "32000"},
+                  "translation": {"address": "10.0.0.5", "port": "22"}},
+    }}},
+    "firewall": {"name": {
+        "WAN_IN": {"default-action": "drop", "rule": {"10": {"action": "accept"}}},
+        "LAN_IN": {"default-action": "accept", "rule": {"20": {"action": "drop"}}},
+    }},
+}
+
+
+@pytest.fixture
+def router(monkeypatch):
+    import vyos_client
+    import vyos_config_mirror
+
+    state = {"tree": json.loads(json.dumps(TREE)), "retrieves": []}
+
+    def handler(request: httpx.Request):
+        body = json.loads(request.content)
+        if request.url.path == "/config":
+            return httpx.Response(200, json={"success": True})
+        path = body["path"]
+        state["retrieves"].append(path)
+        node = state["tree"]
+        for key in path:
+            node = node.get(key) if isinstance(node, dict) else None
+        if node is None:
+            return httpx.Response(200, json={"success": False, "data": None})
+        return httpx.Response(200, json={"success": True, "data": node})
+
+    client = VyOSClient(settings=get_vyos_client_config(), transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(vyos_client, "_vyos_client", client)
+    monkeypatch.setattr(vyos_config_mirror, "_config_mirror", VyOSConfigMirror(ttl_seconds=60))
+    return state
+
+
+def test_command_path_strips_verb_and_quotes():
+    assert command_path("set nat destination rule 10 description 'vm1 SSH'") == ("nat", "destination", "rule", "10", "description", "vm1 SSH")
+
+
+@pytest.mark.asyncio
+async def test_reads_are_served_from_one_retrieve(router):
+    import vyos_core
+
+    policies = await vyos_core.get_vyos_firewall_policies()
+    for name in policies:
+        await vyos_core.get_vyos_firewall_rules(name)
+    nat_rules = await vyos_core.get_vyos_nat_rules()
+    assert nat_rules[0]["rule_number"] == 10001 and nat_rules[0]["translation_port"] == 22
+    assert await vyos_core.get_vyos_static_routes() == {}
+    assert router["retrieves"] == [[]]
+
+
+@pytest.mark.asyncio
+async def test_write_invalidates_only_touched_subtree(router, monkeypatch):
+    import vyos_core
+    import vyos_config_mirror
+
+    monkeypatch.setenv("VYOS_COALESCE_ENABLED", "false")
+    await vyos_core.get_vyos_nat_rules()
+    router["tree"]["nat"]["destination"]["rule"]["10002"] = {
+        "description": "vm2 HTTP", "destination": {"port": "32001"}, "translation": {"address": "10.0.0.6", "port": "80"}}
+    await vyos_core.vyos_api_call(["set nat destination rule 10002 description 'vm2 HTTP'"])
+
+    assert await vyos_core.get_vyos_firewall_rules("WAN_IN") == {"10": {"action": "accept"}}
+    assert router["retrieves"] == [[]]  # Unrelated subtree still served from memory
+    assert {r["rule_number"] for r in await vyos_core.get_vyos_nat_rules()} == {10001, 10002}
+    assert router["retrieves"] == [[], ["nat", "destination", "rule"]]
+    assert vyos_config_mirror.get_config_mirror().stats()["subtree_refreshes"] == 1
+
+
+@pytest.mark.asyncio
+async def test_ttl_expiry_triggers_full_refresh(router):
+    import vyos_core
+    import vyos_config_mirror
+
+    mirror = vyos_config_mirror.get_config_mirror()
+    await vyos_core.get_vyos_firewall_policies()
+    mirror.ttl = 0
+    await vyos_core.get_vyos_firewall_policies()
+    assert router["retrieves"] == [[], []]
+    assert mirror.stats()["full_refreshes"] == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidation_during_a_refresh_is_not_lost():
+    tree = {"system": {"host-name": "old"}, "nat": {"destination": {}}}
+    mirror = VyOSConfigMirror(ttl_seconds=60)
+
+    async def fetch(path):
+        if not path:
+            snapshot = json.loads(json.dumps(tree))
+            mirror.invalidate(("system",))  # A write lands while the full retrieve is in flight
+            tree["system"]["host-name"] = "new"
+            return snapshot
+        node = tree
+        for key in path:
+            node = node.get(key)
+        return json.loads(json.dumps(node))
+
+    mirror._retrieve = fetch
+    await mirror.refresh()
+    assert await mirror.get("system", "host-name") == "new"
+    assert mirror.subtree_refreshes == 1
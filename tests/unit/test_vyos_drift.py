@@ -0,0 +1,122 @@
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi import FastAPI
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import patch
+
+import routers
+from auth import get_current_user
+from models import FirewallPolicy, FirewallRule, PortStatus, PortType, StaticRoute, User, VMPortRule, VyOSOutbox
+from vyos_config_mirror import VyOSConfigMirror, digest_leaf_paths, leaf_paths
+from vyos_drift import DriftDetector, desired_digest
+
+
+ROUTER_CONFIG = {
+    "firewall": {"name": {
+        "DRIFT-OK": {"default-action": "drop", "rule": {"10": {
+            "action": "accept", "protocol": "tcp", "log": "disable",
+            "state": {"established": "disable", "related": "disable", "new": "disable", "invalid": "disable"}}}},
+        "DRIFT-CHANGED": {"default-action": "accept"},
+        "ROUTER-ONLY": {"default-action": "drop"},
+    }},
+}
+
+
+def _mirror(config):
+    mirror = VyOSConfigMirror()
+
+    async def fetch(path):
+        node = config
+        for tok in path:
+            node = node.get(tok) if isinstance(node, dict) else None
+        return node
+
+    mirror._retrieve = fetch
+    return mirror
+
+
+@pytest_asyncio.fixture
+async def detector(test_db_engine):
+    session_factory = sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as db:
+        for model in (VyOSOutbox, FirewallRule, FirewallPolicy, StaticRoute):
+            await db.execute(delete(model))
+        ok = FirewallPolicy(name="DRIFT-OK", default_action="drop", user_id=1)
+        db.add_all([ok, FirewallPolicy(name="DRIFT-CHANGED", default_action="drop", user_id=1),
+                    FirewallPolicy(name="DRIFT-MISSING", default_action="reject", user_id=1)])
+        await db.flush()
+        db.add(FirewallRule(policy_id=ok.id, rule_number=10, action="accept", protocol="tcp"))
+        await db.commit()
+    yield DriftDetector(session_factory, auto_reconcile=False)
+
+
+def test_command_and_tree_digests_agree():
+    commands = ["set protocols static route 10.0.0.0/24 next-hop 192.0.2.1",
+                "set protocols static route 10.0.0.0/24 next-hop 192.0.2.1 description 'core link'",
+                "set protocols static route 10.0.0.0/24 next-hop 192.0.2.1 distance '5'"]
+    key = ("protocols", "static", "route", "10.0.0.0/24", "next-hop", "192.0.2.1")
+    assert desired_digest(key, commands) == digest_leaf_paths(leaf_paths({"description": "core link", "distance": "5"}))
+    assert desired_digest(key, commands[:1]) == digest_leaf_paths(leaf_paths({}))
+    assert desired_digest(key, commands) != desired_digest(key, commands[:2])
+
+
+@pytest.mark.asyncio
+async def test_drift_is_detected_and_reconciled_through_the_outbox(detector):
+    with patch("vyos_drift.get_config_mirror", return_value=_mirror(ROUTER_CONFIG)):
+        report = await detector.run_once()
+        assert report["in_sync"] == 1
+        assert {(d["path"], d["state"]) for d in report["drifted"]} == {
+            ("firewall name DRIFT-CHANGED", "modified"), ("firewall name DRIFT-MISSING", "missing")}
+        assert [u["path"] for u in report["unmanaged"]] == ["firewall name ROUTER-ONLY"]
+
+        report = await detector.run_once(reconcile=True)
+    assert report["queued"] == 2
+    async with detector.session_factory() as db:
+        entries = {e.resource_id: e for e in (await db.execute(select(VyOSOutbox))).scalars()}
+    assert all(e.resource_type == "drift:firewall_policy" for e in entries.values())
+    commands = sorted(c for e in entries.values() for c in e.commands)
+    assert "set firewall name DRIFT-CHANGED default-action drop" in commands
+    assert not any("ROUTER-ONLY" in c or "DRIFT-OK" in c for c in commands)
+
+    # Subtrees with queued changes are skipped until the drainer has applied them.
+    with patch("vyos_drift.get_config_mirror", return_value=_mirror(ROUTER_CONFIG)):
+        report = await detector.run_once()
+    assert report["drifted"] == [] and report["skipped_in_flight"] == 2
+
+
+@pytest.mark.asyncio
+async def test_nat_rules_without_a_vm_are_reported_as_orphaned(detector):
+    async with detector.session_factory() as db:
+        rule = VMPortRule(vm_id=None, port_type=PortType.ssh, external_port=47777, nat_rule_number=17777,
+                          status=PortStatus.enabled)
+        db.add(rule)
+        await db.commit()
+    config = {**ROUTER_CONFIG, "nat": {"destination": {"rule": {"17777": {"description": "left behind"}}}}}
+    try:
+        with patch("vyos_drift.get_config_mirror", return_value=_mirror(config)):
+            report = await detector.run_once(reconcile=True)
+        assert [o for o in report["orphaned"] if o["path"] == "nat destination rule 17777"] == [
+            {"kind": "nat_rule", "path": "nat destination rule 17777", "resource_id": str(rule.id), "on_router": True}]
+        assert not any(d["path"] == "nat destination rule 17777" for d in report["drifted"])
+    finally:
+        async with detector.session_factory() as db:
+            await db.execute(delete(VMPortRule).where(VMPortRule.id == rule.id))
+            await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_drift_report_is_admin_only(detector):
+    app = FastAPI()
+    app.include_router(routers.router)
+    transport = httpx.ASGITransport(app=app)
+    with patch("routers.get_drift_detector", return_value=detector):
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            assert (await client.get("/vyos/drift")).status_code == 401
+            for role, expected in (("user", 403), ("admin", 200)):
+                user = User(id=1, username=role)
+                user.roles = [role]
+                app.dependency_overrides[get_current_user] = lambda user=user: user
+                assert (await client.get("/vyos/drift")).status_code == expected
@@ -0,0 +1,92 @@
+import pytest
+import pytest_asyncio
+from unittest.mock import AsyncMock, patch
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from exceptions import VyOSAPIError
+from models import VyOSOutbox
+from vyos_outbox import VyOSOutboxDrainer, enqueue_vyos_commands
+
+
+async def _passthrough(commands, scopes=()):
+    return list(commands)
+
+
+@pytest_asyncio.fixture
+async def drainer(test_db_engine):
+    session_factory = sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as db:
+        await db.execute(delete(VyOSOutbox))
+        await db.commit()
+    yield VyOSOutboxDrainer(session_factory, max_attempts=2, retry_base_seconds=0)
+
+
+async def _statuses(drainer):
+    async with drainer.session_factory() as db:
+        return [(e.id, e.status, e.attempts) for e in (await db.execute(select(VyOSOutbox).order_by(VyOSOutbox.id))).scalars()]
+
+
+@pytest.mark.asyncio
+async def test_entries_follow_the_db_transaction(drainer):
+    async with drainer.session_factory() as db:
+        enqueue_vyos_commands(db, ["set firewall name A default-action drop"], resource_type="firewall_policy")
+        await db.rollback()
+        assert enqueue_vyos_commands(db, [], resource_type="noop") is None
+        enqueue_vyos_commands(db, ["set firewall name B default-action drop"], resource_type="firewall_policy")
+        await db.commit()
+    assert [s for _, s, _ in await _statuses(drainer)] == ["pending"]
+
+
+@pytest.mark.asyncio
+async def test_non_overlapping_entries_share_one_commit(drainer):
+    async with drainer.session_factory() as db:
+        enqueue_vyos_commands(db, ["set firewall name A default-action drop"])
+        enqueue_vyos_commands(db, ["set firewall name B default-action drop"])
+        enqueue_vyos_commands(db, ["delete firewall name A"])  # Overlaps the first entry
+        await db.commit()
+    with patch("vyos_outbox.compile_against_router", side_effect=_passthrough), \
+         patch("vyos_outbox.vyos_api_call", new_callable=AsyncMock) as vyos_call:
+        assert await drainer.drain_once() == 2
+        vyos_call.assert_awaited_once_with(
+            ["set firewall name A default-action drop", "set firewall name B default-action drop"], coalesce=False)
+        assert await drainer.drain_once() == 1
+        assert await drainer.drain_once() == 0
+    assert [s for _, s, _ in await _statuses(drainer)] == ["applied"] * 3
+
+
+@pytest.mark.asyncio
+async def test_failed_entry_is_retried_then_dead_lettered_in_order(drainer):
+    async with drainer.session_factory() as db:
+        enqueue_vyos_commands(db, ["set firewall name BAD default-action drop"])
+        enqueue_vyos_commands(db, ["set firewall name GOOD default-action drop"])
+        await db.commit()
+
+    async def fake_call(commands, coalesce=True):
+        if any("BAD" in c for c in commands):
+            raise VyOSAPIError(detail="commit failed")
+
+    with patch("vyos_outbox.compile_against_router", side_effect=_passthrough), \
+         patch("vyos_outbox.vyos_api_call", side_effect=fake_call):
+        await drainer.drain_once()
+        (_, bad_status, bad_attempts), (_, good_status, _) = await _statuses(drainer)
+        assert (bad_status, bad_attempts, good_status) == ("pending", 1, "pending")  # GOOD waits behind BAD
+        await drainer.drain_once()
+        await drainer.drain_once()
+    (bad_id, bad_status, _), (_, good_status, _) = await _statuses(drainer)
+    assert (bad_status, good_status) == ("failed", "applied")
+    assert await drainer.retry(bad_id)
+    assert (await drainer.stats())["counts"]["pending"] == 1
+
+
+@pytest.mark.asyncio
+async def test_crud_change_and_router_commands_commit_together(drainer, async_db_session: AsyncSession):
+    import crud
+    from schemas import StaticRouteCreate
+    route = await crud.create_static_route(async_db_session, StaticRouteCreate(destination="10.99.0.0/24", next_hop="192.0.2.1"), user_id=1)
+    async with drainer.session_factory() as db:
+        entry = (await db.execute(select(VyOSOutbox).where(VyOSOutbox.resource_type == "static_route"))).scalars().one()
+    assert entry.resource_id == str(route.id) and entry.status == "pending"
+    assert entry.commands[0] == "set protocols static route 10.99.0.0/24 next-hop 192.0.2.1"
+    assert entry.scopes == [["protocols", "static", "route", "10.99.0.0/24", "next-hop", "192.0.2.1"]]
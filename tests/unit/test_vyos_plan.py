@@ -0,0 +1,199 @@
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi import APIRouter, Depends, FastAPI, Request
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import crud
+import routers
+import vyos_plan
+from auth import get_current_active_user, get_current_user
+from config import get_async_db
+from fastapi import HTTPException
+from models import ChangeJournal, StaticRoute, User, VyOSOutbox, VyOSPlan
+from schemas import StaticRouteCreate
+from vyos_config_mirror import VyOSConfigMirror
+from utils_port_allocator import port_allocator
+from vyos_core import vyos_api_call
+from vyos_plan import PlannableRoute, PlanStore, get_plannable_db
+
+router = APIRouter(route_class=PlannableRoute)
+
+
+@router.post("/routes", status_code=201)
+async def create_route(route: StaticRouteCreate, db: AsyncSession = Depends(get_plannable_db)):
+    db_route = await crud.create_static_route(db, route, user_id=1)
+    return {"id": db_route.id}
+
+
+@router.post("/reserve")
+async def reserve_values(db: AsyncSession = Depends(get_plannable_db)):
+    reservation = await port_allocator.reserve(db, ports=1, nat_rules=1)
+    await db.commit()
+    await vyos_api_call(["set system host-name reserve"], coalesce=False)
+    return {"ports": reservation.ports, "nat_rule_numbers": reservation.nat_rule_numbers}
+
+
+@router.post("/owned")
+async def owned_change(db: AsyncSession = Depends(get_plannable_db), user: User = Depends(get_current_active_user)):
+    await vyos_api_call(["set system host-name owned"], coalesce=False)
+    return {"ok": True}
+
+
+@router.post("/direct")
+async def direct_change(db: AsyncSession = Depends(get_plannable_db)):
+    await vyos_api_call(["set system host-name plan-test"], coalesce=False)
+    return {"ok": True}
+
+
+@router.post("/plans/{plan_id}/apply")
+async def apply_plan(plan_id: str, request: Request):
+    return await vyos_plan.get_plan_store().apply(plan_id, request)
+
+
+@router.post("/unplanned")
+async def unplanned(db: AsyncSession = Depends(get_async_db)):
+    return {"ok": True}
+
+
+ROUTER_CONFIG = {"protocols": {"static": {"route": {"10.50.0.0/24": {"next-hop": {"192.0.2.9": {"distance": "1"}}}}}},
+                 "system": {"host-name": "vyos"}}
+
+
+def _mirror(config):
+    mirror = VyOSConfigMirror()
+
+    async def fetch(path):
+        node = config
+        for tok in path:
+            node = node.get(tok) if isinstance(node, dict) else None
+        return node
+
+    mirror._retrieve = fetch
+    return mirror
+
+
+@pytest_asyncio.fixture
+async def planner(test_db_engine):
+    session_factory = sessionmaker(bind=test_db_engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as db:
+        for model in (VyOSOutbox, VyOSPlan, StaticRoute):
+            await db.execute(delete(model))
+        await db.commit()
+
+    async def override_get_async_db():
+        async with session_factory() as session:
+            yield session
+
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_current_user] = lambda: _user(7, "planner", "user")
+    store = PlanStore(session_factory)
+    config = dict(ROUTER_CONFIG)
+    mirror = _mirror(config)
+    with patch("vyos_plan.get_plan_store", return_value=store), \
+         patch("vyos_plan.get_config_mirror", return_value=mirror), \
+         patch("vyos_compiler.get_config_mirror", return_value=mirror):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver") as client:
+            yield client, session_factory, config, mirror
+
+
+def _user(user_id, username, role):
+    user = User(id=user_id, username=username)
+    user.roles = [role]
+    return user
+
+
+async def _count(session_factory, model):
+    async with session_factory() as db:
+        return len((await db.execute(select(model))).scalars().all())
+
+
+@pytest.mark.asyncio
+async def test_dry_run_returns_plan_without_side_effects(planner):
+    client, session_factory, _, _ = planner
+    response = await client.post("/routes?dry_run=true", json={"destination": "10.50.0.0/24", "next_hop": "192.0.2.9",
+                                                                "description": "lab"})
+    assert response.status_code == 200
+    plan = response.json()
+    # The distance leaf already matches the router, so only the description is sent.
+    assert plan["commands"] == ["set protocols static route 10.50.0.0/24 next-hop 192.0.2.9 description 'lab'"]
+    assert [d["op"] for d in plan["diff"]] == ["add"]
+    assert plan["cost"]["command_count"] == 1 and plan["cost"]["estimated_router_commits"] == 1
+    assert plan["touched_subtrees"] == ["protocols static route 10.50.0.0/24 next-hop 192.0.2.9"]
+    assert await _count(session_factory, StaticRoute) == 0
+    assert await _count(session_factory, VyOSOutbox) == 0
+
+    assert (await client.post("/unplanned?dry_run=true")).status_code == 200  # Not plannable: dry_run is ignored
+    direct = (await client.post("/direct?dry_run=1")).json()
+    assert direct["diff"] == [{"op": "change", "path": "system host-name plan-test", "before": "vyos"}]
+
+
+@pytest.mark.asyncio
+async def test_apply_stored_plan_by_id(planner):
+    client, session_factory, _, _ = planner
+    plan = (await client.post("/routes?dry_run=true", json={"destination": "10.50.0.0/24", "next_hop": "192.0.2.9",
+                                                             "description": "lab"})).json()
+    with patch("vyos_plan.compile_against_router", new_callable=AsyncMock) as compiler:
+        applied = (await client.post(f"/plans/{plan['plan_id']}/apply")).json()
+        compiler.assert_not_awaited()
+    assert applied["status"] == "applied" and applied["result"]["status_code"] == 201
+    async with session_factory() as db:
+        entry = (await db.execute(select(VyOSOutbox))).scalars().one()
+    assert entry.commands == plan["commands"] and entry.scopes == []
+    assert await _count(session_factory, StaticRoute) == 1
+    assert (await client.post(f"/plans/{plan['plan_id']}/apply")).status_code == 409  # Only once
+
+
+@pytest.mark.asyncio
+async def test_plan_is_stale_after_router_change(planner):
+    client, session_factory, config, _ = planner
+    plan = (await client.post("/direct?dry_run=true")).json()
+    config["system"] = {"host-name": "changed-by-hand"}
+    with patch("vyos_core._send_vyos_commands", new_callable=AsyncMock) as send:
+        response = await client.post(f"/plans/{plan['plan_id']}/apply")
+        send.assert_not_awaited()
+    assert response.status_code == 409
+    async with session_factory() as db:
+        assert (await db.get(VyOSPlan, plan["plan_id"])).status == "stale"
+
+
+@pytest.mark.asyncio
+async def test_plans_are_visible_to_their_owner_and_admins(planner):
+    client, session_factory, _, _ = planner
+    plan = (await client.post("/owned?dry_run=true")).json()
+    assert plan["user_id"] == 7
+    with patch("routers.get_plan_store", return_value=vyos_plan.get_plan_store()):
+        assert (await routers.get_vyos_plan(plan["plan_id"], current_user=_user(7, "planner", "user")))["plan_id"] == plan["plan_id"]
+        assert (await routers.get_vyos_plan(plan["plan_id"], current_user=_user(1, "root", "admin")))["user_id"] == 7
+        with pytest.raises(HTTPException) as exc:
+            await routers.get_vyos_plan(plan["plan_id"], current_user=_user(8, "other", "user"))
+        assert exc.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_dry_run_commit_runs_no_after_commit_side_effects(planner):
+    client, session_factory, _, _ = planner
+    writer = MagicMock(write=AsyncMock())
+    journal_rows = await _count(session_factory, ChangeJournal)
+    with patch("utils_journal_writer.get_running_journal_writer", return_value=writer):
+        response = await client.post("/routes?dry_run=true", json={"destination": "10.50.0.0/24", "next_hop": "192.0.2.9"})
+    assert response.status_code == 200
+    writer.write.assert_not_awaited()  # The journal entry was rolled back with the change
+    assert await _count(session_factory, ChangeJournal) == journal_rows
+
+
+@pytest.mark.asyncio
+async def test_dry_run_releases_its_reservations_without_dropping_the_free_lists(planner):
+    client, _, _, _ = planner
+    first = (await client.post("/reserve?dry_run=true")).json()
+    free_lists = port_allocator._nat_rules
+    assert free_lists is not None and port_allocator.stats()["open_reservations"] == 0
+    second = (await client.post("/reserve?dry_run=true")).json()
+    assert port_allocator._nat_rules is free_lists
+    assert second["commands"] == first["commands"]
+    assert port_allocator._nat_rules.reserved == set()
@@ -0,0 +1,101 @@
+# utils_api_keys.py
+# API key format, checksum and storage hash.
+# Keys look like  vyk_<12 hex public prefix>_<48 hex secret><12 hex checksum>.
+# The checksum is an HMAC of everything before it under API_KEY_CHECKSUM_SECRET. A key that is malformed
+# or carries the wrong checksum (typos, garbage, credential stuffing) is therefore rejected in O(1)
+# without touching the database. Only the SHA-256 of a key is stored; the key is looked up by its prefix
+# (a unique, indexed column) and the hashes are compared in constant time. A plain hash is enough here
+# because the secret part carries 192 bits of randomness, unlike a password.
+# Keys issued before this format (43-char token_urlsafe values, stored hashed by the
+# a7c3e91f0b24 migration) are still accepted by key_hash while API_KEY_ALLOW_LEGACY is on.
+# Rotating API_KEY_CHECKSUM_SECRET invalidates every key in the new format.
+
+import hashlib
+import hmac
+import re
+import secrets
+from typing import Any, Dict, Optional, Tuple
+
+from config import get_api_key_config
+
+KEY_SCHEME = "vyk"
+PREFIX_HEX_LENGTH = 12
+SECRET_HEX_LENGTH = 48
+CHECKSUM_HEX_LENGTH = 12
+
+_KEY_RE = re.compile(
+    rf"^{KEY_SCHEME}_([0-9a-f]{{{PREFIX_HEX_LENGTH}}})_[0-9a-f]{{{SECRET_HEX_LENGTH}}}([0-9a-f]{{{CHECKSUM_HEX_LENGTH}}})$"
+)
+_LEGACY_KEY_RE = re.compile(r"^[A-Za-z0-9_-]{43}$")
+
+
+def hash_api_key(api_key_value: str) -> str:
+    """Storage hash of a full API key."""
+    return hashlib.sha256(api_key_value.encode()).hexdigest()
+
+
+class APIKeyCodec:
+    def __init__(self, checksum_secret: str, allow_legacy: bool = True):
+        self._secret = checksum_secret.encode()
+        self.allow_legacy = allow_legacy
+        # Metrics
+        self.issued = 0
+        self.accepted = 0
+        self.rejected_malformed = 0
+        self.rejected_checksum = 0
+        self.legacy_lookups = 0
+
+    def _checksum(self, body: str) -> str:
+        return hmac.new(self._secret, body.encode(), hashlib.sha256).hexdigest()[:CHECKSUM_HEX_LENGTH]
+
+    def generate(self) -> Tuple[str, str, str]:
+        """A new key: (plaintext shown once to the caller, key_prefix, key_hash)."""
+        prefix = secrets.token_hex(PREFIX_HEX_LENGTH // 2)
+        body = f"{KEY_SCHEME}_{prefix}_{secrets.token_hex(SECRET_HEX_LENGTH // 2)}"
+        plaintext = body + self._checksum(body)
+        self.issued += 1
+        return plaintext, prefix, hash_api_key(plaintext)
+
+    def parse(self, api_key_value: str, record: bool = True) -> Optional[str]:
+        """The key's lookup prefix if it is well-formed with a valid checksum, else None. Never touches the DB.
+
+        record=False leaves the metrics alone, for callers other than authentication (e.g. rate limiting).
+        """
+        match = _KEY_RE.match(api_key_value or "")
+        if match is None:
+            self.rejected_malformed += record
+            return None
+        if not hmac.compare_digest(match.group(2), self._checksum(api_key_value[:-CHECKSUM_HEX_LENGTH])):
+            self.rejected_checksum += record
+            return None
+        self.accepted += record
+        return match.group(1)
+
+    def is_legacy(self, api_key_value: str) -> bool:
+        """Whether a key that failed parse() may still be an old-format key worth one lookup by hash."""
+        if self.allow_legacy and _LEGACY_KEY_RE.match(api_key_value or ""):
+            self.rejected_malformed -= 1  # parse() counted it, but it is looked up after all
+            self.legacy_lookups += 1
+            return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "allow_legacy": self.allow_legacy,
+            "issued": self.issued,
+            "accepted": self.accepted,
+            "rejected_malformed": self.rejected_malformed,
+            "rejected_checksum": self.rejected_checksum,
+            "legacy_lookups": self.legacy_lookups,
+        }
+
+
+_api_key_codec: Optional[APIKeyCodec] = None
+
+
+def get_api_key_codec() -> APIKeyCodec:
+    global _api_key_codec
+    if _api_key_codec is None:
+        settings = get_api_key_config()
+        _api_key_codec = APIKeyCodec(settings["CHECKSUM_SECRET"], allow_legacy=settings["ALLOW_LEGACY"])
+    return _api_key_codec
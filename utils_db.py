@@ -0,0 +1,281 @@
+# utils_db.py
+# Async engine construction for SQLite (development, tests) and PostgreSQL via asyncpg (production),
+# with a connection pool that records checkout counts, wait times and hold times.
+# Pool settings are per process: with N API workers the database sees up to
+# N * (POOL_SIZE + MAX_OVERFLOW) connections.
+# SQLite file databases run in WAL mode with tuned pragmas. In single-writer mode all writes share one
+# serialized writer connection, while SELECTs outside a writing transaction use a separate read pool.
+
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Select, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+
+
+def normalize_async_url(url: str) -> str:
+    """Map plain PostgreSQL URLs (postgres://, postgresql://, postgresql+psycopg2://) to the asyncpg driver."""
+    parsed = make_url(url)
+    backend, _, driver = parsed.drivername.partition("+")
+    if backend in ("postgres", "postgresql") and driver != "asyncpg":
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+    return parsed.render_as_string(hide_password=False)
+
+
+class PoolStats:
+    """Counters fed by the instrumented pool and the pool events of one engine."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.slow_waits = 0  # Checkouts that had to wait for a connection (> 1 ms)
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+        self.checkins = 0
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if seconds > 0.001:
+                self.slow_waits += 1
+
+    def record_hold(self, seconds: float) -> None:
+        with self._lock:
+            self.checkins += 1
+            self.hold_total += seconds
+            self.hold_max = max(self.hold_max, seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.timeouts,
+                "checkouts_waited": self.slow_waits,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+                "hold_avg_ms": round(self.hold_total / self.checkins * 1000, 3) if self.checkins else 0.0,
+                "hold_max_ms": round(self.hold_max * 1000, 3),
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+            }
+
+
+class WriterTimeoutError(exc.TimeoutError):
+    """No session released the SQLite writer connection within SQLITE_WRITER_TIMEOUT."""
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that times how long each checkout waits for a free connection."""
+
+    stats: Optional[PoolStats] = None
+    single_writer = False
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError as error:
+            if self.stats is not None:
+                self.stats.record_wait(time.perf_counter() - start, timed_out=True)
+            if self.single_writer:
+                raise WriterTimeoutError(
+                    f"Timed out after {self._timeout:g}s waiting for the SQLite writer connection; another session "
+                    "is holding it (a session that was never closed, or a long write transaction). "
+                    "Set DB_SQLITE_SINGLE_WRITER=false to disable single-writer mode."
+                ) from error
+            raise
+        if self.stats is not None:
+            self.stats.record_wait(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() swaps in a fresh pool; keep counting into the same stats.
+        pool = super().recreate()
+        pool.stats = self.stats
+        pool.single_writer = self.single_writer
+        return pool
+
+
+def _attach_pool_events(engine: AsyncEngine, stats: PoolStats) -> None:
+    pool = engine.sync_engine.pool
+
+    @event.listens_for(pool, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        stats.connects += 1
+
+    @event.listens_for(pool, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+
+    @event.listens_for(pool, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            stats.record_hold(time.perf_counter() - checked_out_at)
+
+    @event.listens_for(pool, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        stats.invalidations += 1
+
+
+def sqlite_pragmas(settings: Dict[str, Any], read_only: bool = False) -> List[str]:
+    pragmas = [
+        f"PRAGMA journal_mode={settings['SQLITE_JOURNAL_MODE']}",
+        # In WAL mode NORMAL only syncs at checkpoints, so a burst of commits shares one fsync.
+        f"PRAGMA synchronous={settings['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={settings['SQLITE_BUSY_TIMEOUT_MS']}",
+        f"PRAGMA mmap_size={settings['SQLITE_MMAP_SIZE']}",
+        f"PRAGMA cache_size=-{settings['SQLITE_CACHE_SIZE_KB']}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only=ON")  # A routing mistake fails loudly instead of taking a write lock
+    return pragmas
+
+
+def _apply_pragmas(engine: AsyncEngine, pragmas: List[str]) -> None:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def _is_sqlite_file(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database not in (None, "", ":memory:")
+
+
+def build_async_engine(url: str, settings: Dict[str, Any]) -> AsyncEngine:
+    """Create the application's async engine from a URL and the DB_* settings in config.get_database_config().
+
+    For SQLite in single-writer mode this is the writer engine, with exactly one connection.
+    """
+    url = normalize_async_url(url)
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    kwargs: Dict[str, Any] = {"echo": settings["ECHO"]}
+    if backend == "sqlite":
+        kwargs["connect_args"] = {"check_same_thread": False}
+        if parsed.database in (None, "", ":memory:"):
+            # Each connection to ':memory:' is a new, empty database; share one.
+            kwargs["poolclass"] = StaticPool
+            return create_async_engine(url, **kwargs)
+        if settings["SQLITE_SINGLE_WRITER"]:
+            # Writers queue for the pool's only connection instead of colliding on SQLite's file lock.
+            settings = {**settings, "POOL_SIZE": 1, "MAX_OVERFLOW": 0, "POOL_TIMEOUT": settings["SQLITE_WRITER_TIMEOUT"]}
+    elif backend == "postgresql":
+        # asyncpg's own prepared statement cache; set 0 behind PgBouncer in transaction pooling mode.
+        kwargs["connect_args"] = {
+            "statement_cache_size": settings["STATEMENT_CACHE_SIZE"],
+            "command_timeout": settings["COMMAND_TIMEOUT"],
+            "server_settings": {"application_name": settings["APPLICATION_NAME"]},
+        }
+        if "prepared_statement_cache_size" not in parsed.query:
+            # SQLAlchemy's cache of asyncpg prepared statements, per connection.
+            url = parsed.update_query_dict({"prepared_statement_cache_size": str(settings["STATEMENT_CACHE_SIZE"])}) \
+                .render_as_string(hide_password=False)
+    kwargs.update(
+        poolclass=InstrumentedAsyncPool,
+        pool_size=settings["POOL_SIZE"],
+        max_overflow=settings["MAX_OVERFLOW"],
+        pool_timeout=settings["POOL_TIMEOUT"],
+        pool_recycle=settings["POOL_RECYCLE"],
+        pool_pre_ping=settings["POOL_PRE_PING"],
+        pool_use_lifo=settings["POOL_USE_LIFO"],
+    )
+    engine = create_async_engine(url, **kwargs)
+    stats = PoolStats()
+    engine.sync_engine.pool.stats = stats
+    engine.sync_engine.pool.single_writer = backend == "sqlite" and settings["SQLITE_SINGLE_WRITER"]
+    _attach_pool_events(engine, stats)
+    if backend == "sqlite":
+        _apply_pragmas(engine, sqlite_pragmas(settings))
+    return engine
+
+
+def build_read_engine(url: str, settings: Dict[str, Any]) -> Optional[AsyncEngine]:
+    """Read-only pool for SQLite single-writer mode; None for every other setup."""
+    url = normalize_async_url(url)
+    if not _is_sqlite_file(url) or not settings["SQLITE_SINGLE_WRITER"]:
+        return None
+    engine = create_async_engine(
+        url,
+        echo=settings["ECHO"],
+        connect_args={"check_same_thread": False},
+        poolclass=InstrumentedAsyncPool,
+        pool_size=settings["SQLITE_READ_POOL_SIZE"],
+        max_overflow=0,
+        pool_timeout=settings["POOL_TIMEOUT"],
+        pool_use_lifo=settings["POOL_USE_LIFO"],
+    )
+    stats = PoolStats()
+    engine.sync_engine.pool.stats = stats
+    _attach_pool_events(engine, stats)
+    _apply_pragmas(engine, sqlite_pragmas(settings, read_only=True))
+    return engine
+
+
+class SQLiteRoutingSession(Session):
+    """Session that runs SELECTs on the read pool until its transaction writes.
+
+    From the first write (or any non-SELECT statement) until the transaction ends, everything uses the
+    writer, so the transaction reads its own uncommitted changes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        read_bind = self.info.get("read_bind")
+        if read_bind is not None and not self._flushing and not self.info.get("writer_pinned") and isinstance(clause, Select):
+            return read_bind
+        self.info["writer_pinned"] = True
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+@event.listens_for(SQLiteRoutingSession, "after_transaction_end")
+def _unpin_writer(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("writer_pinned", None)
+
+
+def session_routing_options(read_engine: Optional[AsyncEngine]) -> Dict[str, Any]:
+    """Extra sessionmaker() arguments that route reads to `read_engine` (no-op when it is None)."""
+    if read_engine is None:
+        return {}
+    return {"sync_session_class": SQLiteRoutingSession, "info": {"read_bind": read_engine.sync_engine}}
+
+
+def get_pool_stats(engine: AsyncEngine) -> Dict[str, Any]:
+    """Pool configuration, current occupancy and checkout/wait/hold statistics of `engine`."""
+    pool = engine.sync_engine.pool
+    result: Dict[str, Any] = {
+        "backend": engine.dialect.name,
+        "driver": engine.dialect.driver,
+        "pool_class": type(pool).__name__,
+    }
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        result.update(
+            pool_size=pool.size(),
+            max_overflow=pool._max_overflow,
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+        )
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        result.update(stats.snapshot())
+    return result
@@ -0,0 +1,236 @@
+# utils_ip_allocator.py
+# Bitmap-backed IP allocation index for DHCP pools.
+# Each pool gets a compact bitmap of used addresses, built once from the DB and kept up to date
+# on every assign/release, so finding a free address no longer needs one query per candidate.
+# The bitmaps only see this process's writes. A transaction that rolls back with reserved addresses may
+# have collided with an address another worker committed, so the bitmaps are rebuilt before the next
+# allocation, keeping the addresses still reserved by open transactions.
+
+import asyncio
+import logging
+from ipaddress import ip_address
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from exceptions import ResourceAllocationError
+from models import DHCPPool, VMNetworkConfig
+from utils_unit_of_work import is_dry_run
+
+logger = logging.getLogger(__name__)
+
+
+class IPBitmap:
+    """Used/free bitmap over a contiguous IPv4/IPv6 range with a rotating next-free cursor."""
+
+    def __init__(self, start: str, end: str):
+        self.start = int(ip_address(start))
+        self.end = int(ip_address(end))
+        if self.end < self.start:
+            raise ValueError(f"Invalid IP range {start}-{end}")
+        self._version = ip_address(start).version
+        self.size = self.end - self.start + 1
+        self._bits = bytearray((self.size + 7) // 8)
+        self.used = 0
+        self._cursor = 0
+
+    @property
+    def range(self) -> Tuple[str, str]:
+        return str(ip_address(self.start)), str(ip_address(self.end))
+
+    def _offset(self, ip: str) -> Optional[int]:
+        try:
+            addr = ip_address(ip)
+        except ValueError:
+            return None
+        value = int(addr)
+        if addr.version != self._version or value < self.start or value > self.end:
+            return None
+        return value - self.start
+
+    def _test(self, offset: int) -> bool:
+        return bool(self._bits[offset >> 3] & (1 << (offset & 7)))
+
+    def _set(self, offset: int) -> None:
+        if not self._test(offset):
+            self._bits[offset >> 3] |= 1 << (offset & 7)
+            self.used += 1
+
+    def _clear(self, offset: int) -> None:
+        if self._test(offset):
+            self._bits[offset >> 3] &= ~(1 << (offset & 7))
+            self.used -= 1
+
+    def is_used(self, ip: str) -> bool:
+        offset = self._offset(ip)
+        return offset is not None and self._test(offset)
+
+    def mark_used(self, ip: str) -> bool:
+        """Mark `ip` as used; returns False if it is outside the range."""
+        offset = self._offset(ip)
+        if offset is None:
+            return False
+        self._set(offset)
+        return True
+
+    def release(self, ip: str) -> bool:
+        offset = self._offset(ip)
+        if offset is None:
+            return False
+        self._clear(offset)
+        # Prefer reusing low addresses so the pool stays compact.
+        self._cursor = min(self._cursor, offset)
+        return True
+
+    def _find_free(self) -> Optional[int]:
+        byte_count = len(self._bits)
+        start_byte = self._cursor >> 3
+        # Skip whole bytes that are full; the extra step wraps back to the bits before the cursor.
+        for step in range(byte_count + 1):
+            index = (start_byte + step) % byte_count
+            byte = self._bits[index]
+            if byte == 0xFF:
+                continue
+            first_bit = self._cursor & 7 if step == 0 else 0
+            for bit in range(first_bit, 8):
+                offset = (index << 3) + bit
+                if offset >= self.size:
+                    break
+                if not byte & (1 << bit):
+                    return offset
+        return None
+
+    def allocate(self, count: int = 1) -> List[str]:
+        """Reserve `count` free addresses at once; either all are reserved or none are."""
+        if count > self.size - self.used:
+            raise ResourceAllocationError(detail=f"Only {self.size - self.used} free IPs left, {count} requested")
+        offsets = []
+        for _ in range(count):
+            offset = self._find_free()
+            if offset is None:  # Should not happen given the free-count check above
+                for taken in offsets:
+                    self._clear(taken)
+                raise ResourceAllocationError(detail="IP bitmap exhausted")
+            self._set(offset)
+            offsets.append(offset)
+            self._cursor = (offset + 1) % self.size
+        return [str(ip_address(self.start + offset)) for offset in offsets]
+
+
+class PoolIPAllocator:
+    """Per-DHCPPool bitmap index, safe for concurrent asyncio callers in this process."""
+
+    def __init__(self):
+        self._bitmaps: Dict[int, IPBitmap] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._in_flight: Set[str] = set()  # Reserved by reserve(), transaction still open
+        self._stale: Set[int] = set()  # Pools to rebuild from the DB on next use
+        # Metrics
+        self.resyncs = 0
+
+    def _lock(self, pool_id: int) -> asyncio.Lock:
+        if pool_id not in self._locks:
+            self._locks[pool_id] = asyncio.Lock()
+        return self._locks[pool_id]
+
+    async def _load(self, db: AsyncSession, pool: DHCPPool) -> IPBitmap:
+        bitmap = self._bitmaps.get(pool.id)
+        if pool.id in self._stale:
+            self._stale.discard(pool.id)
+            bitmap = None
+            self.resyncs += 1
+        if bitmap is not None and bitmap.range == (str(ip_address(pool.ip_range_start)), str(ip_address(pool.ip_range_end))):
+            return bitmap
+        bitmap = IPBitmap(pool.ip_range_start, pool.ip_range_end)
+        # Any VM address inside the range counts as used, whether or not the VM is linked to this pool.
+        result = await db.execute(select(VMNetworkConfig.internal_ip).filter(VMNetworkConfig.internal_ip.isnot(None)))
+        for (ip,) in result.all():
+            bitmap.mark_used(ip)
+        for ip in self._in_flight:  # Not in the DB yet
+            bitmap.mark_used(ip)
+        self._bitmaps[pool.id] = bitmap
+        logger.info(f"Built IP bitmap for DHCP pool '{pool.name}': {bitmap.used}/{bitmap.size} addresses in use.")
+        return bitmap
+
+    async def allocate(self, db: AsyncSession, pool: DHCPPool, count: int = 1) -> List[str]:
+        """Reserve `count` addresses from `pool`. Callers must release() them if the assignment is abandoned."""
+        async with self._lock(pool.id):
+            bitmap = await self._load(db, pool)
+            try:
+                return bitmap.allocate(count)
+            except ResourceAllocationError:
+                raise ResourceAllocationError(
+                    detail=f"No available IPs in DHCP pool '{pool.name}' range {pool.ip_range_start}-{pool.ip_range_end} "
+                           f"({count} requested, {bitmap.size - bitmap.used} free)"
+                )
+
+    async def reserve(self, db: AsyncSession, pool: DHCPPool, count: int = 1) -> List[str]:
+        """allocate() bound to the transaction of `db`: the addresses are released unless it commits."""
+        await db.connection()  # Make sure there is a transaction whose end releases the reservation
+        ips = await self.allocate(db, pool, count)
+        self._in_flight.update(ips)
+        _bind_to_session(db, self, ips)
+        return ips
+
+    def _settle(self, ips: List[str], committed: bool) -> None:
+        self._in_flight.difference_update(ips)
+        if not committed:
+            self.release(ips)
+
+    def mark_used(self, ips: Iterable[str]) -> None:
+        """Record addresses assigned outside allocate() (e.g. static IPs) in every pool covering them."""
+        for ip in ips:
+            if ip:
+                for bitmap in self._bitmaps.values():
+                    bitmap.mark_used(ip)
+
+    def release(self, ips: Iterable[str]) -> None:
+        for ip in ips:
+            if ip:
+                for bitmap in self._bitmaps.values():
+                    bitmap.release(ip)
+
+    def invalidate(self, pool_id: Optional[int] = None) -> None:
+        """Drop one pool's bitmap (or all of them) so it is rebuilt from the DB on next use."""
+        if pool_id is None:
+            self._bitmaps.clear()
+        else:
+            self._bitmaps.pop(pool_id, None)
+
+    def resync(self) -> None:
+        """Rebuild every bitmap from the DB on next use, keeping addresses reserved by open transactions."""
+        self._stale.update(self._bitmaps)
+
+    def stats(self) -> Dict[int, Dict[str, int]]:
+        return {pool_id: {"size": b.size, "used": b.used, "free": b.size - b.used} for pool_id, b in self._bitmaps.items()}
+
+
+def _bind_to_session(db: AsyncSession, allocator: PoolIPAllocator, ips: List[str]) -> None:
+    sync_session = getattr(db, "sync_session", None)
+    if sync_session is None:
+        return  # Not a real session (e.g. a test double); the caller releases explicitly.
+    sync_session.info.setdefault("ip_reservations", []).extend(ips)
+    if sync_session.info.get("ip_reservation_hooks"):
+        return
+    sync_session.info["ip_reservation_hooks"] = True
+
+    def _after_commit(session):
+        if is_dry_run(session):
+            return  # Only a savepoint was released: leave the addresses to _after_transaction_end
+        allocator._settle(session.info.pop("ip_reservations", []), committed=True)
+
+    def _after_transaction_end(session, transaction):
+        # Rolled back, or the session was closed without committing.
+        if transaction.parent is None:
+            ips = session.info.pop("ip_reservations", [])
+            allocator._settle(ips, committed=False)
+            if ips and not is_dry_run(session):
+                # Possibly a unique-constraint conflict with an address another worker committed.
+                allocator.resync()
+
+    event.listen(sync_session, "after_commit", _after_commit)
+    event.listen(sync_session, "after_transaction_end", _after_transaction_end)
+
+
+ip_allocator = PoolIPAllocator()
@@ -0,0 +1,421 @@
+# utils_job_engine.py
+# Persistent, DB-backed job queue for long-running operations (bulk provisioning, config sync,
+# backups, template generation). Jobs live in the `jobs` table, so they survive restarts and are
+# visible to every uvicorn worker; a bounded pool of asyncio workers in each process claims queued
+# rows with an atomic UPDATE, reports progress, honours cancellation and evicts expired results.
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, select, update
+
+from config import AsyncSessionLocal, get_job_engine_config
+from exceptions import JobError
+from models import Job
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCESS = "success"
+JOB_ERROR = "error"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATUSES = (JOB_SUCCESS, JOB_ERROR, JOB_CANCELLED)
+
+MAINTENANCE_INTERVAL_SECONDS = 60.0
+
+# Map job_type to handler coroutines here; a handler is called as `await handler(params, ctx)`.
+job_handlers: Dict[str, Callable[[Dict[str, Any], "JobContext"], Awaitable[Any]]] = {}
+
+
+def register_job_handler(job_type):
+    def decorator(func):
+        job_handlers[job_type] = func
+        return func
+    return decorator
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when its job has been cancelled."""
+
+
+class JobContext:
+    """Handed to job handlers for progress reporting and cooperative cancellation checks."""
+
+    def __init__(self, engine: "JobEngine", job_id: str, user_id: Optional[int]):
+        self.engine = engine
+        self.job_id = job_id
+        self.user_id = user_id
+        self.cancel_requested = False
+
+    def session(self):
+        """Open a new DB session for the handler's own work."""
+        return self.engine.session_factory()
+
+    def check_cancelled(self) -> None:
+        if self.cancel_requested:
+            raise JobCancelled()
+
+    async def report_progress(self, percent: int, message: Optional[str] = None) -> None:
+        """Persist progress (0-100) and raise JobCancelled if the job was cancelled meanwhile."""
+        percent = max(0, min(100, int(percent)))
+        async with self.engine.session_factory() as db:
+            await db.execute(
+                update(Job).where(Job.id == self.job_id)
+                .values(progress=percent, progress_message=message, heartbeat_at=datetime.utcnow())
+            )
+            await db.commit()
+            cancel = await db.scalar(select(Job.cancel_requested).where(Job.id == self.job_id))
+        if cancel:
+            self.cancel_requested = True
+        self.check_cancelled()
+
+
+def job_to_dict(job: Job) -> Dict[str, Any]:
+    return {
+        "task_id": job.id,
+        "job_type": job.job_type,
+        "status": job.status,
+        "progress": job.progress,
+        "progress_message": job.progress_message,
+        "result": job.result,
+        "error": job.error,
+        "user_id": job.user_id,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "expires_at": job.expires_at.isoformat() if job.expires_at else None,
+    }
+
+
+class JobEngine:
+    """Bounded pool of asyncio workers draining the `jobs` table."""
+
+    def __init__(self, session_factory=AsyncSessionLocal, workers: int = 4, poll_interval: float = 2.0,
+                 result_ttl_seconds: int = 86400, stale_after_seconds: int = 600):
+        self.session_factory = session_factory
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.result_ttl = timedelta(seconds=result_ttl_seconds)
+        self.stale_after = timedelta(seconds=stale_after_seconds)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._contexts: Dict[str, JobContext] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._table_ready = False
+        # Metrics
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.evicted = 0
+
+    # --- Lifecycle ---
+    @property
+    def started(self) -> bool:
+        return bool(self._tasks) and self._loop is asyncio.get_running_loop()
+
+    async def _ensure_table(self) -> None:
+        if self._table_ready:
+            return
+        async with self.session_factory() as db:
+            await db.run_sync(lambda session: Job.__table__.create(session.connection(), checkfirst=True))
+            await db.commit()
+        self._table_ready = True
+
+    async def start(self) -> None:
+        """Create the jobs table if needed, recover jobs orphaned by a crash and start the workers."""
+        if self.started:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        await self._ensure_table()
+        await self._recover_stale()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintenance()))
+        logger.info(f"Job engine {self.worker_id} started with {self.workers} workers.")
+
+    async def stop(self) -> None:
+        """Stop the workers; jobs still running in this process are put back in the queue."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # --- Public API ---
+    async def submit(self, job_type: str, params: Optional[Dict[str, Any]] = None, user_id: Optional[int] = None) -> str:
+        if job_type not in job_handlers:
+            raise JobError(detail=f"Unknown task type '{job_type}'. Available: {', '.join(sorted(job_handlers))}")
+        await self.start()
+        job_id = str(uuid.uuid4())
+        async with self.session_factory() as db:
+            db.add(Job(id=job_id, job_type=job_type, params=params or {}, user_id=user_id,
+                       status=JOB_QUEUED, progress=0, cancel_requested=False, created_at=datetime.utcnow()))
+            await db.commit()
+        self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        await self._ensure_table()
+        async with self.session_factory() as db:
+            job = await db.get(Job, job_id)
+            return job_to_dict(job) if job else None
+
+    async def list_jobs(self, status: Optional[str] = None, user_id: Optional[int] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        await self._ensure_table()
+        query = select(Job).order_by(Job.created_at.desc()).limit(limit)
+        if status:
+            query = query.where(Job.status == status)
+        if user_id is not None:
+            query = query.where(Job.user_id == user_id)
+        async with self.session_factory() as db:
+            return [job_to_dict(job) for job in (await db.execute(query)).scalars().all()]
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel a job: queued jobs are cancelled at once, running jobs are interrupted by their worker."""
+        await self._ensure_table()
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            result = await db.execute(
+                update(Job).where(Job.id == job_id, Job.status == JOB_QUEUED)
+                .values(status=JOB_CANCELLED, finished_at=now, expires_at=now + self.result_ttl)
+            )
+            if not result.rowcount:
+                # The owning worker (possibly in another process) sees the flag on its next heartbeat.
+                await db.execute(update(Job).where(Job.id == job_id, Job.status == JOB_RUNNING).values(cancel_requested=True))
+            await db.commit()
+        if job_id in self._contexts:
+            self._contexts[job_id].cancel_requested = True
+        if job_id in self._running:
+            self._running[job_id].cancel()
+        return await self.get(job_id)
+
+    async def evict_expired(self) -> int:
+        """Delete finished jobs whose result TTL has passed."""
+        async with self.session_factory() as db:
+            result = await db.execute(delete(Job).where(Job.status.in_(FINISHED_STATUSES), Job.expires_at <= datetime.utcnow()))
+            await db.commit()
+        self.evicted += result.rowcount or 0
+        return result.rowcount or 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "started": self.started,
+            "workers": self.workers,
+            "running": sorted(self._running),
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "evicted": self.evicted,
+        }
+
+    # --- Workers ---
+    async def _recover_stale(self) -> None:
+        """Fail jobs left 'running' by a worker that stopped heartbeating (crash or hard restart)."""
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            result = await db.execute(
+                update(Job).where(Job.status == JOB_RUNNING, Job.heartbeat_at < now - self.stale_after)
+                .values(status=JOB_ERROR, error="Job interrupted: worker stopped responding",
+                        result={"error": "Job interrupted: worker stopped responding"},
+                        finished_at=now, expires_at=now + self.result_ttl)
+            )
+            await db.commit()
+        if result.rowcount:
+            logger.warning(f"Marked {result.rowcount} stale running job(s) as interrupted.")
+
+    async def _maintenance(self) -> None:
+        while True:
+            await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+            try:
+                await self.evict_expired()
+                await self._recover_stale()
+            except Exception as e:
+                logger.error(f"Job engine maintenance error: {e}")
+
+    async def _claim(self) -> Optional[Job]:
+        async with self.session_factory() as db:
+            candidates = (await db.execute(
+                select(Job.id).where(Job.status == JOB_QUEUED).order_by(Job.created_at).limit(self.workers)
+            )).scalars().all()
+            for job_id in candidates:
+                now = datetime.utcnow()
+                # Conditional update: exactly one worker (in any process) wins each queued row.
+                result = await db.execute(
+                    update(Job).where(Job.id == job_id, Job.status == JOB_QUEUED)
+                    .values(status=JOB_RUNNING, worker_id=self.worker_id, started_at=now, heartbeat_at=now)
+                )
+                await db.commit()
+                if result.rowcount:
+                    return await db.get(Job, job_id)
+        return None
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {index} failed to claim a job: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._execute(job)
+
+    async def _execute(self, job: Job) -> None:
+        ctx = JobContext(self, job.id, job.user_id)
+        handler = job_handlers.get(job.job_type)
+        if handler is None:
+            await self._finish(job.id, JOB_ERROR, error=f"No handler for task type '{job.job_type}'")
+            return
+        task = asyncio.create_task(handler(job.params or {}, ctx))
+        self._running[job.id] = task
+        self._contexts[job.id] = ctx
+        try:
+            heartbeat = max(1.0, self.stale_after.total_seconds() / 3)
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=heartbeat)
+                if done:
+                    break
+                await self._heartbeat(job.id, task, ctx)
+            result = task.result()
+            await self._finish(job.id, JOB_SUCCESS, result=jsonable_encoder(result))
+        except (asyncio.CancelledError, JobCancelled):
+            if self._stopping():
+                # Engine shutdown: hand the job back to the queue for the next worker.
+                task.cancel()
+                await self._requeue(job.id)
+                raise
+            await self._finish(job.id, JOB_CANCELLED, error="Job cancelled")
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.job_type}) failed: {e}")
+            await self._finish(job.id, JOB_ERROR, error=str(getattr(e, "detail", e)))
+        finally:
+            self._running.pop(job.id, None)
+            self._contexts.pop(job.id, None)
+
+    def _stopping(self) -> bool:
+        current = asyncio.current_task()
+        return current is not None and current.cancelling() > 0
+
+    async def _heartbeat(self, job_id: str, task: asyncio.Task, ctx: JobContext) -> None:
+        async with self.session_factory() as db:
+            await db.execute(update(Job).where(Job.id == job_id).values(heartbeat_at=datetime.utcnow()))
+            await db.commit()
+            cancel = await db.scalar(select(Job.cancel_requested).where(Job.id == job_id))
+        if cancel and not ctx.cancel_requested:
+            ctx.cancel_requested = True
+            task.cancel()
+
+    async def _finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        now = datetime.utcnow()
+        values = {"status": status, "finished_at": now, "expires_at": now + self.result_ttl, "error": error,
+                  "result": result if error is None else {"error": error}}
+        if status == JOB_SUCCESS:
+            values["progress"] = 100
+        async with self.session_factory() as db:
+            await db.execute(update(Job).where(Job.id == job_id).values(**values))
+            await db.commit()
+        if status == JOB_SUCCESS:
+            self.completed += 1
+        elif status == JOB_CANCELLED:
+            self.cancelled += 1
+        else:
+            self.failed += 1
+
+    async def _requeue(self, job_id: str) -> None:
+        async with self.session_factory() as db:
+            await db.execute(
+                update(Job).where(Job.id == job_id, Job.status == JOB_RUNNING)
+                .values(status=JOB_QUEUED, worker_id=None, started_at=None, heartbeat_at=None)
+            )
+            await db.commit()
+
+
+_job_engine: Optional[JobEngine] = None
+
+
+def get_job_engine() -> JobEngine:
+    """Return the process-wide job engine; workers start on app startup or on first submit."""
+    global _job_engine
+    if _job_engine is None:
+        settings = get_job_engine_config()
+        _job_engine = JobEngine(workers=settings["WORKERS"], poll_interval=settings["POLL_INTERVAL"],
+                                result_ttl_seconds=settings["RESULT_TTL_SECONDS"],
+                                stale_after_seconds=settings["STALE_AFTER_SECONDS"])
+    return _job_engine
+
+
+async def start_job_engine() -> None:
+    await get_job_engine().start()
+
+
+async def stop_job_engine() -> None:
+    if _job_engine is not None:
+        await _job_engine.stop()
+
+
+# --- Built-in job handlers ---
+@register_job_handler("demo")
+async def handle_demo_job(params, ctx: JobContext):
+    await ctx.report_progress(50, "Working")
+    await asyncio.sleep(1)
+    return {"task_type": "demo", "params": params, "output": "Completed demo"}
+
+
+@register_job_handler("config_backup")
+async def handle_config_backup_job(params, ctx: JobContext):
+    from vyos_core import backup_config
+    await ctx.report_progress(10, "Retrieving VyOS configuration")
+    return {"backup_content": await backup_config()}
+
+
+@register_job_handler("config_sync")
+async def handle_config_sync_job(params, ctx: JobContext):
+    from admin import sync_vyos_config
+    await ctx.report_progress(10, "Comparing VyOS NAT rules with the database")
+    async with ctx.session() as db:
+        return await sync_vyos_config(db)
+
+
+@register_job_handler("bulk_provision")
+async def handle_bulk_provision_job(params, ctx: JobContext):
+    from crud import bulk_provision_vms
+    from schemas import VMProvisionRequest
+    requests = [VMProvisionRequest(**vm) for vm in params.get("vms", [])]
+    await ctx.report_progress(10, f"Provisioning {len(requests)} VMs")
+    async with ctx.session() as db:
+        results = await bulk_provision_vms(db, requests, user_id=ctx.user_id)
+    successful = sum(1 for r in results if r["status"] == "success")
+    return {"results": results, "total_requested": len(results), "total_successful": successful,
+            "total_failed": len(results) - successful}
+
+
+@register_job_handler("dhcp_template_generate")
+async def handle_dhcp_template_generate_job(params, ctx: JobContext):
+    from models import User
+    from routers.dhcp_templates import generate_reservations_from_template
+    from schemas import DHCPReservationFromTemplate
+    request = DHCPReservationFromTemplate(**{k: v for k, v in params.items() if k != "reservation_id"})
+    await ctx.report_progress(10, f"Generating {request.count} reservations")
+    async with ctx.session() as db:
+        user = await db.get(User, ctx.user_id) if ctx.user_id else None
+        if user is None:
+            raise JobError(detail="Template generation jobs must be submitted by an authenticated user")
+        generated = await generate_reservations_from_template(params["reservation_id"], request, db, user)
+    return {"reservations": [r.dict() for r in generated]}
@@ -0,0 +1,578 @@
+# utils_journal_archive.py
+# Time-partitioned storage for the change journal.
+# `change_journal` is the hot table. On SQLite (and on an unpartitioned PostgreSQL table) the archiver
+# moves every month older than the hot window into its own table `change_journal_YYYYMM`. On PostgreSQL
+# a `change_journal` created with PARTITION BY RANGE (timestamp) (see POSTGRES_PARTITIONED_DDL) gets
+# native monthly partitions instead, created ahead of time. Months older than the archive horizon are
+# exported to gzip-compressed NDJSON files in the archive directory and their table or partition is
+# dropped.
+# Reads go through query_journal() / journal_activity(). They visit the sources newest first (hot table,
+# monthly tables, then archive files) and stop once the page is full. Sources outside the requested time
+# range are skipped, and archive files are only read when a since/until range reaches back into them.
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Column, DateTime, Index, Integer, JSON, MetaData, String, Table, Text, and_, func, inspect, or_, select, text, union_all, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import AsyncSessionLocal, get_journal_archive_config, get_journal_delta_config
+from models import ChangeJournal, ServiceLease
+from utils_journal_delta import DELTA, FULL, compact_journal, decode_archive_rows, decode_rows
+
+logger = logging.getLogger(__name__)
+
+HOT_TABLE = ChangeJournal.__tablename__
+_PARTITION_RE = re.compile(r"^change_journal_(\d{4})(\d{2})$")
+_ARCHIVE_RE = re.compile(r"^change_journal_(\d{4})(\d{2})\.ndjson\.gz$")
+ARCHIVER_LEASE = "journal_archiver"
+JOURNAL_COLUMNS = ("id", "timestamp", "user_id", "resource_type", "resource_id", "operation", "before", "after", "comment", "encoding")
+
+# For new PostgreSQL deployments that want native partitions; the archiver then only adds/drops partitions.
+POSTGRES_PARTITIONED_DDL = """
+CREATE TABLE change_journal (
+    id BIGSERIAL,
+    timestamp TIMESTAMP NOT NULL,
+    user_id INTEGER REFERENCES users(id),
+    resource_type VARCHAR NOT NULL,
+    resource_id VARCHAR NOT NULL,
+    operation VARCHAR NOT NULL,
+    before JSON,
+    after JSON,
+    comment TEXT,
+    encoding VARCHAR,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp)
+"""
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month: datetime, count: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{HOT_TABLE}_{month.year:04d}{month.month:02d}"
+
+
+def archive_path(archive_dir: str, month: datetime) -> str:
+    return os.path.join(archive_dir, f"{partition_name(month)}.ndjson.gz")
+
+
+_partition_tables: Dict[str, Table] = {}
+
+
+def partition_table(name: str) -> Table:
+    """Table object for a monthly journal table; same columns as change_journal, no foreign keys."""
+    table = _partition_tables.get(name)
+    if table is None:
+        table = Table(
+            name, MetaData(),
+            Column("id", Integer, primary_key=True),
+            Column("timestamp", DateTime, nullable=False),
+            Column("user_id", Integer, nullable=True),
+            Column("resource_type", String, nullable=False),
+            Column("resource_id", String, nullable=False),
+            Column("operation", String, nullable=False),
+            Column("before", JSON, nullable=True),
+            Column("after", JSON, nullable=True),
+            Column("comment", Text, nullable=True),
+            Column("encoding", String, nullable=True),
+        )
+        Index(f"ix_{name}_timestamp", table.c.timestamp)
+        Index(f"ix_{name}_resource_id_seq", table.c.resource_type, table.c.resource_id, table.c.id)
+        _partition_tables[name] = table
+    return table
+
+
+def _months_from_names(names, pattern) -> Dict[datetime, str]:
+    months = {}
+    for name in names:
+        match = pattern.match(name)
+        if match:
+            months[datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return months
+
+
+async def list_partitions(db: AsyncSession) -> Dict[datetime, str]:
+    """Monthly journal tables in the database (not native PostgreSQL partitions), by month."""
+    names = await db.run_sync(lambda session: inspect(session.connection()).get_table_names())
+    return _months_from_names(names, _PARTITION_RE)
+
+
+def list_archives(archive_dir: str) -> Dict[datetime, str]:
+    if not os.path.isdir(archive_dir):
+        return {}
+    return {month: os.path.join(archive_dir, name) for month, name in _months_from_names(os.listdir(archive_dir), _ARCHIVE_RE).items()}
+
+
+async def is_natively_partitioned(db: AsyncSession) -> bool:
+    if db.bind.dialect.name != "postgresql":
+        return False
+    return bool(await db.scalar(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :name"
+    ), {"name": HOT_TABLE}))
+
+
+def journal_row(row) -> Dict[str, Any]:
+    return {column: row.get(column) for column in JOURNAL_COLUMNS}
+
+
+def _to_journal(values: Dict[str, Any]) -> ChangeJournal:
+    # Transient instance, never added to a session; lets callers treat all sources alike.
+    return ChangeJournal(**values)
+
+
+# --- Reading across hot, monthly and archived data ---
+
+class JournalQuery:
+    """Filters shared by every source; `since` is inclusive, `until` exclusive."""
+
+    def __init__(self, resource_type: Optional[str] = None, resource_id: Optional[str] = None, user_id: Optional[int] = None,
+                 operation: Optional[str] = None, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 resource_types: Optional[Sequence[str]] = None):
+        self.resource_type = resource_type
+        self.resource_types = tuple(resource_types) if resource_types else None
+        self.resource_id = resource_id
+        self.user_id = user_id
+        self.operation = operation
+        self.since = since
+        self.until = until
+
+    def where(self, table) -> list:
+        c = table.c
+        conditions = []
+        if self.resource_type:
+            conditions.append(c.resource_type == self.resource_type)
+        if self.resource_types:
+            conditions.append(c.resource_type.in_(self.resource_types))
+        if self.resource_id:
+            conditions.append(c.resource_id == self.resource_id)
+        if self.user_id:
+            conditions.append(c.user_id == self.user_id)
+        if self.operation:
+            conditions.append(c.operation == self.operation)
+        if self.since is not None:
+            conditions.append(c.timestamp >= self.since)
+        if self.until is not None:
+            conditions.append(c.timestamp < self.until)
+        return conditions
+
+    def matches(self, values: Dict[str, Any]) -> bool:
+        return ((not self.resource_type or values["resource_type"] == self.resource_type)
+                and (not self.resource_types or values["resource_type"] in self.resource_types)
+                and (not self.resource_id or values["resource_id"] == self.resource_id)
+                and (not self.user_id or values["user_id"] == self.user_id)
+                and (not self.operation or values["operation"] == self.operation)
+                and (self.since is None or values["timestamp"] >= self.since)
+                and (self.until is None or values["timestamp"] < self.until))
+
+    def overlaps(self, month: datetime) -> bool:
+        return ((self.since is None or add_months(month, 1) > self.since)
+                and (self.until is None or month < self.until))
+
+    @property
+    def has_range(self) -> bool:
+        return self.since is not None or self.until is not None
+
+
+def _read_archive(path: str, query: JournalQuery) -> List[Dict[str, Any]]:
+    rows = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            values = json.loads(line)
+            values["timestamp"] = datetime.fromisoformat(values["timestamp"])
+            rows.append(values)
+    rows = [values for values in decode_archive_rows(rows) if query.matches(values)]
+    rows.sort(key=lambda v: (v["timestamp"], v["id"]), reverse=True)
+    return rows
+
+
+async def _sources(db: AsyncSession, query: JournalQuery, archive_dir: str) -> List[Tuple[str, Any]]:
+    """('table', Table) and ('archive', path) sources overlapping the query, newest first."""
+    sources: List[Tuple[str, Any]] = [("table", ChangeJournal.__table__)]
+    # Native partitions are already read through the partitioned parent table.
+    partitions = {} if await is_natively_partitioned(db) else await list_partitions(db)
+    for month in sorted(partitions, reverse=True):
+        if query.overlaps(month):
+            sources.append(("table", partition_table(partitions[month])))
+    if query.has_range:
+        archives = list_archives(archive_dir)
+        for month in sorted(archives, reverse=True):
+            if query.overlaps(month):
+                sources.append(("archive", archives[month]))
+    return sources
+
+
+async def query_journal(db: AsyncSession, query: JournalQuery, skip: int = 0, limit: int = 100,
+                        archive_dir: Optional[str] = None) -> List[ChangeJournal]:
+    """Journal entries matching `query`, newest first, across hot, monthly and archived storage.
+
+    Rows from the hot table are session-bound ChangeJournal objects; rows from monthly tables and
+    archives are transient ChangeJournal objects with the same attributes.
+    """
+    archive_dir = archive_dir or get_journal_archive_config()["ARCHIVE_DIR"]
+    sources = await _sources(db, query, archive_dir)
+    if len(sources) == 1:
+        stmt = select(ChangeJournal).where(*query.where(ChangeJournal.__table__))
+        stmt = stmt.order_by(ChangeJournal.timestamp.desc(), ChangeJournal.id.desc()).offset(skip).limit(limit)
+        return await _decoded(db, ChangeJournal.__table__, (await db.execute(stmt)).scalars().all())
+
+    results: List[ChangeJournal] = []
+    for kind, source in sources:
+        if len(results) >= limit:
+            break
+        if kind == "archive":
+            rows = await asyncio.to_thread(_read_archive, source, query)
+            if skip >= len(rows):
+                skip -= len(rows)
+                continue
+            results.extend(_to_journal(values) for values in rows[skip:skip + limit - len(results)])
+            skip = 0
+            continue
+        conditions = query.where(source)
+        if skip:
+            count = await db.scalar(select(func.count()).select_from(source).where(*conditions))
+            if skip >= count:
+                skip -= count
+                continue
+        stmt = select(source).where(*conditions).order_by(source.c.timestamp.desc(), source.c.id.desc())
+        stmt = stmt.offset(skip).limit(limit - len(results))
+        skip = 0
+        if source is ChangeJournal.__table__:
+            stmt = select(ChangeJournal).from_statement(stmt)
+            results.extend(await _decoded(db, source, (await db.execute(stmt)).scalars().all()))
+        else:
+            rows = await decode_rows(db, source, [journal_row(row._mapping) for row in await db.execute(stmt)])
+            results.extend(_to_journal(values) for values in rows)
+    return results
+
+
+async def iter_journal_rows(db: AsyncSession, query: JournalQuery, archive_dir: Optional[str] = None,
+                            chunk_size: int = 5000) -> AsyncIterator[Dict[str, Any]]:
+    """Matching entries as plain dicts with full documents, oldest first, read in keyset-paginated chunks."""
+    archive_dir = archive_dir or get_journal_archive_config()["ARCHIVE_DIR"]
+    for kind, source in reversed(await _sources(db, query, archive_dir)):
+        if kind == "archive":
+            for values in reversed(await asyncio.to_thread(_read_archive, source, query)):
+                yield values
+            continue
+        c = source.c
+        # Resource types are filtered here rather than in SQL: given an IN list, SQLite picks the resource
+        # index and sorts the whole time range instead of walking the timestamp index.
+        conditions = JournalQuery(**{**vars(query), "resource_types": None}).where(source)
+        last: Optional[Tuple[datetime, int]] = None
+        while True:
+            stmt = select(*[c[column] for column in JOURNAL_COLUMNS]).where(*conditions)
+            if last is not None:
+                stmt = stmt.where(or_(c.timestamp > last[0], and_(c.timestamp == last[0], c.id > last[1])))
+            stmt = stmt.order_by(c.timestamp, c.id).limit(chunk_size)
+            rows = await decode_rows(db, source, [journal_row(row._mapping) for row in await db.execute(stmt)])
+            for values in rows:
+                if not query.resource_types or values["resource_type"] in query.resource_types:
+                    yield values
+            if len(rows) < chunk_size:
+                break
+            last = (rows[-1]["timestamp"], rows[-1]["id"])
+
+
+async def find_journal_entry(db: AsyncSession, entry_id: int) -> Optional[ChangeJournal]:
+    """One entry by id from the hot or monthly tables (archived months are only reachable by time range)."""
+    for _, table in await _sources(db, JournalQuery(), ""):
+        stmt = select(table).where(table.c.id == entry_id)
+        if table is ChangeJournal.__table__:
+            found = await _decoded(db, table, (await db.execute(select(ChangeJournal).from_statement(stmt))).scalars().all())
+            if found:
+                return found[0]
+        else:
+            rows = [journal_row(row._mapping) for row in await db.execute(stmt)]
+            if rows:
+                return _to_journal((await decode_rows(db, table, rows))[0])
+    return None
+
+
+async def resource_state_at(db: AsyncSession, resource_type: str, resource_id: str,
+                            at: Optional[datetime] = None, archive_dir: Optional[str] = None) -> Optional[ChangeJournal]:
+    """The last journal entry of a resource at or before `at` (default: now), with full documents.
+
+    Its `after` is the materialized state of the resource at that time (None once deleted).
+    """
+    query = JournalQuery(resource_type=resource_type, resource_id=resource_id,
+                         until=at + timedelta(microseconds=1) if at is not None else None)
+    entries = await query_journal(db, query, limit=1, archive_dir=archive_dir)
+    return entries[0] if entries else None
+
+
+async def _decoded(db: AsyncSession, table, entries: List[ChangeJournal]) -> List[ChangeJournal]:
+    """Hot-table entries with delta payloads swapped for transient copies holding the full documents."""
+    if all(entry.encoding != DELTA for entry in entries):
+        return list(entries)
+    rows = await decode_rows(db, table, [{column: getattr(entry, column) for column in JOURNAL_COLUMNS} for entry in entries])
+    return [_to_journal(values) if entry.encoding == DELTA else entry for entry, values in zip(entries, rows)]
+
+
+async def journal_activity(db: AsyncSession, since: datetime, until: Optional[datetime] = None,
+                           archive_dir: Optional[str] = None) -> Dict[str, int]:
+    """Number of journal entries per day (ISO date) in [since, until), aggregated in the database."""
+    archive_dir = archive_dir or get_journal_archive_config()["ARCHIVE_DIR"]
+    query = JournalQuery(since=since, until=until)
+    per_day: Dict[str, int] = {}
+    sources = await _sources(db, query, archive_dir)
+    tables = [source for kind, source in sources if kind == "table"]
+    day_queries = [select(func.date(t.c.timestamp).label("day"), func.count().label("n")).where(*query.where(t))
+                   .group_by(func.date(t.c.timestamp)) for t in tables]
+    for day, count in (await db.execute(union_all(*day_queries) if len(day_queries) > 1 else day_queries[0])).all():
+        day = day if isinstance(day, str) else day.isoformat()
+        per_day[day] = per_day.get(day, 0) + count
+    for kind, path in sources:
+        if kind == "archive":
+            for values in await asyncio.to_thread(_read_archive, path, query):
+                day = values["timestamp"].date().isoformat()
+                per_day[day] = per_day.get(day, 0) + 1
+    return dict(sorted(per_day.items()))
+
+
+# --- Rotation and archiving ---
+
+class JournalArchiver:
+    """Background task that moves old journal months out of the hot table and archives the oldest ones."""
+
+    def __init__(self, session_factory=AsyncSessionLocal, hot_months: int = 2, archive_after_months: int = 12,
+                 archive_dir: str = "./journal_archive", interval_seconds: float = 3600.0, lease_seconds: float = 3600.0):
+        self.session_factory = session_factory
+        self.hot_months = max(1, hot_months)
+        self.archive_after_months = max(self.hot_months, archive_after_months)
+        self.archive_dir = archive_dir
+        self.interval = interval_seconds
+        self.lease = timedelta(seconds=lease_seconds)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+        # Metrics
+        self.passes = 0
+        self.passes_skipped = 0
+        self.rows_moved = 0
+        self.rows_compacted = 0
+        self.months_archived = 0
+        self.last_report: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+
+    async def run_once(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        current = month_start(now or datetime.utcnow())
+        hot_start = add_months(current, -(self.hot_months - 1))
+        archive_before = add_months(current, -(self.archive_after_months - 1))
+        report: Dict[str, Any] = {"partitioned": [], "archived": [], "native": False, "compacted": None}
+        # Every worker runs the archiver; only the lease holder may split or archive months.
+        if not await self._acquire_lease():
+            self.passes_skipped += 1
+            report["skipped"] = True
+            return report
+        try:
+            await self._run_pass(report, current, hot_start, archive_before)
+        finally:
+            await self._release_lease()
+        self.passes += 1
+        self.last_report = report
+        return report
+
+    async def _run_pass(self, report: Dict[str, Any], current: datetime, hot_start: datetime, archive_before: datetime) -> None:
+        async with self.session_factory() as db:
+            delta_settings = get_journal_delta_config()
+            if delta_settings["ENABLED"]:
+                report["compacted"] = await compact_journal(
+                    db, datetime.utcnow() - timedelta(seconds=delta_settings["SETTLE_SECONDS"]),
+                    checkpoint_interval=delta_settings["CHECKPOINT_INTERVAL"], batch_size=delta_settings["BATCH_SIZE"])
+                self.rows_compacted += report["compacted"]["rows"]
+            native = report["native"] = await is_natively_partitioned(db)
+            if native:
+                await self._ensure_native_partitions(db, current)
+                partitions = await self._native_partitions(db)
+            else:
+                for month in await self._hot_months_before(db, hot_start):
+                    moved = await self._split_month(db, month)
+                    if moved:
+                        report["partitioned"].append(partition_name(month))
+                partitions = await list_partitions(db)
+        for month in sorted(partitions):
+            if month < archive_before:
+                await self._archive(month, partitions[month], native)
+                report["archived"].append(partitions[month])
+
+    async def _acquire_lease(self) -> bool:
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            if await db.get(ServiceLease, ARCHIVER_LEASE) is None:
+                db.add(ServiceLease(name=ARCHIVER_LEASE))
+                try:
+                    await db.commit()
+                except IntegrityError:
+                    await db.rollback()  # Another worker created the row first
+            result = await db.execute(
+                update(ServiceLease).where(
+                    ServiceLease.name == ARCHIVER_LEASE,
+                    or_(ServiceLease.holder.is_(None), ServiceLease.holder == self.worker_id, ServiceLease.expires_at < now),
+                ).values(holder=self.worker_id, expires_at=now + self.lease)
+            )
+            await db.commit()
+            return result.rowcount == 1
+
+    async def _release_lease(self) -> None:
+        async with self.session_factory() as db:
+            await db.execute(
+                update(ServiceLease).where(ServiceLease.name == ARCHIVER_LEASE, ServiceLease.holder == self.worker_id)
+                .values(holder=None, expires_at=None)
+            )
+            await db.commit()
+
+    async def _hot_months_before(self, db: AsyncSession, hot_start: datetime) -> List[datetime]:
+        oldest = await db.scalar(select(func.min(ChangeJournal.timestamp)).where(ChangeJournal.timestamp < hot_start))
+        months = []
+        month = month_start(oldest) if oldest else hot_start
+        while month < hot_start:
+            months.append(month)
+            month = add_months(month, 1)
+        return months
+
+    async def _split_month(self, db: AsyncSession, month: datetime) -> int:
+        """Move one month of rows from the hot table into its monthly table, in one transaction."""
+        hot = ChangeJournal.__table__
+        table = partition_table(partition_name(month))
+        await db.run_sync(lambda session: table.create(session.connection(), checkfirst=True))
+        columns = [hot.c[name] for name in JOURNAL_COLUMNS]
+        # The newest row always stays hot so SQLite, which reuses max(id) + 1, never hands out an archived id again.
+        newest_id = await db.scalar(select(func.max(hot.c.id)))
+        in_month = [hot.c.timestamp >= month, hot.c.timestamp < add_months(month, 1), hot.c.id < newest_id]
+        await self._detach_from_chain(db, newest_id)
+        moved = (await db.execute(table.insert().from_select(list(JOURNAL_COLUMNS), select(*columns).where(*in_month)))).rowcount
+        await db.execute(hot.delete().where(*in_month))
+        await db.commit()
+        self.rows_moved += max(moved or 0, 0)
+        if moved:
+            logger.info(f"Moved {moved} change journal rows into {table.name}.")
+        return moved or 0
+
+    async def _detach_from_chain(self, db: AsyncSession, entry_id: Optional[int]) -> None:
+        """Store a delta row that stays behind in the hot table in full, since its chain is moving away."""
+        entry = await db.get(ChangeJournal, entry_id) if entry_id is not None else None
+        if entry is not None and entry.encoding == DELTA:
+            decoded = (await decode_rows(db, ChangeJournal.__table__, [{column: getattr(entry, column) for column in JOURNAL_COLUMNS}]))[0]
+            entry.before, entry.after, entry.encoding = decoded["before"], decoded["after"], FULL
+            await db.flush()
+
+    async def _ensure_native_partitions(self, db: AsyncSession, current: datetime) -> None:
+        for offset in (0, 1):  # This month and the next, so inserts never lack a partition
+            month = add_months(current, offset)
+            await db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {HOT_TABLE} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+        await db.commit()
+
+    async def _native_partitions(self, db: AsyncSession) -> Dict[datetime, str]:
+        names = (await db.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :name"
+        ), {"name": HOT_TABLE})).scalars().all()
+        return _months_from_names(names, _PARTITION_RE)
+
+    async def _archive(self, month: datetime, name: str, native: bool) -> None:
+        """Export one month to gzip NDJSON (written to a temp file, then renamed), then drop its table."""
+        table = partition_table(name)
+        async with self.session_factory() as db:
+            if native:
+                await db.execute(text(f"ALTER TABLE {HOT_TABLE} DETACH PARTITION {name}"))
+                await db.commit()
+            rows = [journal_row(row._mapping) for row in await db.execute(select(table).order_by(table.c.id))]
+        path = archive_path(self.archive_dir, month)
+        await asyncio.to_thread(self._write_archive, path, rows)
+        async with self.session_factory() as db:
+            await db.run_sync(lambda session: table.drop(session.connection(), checkfirst=True))
+            await db.commit()
+        self.months_archived += 1
+        logger.info(f"Archived {len(rows)} change journal rows of {name} to {path}.")
+
+    def _write_archive(self, path: str, rows: List[Dict[str, Any]]) -> None:
+        os.makedirs(self.archive_dir, exist_ok=True)
+        existing = []
+        if os.path.exists(path):  # A month archived before (e.g. late rows): merge rather than overwrite
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                existing = [line for line in f if line.strip()]
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            f.writelines(existing)
+            for values in rows:
+                f.write(json.dumps({**values, "timestamp": values["timestamp"].isoformat()}, default=str) + "\n")
+        os.replace(tmp_path, path)
+
+    # --- Background loop ---
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Change journal archiver error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "hot_months": self.hot_months,
+            "archive_after_months": self.archive_after_months,
+            "archive_dir": self.archive_dir,
+            "archives": sorted(os.path.basename(p) for p in list_archives(self.archive_dir).values()),
+            "passes": self.passes,
+            "passes_skipped": self.passes_skipped,
+            "rows_moved": self.rows_moved,
+            "rows_compacted": self.rows_compacted,
+            "months_archived": self.months_archived,
+            "last_report": self.last_report,
+            "last_error": self.last_error,
+        }
+
+
+_journal_archiver: Optional[JournalArchiver] = None
+
+
+def get_journal_archiver() -> JournalArchiver:
+    global _journal_archiver
+    if _journal_archiver is None:
+        settings = get_journal_archive_config()
+        _journal_archiver = JournalArchiver(hot_months=settings["HOT_MONTHS"], archive_after_months=settings["ARCHIVE_AFTER_MONTHS"],
+                                            archive_dir=settings["ARCHIVE_DIR"], interval_seconds=settings["INTERVAL_SECONDS"],
+                                            lease_seconds=settings["LEASE_SECONDS"])
+    return _journal_archiver
+
+
+async def start_journal_archiver() -> None:
+    if get_journal_archive_config()["ENABLED"]:
+        await get_journal_archiver().start()
+
+
+async def stop_journal_archiver() -> None:
+    if _journal_archiver is not None:
+        await _journal_archiver.stop()
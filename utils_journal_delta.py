@@ -0,0 +1,230 @@
+# utils_journal_delta.py
+# Delta encoding for change journal payloads.
+# The compaction pass (run by the journal archiver) rewrites settled journal rows of each resource into
+# chains: a "checkpoint" row keeps its full before/after documents, and the following "delta" rows store
+# them as JSON Patch (RFC 6902) operations. `before` is a patch against the previous row's `after`, and
+# `after` is a patch against the row's own `before` (or against the previous `after` when `before` is
+# empty). A new checkpoint starts every `checkpoint_interval` rows and at every month boundary, so a chain
+# never spans two journal partitions or archive files. A row is only stored as a delta when its patches
+# are smaller than its full documents.
+# `encoding` column: NULL = not compacted yet, "full" = left as is (arrived after later rows of the same
+# resource had been compacted), "checkpoint" / "delta" = chain rows. Readers go through decode_rows() /
+# decode_archive_rows(), which return full documents.
+
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ChangeJournal
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT = "checkpoint"
+DELTA = "delta"
+FULL = "full"
+CHAIN_ENCODINGS = (CHECKPOINT, DELTA)
+
+
+# --- JSON Patch ---
+
+def _escape(token: str) -> str:
+    return token.replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def make_patch(source: Any, target: Any, path: str = "") -> List[Dict[str, Any]]:
+    """JSON Patch operations turning `source` into `target`; objects are diffed key by key, lists and scalars replaced."""
+    if source == target and type(source) is type(target):
+        return []
+    if not (isinstance(source, dict) and isinstance(target, dict)):
+        return [{"op": "replace", "path": path, "value": target}]
+    ops: List[Dict[str, Any]] = []
+    for key in source:
+        if key not in target:
+            ops.append({"op": "remove", "path": f"{path}/{_escape(str(key))}"})
+    for key, value in target.items():
+        child = f"{path}/{_escape(str(key))}"
+        if key not in source:
+            ops.append({"op": "add", "path": child, "value": value})
+        else:
+            ops.extend(make_patch(source[key], value, child))
+    return ops
+
+
+def apply_patch(document: Any, ops: List[Dict[str, Any]]) -> Any:
+    """Apply operations produced by make_patch() to a copy of `document`."""
+    document = json.loads(json.dumps(document))
+    for op in ops:
+        if op["path"] == "":
+            document = op.get("value")
+            continue
+        *parents, last = [_unescape(token) for token in op["path"][1:].split("/")]
+        container = document
+        for token in parents:
+            container = container[int(token)] if isinstance(container, list) else container[token]
+        if isinstance(container, list):
+            last = int(last)
+        if op["op"] == "remove":
+            del container[last]
+        else:
+            container[last] = op["value"]
+    return document
+
+
+def _size(value: Any) -> int:
+    return len(json.dumps(value, default=str, separators=(",", ":")))
+
+
+def encode_payload(previous_after: Any, before: Any, after: Any) -> Optional[Tuple[list, list]]:
+    """(before_patch, after_patch) if they are smaller than the full documents, else None."""
+    before_patch = make_patch(previous_after, before)
+    after_patch = make_patch(before if before is not None else previous_after, after)
+    if _size(before_patch) + _size(after_patch) < _size(before) + _size(after):
+        return before_patch, after_patch
+    return None
+
+
+def decode_payload(previous_after: Any, before_patch: list, after_patch: list) -> Tuple[Any, Any]:
+    before = apply_patch(previous_after, before_patch or [])
+    after = apply_patch(before if before is not None else previous_after, after_patch or [])
+    return before, after
+
+
+def _month(value: datetime) -> Tuple[int, int]:
+    return value.year, value.month
+
+
+# --- Reading ---
+
+def decode_chain(rows: Iterable[Dict[str, Any]]) -> Dict[int, Tuple[Any, Any]]:
+    """Full (before, after) by id for the chain rows of one resource, given in id order from a checkpoint."""
+    decoded: Dict[int, Tuple[Any, Any]] = {}
+    previous_after = None
+    for row in rows:
+        if row["encoding"] == DELTA:
+            before, after = decode_payload(previous_after, row["before"], row["after"])
+        else:
+            before, after = row["before"], row["after"]
+        decoded[row["id"]] = (before, after)
+        previous_after = after
+    return decoded
+
+
+async def decode_rows(db: AsyncSession, table, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Replace delta payloads in `rows` (dicts read from `table`) with full documents.
+
+    Loads each affected resource's chain once: from the checkpoint before its oldest delta row up to its
+    newest one.
+    """
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    for row in rows:
+        if row.get("encoding") == DELTA:
+            groups.setdefault((row["resource_type"], row["resource_id"]), []).append(row["id"])
+    if not groups:
+        return rows
+    c = table.c
+    decoded: Dict[int, Tuple[Any, Any]] = {}
+    for (resource_type, resource_id), ids in groups.items():
+        same_resource = [c.resource_type == resource_type, c.resource_id == resource_id]
+        checkpoint_id = await db.scalar(select(func.max(c.id)).where(*same_resource, c.encoding == CHECKPOINT, c.id <= min(ids)))
+        chain = await db.execute(
+            select(c.id, c.encoding, c.before, c.after)
+            .where(*same_resource, c.encoding.in_(CHAIN_ENCODINGS), c.id >= (checkpoint_id or 0), c.id <= max(ids))
+            .order_by(c.id)
+        )
+        decoded.update(decode_chain(row._mapping for row in chain))
+    return [
+        {**row, "before": decoded[row["id"]][0], "after": decoded[row["id"]][1], "encoding": None}
+        if row.get("encoding") == DELTA else row
+        for row in rows
+    ]
+
+
+def decode_archive_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Decode a whole archived month in memory (chains never leave their month)."""
+    chains: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for row in sorted(rows, key=lambda r: r["id"]):
+        if row.get("encoding") in CHAIN_ENCODINGS:
+            chains.setdefault((row["resource_type"], row["resource_id"]), []).append(row)
+    decoded: Dict[int, Tuple[Any, Any]] = {}
+    for chain in chains.values():
+        decoded.update(decode_chain(chain))
+    for row in rows:
+        if row.get("encoding") == DELTA:
+            row["before"], row["after"] = decoded[row["id"]]
+            row["encoding"] = None
+    return rows
+
+
+# --- Compaction ---
+
+async def compact_journal(db: AsyncSession, settled_before: datetime, checkpoint_interval: int = 16,
+                          batch_size: int = 5000) -> Dict[str, int]:
+    """Delta-encode up to `batch_size` not yet compacted hot journal rows older than `settled_before`."""
+    hot = ChangeJournal.__table__
+    c = hot.c
+    pending = (await db.execute(
+        select(c.id, c.timestamp, c.resource_type, c.resource_id, c.encoding, c.before, c.after)
+        .where(c.encoding.is_(None), c.timestamp < settled_before)
+        .order_by(c.id).limit(batch_size)
+    )).all()
+    report = {"rows": len(pending), "deltas": 0, "checkpoints": 0, "bytes_before": 0, "bytes_after": 0}
+    marked: List[Dict[str, Any]] = []  # Rows whose payload stays as is
+    encoded_rows: List[Dict[str, Any]] = []
+    by_resource: Dict[Tuple[str, str], List[Any]] = {}
+    for row in pending:
+        by_resource.setdefault((row.resource_type, row.resource_id), []).append(row)
+
+    for (resource_type, resource_id), resource_rows in by_resource.items():
+        same_resource = [c.resource_type == resource_type, c.resource_id == resource_id]
+        last = (await db.execute(
+            select(c.id, c.timestamp).where(*same_resource, c.encoding.in_(CHAIN_ENCODINGS))
+            .order_by(c.id.desc()).limit(1)
+        )).first()
+        previous_after, previous_month, since_checkpoint, last_id = None, None, 0, 0
+        if last is not None:
+            last_id = last.id
+            checkpoint_id = await db.scalar(select(func.max(c.id)).where(*same_resource, c.encoding == CHECKPOINT, c.id <= last.id))
+            chain = [r._mapping for r in await db.execute(
+                select(c.id, c.encoding, c.before, c.after)
+                .where(*same_resource, c.encoding.in_(CHAIN_ENCODINGS), c.id >= checkpoint_id, c.id <= last.id)
+                .order_by(c.id)
+            )]
+            previous_after = decode_chain(chain)[last.id][1]
+            previous_month, since_checkpoint = _month(last.timestamp), len(chain)
+
+        for row in resource_rows:
+            size = _size(row.before) + _size(row.after)
+            report["bytes_before"] += size
+            if row.id < last_id:  # Arrived after newer rows of this resource were chained; leave it whole
+                marked.append({"row_id": row.id, "encoding": FULL})
+            else:
+                encoded = None
+                if previous_month == _month(row.timestamp) and since_checkpoint < checkpoint_interval:
+                    encoded = encode_payload(previous_after, row.before, row.after)
+                if encoded is None:
+                    marked.append({"row_id": row.id, "encoding": CHECKPOINT})
+                    report["checkpoints"] += 1
+                    since_checkpoint = 0
+                else:
+                    encoded_rows.append({"row_id": row.id, "encoding": DELTA, "before": encoded[0], "after": encoded[1]})
+                    report["deltas"] += 1
+                    size = _size(encoded[0]) + _size(encoded[1])
+                previous_after, previous_month = row.after, _month(row.timestamp)
+                since_checkpoint += 1
+            report["bytes_after"] += size
+    for params in (marked, encoded_rows):
+        if params:
+            await db.execute(update(hot).where(c.id == bindparam("row_id")), params)
+    await db.commit()
+    if report["deltas"]:
+        logger.info(f"Delta-encoded {report['deltas']} change journal rows "
+                    f"({report['bytes_before']} -> {report['bytes_after']} payload bytes).")
+    return report
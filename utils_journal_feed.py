@@ -0,0 +1,163 @@
+# utils_journal_feed.py
+# Change-data-capture feed over the change journal.
+# Consumers pass the cursor from the previous page (the last journal id they have seen) and get the entries
+# after it in id order. Reads are keyset reads on the primary key, so they cost the same at any depth. An
+# id is only handed out once every lower id has committed: a gap in the ids means an insert is still in
+# flight, and the feed waits for it for up to `visibility_lag_ms` (after that it is treated as a rolled-back id).
+# That way a consumer never skips a row that commits late. Long-polls and SSE streams wait on an
+# in-process signal from the journal write paths, and also re-check every `poll_interval` seconds for
+# entries written by other workers.
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import get_change_feed_config
+from models import ChangeJournal
+from utils_journal_archive import JOURNAL_COLUMNS, journal_row, list_partitions, partition_table
+from utils_journal_delta import decode_rows
+
+logger = logging.getLogger(__name__)
+
+_FEED_FIELDS = tuple(column for column in JOURNAL_COLUMNS if column != "encoding")
+
+
+class ChangeFeed:
+    """Cursor reads over the journal, plus the wake-up signal for waiting consumers."""
+
+    def __init__(self, poll_interval: float = 1.0, visibility_lag_ms: float = 2000.0, max_batch: int = 1000):
+        self.poll_interval = poll_interval
+        self.visibility_lag = timedelta(milliseconds=visibility_lag_ms)
+        self.max_batch = max_batch
+        self._signal: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = None
+        # Metrics
+        self.reads_total = 0
+        self.entries_delivered = 0
+        self.held_back_reads = 0
+        self.waiting = 0
+
+    # --- Wake-ups ---
+    def _event(self) -> asyncio.Event:
+        loop = asyncio.get_running_loop()
+        if self._signal is None or self._signal[0] is not loop:
+            self._signal = (loop, asyncio.Event())
+        return self._signal[1]
+
+    def notify(self) -> None:
+        """Wake every waiting consumer in this process; call after journal entries commit."""
+        try:
+            event = self._event()
+        except RuntimeError:  # No running loop, nobody can be waiting
+            return
+        event.set()
+        self._signal = (self._signal[0], asyncio.Event())
+
+    async def on_batch(self, records) -> None:
+        """Journal writer consumer: a batch has committed."""
+        self.notify()
+
+    # --- Reading ---
+    async def _safe_max(self, db: AsyncSession, after: int, scan: int) -> Tuple[int, bool]:
+        """Highest id up to which every id after `after` has committed (or is an old gap), and whether more follow."""
+        rows = (await db.execute(
+            select(ChangeJournal.id, ChangeJournal.timestamp).where(ChangeJournal.id > after).order_by(ChangeJournal.id).limit(scan)
+        )).all()
+        settled_before = datetime.utcnow() - self.visibility_lag
+        safe, expected = after, after + 1
+        for entry_id, timestamp in rows:
+            if entry_id != expected and timestamp > settled_before:
+                self.held_back_reads += 1
+                return safe, False
+            safe, expected = entry_id, entry_id + 1
+        return safe, len(rows) == scan
+
+    async def _tables(self, db: AsyncSession, after: int) -> list:
+        """Monthly journal tables still holding ids after the cursor (oldest first), then the hot table."""
+        hot = ChangeJournal.__table__
+        tables = []
+        min_hot = await db.scalar(select(func.min(hot.c.id)))
+        if min_hot is None or after + 1 < min_hot:
+            partitions = await list_partitions(db)
+            for month in sorted(partitions):
+                table = partition_table(partitions[month])
+                if ((await db.scalar(select(func.max(table.c.id)))) or 0) > after:
+                    tables.append(table)
+        tables.append(hot)
+        return tables
+
+    async def read_once(self, db: AsyncSession, after: int = 0, limit: int = 100,
+                        resource_type: Optional[str] = None) -> Tuple[List[Dict[str, Any]], int, bool]:
+        """(entries, next_cursor, has_more) for entries after cursor `after`, without waiting."""
+        limit = max(1, min(limit, self.max_batch))
+        entries: List[Dict[str, Any]] = []
+        cursor, has_more = after, False
+        for table in await self._tables(db, after):
+            c = table.c
+            stmt = select(*[c[column] for column in JOURNAL_COLUMNS]).where(c.id > cursor)
+            if table is ChangeJournal.__table__:
+                # Scan a wider window than the page so sparse resource_type filters still make progress.
+                safe_max, has_more = await self._safe_max(db, cursor, max(limit, 1000))
+                stmt = stmt.where(c.id <= safe_max)
+            else:
+                safe_max = await db.scalar(select(func.max(c.id)))
+            if resource_type:
+                stmt = stmt.where(c.resource_type == resource_type)
+            rows = [journal_row(row._mapping) for row in await db.execute(stmt.order_by(c.id).limit(limit - len(entries)))]
+            entries.extend(await decode_rows(db, table, rows))
+            if len(entries) >= limit:
+                return self._page(entries, entries[-1]["id"], True)
+            cursor = max(cursor, safe_max or cursor)  # Everything up to here has been read
+        return self._page(entries, cursor, has_more)
+
+    def _page(self, entries: List[Dict[str, Any]], cursor: int, has_more: bool) -> Tuple[List[Dict[str, Any]], int, bool]:
+        self.reads_total += 1
+        self.entries_delivered += len(entries)
+        return [{field: entry[field] for field in _FEED_FIELDS} for entry in entries], cursor, has_more
+
+    async def read(self, db: AsyncSession, after: int = 0, limit: int = 100, resource_type: Optional[str] = None,
+                   wait: float = 0.0) -> Tuple[List[Dict[str, Any]], int, bool]:
+        """Like read_once(), but when nothing is available wait up to `wait` seconds for new entries (long-poll)."""
+        deadline = asyncio.get_running_loop().time() + max(0.0, wait)
+        while True:
+            entries, cursor, has_more = await self.read_once(db, after, limit, resource_type)
+            remaining = deadline - asyncio.get_running_loop().time()
+            if entries or remaining <= 0:
+                return entries, cursor, has_more
+            after = cursor
+            # End the read transaction so the next read sees newly committed rows and the connection is released.
+            await db.rollback()
+            event = self._event()
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(event.wait(), timeout=min(self.poll_interval, remaining))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.waiting -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "poll_interval": self.poll_interval,
+            "visibility_lag_ms": self.visibility_lag.total_seconds() * 1000.0,
+            "max_batch": self.max_batch,
+            "reads_total": self.reads_total,
+            "entries_delivered": self.entries_delivered,
+            "held_back_reads": self.held_back_reads,
+            "waiting": self.waiting,
+        }
+
+
+_change_feed: Optional[ChangeFeed] = None
+
+
+def get_change_feed() -> ChangeFeed:
+    global _change_feed
+    if _change_feed is None:
+        settings = get_change_feed_config()
+        _change_feed = ChangeFeed(poll_interval=settings["POLL_INTERVAL"], visibility_lag_ms=settings["VISIBILITY_LAG_MS"],
+                                  max_batch=settings["MAX_BATCH"])
+    return _change_feed
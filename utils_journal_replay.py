@@ -0,0 +1,285 @@
+# utils_journal_replay.py
+# Journal replay: point-in-time state of VMs, firewall policies/rules and static routes.
+# A MaterializedView folds journal events in (timestamp, id) order: a create sets the resource's state, an
+# update merges the event's `after` into it, and a delete removes it. Deleting a policy also removes its rules.
+# The replay engine saves a JournalSnapshot of the view every `snapshot_every` events, once those events
+# have settled. A point-in-time query loads the newest snapshot before T and folds only the remaining
+# events, so the cost depends on the snapshot interval and not on the journal's length.
+# rollback_commands() diffs two views and returns the VyOS commands that turn one configuration into the other.
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import AsyncSessionLocal, get_journal_replay_config
+from models import ChangeJournal, JournalSnapshot
+from schemas import StaticRouteCreate
+from utils_journal_archive import JournalQuery, iter_journal_rows
+from vyos_compiler import compile_against_router
+from vyos_core import generate_firewall_policy_commands, generate_firewall_rule_commands, generate_static_route_vyos_commands
+
+logger = logging.getLogger(__name__)
+
+TRACKED_RESOURCES = ("vm", "firewall_policy", "firewall_rule", "static_route")
+_TICK = timedelta(microseconds=1)
+
+
+class MaterializedView:
+    """State of every tracked resource after folding a prefix of the journal."""
+
+    def __init__(self, resources: Optional[Dict[str, Dict[str, Dict[str, Any]]]] = None, event_count: int = 0,
+                 last_journal_id: Optional[int] = None, as_of: Optional[datetime] = None):
+        resources = resources or {}
+        self.resources: Dict[str, Dict[str, Dict[str, Any]]] = {kind: dict(resources.get(kind) or {}) for kind in TRACKED_RESOURCES}
+        self.event_count = event_count
+        self.last_journal_id = last_journal_id
+        self.as_of = as_of
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Optional[JournalSnapshot]) -> "MaterializedView":
+        if snapshot is None:
+            return cls()
+        return cls(snapshot.state, snapshot.event_count, snapshot.last_journal_id, snapshot.taken_at)
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        # Resource states are replaced, never modified in place, so snapshots may share them.
+        collection = self.resources.get(event["resource_type"])
+        if collection is None:
+            return
+        key, after = str(event["resource_id"]), event["after"]
+        if event["operation"] == "delete" or (after is None and event["operation"] != "update"):
+            collection.pop(key, None)
+            if event["resource_type"] == "firewall_policy":
+                rules = self.resources["firewall_rule"]
+                for rule_id in [k for k, rule in rules.items() if str(rule.get("policy_id")) == key]:
+                    del rules[rule_id]
+        elif event["operation"] == "create":
+            collection[key] = dict(after or {})
+        else:  # Updates may carry only the changed fields
+            collection[key] = {**(collection.get(key) or event["before"] or {}), **(after or {})}
+        self.event_count += 1
+        self.last_journal_id = event["id"]
+        self.as_of = event["timestamp"]
+
+    def policy_rules(self, policy_id: str) -> Dict[int, Dict[str, Any]]:
+        return {int(rule["rule_number"]): rule for rule in self.resources["firewall_rule"].values()
+                if str(rule.get("policy_id")) == policy_id and rule.get("rule_number") is not None}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"as_of": self.as_of, "event_count": self.event_count, "last_journal_id": self.last_journal_id,
+                **{kind: self.resources[kind] for kind in TRACKED_RESOURCES}}
+
+
+# --- Rollback commands ---
+
+_RULE_META = ("policy_id", "policy_name")
+
+
+def _firewall_config(view: MaterializedView) -> Dict[str, Tuple[Dict[str, Any], Dict[int, Dict[str, Any]]]]:
+    """Policies by name as (policy fields, rules by number), with bookkeeping fields dropped."""
+    policies = {}
+    for policy_id, policy in view.resources["firewall_policy"].items():
+        if not policy.get("name"):
+            continue
+        fields = {"description": policy.get("description"), "default_action": policy.get("default_action")}
+        rules = {number: {k: v for k, v in rule.items() if k not in _RULE_META}
+                 for number, rule in view.policy_rules(policy_id).items()}
+        policies[policy["name"]] = (fields, rules)
+    return policies
+
+
+def _route_config(view: MaterializedView) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    return {(route["destination"], route["next_hop"]): {"description": route.get("description"), "distance": route.get("distance")}
+            for route in view.resources["static_route"].values() if route.get("destination") and route.get("next_hop")}
+
+
+async def rollback_commands(target: MaterializedView, current: MaterializedView, against_router: bool = False) -> List[str]:
+    """VyOS commands that take the firewall and static route config of `current` back to `target`.
+
+    VMs are part of the views but have no router config of their own here. With `against_router`, the
+    commands are compiled against the mirrored router state so only the differing leaves are sent.
+    """
+    deletes: List[str] = []
+    sets: List[str] = []
+    scopes: List[Tuple[str, ...]] = []
+
+    target_policies, current_policies = _firewall_config(target), _firewall_config(current)
+    for name in sorted(current_policies.keys() - target_policies.keys()):
+        deletes.extend(generate_firewall_policy_commands(name, None, None, action="delete"))
+    for name, (fields, rules) in sorted(target_policies.items()):
+        if current_policies.get(name) == (fields, rules):
+            continue
+        if name in current_policies:  # Recreate whole, like a policy rename does
+            deletes.extend(generate_firewall_policy_commands(name, None, None, action="delete"))
+        sets.extend(generate_firewall_policy_commands(name, fields["default_action"], fields["description"]))
+        for number, rule in sorted(rules.items()):
+            sets.extend(generate_firewall_rule_commands(name, number, rule))
+        scopes.append(("firewall", "name", name))
+
+    target_routes, current_routes = _route_config(target), _route_config(current)
+    for destination, next_hop in sorted(current_routes.keys() - target_routes.keys()):
+        deletes.extend(await generate_static_route_vyos_commands(
+            StaticRouteCreate(destination=destination, next_hop=next_hop), "delete"))
+    for (destination, next_hop), fields in sorted(target_routes.items()):
+        if current_routes.get((destination, next_hop)) == fields:
+            continue
+        route = StaticRouteCreate(destination=destination, next_hop=next_hop, **fields)
+        if (destination, next_hop) in current_routes:
+            deletes.extend(await generate_static_route_vyos_commands(route, "delete"))
+        sets.extend(await generate_static_route_vyos_commands(route, "set"))
+        scopes.append(("protocols", "static", "route", destination, "next-hop", next_hop))
+
+    commands = deletes + sets
+    if against_router and commands:
+        return await compile_against_router(commands, scopes)
+    return commands
+
+
+# --- Replay engine ---
+
+class JournalReplayEngine:
+    """Answers point-in-time queries from snapshots and keeps new snapshots coming in the background."""
+
+    def __init__(self, session_factory=AsyncSessionLocal, snapshot_every: int = 10000, settle_seconds: float = 300.0,
+                 interval_seconds: float = 300.0):
+        self.session_factory = session_factory
+        self.snapshot_every = max(1, snapshot_every)
+        self.settle = timedelta(seconds=settle_seconds)
+        self.interval = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._table_ready = False
+        # Metrics
+        self.snapshots_written = 0
+        self.queries_total = 0
+        self.events_replayed = 0
+        self.last_query_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    async def _ensure_table(self, db: AsyncSession) -> None:
+        if not self._table_ready:
+            await db.run_sync(lambda session: JournalSnapshot.__table__.create(session.connection(), checkfirst=True))
+            self._table_ready = True
+
+    async def _latest_snapshot(self, db: AsyncSession, at: Optional[datetime] = None) -> Optional[JournalSnapshot]:
+        stmt = select(JournalSnapshot)
+        if at is not None:
+            stmt = stmt.where(JournalSnapshot.taken_at <= at)
+        stmt = stmt.order_by(JournalSnapshot.taken_at.desc(), JournalSnapshot.id.desc()).limit(1)
+        return (await db.execute(stmt)).scalars().first()
+
+    async def state_at(self, db: AsyncSession, at: Optional[datetime] = None) -> MaterializedView:
+        """The view after every journal entry with a timestamp at or before `at` (default: now)."""
+        started = datetime.utcnow()
+        at = at or started
+        await self._ensure_table(db)
+        snapshot = await self._latest_snapshot(db, at + _TICK)
+        view = MaterializedView.from_snapshot(snapshot)
+        replayed = 0
+        query = JournalQuery(since=snapshot.taken_at if snapshot else None, until=at + _TICK, resource_types=TRACKED_RESOURCES)
+        async for event in iter_journal_rows(db, query):
+            view.apply(event)
+            replayed += 1
+        view.as_of = at
+        self.queries_total += 1
+        self.events_replayed += replayed
+        self.last_query_ms = round((datetime.utcnow() - started).total_seconds() * 1000.0, 2)
+        return view
+
+    async def rollback_to(self, db: AsyncSession, at: datetime, against_router: bool = False) -> Dict[str, Any]:
+        target = await self.state_at(db, at)
+        current = await self.state_at(db)
+        return {"to": at, "commands": await rollback_commands(target, current, against_router=against_router)}
+
+    async def run_once(self, now: Optional[datetime] = None) -> int:
+        """Fold settled events after the newest snapshot, saving a snapshot every `snapshot_every` events."""
+        cutoff = (now or datetime.utcnow()) - self.settle
+        written = 0
+        async with self.session_factory() as db:
+            await self._ensure_table(db)
+            snapshot = await self._latest_snapshot(db)
+            since = snapshot.taken_at if snapshot else None
+            pending = await db.scalar(select(func.count()).select_from(ChangeJournal).where(
+                ChangeJournal.resource_type.in_(TRACKED_RESOURCES), ChangeJournal.timestamp < cutoff,
+                *([ChangeJournal.timestamp >= since] if since else [])))
+            if snapshot is not None and pending <= self.snapshot_every:
+                return 0
+            view = MaterializedView.from_snapshot(snapshot)
+            folded = 0
+            query = JournalQuery(since=since, until=cutoff, resource_types=TRACKED_RESOURCES)
+            async for event in iter_journal_rows(db, query):
+                # Only cut between distinct timestamps, so a snapshot never splits same-instant events.
+                if folded >= self.snapshot_every and event["timestamp"] > view.as_of:
+                    db.add(self._snapshot(view))
+                    written += 1
+                    folded = 0
+                view.apply(event)
+                folded += 1
+            await db.commit()
+        self.snapshots_written += written
+        if written:
+            logger.info(f"Wrote {written} change journal replay snapshots (through journal ID {view.last_journal_id}).")
+        return written
+
+    @staticmethod
+    def _snapshot(view: MaterializedView) -> JournalSnapshot:
+        return JournalSnapshot(taken_at=view.as_of + _TICK, last_journal_id=view.last_journal_id, event_count=view.event_count,
+                               state={kind: dict(view.resources[kind]) for kind in TRACKED_RESOURCES})
+
+    # --- Background loop ---
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Change journal replay snapshot error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "snapshot_every": self.snapshot_every,
+            "snapshots_written": self.snapshots_written,
+            "queries_total": self.queries_total,
+            "avg_events_replayed": round(self.events_replayed / self.queries_total, 1) if self.queries_total else 0.0,
+            "last_query_ms": self.last_query_ms,
+            "last_error": self.last_error,
+        }
+
+
+_replay_engine: Optional[JournalReplayEngine] = None
+
+
+def get_replay_engine() -> JournalReplayEngine:
+    global _replay_engine
+    if _replay_engine is None:
+        settings = get_journal_replay_config()
+        _replay_engine = JournalReplayEngine(snapshot_every=settings["SNAPSHOT_EVERY"], settle_seconds=settings["SETTLE_SECONDS"],
+                                             interval_seconds=settings["INTERVAL_SECONDS"])
+    return _replay_engine
+
+
+async def start_replay_engine() -> None:
+    if get_journal_replay_config()["ENABLED"]:
+        await get_replay_engine().start()
+
+
+async def stop_replay_engine() -> None:
+    if _replay_engine is not None:
+        await _replay_engine.stop()
@@ -0,0 +1,228 @@
+# utils_journal_writer.py
+# Group-commit writer for the change journal.
+# CRUD operations hand their journal entries to the writer once their own transaction has committed.
+# The writer buffers entries and inserts them in one multi-row INSERT per batch, flushing when the batch
+# is full or the oldest entry has waited `max_delay_ms`. Callers that need the entry to be durable before
+# they respond await the batch commit; everyone else returns immediately. Each committed batch is handed
+# to the registered consumers (notifications) in one call.
+# Entries are timestamped when their batch is inserted, right before it commits: the change feed treats an
+# id gap as settled by the timestamp of the row after it, so that timestamp must not predate the insert.
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import insert
+
+from config import AsyncSessionLocal, get_journal_writer_config
+from models import ChangeJournal
+from schemas import ChangeJournalCreate
+
+logger = logging.getLogger(__name__)
+
+
+class JournalRecord:
+    """Detached snapshot of a committed journal row, as handed to consumers and durable callers."""
+
+    __slots__ = ("id", "timestamp", "user_id", "resource_type", "resource_id", "operation", "before", "after", "comment")
+
+    def __init__(self, id: Optional[int], values: Dict[str, Any]):
+        self.id = id
+        for field in self.__slots__[1:]:
+            setattr(self, field, values.get(field))
+
+
+JournalConsumer = Callable[[List[JournalRecord]], Awaitable[None]]
+
+
+def _row_values(entry: Union[ChangeJournalCreate, Dict[str, Any]]) -> Dict[str, Any]:
+    return dict(entry.dict() if isinstance(entry, ChangeJournalCreate) else entry)
+
+
+class JournalWriter:
+    """Buffers journal entries and commits them in batches from one background task."""
+
+    def __init__(self, session_factory=AsyncSessionLocal, max_batch: int = 500, max_delay_ms: float = 50.0,
+                 durable: bool = True):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000.0
+        self.durable = durable  # Default for callers that do not say whether to wait for the commit
+        self._buffer: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._consumers: List[JournalConsumer] = []
+        self._deliveries: "set[asyncio.Task]" = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        # Metrics
+        self.batches_total = 0
+        self.entries_written = 0
+        self.entries_failed = 0
+        self.largest_batch = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        """True if the background task is alive on the current event loop (futures cannot cross loops)."""
+        if self._task is None or self._task.done():
+            return False
+        try:
+            return self._task.get_loop() is asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+    def add_consumer(self, consumer: JournalConsumer) -> None:
+        """Register an async callable that receives every committed batch (a list of JournalRecord)."""
+        if consumer not in self._consumers:
+            self._consumers.append(consumer)
+
+    # --- Lifecycle ---
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Change journal writer started.")
+
+    async def stop(self) -> None:
+        """Stop the background task after writing out whatever is still buffered."""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        while self._buffer:
+            await self.flush()
+        if self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
+
+    # --- Submitting ---
+    def submit(self, entry: Union[ChangeJournalCreate, Dict[str, Any]]) -> asyncio.Future:
+        """Buffer `entry`; the returned future resolves to its JournalRecord once the batch has committed."""
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((_row_values(entry), future))
+        if self._wakeup is not None:
+            self._wakeup.set()
+            if len(self._buffer) >= self.max_batch:
+                self._full.set()
+        return future
+
+    async def write(self, entry: Union[ChangeJournalCreate, Dict[str, Any]], durable: Optional[bool] = None) -> Optional[JournalRecord]:
+        """Submit `entry`; when durable, wait until it is committed and return its record."""
+        future = self.submit(entry)
+        if not self.running:
+            await self.flush()
+        if self.durable if durable is None else durable:
+            return await asyncio.shield(future)
+        return None
+
+    # --- Flushing ---
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Group commit: give concurrent writers `max_delay` to join the batch unless it is already full.
+            if len(self._buffer) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            self._full.clear()
+            try:
+                while self._buffer:
+                    await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Change journal writer error: {e}")
+
+    async def flush(self) -> int:
+        """Write up to `max_batch` buffered entries in one transaction; returns the number written."""
+        batch, self._buffer = self._buffer[:self.max_batch], self._buffer[self.max_batch:]
+        if not batch:
+            return 0
+        inserted_at = datetime.utcnow()
+        rows = [{**values, "timestamp": inserted_at} for values, _ in batch]
+        try:
+            async with self.session_factory() as db:
+                result = await db.execute(insert(ChangeJournal).returning(ChangeJournal.id, sort_by_parameter_order=True), rows)
+                ids = result.scalars().all()
+                await db.commit()
+        except Exception as e:
+            self.entries_failed += len(batch)
+            self.last_error = str(e)
+            logger.error(f"Failed to write {len(batch)} change journal entries: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()  # Not every submitter awaits its future; keep asyncio from warning.
+            return 0
+        records = [JournalRecord(id, values) for id, values in zip(ids, rows)]
+        for record, (_, future) in zip(records, batch):
+            if not future.done():
+                future.set_result(record)
+        self.batches_total += 1
+        self.entries_written += len(records)
+        self.largest_batch = max(self.largest_batch, len(records))
+        if self._consumers:
+            task = asyncio.create_task(self._deliver(records))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+        return len(records)
+
+    async def _deliver(self, records: List[JournalRecord]) -> None:
+        for consumer in self._consumers:
+            try:
+                await consumer(records)
+            except Exception as e:
+                logger.error(f"Change journal consumer {getattr(consumer, '__name__', consumer)} failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "buffered": len(self._buffer),
+            "max_batch": self.max_batch,
+            "max_delay_ms": self.max_delay * 1000.0,
+            "durable_by_default": self.durable,
+            "batches_total": self.batches_total,
+            "entries_written": self.entries_written,
+            "entries_failed": self.entries_failed,
+            "avg_batch_size": round(self.entries_written / self.batches_total, 2) if self.batches_total else 0.0,
+            "largest_batch": self.largest_batch,
+            "deliveries_in_flight": len(self._deliveries),
+            "last_error": self.last_error,
+        }
+
+
+_journal_writer: Optional[JournalWriter] = None
+
+
+def get_journal_writer() -> JournalWriter:
+    global _journal_writer
+    if _journal_writer is None:
+        from crud_journal import notify_journal_batch
+        from utils_journal_feed import get_change_feed
+        settings = get_journal_writer_config()
+        _journal_writer = JournalWriter(max_batch=settings["MAX_BATCH"], max_delay_ms=settings["MAX_DELAY_MS"],
+                                        durable=settings["DURABLE"])
+        _journal_writer.add_consumer(notify_journal_batch)
+        _journal_writer.add_consumer(get_change_feed().on_batch)
+    return _journal_writer
+
+
+def get_running_journal_writer() -> Optional[JournalWriter]:
+    """The journal writer if it has been started in this process, else None (CRUD then writes inline)."""
+    if _journal_writer is not None and _journal_writer.running:
+        return _journal_writer
+    return None
+
+
+async def start_journal_writer() -> None:
+    if get_journal_writer_config()["ENABLED"]:
+        await get_journal_writer().start()
+
+
+async def stop_journal_writer() -> None:
+    if _journal_writer is not None:
+        await _journal_writer.stop()
@@ -6,7 +6,7 @@ from sqlalchemy.dialects.postgresql import insert
 
 from models import Subnet, SubnetTrafficMetrics
 from vyos_core import collect_subnet_traffic_metrics
-from config import get_async_db
+from config import AsyncSessionLocal
 
 async def collect_metrics_task():
     """
@@ -17,23 +17,22 @@ async def collect_metrics_task():
             # Collect metrics from VyOS
             metrics = await collect_subnet_traffic_metrics()
             
-            # Get a database session
-            db = await get_async_db().__anext__()
-            
-            # Store metrics in the database
-            for metric in metrics:
-                db_metric = SubnetTrafficMetrics(
-                    subnet_id=metric["subnet_id"],
-                    timestamp=datetime.utcnow(),
-                    rx_bytes=metric["rx_bytes"],
-                    tx_bytes=metric["tx_bytes"],
-                    rx_packets=metric["rx_packets"],
-                    tx_packets=metric["tx_packets"],
-                    active_hosts=metric["active_hosts"]
-                )
-                db.add(db_metric)
-            
-            await db.commit()
+            # Get a database session, closed (and its connection released) when the block ends
+            async with AsyncSessionLocal() as db:
+                # Store metrics in the database
+                for metric in metrics:
+                    db_metric = SubnetTrafficMetrics(
+                        subnet_id=metric["subnet_id"],
+                        timestamp=datetime.utcnow(),
+                        rx_bytes=metric["rx_bytes"],
+                        tx_bytes=metric["tx_bytes"],
+                        rx_packets=metric["rx_packets"],
+                        tx_packets=metric["tx_packets"],
+                        active_hosts=metric["active_hosts"]
+                    )
+                    db.add(db_metric)
+
+                await db.commit()
             print(f"Collected traffic metrics for {len(metrics)} subnets at {datetime.utcnow().isoformat()}")
             
         except Exception as e:
@@ -49,9 +48,6 @@ async def cleanup_old_metrics_task():
     """
     while True:
         try:
-            # Get a database session
-            db = await get_async_db().__anext__()
-            
             # Delete metrics older than 90 days
             cutoff_date = datetime.utcnow() - timedelta(days=90)
             
@@ -60,8 +56,10 @@ async def cleanup_old_metrics_task():
                 SubnetTrafficMetrics.timestamp < cutoff_date
             )
             
-            await db.execute(delete_stmt)
-            await db.commit()
+            # Get a database session, closed (and its connection released) when the block ends
+            async with AsyncSessionLocal() as db:
+                await db.execute(delete_stmt)
+                await db.commit()
             
             print(f"Cleaned up old metrics data older than {cutoff_date.isoformat()}")
             
@@ -0,0 +1,139 @@
+# utils_password.py
+# Password hashing off the event loop.
+# bcrypt costs ~100-300 ms of CPU per hash/verify. Run inline in an async handler, that blocks every other
+# request on the worker for that long. PasswordHasher runs passlib on a dedicated, size-limited thread pool
+# (bcrypt releases the GIL, so throughput scales with POOL_SIZE up to the core count).
+# Logins also go through a concurrency cap: at most LOGIN_CONCURRENCY verifications are queued or running
+# at once. A login that cannot get a slot within LOGIN_QUEUE_TIMEOUT_SECONDS is rejected with 503 +
+# Retry-After instead of piling up behind a burst.
+# utils.hash_password / verify_password stay as the synchronous API for scripts and tests.
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from config import get_password_hash_config
+from exceptions import LoginThrottledError
+from utils import pwd_context
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHasher:
+    def __init__(self, pool_size: Optional[int] = None, login_concurrency: Optional[int] = None,
+                 login_queue_timeout: float = 5.0, context=pwd_context):
+        self.pool_size = pool_size or os.cpu_count() or 1
+        self.login_concurrency = login_concurrency or self.pool_size * 2
+        self.login_queue_timeout = login_queue_timeout
+        self.context = context
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._login_slots: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+        # Metrics
+        self.hashes = 0
+        self.verifications = 0
+        self.in_flight = 0
+        self.logins_waiting = 0
+        self.logins_rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool(), fn, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.in_flight -= 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+    async def hash(self, password: str) -> str:
+        self.hashes += 1
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        self.verifications += 1
+        return await self._run(self.context.verify, plain_password, hashed_password)
+
+    # --- Login cap ---
+    def _slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._login_slots is None or self._login_slots[0] is not loop:
+            self._login_slots = (loop, asyncio.Semaphore(self.login_concurrency))
+        return self._login_slots[1]
+
+    @asynccontextmanager
+    async def login_slot(self):
+        """Hold one of the LOGIN_CONCURRENCY login slots; raises LoginThrottledError if none frees up in time."""
+        slots = self._slots()
+        self.logins_waiting += 1
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=self.login_queue_timeout)
+        except asyncio.TimeoutError:
+            self.logins_rejected += 1
+            logger.warning("Login rejected: %d login verifications already in progress", self.login_concurrency)
+            raise LoginThrottledError(retry_after=max(1, round(self.login_queue_timeout)))
+        finally:
+            self.logins_waiting -= 1
+        try:
+            yield
+        finally:
+            slots.release()
+
+    async def verify_login(self, plain_password: str, hashed_password: str) -> bool:
+        async with self.login_slot():
+            return await self.verify(plain_password, hashed_password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        operations = self.hashes + self.verifications
+        return {
+            "pool_size": self.pool_size,
+            "login_concurrency": self.login_concurrency,
+            "hashes": self.hashes,
+            "verifications": self.verifications,
+            "in_flight": self.in_flight,
+            "logins_waiting": self.logins_waiting,
+            "logins_rejected": self.logins_rejected,
+            "avg_ms": (self.total_seconds / operations * 1000.0) if operations else 0.0,
+            "max_ms": self.max_seconds * 1000.0,
+        }
+
+
+_password_hasher: Optional[PasswordHasher] = None
+
+
+def get_password_hasher() -> PasswordHasher:
+    global _password_hasher
+    if _password_hasher is None:
+        settings = get_password_hash_config()
+        _password_hasher = PasswordHasher(pool_size=settings["POOL_SIZE"], login_concurrency=settings["LOGIN_CONCURRENCY"],
+                                          login_queue_timeout=settings["LOGIN_QUEUE_TIMEOUT_SECONDS"])
+    return _password_hasher
+
+
+def stop_password_hasher() -> None:
+    if _password_hasher is not None:
+        _password_hasher.shutdown()
+
+
+async def hash_password_async(password: str) -> str:
+    return await get_password_hasher().hash(password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await get_password_hasher().verify(plain_password, hashed_password)
@@ -0,0 +1,247 @@
+# utils_port_allocator.py
+# Free-list allocator for external NAT ports and destination NAT rule numbers.
+# Values are handed out as reservations that are committed or released together with the DB transaction
+# they were taken in, so concurrent provisions never race onto the same unique value. Only reservations
+# without a session (nothing would ever end them) expire, after PORT_RESERVATION_TTL_SECONDS.
+# The free-lists only see this process's writes. A transaction that rolls back with reservations may
+# have collided with a value another worker committed, so the next reservation re-reads the used values.
+
+import asyncio
+import heapq
+import logging
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import get_port_allocator_config
+from exceptions import NATRuleExhaustedError, PortExhaustedError, ResourceAllocationError
+from models import VMPortRule
+from utils_unit_of_work import is_dry_run
+
+logger = logging.getLogger(__name__)
+
+NAT_RULE_RANGE = (10000, 19999)
+
+
+class RangeFreeList:
+    """Min-heap free-list over an integer range; lowest free value first, O(log n) per allocation."""
+
+    def __init__(self, start: int, end: int, used: Iterable[int]):
+        self.start = start
+        self.end = end
+        self.used: Set[int] = {v for v in used if v is not None and start <= v <= end}
+        self.reserved: Set[int] = set()
+        self._free = [v for v in range(start, end + 1) if v not in self.used]
+        heapq.heapify(self._free)
+
+    @property
+    def available(self) -> int:
+        return (self.end - self.start + 1) - len(self.used) - len(self.reserved)
+
+    def take(self, count: int) -> List[int]:
+        if count > self.available:
+            raise ResourceAllocationError(detail=f"Only {self.available} values left in {self.start}-{self.end}, {count} requested")
+        values = []
+        while len(values) < count:
+            value = heapq.heappop(self._free)
+            # Lazy deletion: entries may be stale if the value was marked used out of band.
+            if value not in self.used and value not in self.reserved:
+                self.reserved.add(value)
+                values.append(value)
+        return values
+
+    def commit(self, values: Iterable[int]) -> None:
+        for value in values:
+            if self.start <= value <= self.end:
+                self.reserved.discard(value)
+                self.used.add(value)
+
+    def release(self, values: Iterable[int]) -> None:
+        for value in values:
+            if value in self.reserved or value in self.used:
+                self.reserved.discard(value)
+                self.used.discard(value)
+                heapq.heappush(self._free, value)
+
+    def mark_used(self, values: Iterable[int]) -> None:
+        for value in values:
+            if value is not None and self.start <= value <= self.end:
+                self.reserved.discard(value)
+                self.used.add(value)
+
+
+class Reservation:
+    """Ports and NAT rule numbers held for one transaction until commit() or release()."""
+
+    def __init__(self, allocator: "PortAllocator", port_range: Tuple[int, int], ports: List[int], nat_rule_numbers: List[int]):
+        self.id = str(uuid.uuid4())
+        self.allocator = allocator
+        self.port_range = port_range
+        self.ports = ports
+        self.nat_rule_numbers = nat_rule_numbers
+        self.expires_at: Optional[float] = time.monotonic() + allocator.ttl  # None once bound to a session
+        self.done = False
+
+    def commit(self) -> None:
+        self.allocator._finish(self, committed=True)
+
+    def release(self) -> None:
+        self.allocator._finish(self, committed=False)
+
+
+class PortAllocator:
+    """Process-wide allocator for VMPortRule.external_port and VMPortRule.nat_rule_number."""
+
+    def __init__(self, ttl: float = 3600.0):
+        self.ttl = ttl
+        self._ports: Dict[Tuple[int, int], RangeFreeList] = {}
+        self._nat_rules: Optional[RangeFreeList] = None
+        self._reservations: Dict[str, Reservation] = {}
+        self._lock = asyncio.Lock()
+        self._stale = False
+        # Metrics
+        self.resyncs = 0
+
+    async def _load(self, db: AsyncSession, port_range: Tuple[int, int]) -> None:
+        if self._stale:
+            self._stale = False
+            self._ports.clear()
+            self._nat_rules = None
+            self.resyncs += 1
+        if port_range in self._ports and self._nat_rules is not None:
+            return
+        result = await db.execute(select(VMPortRule.external_port, VMPortRule.nat_rule_number))
+        rows = result.all()
+        # Values held by open reservations (of this or overlapping ranges) are not in the DB yet.
+        if port_range not in self._ports:
+            self._ports[port_range] = RangeFreeList(port_range[0], port_range[1], (row[0] for row in rows))
+            for reservation in self._reservations.values():
+                self._ports[port_range].mark_used(reservation.ports)
+        if self._nat_rules is None:
+            self._nat_rules = RangeFreeList(NAT_RULE_RANGE[0], NAT_RULE_RANGE[1], (row[1] for row in rows))
+            for reservation in self._reservations.values():
+                self._nat_rules.mark_used(reservation.nat_rule_numbers)
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for reservation in [r for r in self._reservations.values() if r.expires_at is not None and r.expires_at <= now]:
+            logger.warning(f"Port reservation {reservation.id} expired without commit; releasing {reservation.ports} / {reservation.nat_rule_numbers}.")
+            self._finish(reservation, committed=False)
+
+    async def reserve(self, db: AsyncSession, ports: int = 0, nat_rules: int = 0,
+                      port_range: Tuple[int, int] = (32000, 33000)) -> Reservation:
+        """Reserve `ports` external ports and `nat_rules` NAT rule numbers in one call.
+
+        The reservation is bound to `db`: it is committed when the session commits and released when its
+        transaction ends otherwise (rollback, or close without a commit). Raises PortExhaustedError or
+        NATRuleExhaustedError when a range runs out.
+        """
+        if getattr(db, "sync_session", None) is not None:
+            await db.connection()  # Make sure there is a transaction whose end settles the reservation
+        async with self._lock:
+            self._expire()
+            await self._load(db, port_range)
+            try:
+                port_list = self._ports[port_range].take(ports) if ports else []
+            except ResourceAllocationError as e:
+                raise PortExhaustedError(detail=e.detail)
+            try:
+                nat_list = self._nat_rules.take(nat_rules) if nat_rules else []
+            except ResourceAllocationError:
+                self._ports[port_range].release(port_list)
+                raise NATRuleExhaustedError(detail="No available NAT rule numbers")
+            for other_range, free_list in self._ports.items():
+                if other_range != port_range:
+                    free_list.mark_used(port_list)
+            reservation = Reservation(self, port_range, port_list, nat_list)
+            self._reservations[reservation.id] = reservation
+        _bind_to_session(db, reservation)
+        return reservation
+
+    def _finish(self, reservation: Reservation, committed: bool) -> None:
+        if reservation.done:
+            return
+        reservation.done = True
+        self._reservations.pop(reservation.id, None)
+        for free_list in self._ports.values():
+            if committed:
+                free_list.commit(reservation.ports)
+            else:
+                free_list.release(reservation.ports)
+        if self._nat_rules is not None:
+            if committed:
+                self._nat_rules.commit(reservation.nat_rule_numbers)
+            else:
+                self._nat_rules.release(reservation.nat_rule_numbers)
+
+    def release(self, ports: Iterable[Optional[int]] = (), nat_rule_numbers: Iterable[Optional[int]] = ()) -> None:
+        """Return values freed by deleted port rules to the free-lists."""
+        ports = [p for p in ports if p is not None]
+        nat_rule_numbers = [n for n in nat_rule_numbers if n is not None]
+        for free_list in self._ports.values():
+            free_list.release(ports)
+        if self._nat_rules is not None:
+            self._nat_rules.release(nat_rule_numbers)
+
+    def mark_used(self, ports: Iterable[Optional[int]] = (), nat_rule_numbers: Iterable[Optional[int]] = ()) -> None:
+        """Record values written without a reservation (e.g. explicit ports) so they are not handed out."""
+        ports = list(ports)
+        for free_list in self._ports.values():
+            free_list.mark_used(ports)
+        if self._nat_rules is not None:
+            self._nat_rules.mark_used(nat_rule_numbers)
+
+    def invalidate(self) -> None:
+        """Drop the free-lists so they are rebuilt from the DB on next use."""
+        self._ports.clear()
+        self._nat_rules = None
+
+    def resync(self) -> None:
+        """Rebuild the free-lists from the DB before the next reservation, keeping open reservations."""
+        self._stale = True
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "port_ranges": {f"{lo}-{hi}": {"used": len(f.used), "reserved": len(f.reserved), "available": f.available}
+                            for (lo, hi), f in self._ports.items()},
+            "nat_rules": None if self._nat_rules is None else {
+                "used": len(self._nat_rules.used), "reserved": len(self._nat_rules.reserved), "available": self._nat_rules.available},
+            "open_reservations": len(self._reservations),
+            "resyncs": self.resyncs,
+        }
+
+
+def _bind_to_session(db: AsyncSession, reservation: Reservation) -> None:
+    sync_session = getattr(db, "sync_session", None)
+    if sync_session is None:
+        return  # Not a real session (e.g. a test double); the caller commits/releases explicitly.
+    reservation.expires_at = None  # Settled by the transaction, however long it takes
+    pending = sync_session.info.setdefault("port_reservations", [])
+    pending.append(reservation)
+    if sync_session.info.get("port_reservation_hooks"):
+        return
+    sync_session.info["port_reservation_hooks"] = True
+
+    def _after_commit(session):
+        if is_dry_run(session):
+            return  # Only a savepoint was released: leave the values to _after_transaction_end
+        for r in session.info.pop("port_reservations", []):
+            r.commit()
+
+    def _after_transaction_end(session, transaction):
+        # Rolled back, or the session was closed without committing.
+        if transaction.parent is None:
+            for r in session.info.pop("port_reservations", []):
+                r.release()
+                if not is_dry_run(session):
+                    # Possibly a unique-constraint conflict with a value another worker committed.
+                    r.allocator.resync()
+
+    event.listen(sync_session, "after_commit", _after_commit)
+    event.listen(sync_session, "after_transaction_end", _after_transaction_end)
+
+
+port_allocator = PortAllocator(ttl=get_port_allocator_config()["RESERVATION_TTL_SECONDS"])
@@ -0,0 +1,161 @@
+# utils_principal_cache.py
+# Bounded LRU/TTL cache of authenticated principals.
+# get_current_user and get_api_key_auth resolve a bearer token or API key to a user on every request.
+# With this cache a repeat credential costs one dict lookup instead of a JWT decode plus one or two queries.
+# Entries are keyed by a SHA-256 digest of the whole credential (the raw token or key is never stored).
+# An entry never outlives the token's `exp` or the key's `expires_at`. Writes through crud.update_user,
+# delete_user, the API-key functions and role assignments invalidate the affected entries in this process.
+# Other workers pick the change up when their entries reach TTL_SECONDS, so keep it short.
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from config import get_principal_cache_config
+from models import User
+
+
+def credential_key(kind: str, credential: str) -> str:
+    """Cache key for a credential ("jwt" or "api_key"); the raw value is hashed, never kept."""
+    return f"{kind}:{hashlib.sha256(credential.encode()).hexdigest()}"
+
+
+class Principal:
+    """What auth needs to know about a resolved credential, detached from any DB session."""
+
+    __slots__ = ("user_id", "username", "roles", "created_at", "updated_at", "api_key_id", "expires_at", "permissions")
+
+    def __init__(self, user_id: int, username: str, roles: List[str], created_at: Optional[datetime] = None,
+                 updated_at: Optional[datetime] = None, api_key_id: Optional[int] = None,
+                 expires_at: Optional[datetime] = None, permissions: int = 0):
+        self.user_id = user_id
+        self.username = username
+        self.roles = list(roles)
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.api_key_id = api_key_id
+        self.expires_at = expires_at  # Token exp / key expiry (naive UTC), None if it never expires
+        self.permissions = permissions  # Compiled permission bitmask (see utils_rbac.py)
+
+    @classmethod
+    def from_user(cls, user: User, api_key_id: Optional[int] = None, expires_at: Optional[datetime] = None) -> "Principal":
+        return cls(user.id, user.username, user.roles, user.created_at, user.updated_at, api_key_id, expires_at,
+                   user.permission_mask or 0)
+
+    def is_expired(self, now: Optional[datetime] = None) -> bool:
+        return self.expires_at is not None and self.expires_at < (now or datetime.utcnow())
+
+    async def to_user(self, db: AsyncSession) -> User:
+        """A User for this principal attached to `db` without querying it (session.merge with load=False)."""
+        user = User(id=self.user_id, username=self.username, created_at=self.created_at, updated_at=self.updated_at)
+        user.roles = self.roles
+        make_transient_to_detached(user)
+        user = await db.merge(user, load=False)
+        user.permission_mask = self.permissions
+        return user
+
+
+class PrincipalCache:
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 60.0, enabled: bool = True):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, Tuple[float, Principal]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation; a load that started before one must not be cached (see put()).
+        self.generation = 0
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[Principal]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                deadline, principal = entry
+                if deadline > time.monotonic() and not principal.is_expired():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return principal
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: str, principal: Principal, generation: Optional[int] = None) -> None:
+        """Cache a principal. Pass the `generation` read before loading it so a racing invalidation wins."""
+        if not self.enabled or self.max_entries <= 0:
+            return
+        ttl = self.ttl_seconds
+        if principal.expires_at is not None:
+            ttl = min(ttl, (principal.expires_at - datetime.utcnow()).total_seconds())
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + ttl, principal)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _drop(self, match) -> int:
+        with self._lock:
+            self.generation += 1
+            stale = [key for key, (_, principal) in self._entries.items() if match(principal)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def invalidate_user(self, user_id: int) -> int:
+        """Drop every cached credential (tokens and API keys) of a user."""
+        return self._drop(lambda principal: principal.user_id == user_id)
+
+    def invalidate_api_key(self, api_key_id: int) -> int:
+        return self._drop(lambda principal: principal.api_key_id == api_key_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+_principal_cache: Optional[PrincipalCache] = None
+
+
+def get_principal_cache() -> PrincipalCache:
+    global _principal_cache
+    if _principal_cache is None:
+        settings = get_principal_cache_config()
+        _principal_cache = PrincipalCache(max_entries=settings["MAX_ENTRIES"], ttl_seconds=settings["TTL_SECONDS"],
+                                          enabled=settings["ENABLED"])
+    return _principal_cache
@@ -1,24 +1,252 @@
+# utils_ratelimit.py
+# GCRA (generic cell rate algorithm) rate limiting with per-route policies and per-principal keys.
+# Each bucket is one float, its theoretical arrival time (TAT). A request is allowed if TAT - now <= tau,
+# and then TAT = max(TAT, now) + T, where T = period / rate and tau = T * (burst - 1). That is O(1) time
+# and state per key.
+# A bucket whose TAT is in the past is full again and equivalent to no bucket at all, so idle keys are
+# evicted, with a hard LRU cap on top. Policies pick a route (method + path prefix), a rate and what to
+# key on: the client IP, the principal (API key digest, or the subject of a valid JWT) or the tenant (a
+# "tenant" claim in the JWT). Requests with no principal fall back to the IP.
+# The "sqlite" backend keeps buckets in a shared SQLite file so all workers on a host enforce one limit.
+
+import asyncio
+import json
+import logging
+import math
+import sqlite3
+import threading
 import time
-from fastapi import Request, HTTPException, status
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import jwt as pyjwt
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
-from collections import defaultdict
 
-# Simple in-memory rate limiter (per-IP, per-endpoint)
+from config import get_rate_limit_config
+from utils_api_keys import get_api_key_codec
+from utils_principal_cache import credential_key
+
+logger = logging.getLogger(__name__)
+
+KEY_KINDS = ("ip", "principal", "tenant")
+
+
+class RatePolicy:
+    def __init__(self, name: str, rate: int, period: float, burst: Optional[int] = None, key: str = "principal",
+                 path_prefix: str = "/", methods: Optional[Sequence[str]] = None):
+        if key not in KEY_KINDS:
+            raise ValueError(f"Unknown rate limit key {key!r}, expected one of {KEY_KINDS}")
+        self.name = name
+        self.rate = rate
+        self.period = period
+        self.burst = burst or rate
+        self.key = key
+        self.path_prefix = path_prefix
+        self.methods = {m.upper() for m in methods} if methods else None
+        self.emission_interval = period / rate  # T
+        self.tolerance = self.emission_interval * (self.burst - 1)  # tau
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RatePolicy":
+        return cls(name=data["name"], rate=int(data["rate"]), period=float(data.get("period", 60)), burst=data.get("burst"),
+                   key=data.get("key", "principal"), path_prefix=data.get("path", "/"), methods=data.get("methods"))
+
+    def matches(self, method: str, path: str) -> bool:
+        return path.startswith(self.path_prefix) and (self.methods is None or method in self.methods)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "rate": self.rate, "period": self.period, "burst": self.burst, "key": self.key,
+                "path": self.path_prefix, "methods": sorted(self.methods) if self.methods else None}
+
+
+def gcra(tat: Optional[float], now: float, policy: RatePolicy) -> Tuple[bool, float, float, int]:
+    """One GCRA step: (allowed, new TAT, retry_after seconds, remaining requests)."""
+    tat = max(tat or now, now)
+    if tat - now > policy.tolerance:
+        return False, tat, tat - policy.tolerance - now, 0
+    new_tat = tat + policy.emission_interval
+    remaining = int((policy.tolerance - (new_tat - now)) / policy.emission_interval) + 1
+    return True, new_tat, 0.0, max(0, remaining)
+
+
+class MemoryBackend:
+    """Buckets of this worker only: an LRU of key -> TAT with idle eviction and a size cap."""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._tats: "OrderedDict[str, float]" = OrderedDict()
+        self.idle_evictions = 0
+        self.forced_evictions = 0
+
+    async def hit(self, key: str, policy: RatePolicy, now: float) -> Tuple[bool, float, int]:
+        tats = self._tats
+        # The least recently used buckets are the likeliest to have refilled; drop a few per call.
+        for _ in range(2):
+            if not tats:
+                break
+            oldest, oldest_tat = next(iter(tats.items()))
+            if oldest_tat > now:
+                break
+            del tats[oldest]
+            self.idle_evictions += 1
+        allowed, new_tat, retry_after, remaining = gcra(tats.get(key), now, policy)
+        if allowed:
+            tats[key] = new_tat
+            tats.move_to_end(key)
+            while len(tats) > self.max_keys:
+                tats.popitem(last=False)
+                self.forced_evictions += 1
+        return allowed, retry_after, remaining
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "keys": len(self._tats), "max_keys": self.max_keys,
+                "idle_evictions": self.idle_evictions, "forced_evictions": self.forced_evictions}
+
+
+class SQLiteBackend:
+    """Buckets in a SQLite file shared by every worker on the host; each step is one IMMEDIATE transaction."""
+
+    def __init__(self, path: str, sweep_every: int = 1000):
+        self.path = path
+        self.sweep_every = sweep_every
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS rate_limit_buckets (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+        self._lock = threading.Lock()
+        self._calls = 0
+        self.idle_evictions = 0
+
+    def _hit(self, key: str, policy: RatePolicy, now: float) -> Tuple[bool, float, int]:
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tat FROM rate_limit_buckets WHERE key = ?", (key,)).fetchone()
+                allowed, new_tat, retry_after, remaining = gcra(row[0] if row else None, now, policy)
+                if allowed:
+                    conn.execute("INSERT INTO rate_limit_buckets (key, tat) VALUES (?, ?) "
+                                 "ON CONFLICT(key) DO UPDATE SET tat = excluded.tat", (key, new_tat))
+                self._calls += 1
+                if self._calls % self.sweep_every == 0:
+                    self.idle_evictions += conn.execute("DELETE FROM rate_limit_buckets WHERE tat <= ?", (now,)).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return allowed, retry_after, remaining
+
+    async def hit(self, key: str, policy: RatePolicy, now: float) -> Tuple[bool, float, int]:
+        return await asyncio.to_thread(self._hit, key, policy, now)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            keys = self._conn.execute("SELECT COUNT(*) FROM rate_limit_buckets").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "keys": keys, "idle_evictions": self.idle_evictions}
+
+
+class RateLimitEngine:
+    def __init__(self, policies: List[RatePolicy], backend=None, jwt_secret: Optional[str] = None,
+                 jwt_algorithm: str = "HS256", clock=time.time):
+        self.policies = policies
+        self.backend = backend or MemoryBackend()
+        self.jwt_secret = jwt_secret
+        self.jwt_algorithm = jwt_algorithm
+        self.clock = clock  # Wall clock, so TATs mean the same thing in every worker sharing a backend
+        # Metrics
+        self.allowed = 0
+        self.limited: Dict[str, int] = {}
+
+    def policy_for(self, method: str, path: str) -> Optional[RatePolicy]:
+        for policy in self.policies:
+            if policy.matches(method, path):
+                return policy
+        return None
+
+    def _claims(self, request: Request) -> Optional[Dict[str, Any]]:
+        authorization = request.headers.get("authorization", "")
+        if not self.jwt_secret or not authorization.lower().startswith("bearer "):
+            return None
+        try:
+            # Verified, so a forged token cannot spend someone else's budget
+            return pyjwt.decode(authorization[7:], self.jwt_secret, algorithms=[self.jwt_algorithm])
+        except pyjwt.PyJWTError:
+            return None
+
+    def key_for(self, request: Request, policy: RatePolicy) -> str:
+        ip = request.client.host if request.client else "unknown"
+        if policy.key == "ip":
+            return f"ip:{ip}"
+        claims = self._claims(request)
+        if policy.key == "tenant" and claims and claims.get("tenant") is not None:
+            return f"tenant:{claims['tenant']}"
+        api_key = request.headers.get("x-api-key")
+        # Only a key with a valid checksum gets a bucket of its own; random keys would each get a fresh one.
+        if api_key and get_api_key_codec().parse(api_key, record=False) is not None:
+            return credential_key("api_key", api_key)
+        if claims and claims.get("sub"):
+            return f"user:{claims['sub']}"
+        return f"ip:{ip}"
+
+    async def check(self, request: Request) -> Tuple[Optional[RatePolicy], bool, float, int]:
+        """(policy, allowed, retry_after, remaining) for a request; requests no policy matches are allowed."""
+        policy = self.policy_for(request.method, request.url.path)
+        if policy is None:
+            return None, True, 0.0, 0
+        key = f"{policy.name}|{self.key_for(request, policy)}"
+        allowed, retry_after, remaining = await self.backend.hit(key, policy, self.clock())
+        if allowed:
+            self.allowed += 1
+        else:
+            self.limited[policy.name] = self.limited.get(policy.name, 0) + 1
+        return policy, allowed, retry_after, remaining
+
+    def stats(self) -> Dict[str, Any]:
+        return {"policies": [policy.to_dict() for policy in self.policies], "allowed": self.allowed,
+                "limited": dict(self.limited), **self.backend.stats()}
+
+
 class RateLimiter(BaseHTTPMiddleware):
-    def __init__(self, app, max_requests=5, window_seconds=60):
+    def __init__(self, app, engine: Optional[RateLimitEngine] = None):
         super().__init__(app)
-        self.max_requests = max_requests
-        self.window_seconds = window_seconds
-        self.attempts = defaultdict(list)  # { (ip, endpoint): [timestamps] }
+        self._engine = engine
+
+    @property
+    def engine(self) -> RateLimitEngine:
+        return self._engine or get_rate_limiter()
 
     async def dispatch(self, request: Request, call_next):
-        ip = request.client.host
-        endpoint = request.url.path
-        key = (ip, endpoint)
-        now = time.time()
-        # Remove old attempts
-        self.attempts[key] = [t for t in self.attempts[key] if now - t < self.window_seconds]
-        if len(self.attempts[key]) >= self.max_requests:
-            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many requests. Please try again later.")
-        self.attempts[key].append(now)
-        return await call_next(request)
+        policy, allowed, retry_after, remaining = await self.engine.check(request)
+        if policy is None:
+            return await call_next(request)
+        if not allowed:
+            return JSONResponse(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content={"detail": "Too many requests. Please try again later."},
+                headers={"Retry-After": str(max(1, math.ceil(retry_after))), "X-RateLimit-Limit": str(policy.burst),
+                         "X-RateLimit-Remaining": "0"},
+            )
+        response = await call_next(request)
+        response.headers["X-RateLimit-Limit"] = str(policy.burst)
+        response.headers["X-RateLimit-Remaining"] = str(remaining)
+        return response
+
+
+_rate_limiter: Optional[RateLimitEngine] = None
+
+
+def get_rate_limiter() -> RateLimitEngine:
+    global _rate_limiter
+    if _rate_limiter is None:
+        settings = get_rate_limit_config()
+        policies = [RatePolicy.from_dict(policy) for policy in json.loads(settings["POLICIES"])] if settings["POLICIES"] else []
+        policies.append(RatePolicy("default", rate=settings["DEFAULT_RATE"], period=settings["DEFAULT_PERIOD_SECONDS"],
+                                   burst=settings["DEFAULT_BURST"], key=settings["DEFAULT_KEY"]))
+        if settings["BACKEND"] == "sqlite":
+            backend = SQLiteBackend(settings["SQLITE_PATH"])
+        else:
+            backend = MemoryBackend(max_keys=settings["MAX_KEYS"])
+        _rate_limiter = RateLimitEngine(policies, backend, jwt_secret=settings["JWT_SECRET"])
+    return _rate_limiter
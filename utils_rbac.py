@@ -0,0 +1,141 @@
+# utils_rbac.py
+# Permission sets compiled to bitmasks.
+# Every permission name ("network.read", and "role:<name>" for each role name) gets a bit in a process-wide
+# registry. A user's permissions are compiled once, when auth resolves the principal, into a single int:
+# the OR of the masks of the user's roles. Roles come from User.roles (the legacy comma-separated column)
+# and from UserRoleAssignment rows. A role's mask is its own role bit plus the bits of the permissions in
+# its Role row, or just the role bit if it has no row. The mask is cached on the Principal (see
+# utils_principal_cache.py), so RoleChecker / PermissionChecker run one AND per request. Role rows are
+# recompiled after RBAC writes in crud_rbac, and at least every PRINCIPAL_CACHE_TTL_SECONDS so that
+# writes made through other workers take effect within the same bound as cached principals.
+# A Role whose permissions include "*" grants everything.
+
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import get_principal_cache_config
+from models import Role, UserRoleAssignment
+from utils_principal_cache import get_principal_cache
+
+WILDCARD = "*"
+
+
+def role_permission(role_name: str) -> str:
+    return f"role:{role_name}"
+
+
+class PermissionRegistry:
+    """Stable name -> bit mapping for this process. Bits are never reused, so compiled masks stay valid."""
+
+    def __init__(self):
+        self._bits: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.bit(WILDCARD)  # Always bit 0
+
+    def bit(self, name: str) -> int:
+        bit = self._bits.get(name)
+        if bit is None:
+            with self._lock:
+                bit = self._bits.setdefault(name, 1 << len(self._bits))
+        return bit
+
+    def mask(self, names: Iterable[str]) -> int:
+        mask = 0
+        for name in names:
+            mask |= self.bit(name)
+        return mask
+
+    def names(self, mask: int) -> List[str]:
+        return [name for name, bit in self._bits.items() if mask & bit]
+
+    def __len__(self) -> int:
+        return len(self._bits)
+
+
+registry = PermissionRegistry()
+WILDCARD_BIT = registry.bit(WILDCARD)
+
+
+def roles_mask(role_names: Iterable[str]) -> int:
+    """Requirement mask for a list of role names (as used by RoleChecker)."""
+    return registry.mask(role_permission(name) for name in role_names)
+
+
+def has_any(mask: int, required: int) -> bool:
+    return bool(mask & (required | WILDCARD_BIT))
+
+
+def has_all(mask: int, required: int) -> bool:
+    return bool(mask & WILDCARD_BIT) or mask & required == required
+
+
+class PermissionCompiler:
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self._role_masks: Optional[Dict[str, int]] = None
+        self._compiled_at = 0.0
+        self._generation = 0  # Bumped by invalidate(); a compile that raced one is not kept
+        # Metrics
+        self.role_compilations = 0
+        self.user_compilations = 0
+
+    async def role_masks(self, db: AsyncSession) -> Dict[str, int]:
+        """Mask of every Role row, kept until invalidate() or for at most `ttl` seconds."""
+        role_masks = self._role_masks
+        if role_masks is None or time.monotonic() - self._compiled_at >= self.ttl:
+            generation = self._generation
+            role_masks = {}
+            for name, permissions in (await db.execute(select(Role.name, Role.permissions))).all():
+                granted = [p.strip() for p in (permissions or "").split(",") if p.strip()]
+                role_masks[name] = registry.bit(role_permission(name)) | registry.mask(granted)
+            if generation == self._generation:
+                self._role_masks = role_masks
+                self._compiled_at = time.monotonic()
+            self.role_compilations += 1
+        return role_masks
+
+    def compile_roles(self, role_names: Iterable[str], role_masks: Optional[Dict[str, int]] = None) -> int:
+        """OR of the masks of the given roles; without compiled Role rows only the role bits are set."""
+        role_masks = role_masks if role_masks is not None else (self._role_masks or {})
+        mask = 0
+        for name in role_names:
+            mask |= role_masks.get(name) or registry.bit(role_permission(name))
+        return mask
+
+    async def compile_user(self, db: AsyncSession, user) -> int:
+        """A user's permission mask from User.roles and their UserRoleAssignment rows."""
+        role_masks = await self.role_masks(db)
+        assigned = (await db.execute(
+            select(Role.name).join(UserRoleAssignment, UserRoleAssignment.role_id == Role.id)
+            .where(UserRoleAssignment.user_id == user.id)
+        )).scalars().all()
+        self.user_compilations += 1
+        return self.compile_roles(set(user.roles) | set(assigned), role_masks)
+
+    def invalidate(self) -> None:
+        """Recompile Role rows on next use and drop every cached principal mask."""
+        self._generation += 1
+        self._role_masks = None
+        get_principal_cache().clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "permission_bits": len(registry),
+            "compiled_roles": len(self._role_masks) if self._role_masks is not None else None,
+            "role_compilations": self.role_compilations,
+            "user_compilations": self.user_compilations,
+        }
+
+
+_permission_compiler: Optional[PermissionCompiler] = None
+
+
+def get_permission_compiler() -> PermissionCompiler:
+    global _permission_compiler
+    if _permission_compiler is None:
+        _permission_compiler = PermissionCompiler(ttl=get_principal_cache_config()["TTL_SECONDS"])
+    return _permission_compiler
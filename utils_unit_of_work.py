@@ -0,0 +1,124 @@
+# utils_unit_of_work.py
+# Unit-of-work scope for CRUD operations: one API operation (resource rows, quota update, journal entry,
+# outbox entry) is flushed as it goes and committed exactly once at the end. CRUD functions marked
+# @transactional join an enclosing unit of work instead of committing on their own, and register
+# in-memory side effects (allocator bookkeeping, notifications) to run only once the commit succeeded.
+
+import functools
+import inspect
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, List, Optional, Union
+
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+Hook = Callable[[], Union[None, Awaitable[None]]]
+
+_INFO_KEY = "unit_of_work"
+_DRY_RUN_KEY = "dry_run"
+
+
+class UnitOfWork:
+    """State of one open unit of work on a session; see unit_of_work()."""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.depth = 0
+        self._after_commit: List[Hook] = []
+        self._after_rollback: List[Hook] = []
+        self._refresh: List[Any] = []
+
+    def after_commit(self, hook: Hook) -> None:
+        """Run `hook` (sync or async) after the final commit; dropped if the unit of work rolls back."""
+        self._after_commit.append(hook)
+
+    def after_rollback(self, hook: Hook) -> None:
+        self._after_rollback.append(hook)
+
+    def refresh(self, instance: Any) -> None:
+        """Reload `instance` after the final commit (commit expires it; async sessions cannot lazy-load)."""
+        if all(instance is not other for other in self._refresh):
+            self._refresh.append(instance)
+
+
+async def _run_hooks(hooks: List[Hook], stage: str) -> None:
+    for hook in hooks:
+        try:
+            result = hook()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.error(f"Unit of work {stage} hook failed: {e}")
+
+
+def current_unit_of_work(db: AsyncSession) -> Optional[UnitOfWork]:
+    return db.info.get(_INFO_KEY)
+
+
+def mark_dry_run(db: AsyncSession) -> None:
+    """Flag `db` as a dry-run session: its commits only release savepoints of a transaction that is rolled back."""
+    db.info[_DRY_RUN_KEY] = True
+
+
+def is_dry_run(db) -> bool:
+    """True for a session flagged by mark_dry_run(); accepts an AsyncSession or its sync Session."""
+    return bool(db.info.get(_DRY_RUN_KEY))
+
+
+@asynccontextmanager
+async def unit_of_work(db: AsyncSession):
+    """Group every write made on `db` inside the block into one transaction with a single commit.
+
+    Nested scopes (including @transactional CRUD functions called from inside the block) join the
+    outermost one: they only flush, and the outermost scope commits, or rolls back on any exception.
+    """
+    uow = current_unit_of_work(db)
+    if uow is not None:
+        uow.depth += 1
+        try:
+            yield uow
+        finally:
+            uow.depth -= 1
+        return
+
+    uow = UnitOfWork(db)
+    db.info[_INFO_KEY] = uow
+    try:
+        yield uow
+        await db.commit()
+    except BaseException:
+        db.info.pop(_INFO_KEY, None)
+        await db.rollback()
+        await _run_hooks(uow._after_rollback, "rollback")
+        raise
+    db.info.pop(_INFO_KEY, None)
+    for instance in uow._refresh:
+        state = sa_inspect(instance)
+        if state.persistent:
+            await db.refresh(instance)
+    if is_dry_run(db):
+        # The commit only released a savepoint; the change is about to be rolled back.
+        await _run_hooks(uow._after_rollback, "rollback")
+        return
+    await _run_hooks(uow._after_commit, "commit")
+
+
+def transactional(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Run an async CRUD function `func(db, ...)` in a unit of work on `db`.
+
+    Called on its own, the function commits once and its returned ORM object is refreshed; called inside
+    another unit of work it only flushes and leaves commit and refresh to the enclosing scope.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(db: AsyncSession, *args, **kwargs):
+        async with unit_of_work(db) as uow:
+            result = await func(db, *args, **kwargs)
+            if uow.depth == 0 and hasattr(type(result), "__mapper__"):
+                uow.refresh(result)
+            return result
+
+    return wrapper
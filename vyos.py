@@ -7,22 +7,19 @@ import schemas # Changed from relative to absolute import
 
 from config import get_vyos_config
 from exceptions import VyOSAPIError # Import the custom exception
+from vyos_client import get_vyos_client
 
 async def vyos_api_call(commands, operation="set"):
     vyos_cfg = get_vyos_config()
-    url = f"https://{vyos_cfg['VYOS_IP']}:{vyos_cfg['VYOS_API_PORT']}/config"
     payload = {
         "op": operation,
         "id": vyos_cfg['VYOS_API_KEY_ID'],
         "key": vyos_cfg['VYOS_API_KEY'],
         "commands": commands
     }
-    headers = {"Content-Type": "application/json"}
     try:
-        async with httpx.AsyncClient(verify=True) as client: # Changed verify=False to verify=True
-            response = await client.post(url, json=payload, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            return response.json()
+        response = await get_vyos_client().post("/config", payload, operation="config")
+        return response.json()
     except httpx.RequestError as e:
         raise VyOSAPIError(detail=f"An error occurred while requesting VyOS API: {e}")
     except httpx.HTTPStatusError as e:
@@ -40,43 +37,39 @@ async def vyos_api_call(commands, operation="set"):
 
 async def get_vyos_nat_rules():
     vyos_cfg = get_vyos_config()
-    url = f"https://{vyos_cfg['VYOS_IP']}:{vyos_cfg['VYOS_API_PORT']}/retrieve"
     payload = {
         "op": "show",
         "id": vyos_cfg['VYOS_API_KEY_ID'],
         "key": vyos_cfg['VYOS_API_KEY'],
         "path": ["nat", "destination", "rule"]
     }
-    headers = {"Content-Type": "application/json"}
     try:
-        async with httpx.AsyncClient(verify=True) as client:
-            response = await client.post(url, json=payload, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            data = response.json()
-            if data and data.get("success") and "data" in data:
-                # Parse the NAT rules from VyOS output
-                nat_rules = []
-                # Assuming data["data"] is a dictionary where keys are rule numbers
-                # Example: {"10001": {"description": "vm1 ssh", ...}, "10002": {...}}
-                for rule_num, rule_details in data["data"].items():
-                    try:
-                        nat_rules.append({
-                            "rule_number": int(rule_num),
-                            "description": rule_details.get("description"),
-                            "inbound_interface": rule_details.get("inbound-interface"),
-                            "destination_port": int(rule_details.get("destination", {}).get("port")),
-                            "translation_address": rule_details.get("translation", {}).get("address"),
-                            "translation_port": int(rule_details.get("translation", {}).get("port")),
-                            "protocol": rule_details.get("protocol"), # New: protocol
-                            "source_ip": rule_details.get("source", {}).get("address"), # New: source IP
-                            "disabled": "disable" in rule_details # Check if 'disable' key exists
-                        })
-                    except (ValueError, TypeError, AttributeError):
-                        # Handle cases where rule details might be incomplete or malformed
-                        continue
-                return nat_rules
-            else:
-                return [] # No data or not successful
+        response = await get_vyos_client().post("/retrieve", payload, operation="retrieve")
+        data = response.json()
+        if data and data.get("success") and "data" in data:
+            # Parse the NAT rules from VyOS output
+            nat_rules = []
+            # Assuming data["data"] is a dictionary where keys are rule numbers
+            # Example: {"10001": {"description": "vm1 ssh", ...}, "10002": {...}}
+            for rule_num, rule_details in data["data"].items():
+                try:
+                    nat_rules.append({
+                        "rule_number": int(rule_num),
+                        "description": rule_details.get("description"),
+                        "inbound_interface": rule_details.get("inbound-interface"),
+                        "destination_port": int(rule_details.get("destination", {}).get("port")),
+                        "translation_address": rule_details.get("translation", {}).get("address"),
+                        "translation_port": int(rule_details.get("translation", {}).get("port")),
+                        "protocol": rule_details.get("protocol"), # New: protocol
+                        "source_ip": rule_details.get("source", {}).get("address"), # New: source IP
+                        "disabled": "disable" in rule_details # Check if 'disable' key exists
+                    })
+                except (ValueError, TypeError, AttributeError):
+                    # Handle cases where rule details might be incomplete or malformed
+                    continue
+            return nat_rules
+        else:
+            return [] # No data or not successful
     except httpx.RequestError as e:
         raise VyOSAPIError(detail=f"An error occurred while requesting VyOS API for NAT rules: {e}")
     except httpx.HTTPStatusError as e:
@@ -179,23 +172,19 @@ def generate_delete_static_mapping_commands(pool_name: str, subnet: str, mac_add
 
 async def get_vyos_dhcp_pools():
     vyos_cfg = get_vyos_config()
-    url = f"https://{vyos_cfg['VYOS_IP']}:{vyos_cfg['VYOS_API_PORT']}/retrieve"
     payload = {
         "op": "show",
         "id": vyos_cfg['VYOS_API_KEY_ID'],
         "key": vyos_cfg['VYOS_API_KEY'],
         "path": ["service", "dhcp-server", "shared-network-name"]
     }
-    headers = {"Content-Type": "application/json"}
     try:
-        async with httpx.AsyncClient(verify=True) as client:
-            response = await client.post(url, json=payload, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            data = response.json()
-            if data and data.get("success") and "data" in data:
-                return data["data"] # Returns a dict of pools
-            else:
-                return {}
+        response = await get_vyos_client().post("/retrieve", payload, operation="retrieve")
+        data = response.json()
+        if data and data.get("success") and "data" in data:
+            return data["data"] # Returns a dict of pools
+        else:
+            return {}
     except httpx.RequestError as e:
         raise VyOSAPIError(detail=f"An error occurred while requesting VyOS API for DHCP pools: {e}")
     except httpx.HTTPStatusError as e:
@@ -206,23 +195,19 @@ async def get_vyos_dhcp_pools():
 
 async def get_vyos_dhcp_static_mappings(pool_name: str, subnet_cidr: str):
     vyos_cfg = get_vyos_config()
-    url = f"https://{vyos_cfg['VYOS_IP']}:{vyos_cfg['VYOS_API_PORT']}/retrieve"
     payload = {
         "op": "show",
         "id": vyos_cfg['VYOS_API_KEY_ID'],
         "key": vyos_cfg['VYOS_API_KEY'],
         "path": ["service", "dhcp-server", "shared-network-name", pool_name, "subnet", subnet_cidr, "static-mapping"]
     }
-    headers = {"Content-Type": "application/json"}
     try:
-        async with httpx.AsyncClient(verify=True) as client:
-            response = await client.post(url, json=payload, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            data = response.json()
-            if data and data.get("success") and "data" in data:
-                return data["data"] # Returns a dict of static mappings for the subnet
-            else:
-                return {}
+        response = await get_vyos_client().post("/retrieve", payload, operation="retrieve")
+        data = response.json()
+        if data and data.get("success") and "data" in data:
+            return data["data"] # Returns a dict of static mappings for the subnet
+        else:
+            return {}
     except httpx.RequestError as e:
         raise VyOSAPIError(detail=f"An error occurred while requesting VyOS API for DHCP static mappings: {e}")
     except httpx.HTTPStatusError as e:
@@ -293,23 +278,19 @@ def generate_firewall_rule_commands(policy_name: str, rule_number: int, rule_dat
 async def get_vyos_firewall_policies():
     """Retrieves all firewall policies from VyOS."""
     vyos_cfg = get_vyos_config()
-    url = f"https://{vyos_cfg['VYOS_IP']}:{vyos_cfg['VYOS_API_PORT']}/retrieve"
     payload = {
         "op": "show",
         "id": vyos_cfg['VYOS_API_KEY_ID'],
         "key": vyos_cfg['VYOS_API_KEY'],
         "path": ["firewall", "name"]
     }
-    headers = {"Content-Type": "application/json"}
     try:
-        async with httpx.AsyncClient(verify=True) as client:
-            response = await client.post(url, json=payload, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            data = response.json()
-            if data and data.get("success") and "data" in data:
-                return data["data"]  # Returns a dict of policies
-            else:
-                return {}
+        response = await get_vyos_client().post("/retrieve", payload, operation="retrieve")
+        data = response.json()
+        if data and data.get("success") and "data" in data:
+            return data["data"]  # Returns a dict of policies
+        else:
+            return {}
     except httpx.RequestError as e:
         raise VyOSAPIError(detail=f"An error occurred while requesting VyOS API for firewall policies: {e}")
     except httpx.HTTPStatusError as e:
@@ -321,23 +302,19 @@ async def get_vyos_firewall_policies():
 async def get_vyos_firewall_rules(policy_name: str):
     """Retrieves all rules for a specific firewall policy from VyOS."""
     vyos_cfg = get_vyos_config()
-    url = f"https://{vyos_cfg['VYOS_IP']}:{vyos_cfg['VYOS_API_PORT']}/retrieve"
     payload = {
         "op": "show",
         "id": vyos_cfg['VYOS_API_KEY_ID'],
         "key": vyos_cfg['VYOS_API_KEY'],
         "path": ["firewall", "name", policy_name, "rule"]
     }
-    headers = {"Content-Type": "application/json"}
     try:
-        async with httpx.AsyncClient(verify=True) as client:
-            response = await client.post(url, json=payload, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            data = response.json()
-            if data and data.get("success") and "data" in data:
-                return data["data"]  # Returns a dict of rules for the policy
-            else:
-                return {}
+        response = await get_vyos_client().post("/retrieve", payload, operation="retrieve")
+        data = response.json()
+        if data and data.get("success") and "data" in data:
+            return data["data"]  # Returns a dict of rules for the policy
+        else:
+            return {}
     except httpx.RequestError as e:
         raise VyOSAPIError(detail=f"An error occurred while requesting VyOS API for firewall rules of policy {policy_name}: {e}")
     except httpx.HTTPStatusError as e:
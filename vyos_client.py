@@ -0,0 +1,158 @@
+# vyos_client.py
+# Shared, pooled HTTP client for the VyOS HTTP API.
+# One keep-alive connection pool is owned by the FastAPI app (see main.py startup/shutdown)
+# and reused by every helper in vyos_core.py, instead of a new TLS handshake per call.
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from config import get_vyos_config, get_vyos_client_config
+
+logger = logging.getLogger(__name__)
+
+
+class VyOSClient:
+    """Pooled async client for the VyOS HTTP API with per-operation timeouts and usage stats."""
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.settings = settings or get_vyos_client_config()
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._lock = asyncio.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._requests_total = 0
+        self._errors_total = 0
+        self._total_latency = 0.0
+        self._per_operation: Dict[str, Dict[str, float]] = {}
+        self._http2 = False
+
+    def _build_client(self) -> httpx.AsyncClient:
+        vyos_cfg = get_vyos_config()
+        limits = httpx.Limits(
+            max_connections=self.settings["MAX_CONNECTIONS"],
+            max_keepalive_connections=self.settings["MAX_KEEPALIVE_CONNECTIONS"],
+            keepalive_expiry=self.settings["KEEPALIVE_EXPIRY"],
+        )
+        http2 = self.settings["HTTP2"]
+        if http2:
+            try:
+                import h2  # noqa: F401 - optional dependency, only needed for HTTP/2
+            except ImportError:
+                logger.warning("VYOS_HTTP2 is enabled but the 'h2' package is not installed; falling back to HTTP/1.1.")
+                http2 = False
+        self._http2 = http2
+        return httpx.AsyncClient(
+            base_url=f"https://{vyos_cfg['VYOS_IP']}:{vyos_cfg['VYOS_API_PORT']}",
+            verify=self.settings["VERIFY_SSL"],
+            http2=http2,
+            limits=limits,
+            timeout=httpx.Timeout(self.settings["TIMEOUTS"]["default"], connect=self.settings["CONNECT_TIMEOUT"]),
+            headers={"Content-Type": "application/json"},
+            transport=self._transport,
+        )
+
+    async def start(self) -> None:
+        async with self._lock:
+            if self._client is None or self._client.is_closed:
+                self._client = self._build_client()
+                logger.info(
+                    f"VyOS client pool started (max_connections={self.settings['MAX_CONNECTIONS']}, "
+                    f"keepalive={self.settings['MAX_KEEPALIVE_CONNECTIONS']}, http2={self._http2})."
+                )
+
+    async def close(self) -> None:
+        async with self._lock:
+            if self._client is not None and not self._client.is_closed:
+                await self._client.aclose()
+                logger.info("VyOS client pool closed.")
+            self._client = None
+
+    @property
+    def is_started(self) -> bool:
+        return self._client is not None and not self._client.is_closed
+
+    def timeout_for(self, operation: str) -> float:
+        timeouts = self.settings["TIMEOUTS"]
+        return timeouts.get(operation, timeouts["default"])
+
+    async def post(self, path: str, payload: Dict[str, Any], operation: str = "default") -> httpx.Response:
+        """POST `payload` to `path` on the router, raising httpx errors for the caller to translate."""
+        if not self.is_started:
+            await self.start()
+        self._in_flight += 1
+        self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        started = time.monotonic()
+        try:
+            response = await self._client.post(path, json=payload, timeout=self.timeout_for(operation))
+            response.raise_for_status()
+            return response
+        except Exception:
+            self._errors_total += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            self._in_flight -= 1
+            self._requests_total += 1
+            self._total_latency += elapsed
+            op_stats = self._per_operation.setdefault(operation, {"requests": 0, "total_latency": 0.0})
+            op_stats["requests"] += 1
+            op_stats["total_latency"] += elapsed
+
+    def _pool_connections(self) -> Dict[str, Optional[int]]:
+        # httpcore does not expose pool occupancy through httpx, so peek at the transport's pool when available.
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return {"open": None, "idle": None, "active": None}
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "started": self.is_started,
+            "http2": self._http2,
+            "max_connections": self.settings["MAX_CONNECTIONS"],
+            "max_keepalive_connections": self.settings["MAX_KEEPALIVE_CONNECTIONS"],
+            "in_flight": self._in_flight,
+            "peak_in_flight": self._peak_in_flight,
+            "occupancy": self._in_flight / self.settings["MAX_CONNECTIONS"] if self.settings["MAX_CONNECTIONS"] else None,
+            "requests_total": self._requests_total,
+            "errors_total": self._errors_total,
+            "avg_latency_ms": round(self._total_latency / self._requests_total * 1000, 2) if self._requests_total else 0.0,
+            "operations": {
+                op: {
+                    "requests": int(s["requests"]),
+                    "avg_latency_ms": round(s["total_latency"] / s["requests"] * 1000, 2) if s["requests"] else 0.0,
+                    "timeout_seconds": self.timeout_for(op),
+                }
+                for op, s in self._per_operation.items()
+            },
+            "connections": self._pool_connections() if self.is_started else {"open": 0, "idle": 0, "active": 0},
+        }
+
+
+_vyos_client: Optional[VyOSClient] = None
+
+
+def get_vyos_client() -> VyOSClient:
+    """Return the process-wide VyOS client; it is started lazily if the app lifespan has not done so."""
+    global _vyos_client
+    if _vyos_client is None:
+        _vyos_client = VyOSClient()
+    return _vyos_client
+
+
+async def start_vyos_client() -> None:
+    await get_vyos_client().start()
+
+
+async def close_vyos_client() -> None:
+    global _vyos_client
+    if _vyos_client is not None:
+        await _vyos_client.close()
+        _vyos_client = None
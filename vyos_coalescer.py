@@ -0,0 +1,174 @@
+# vyos_coalescer.py
+# Micro-batching queue in front of the VyOS /config endpoint.
+# Commands from concurrent callers are gathered for a short window (or until a size cap is hit)
+# and sent as a single request, so the router performs one commit instead of one per caller.
+# Batches are flushed in arrival order and sent one at a time, so a later delete never overtakes an
+# earlier set of the same path.
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from config import get_vyos_coalescer_config
+from exceptions import VyOSAPIError
+
+logger = logging.getLogger(__name__)
+
+SendFunc = Callable[[List[str], str], Awaitable[Any]]
+
+
+class _PendingBatch:
+    def __init__(self):
+        self.items: List[Tuple[List[str], asyncio.Future, float]] = []
+        self.command_count = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class CommitCoalescer:
+    """Coalesces concurrent vyos_api_call() invocations into batched /config requests.
+
+    Each caller still gets its own outcome: if a combined request fails, the batch is
+    replayed caller by caller so that only the callers whose commands are rejected see the error.
+    """
+
+    def __init__(self, send: SendFunc, max_wait_ms: float = 20.0, max_batch_commands: int = 200):
+        self._send = send
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_commands = max_batch_commands
+        self._pending: Dict[str, _PendingBatch] = {}
+        self._send_lock = asyncio.Lock()
+        self._flush_tasks: Set[asyncio.Task] = set()
+        # Metrics
+        self.batches_total = 0
+        self.callers_total = 0
+        self.commands_total = 0
+        self.commits_total = 0
+        self.fallback_batches_total = 0
+        self.failed_callers_total = 0
+        self.max_batch_size_seen = 0
+        self._total_wait = 0.0
+        self._commit_times: Deque[float] = deque(maxlen=1000)
+
+    async def submit(self, commands: List[str], operation: str = "set") -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Callers of another operation that arrived earlier are sent first.
+        for other in [op for op in self._pending if op != operation]:
+            self._flush_now(other)
+        batch = self._pending.setdefault(operation, _PendingBatch())
+        batch.items.append((list(commands), future, time.monotonic()))
+        batch.command_count += len(commands)
+        if batch.command_count >= self.max_batch_commands:
+            self._flush_now(operation)
+        elif batch.timer is None:
+            batch.timer = loop.call_later(self.max_wait, self._flush_now, operation)
+        return await future
+
+    def _flush_now(self, operation: str) -> None:
+        batch = self._pending.pop(operation, None)
+        if batch is None or not batch.items:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.ensure_future(self._flush(operation, batch))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _commit(self, commands: List[str], operation: str) -> Any:
+        self.commits_total += 1
+        self._commit_times.append(time.monotonic())
+        return await self._send(commands, operation)
+
+    async def _flush(self, operation: str, batch: _PendingBatch) -> None:
+        # The lock wakes waiters first come, first served, so batches reach the router in flush order.
+        async with self._send_lock:
+            await self._send_batch(operation, batch)
+
+    async def _send_batch(self, operation: str, batch: _PendingBatch) -> None:
+        flushed_at = time.monotonic()
+        items = [item for item in batch.items if not item[1].cancelled()]
+        if not items:
+            return
+        self.batches_total += 1
+        self.callers_total += len(items)
+        self.max_batch_size_seen = max(self.max_batch_size_seen, len(items))
+        combined: List[str] = []
+        for commands, _, enqueued_at in items:
+            combined.extend(commands)
+            self._total_wait += flushed_at - enqueued_at
+        self.commands_total += len(combined)
+
+        try:
+            result = await self._commit(combined, operation)
+        except VyOSAPIError as e:
+            if len(items) == 1:
+                self._resolve(items[0][1], error=e)
+                return
+            # Replay caller by caller so each one gets its own success or failure.
+            self.fallback_batches_total += 1
+            logger.warning(f"Coalesced VyOS commit of {len(items)} callers failed ({e.detail}); replaying individually.")
+            for commands, future, _ in items:
+                try:
+                    self._resolve(future, result=await self._commit(commands, operation))
+                except Exception as item_error:
+                    self._resolve(future, error=item_error)
+            return
+        except Exception as e:
+            for _, future, _ in items:
+                self._resolve(future, error=e)
+            return
+
+        for _, future, _ in items:
+            self._resolve(future, result=result)
+
+    def _resolve(self, future: asyncio.Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        if future.done():
+            return
+        if error is not None:
+            self.failed_callers_total += 1
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        recent_commits = [t for t in self._commit_times if now - t <= 60.0]
+        return {
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_batch_commands": self.max_batch_commands,
+            "batches_total": self.batches_total,
+            "callers_total": self.callers_total,
+            "commands_total": self.commands_total,
+            "commits_total": self.commits_total,
+            "commits_saved": max(self.callers_total - self.commits_total, 0),
+            "fallback_batches_total": self.fallback_batches_total,
+            "failed_callers_total": self.failed_callers_total,
+            "avg_batch_size": round(self.callers_total / self.batches_total, 2) if self.batches_total else 0.0,
+            "max_batch_size": self.max_batch_size_seen,
+            "avg_wait_ms": round(self._total_wait / self.callers_total * 1000, 2) if self.callers_total else 0.0,
+            "commits_per_second_1m": round(len(recent_commits) / 60.0, 3),
+            "pending_callers": sum(len(b.items) for b in self._pending.values()),
+            "flushes_in_flight": len(self._flush_tasks),
+        }
+
+
+_coalescer: Optional[CommitCoalescer] = None
+
+
+def get_commit_coalescer(send: SendFunc) -> Optional[CommitCoalescer]:
+    """Return the process-wide coalescer, or None when coalescing is disabled via VYOS_COALESCE_ENABLED."""
+    global _coalescer
+    settings = get_vyos_coalescer_config()
+    if not settings["ENABLED"]:
+        return None
+    if _coalescer is None:
+        _coalescer = CommitCoalescer(send, max_wait_ms=settings["MAX_WAIT_MS"], max_batch_commands=settings["MAX_BATCH_COMMANDS"])
+    return _coalescer
+
+
+def get_coalescer_stats() -> Dict[str, Any]:
+    if _coalescer is None:
+        return {"enabled": get_vyos_coalescer_config()["ENABLED"], "batches_total": 0}
+    return {"enabled": True, **_coalescer.stats()}
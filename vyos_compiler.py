@@ -0,0 +1,155 @@
+# vyos_compiler.py
+# Minimal-diff compiler for VyOS CLI commands.
+# Takes the desired state produced by the generate_* helpers in vyos_core.py, compares it with the
+# known router config tree (see vyos_config_mirror.py) and emits only the leaf-level 'set'/'delete'
+# commands that actually change something.
+
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from exceptions import VyOSAPIError
+from vyos_config_mirror import ConfigPath, command_path, get_config_mirror
+
+logger = logging.getLogger(__name__)
+
+_SAFE_TOKEN = re.compile(r"^[\w.:/@+-]+$")
+
+
+def _render(verb: str, path: ConfigPath) -> str:
+    return " ".join([verb] + [tok if _SAFE_TOKEN.match(tok) else f"'{tok}'" for tok in path])
+
+
+def _path_exists(tree: Any, path: ConfigPath) -> bool:
+    """True if `path` (node path, optionally ending in a leaf value) is present in the config tree."""
+    node = tree
+    for i, tok in enumerate(path):
+        last = i == len(path) - 1
+        if isinstance(node, dict):
+            if tok not in node:
+                return False
+            node = node[tok]
+        elif isinstance(node, list):
+            return last and tok in (str(v) for v in node)
+        elif node is not None:
+            return last and str(node) == tok
+        else:
+            return False
+    return True
+
+
+def _lookup(tree: Any, path: ConfigPath) -> Any:
+    node = tree
+    for tok in path:
+        if not isinstance(node, dict) or tok not in node:
+            return None
+        node = node[tok]
+    return node
+
+
+class _DesiredState:
+    def __init__(self, set_paths: Sequence[ConfigPath]):
+        self.leaves: Set[ConfigPath] = set(set_paths)
+        self.prefixes: Set[ConfigPath] = {p[:i] for p in set_paths for i in range(1, len(p))}
+
+    def covers(self, path: ConfigPath) -> bool:
+        return path in self.leaves or path in self.prefixes
+
+
+def _stale_paths(node: Any, path: ConfigPath, desired: _DesiredState) -> Tuple[bool, List[ConfigPath]]:
+    """Return (whole subtree is stale, paths to delete) for the current config under `path`."""
+    if isinstance(node, dict) and node:
+        results = [_stale_paths(child, path + (key,), desired) for key, child in node.items()]
+        # A node the desired state sets by itself (e.g. a bare next-hop) stays even if nothing under it does.
+        if all(stale for stale, _ in results) and path not in desired.leaves:
+            return True, [path]
+        return False, [p for _, paths in results for p in paths]
+    if isinstance(node, list):
+        stale_values = [path + (str(v),) for v in node if not desired.covers(path + (str(v),))]
+        if len(stale_values) == len(node):
+            return True, [path]
+        return False, stale_values
+    if isinstance(node, dict) or node is None:
+        stale = not desired.covers(path)
+        return stale, [path] if stale else []
+    # Single-valued leaf: a 'set' of the same node with another value replaces it, so no delete is needed.
+    stale = not desired.covers(path + (str(node),)) and path not in desired.prefixes
+    return stale, [path] if stale else []
+
+
+def compile_minimal_commands(desired_commands: Iterable[str], current_tree: Optional[Dict[str, Any]],
+                             scopes: Iterable[Sequence[str]] = ()) -> List[str]:
+    """Diff desired commands against `current_tree` and return only the commands that change it.
+
+    `scopes` are subtree roots fully owned by the desired state (e.g. one firewall policy or NAT rule):
+    anything found under them on the router that the desired commands do not produce is deleted leaf
+    by leaf (or as the highest fully-stale node). Without scopes, unrelated leaves are never deleted.
+    """
+    tree = current_tree or {}
+    set_commands: List[Tuple[ConfigPath, str]] = []
+    deletes: List[ConfigPath] = []
+    for command in desired_commands:
+        path = command_path(command)
+        if not path:
+            continue
+        if command.lstrip().startswith("delete"):
+            deletes.append(path)
+        else:
+            set_commands.append((path, command))
+
+    desired = _DesiredState([path for path, _ in set_commands])
+    delete_out: List[ConfigPath] = []
+    seen: Set[ConfigPath] = set()
+
+    def add_delete(path: ConfigPath) -> None:
+        if path not in seen and not any(path[:i] in seen for i in range(1, len(path))):
+            seen.add(path)
+            delete_out.append(path)
+
+    for path in deletes:
+        if not _path_exists(tree, path):
+            continue  # Already gone on the router
+        if desired.covers(path):
+            # Delete-then-recreate in one batch: only remove what the new state no longer has.
+            _, stale = _stale_paths(_lookup(tree, path), path, desired)
+            for stale_path in stale:
+                add_delete(stale_path)
+        else:
+            add_delete(path)
+
+    for scope in scopes:
+        scope = tuple(str(tok) for tok in scope)
+        node = _lookup(tree, scope)
+        if node is None:
+            continue
+        _, stale = _stale_paths(node, scope, desired)
+        for stale_path in stale:
+            add_delete(stale_path)
+
+    set_out = [command for path, command in set_commands if not _path_exists(tree, path)]
+    # Deletes go first so a scoped delete never removes a value set in the same commit.
+    return [_render("delete", path) for path in delete_out] + list(dict.fromkeys(set_out))
+
+
+async def compile_against_router(desired_commands: Iterable[str], scopes: Iterable[Sequence[str]] = ()) -> List[str]:
+    """Compile `desired_commands` against the router state held by the config mirror."""
+    desired_commands = list(desired_commands)
+    scopes = [tuple(str(tok) for tok in scope) for scope in scopes]
+    mirror = get_config_mirror()
+    roots = {command_path(c)[:mirror.invalidation_depth] for c in desired_commands}
+    roots.update(scope[:mirror.invalidation_depth] for scope in scopes)
+    sparse_tree: Dict[str, Any] = {}
+    for root in sorted(r for r in roots if r):
+        try:
+            subtree = await mirror.get(*root)
+        except VyOSAPIError as e:
+            # Without a known router state the full desired commands are still correct, just larger.
+            logger.warning(f"Could not read VyOS state for diffing ({e.detail}); sending full command set.")
+            return desired_commands
+        if subtree is None:
+            continue
+        node = sparse_tree
+        for tok in root[:-1]:
+            node = node.setdefault(tok, {})
+        node[root[-1]] = subtree
+    return compile_minimal_commands(desired_commands, sparse_tree, scopes)
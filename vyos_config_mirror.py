@@ -0,0 +1,247 @@
+# vyos_config_mirror.py
+# In-memory mirror of the router's running configuration tree.
+# The whole tree is pulled with one /retrieve call, indexed by path, refreshed on a TTL and
+# selectively re-fetched for the subtrees our own writes touch, so get_vyos_* reads in
+# vyos_core.py are served from memory instead of one round trip per helper.
+
+import asyncio
+import copy
+import hashlib
+import logging
+import shlex
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import httpx
+
+from config import get_vyos_config, get_vyos_mirror_config
+from exceptions import VyOSAPIError
+from vyos_client import get_vyos_client
+
+logger = logging.getLogger(__name__)
+
+ConfigPath = Tuple[str, ...]
+
+
+def command_path(command: str) -> ConfigPath:
+    """Split a 'set'/'delete' CLI command into its config path (without the verb)."""
+    try:
+        tokens = shlex.split(command)
+    except ValueError:
+        tokens = command.split()
+    if tokens and tokens[0] in ("set", "delete"):
+        tokens = tokens[1:]
+    return tuple(tokens)
+
+
+def _is_prefix(prefix: ConfigPath, path: ConfigPath) -> bool:
+    return path[:len(prefix)] == prefix
+
+
+def leaf_paths(node: Any, prefix: ConfigPath = ()) -> List[ConfigPath]:
+    """Flatten a config subtree into full leaf paths (node path plus value), as 'set' commands address them."""
+    if isinstance(node, dict) and node:
+        return [p for key, child in node.items() for p in leaf_paths(child, prefix + (str(key),))]
+    if isinstance(node, list):
+        return [prefix + (str(v),) for v in node] or [prefix]
+    if isinstance(node, dict) or node is None:
+        return [prefix]
+    return [prefix + (str(node),)]
+
+
+def digest_leaf_paths(paths: Iterable[ConfigPath]) -> str:
+    """Order-independent digest of a set of leaf paths."""
+    h = hashlib.sha256()
+    for path in sorted(set(paths)):
+        h.update("\x1f".join(path).encode())
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+
+class VyOSConfigMirror:
+    """Cached copy of the VyOS config tree with a flat path index and subtree invalidation."""
+
+    def __init__(self, ttl_seconds: float = 30.0, invalidation_depth: int = 3):
+        self.ttl = ttl_seconds
+        self.invalidation_depth = invalidation_depth
+        self._tree: Optional[Dict[str, Any]] = None
+        self._index: Dict[ConfigPath, Any] = {}
+        self._loaded_at = 0.0
+        self._dirty: Set[ConfigPath] = set()
+        self._generation = 0  # Bumped by invalidate(()); a full refresh that raced one does not count
+        self._digests: Dict[ConfigPath, str] = {}
+        self._lock = asyncio.Lock()
+        # Metrics
+        self.hits = 0
+        self.full_refreshes = 0
+        self.subtree_refreshes = 0
+        self.invalidations = 0
+
+    # --- Fetching ---
+    async def _retrieve(self, path: ConfigPath) -> Any:
+        vyos_cfg = get_vyos_config()
+        payload = {
+            "op": "showConfig",
+            "id": vyos_cfg['VYOS_API_KEY_ID'],
+            "key": vyos_cfg['VYOS_API_KEY'],
+            "path": list(path),
+        }
+        try:
+            response = await get_vyos_client().post("/retrieve", payload, operation="retrieve")
+            data = response.json()
+        except httpx.RequestError as e:
+            raise VyOSAPIError(detail=f"An error occurred while requesting VyOS API for config {' '.join(path) or '/'}: {e}")
+        except httpx.HTTPStatusError as e:
+            error_detail = e.response.text
+            try:
+                error_json = e.response.json()
+                if "error" in error_json and "message" in error_json["error"]:
+                    error_detail = error_json["error"]["message"]
+            except ValueError:
+                pass
+            raise VyOSAPIError(detail=f"VyOS API returned an error for config {' '.join(path) or '/'}: {e.response.status_code} - {error_detail}", status_code=e.response.status_code)
+        except Exception as e:
+            raise VyOSAPIError(detail=f"An unexpected error occurred while fetching config {' '.join(path) or '/'}: {e}")
+        if data and data.get("success") and data.get("data") is not None:
+            return data["data"]
+        # VyOS reports a missing path as an unsuccessful retrieve; treat it as an empty subtree.
+        return None
+
+    def _rebuild_index(self) -> None:
+        index: Dict[ConfigPath, Any] = {}
+        stack: List[Tuple[ConfigPath, Any]] = [((), self._tree)]
+        while stack:
+            path, node = stack.pop()
+            index[path] = node
+            if isinstance(node, dict):
+                for key, child in node.items():
+                    stack.append((path + (key,), child))
+        self._index = index
+
+    def _splice(self, path: ConfigPath, subtree: Any) -> None:
+        parent = self._tree
+        for key in path[:-1]:
+            child = parent.get(key)
+            if not isinstance(child, dict):
+                if subtree is None:
+                    return
+                child = parent[key] = {}
+            parent = child
+        if subtree is None:
+            parent.pop(path[-1], None)
+        else:
+            parent[path[-1]] = subtree
+
+    async def refresh(self) -> None:
+        """Pull the whole running config tree in a single retrieve."""
+        async with self._lock:
+            await self._refresh_all()
+
+    async def _refresh_all(self) -> None:
+        # Take the dirty set before the fetch: invalidations that arrive while it is in flight must survive it.
+        dirty, self._dirty = self._dirty, set()
+        generation = self._generation
+        try:
+            tree = await self._retrieve(())
+        except BaseException:
+            self._dirty |= dirty
+            raise
+        self._tree = tree if isinstance(tree, dict) else {}
+        self._loaded_at = time.monotonic() if generation == self._generation else 0.0
+        self._digests.clear()
+        self.full_refreshes += 1
+        self._rebuild_index()
+
+    async def _ensure_fresh(self, path: ConfigPath) -> None:
+        if self._tree is not None and time.monotonic() - self._loaded_at < self.ttl and not self._dirty_for(path):
+            self.hits += 1
+            return
+        async with self._lock:
+            if self._tree is None or time.monotonic() - self._loaded_at >= self.ttl:
+                await self._refresh_all()
+                return
+            stale = self._dirty_for(path)
+            for dirty_path in sorted(stale, key=len):
+                # Cleared before the fetch, so an invalidation arriving during it marks the path again.
+                self._dirty.discard(dirty_path)
+                if not any(_is_prefix(p, dirty_path) and p != dirty_path for p in stale):
+                    try:
+                        subtree = await self._retrieve(dirty_path)
+                    except BaseException:
+                        self._dirty.add(dirty_path)
+                        raise
+                    self._splice(dirty_path, subtree)
+                    self.subtree_refreshes += 1
+                    # Digests of the re-fetched subtree and of every node above it are stale.
+                    for cached in [p for p in self._digests if _is_prefix(p, dirty_path) or _is_prefix(dirty_path, p)]:
+                        del self._digests[cached]
+            if stale:
+                self._rebuild_index()
+            else:
+                self.hits += 1
+
+    def _dirty_for(self, path: ConfigPath) -> Set[ConfigPath]:
+        return {d for d in self._dirty if _is_prefix(d, path) or _is_prefix(path, d)}
+
+    # --- Public API ---
+    async def get(self, *path: str, default: Any = None) -> Any:
+        """Return a copy of the config node at `path`, or `default` if it does not exist."""
+        await self._ensure_fresh(tuple(path))
+        node = self._index.get(tuple(path))
+        return copy.deepcopy(node) if node is not None else default
+
+    async def digest(self, *path: str) -> Optional[str]:
+        """Digest of the subtree at `path` (None if absent); cached until the subtree is re-fetched."""
+        path = tuple(path)
+        await self._ensure_fresh(path)
+        cached = self._digests.get(path)
+        if cached is not None:
+            return cached
+        node = self._index.get(path)
+        if node is None:
+            return None
+        self._digests[path] = digest_leaf_paths(leaf_paths(node))
+        return self._digests[path]
+
+    def invalidate(self, path: ConfigPath = ()) -> None:
+        """Mark a subtree (or the whole tree for an empty path) as stale."""
+        self.invalidations += 1
+        if not path:
+            self._tree = None
+            self._generation += 1
+            self._dirty.clear()
+            return
+        self._dirty.add(tuple(path))
+
+    def invalidate_commands(self, commands: Iterable[str]) -> None:
+        """Invalidate the subtrees touched by a batch of successfully applied CLI commands."""
+        for command in commands:
+            path = command_path(command)[:self.invalidation_depth]
+            if path:
+                self.invalidate(path)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": self._tree is not None,
+            "age_seconds": round(time.monotonic() - self._loaded_at, 3) if self._tree is not None else None,
+            "ttl_seconds": self.ttl,
+            "indexed_paths": len(self._index),
+            "cached_digests": len(self._digests),
+            "dirty_subtrees": sorted(" ".join(p) for p in self._dirty),
+            "hits": self.hits,
+            "full_refreshes": self.full_refreshes,
+            "subtree_refreshes": self.subtree_refreshes,
+            "invalidations": self.invalidations,
+        }
+
+
+_config_mirror: Optional[VyOSConfigMirror] = None
+
+
+def get_config_mirror() -> VyOSConfigMirror:
+    """Return the process-wide config mirror; the tree is pulled lazily on first read."""
+    global _config_mirror
+    if _config_mirror is None:
+        settings = get_vyos_mirror_config()
+        _config_mirror = VyOSConfigMirror(ttl_seconds=settings["TTL_SECONDS"], invalidation_depth=settings["INVALIDATION_DEPTH"])
+    return _config_mirror
@@ -9,23 +9,44 @@ from fastapi import HTTPException
 import schemas
 from config import get_vyos_config
 from exceptions import VyOSAPIError
+from vyos_client import get_vyos_client
+from vyos_coalescer import get_commit_coalescer
+from vyos_config_mirror import get_config_mirror
+from utils_job_engine import get_job_engine
+from vyos_plan import current_plan
 
 # --- VyOS API Utility Functions ---
-async def vyos_api_call(commands, operation="set"):
+async def vyos_api_call(commands, operation="set", coalesce=True):
+    plan = current_plan()
+    if plan is not None:
+        # Dry run: record instead of sending. Applying a plan: send the stored compiled commands.
+        if plan.dry_run:
+            plan.record("direct", commands)
+            return {"success": True, "dry_run": True}
+        commands = plan.take("direct", commands)
+        if not commands:
+            return {"success": True, "data": None}
+    # Concurrent callers share one /config request (and one router commit) through the coalescer.
+    coalescer = get_commit_coalescer(_send_vyos_commands) if coalesce and commands else None
+    if coalescer is not None:
+        result = await coalescer.submit(commands, operation)
+    else:
+        result = await _send_vyos_commands(commands, operation)
+    # Our own write succeeded, so the mirrored copy of the touched subtrees is stale.
+    get_config_mirror().invalidate_commands(commands)
+    return result
+
+async def _send_vyos_commands(commands, operation="set"):
     vyos_cfg = get_vyos_config()
-    url = f"https://{vyos_cfg['VYOS_IP']}:{vyos_cfg['VYOS_API_PORT']}/config"
     payload = {
         "op": operation,
         "id": vyos_cfg['VYOS_API_KEY_ID'],
         "key": vyos_cfg['VYOS_API_KEY'],
         "commands": commands
     }
-    headers = {"Content-Type": "application/json"}
     try:
-        async with httpx.AsyncClient(verify=True) as client:
-            response = await client.post(url, json=payload, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            return response.json()
+        response = await get_vyos_client().post("/config", payload, operation="config")
+        return response.json()
     except httpx.RequestError as e:
         raise VyOSAPIError(detail=f"An error occurred while requesting VyOS API: {e}")
     except httpx.HTTPStatusError as e:
@@ -46,6 +67,7 @@ def some_utility_function():
 def generate_firewall_policy_commands(policy_name: str, default_action: str, description: Optional[str], action: str = "set"):
     commands = []
     base_path = f"firewall name {policy_name}"
+    default_action = getattr(default_action, "value", default_action)  # Model rows carry the FirewallAction enum
     if action == "set":
         if description:
             commands.append(f"set {base_path} description '{description}'")
@@ -104,10 +126,48 @@ async def generate_static_route_vyos_commands(route: schemas.StaticRouteCreate,
         raise ValueError(f"Unsupported operation for static route: {operation}")
     return commands
 
-def get_vyos_nat_rules():
-    # Placeholder for NAT rules retrieval logic
-    # In production, this should call VyOS API or parse config
-    return []
+# --- Config Reads (served from the in-memory config mirror) ---
+async def get_vyos_nat_rules():
+    """Return destination NAT rules parsed from the mirrored config tree."""
+    rules = await get_config_mirror().get("nat", "destination", "rule", default={})
+    nat_rules = []
+    for rule_num, rule_details in rules.items():
+        try:
+            nat_rules.append({
+                "rule_number": int(rule_num),
+                "description": rule_details.get("description"),
+                "inbound_interface": rule_details.get("inbound-interface"),
+                "destination_port": int(rule_details.get("destination", {}).get("port")),
+                "translation_address": rule_details.get("translation", {}).get("address"),
+                "translation_port": int(rule_details.get("translation", {}).get("port")),
+                "protocol": rule_details.get("protocol"),
+                "source_ip": rule_details.get("source", {}).get("address"),
+                "disabled": "disable" in rule_details
+            })
+        except (ValueError, TypeError, AttributeError):
+            # Skip incomplete or malformed rules
+            continue
+    return nat_rules
+
+async def get_vyos_dhcp_pools():
+    """Return the DHCP shared networks keyed by pool name."""
+    return await get_config_mirror().get("service", "dhcp-server", "shared-network-name", default={})
+
+async def get_vyos_dhcp_static_mappings(pool_name: str, subnet_cidr: str):
+    """Return the static mappings of one DHCP pool subnet."""
+    return await get_config_mirror().get("service", "dhcp-server", "shared-network-name", pool_name, "subnet", subnet_cidr, "static-mapping", default={})
+
+async def get_vyos_firewall_policies():
+    """Return all firewall policies keyed by policy name."""
+    return await get_config_mirror().get("firewall", "name", default={})
+
+async def get_vyos_firewall_rules(policy_name: str):
+    """Return the rules of one firewall policy; repeated calls for many policies do not hit the router."""
+    return await get_config_mirror().get("firewall", "name", policy_name, "rule", default={})
+
+async def get_vyos_static_routes():
+    """Return the static routes keyed by destination prefix."""
+    return await get_config_mirror().get("protocols", "static", "route", default={})
 
 def generate_port_forward_commands(*args, **kwargs):
     # Placeholder for port forward command generation
@@ -191,73 +251,49 @@ async def get_dhcp_leases():
 async def backup_config() -> str:
     """Trigger VyOS config backup and return backup content as string."""
     vyos_cfg = get_vyos_config()
-    url = f"https://{vyos_cfg['VYOS_IP']}:{vyos_cfg['VYOS_API_PORT']}/config/backup"
-    headers = {"Content-Type": "application/json"}
     payload = {
         "id": vyos_cfg['VYOS_API_KEY_ID'],
         "key": vyos_cfg['VYOS_API_KEY']
     }
     try:
-        async with httpx.AsyncClient(verify=True) as client:
-            response = await client.post(url, json=payload, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            # Assume response contains backup content as text
-            return response.text
+        response = await get_vyos_client().post("/config/backup", payload, operation="backup")
+        # Assume response contains backup content as text
+        return response.text
     except Exception as e:
         raise VyOSAPIError(detail=f"Failed to backup VyOS config: {e}")
 
 async def restore_config(backup_content: str) -> str:
     """Restore VyOS config from backup content (string)."""
     vyos_cfg = get_vyos_config()
-    url = f"https://{vyos_cfg['VYOS_IP']}:{vyos_cfg['VYOS_API_PORT']}/config/restore"
-    headers = {"Content-Type": "application/json"}
     payload = {
         "id": vyos_cfg['VYOS_API_KEY_ID'],
         "key": vyos_cfg['VYOS_API_KEY'],
         "backup": backup_content
     }
     try:
-        async with httpx.AsyncClient(verify=True) as client:
-            response = await client.post(url, json=payload, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            return response.text
+        response = await get_vyos_client().post("/config/restore", payload, operation="restore")
+        get_config_mirror().invalidate()
+        return response.text
     except Exception as e:
         raise VyOSAPIError(detail=f"Failed to restore VyOS config: {e}")
 
 # --- Task Management (Async Ops) ---
-import asyncio
-import uuid
+# Tasks run on the persistent job engine (see utils_job_engine.py).
 
-# In-memory task store (for demo/prototype)
-_task_store = {}
-
-async def submit_task(task_type, params):
+async def submit_task(task_type, params, user_id=None):
     """Submit async task and return task ID."""
-    task_id = str(uuid.uuid4())
-    loop = asyncio.get_event_loop()
-    # Start the background task
-    task = loop.create_task(_run_task(task_id, task_type, params))
-    _task_store[task_id] = {"status": "pending", "result": None, "task": task}
-    return task_id
-
-async def _run_task(task_id, task_type, params):
-    try:
-        # Simulate a long-running operation
-        await asyncio.sleep(2)
-        # For demo, just echo the input
-        result = {"task_type": task_type, "params": params, "output": f"Completed {task_type}"}
-        _task_store[task_id]["status"] = "success"
-        _task_store[task_id]["result"] = result
-    except Exception as e:
-        _task_store[task_id]["status"] = "error"
-        _task_store[task_id]["result"] = {"error": str(e)}
+    return await get_job_engine().submit(task_type, params, user_id=user_id)
 
 async def get_task_status(task_id):
-    """Return status/result of async task."""
-    task_info = _task_store.get(task_id)
-    if not task_info:
+    """Return status/result/progress of async task."""
+    job = await get_job_engine().get(task_id)
+    if not job:
         return {"status": "not_found", "result": None}
-    return {"status": task_info["status"], "result": task_info["result"]}
+    return job
+
+async def cancel_task(task_id):
+    """Cancel a queued or running async task; returns None if it does not exist."""
+    return await get_job_engine().cancel(task_id)
 
 async def generate_subnet_isolation_rules(subnet: dict, action: str = "set") -> List[str]:
     """
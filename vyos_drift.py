@@ -0,0 +1,317 @@
+# vyos_drift.py
+# Drift detection between the DB (desired state) and the router (actual state).
+# Desired state is produced per subtree (one NAT rule, firewall policy, DHCP shared-network or static
+# route) by registered providers and reduced to a digest of its leaf paths; the router side uses the
+# per-subtree digests cached by the config mirror. Only subtrees whose digests differ are diffed, and
+# the resulting minimal commands are queued in the VyOS outbox for the drainer to apply.
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from config import AsyncSessionLocal, get_vyos_drift_config
+from exceptions import VyOSAPIError
+from models import DHCPPool, FirewallPolicy, PortStatus, StaticRoute, VMPortRule, VyOSOutbox
+from vyos_compiler import compile_minimal_commands
+from vyos_config_mirror import ConfigPath, command_path, digest_leaf_paths, get_config_mirror
+from vyos_outbox import OUTBOX_PENDING, OUTBOX_SENDING, enqueue_vyos_commands
+
+logger = logging.getLogger(__name__)
+
+
+class DesiredSubtree:
+    """Desired router state of one subtree, as the 'set' commands the DB implies."""
+
+    def __init__(self, kind: str, key: Sequence[str], resource_id: Any, commands: List[str], orphaned: bool = False):
+        self.kind = kind
+        self.key: ConfigPath = tuple(str(tok) for tok in key)
+        self.resource_id = str(resource_id) if resource_id is not None else None
+        self.commands = commands
+        self.orphaned = orphaned  # The row's parent (e.g. its VM) is gone, so its desired state is unknown
+        self._digest: Optional[str] = None
+
+    @property
+    def modeled(self) -> bool:
+        """False when no command generator exists yet for this kind of resource."""
+        return bool(self.commands)
+
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            self._digest = desired_digest(self.key, self.commands)
+        return self._digest
+
+
+def desired_digest(key: ConfigPath, commands: Iterable[str]) -> str:
+    """Digest of the leaf paths under `key` that `commands` produce, comparable with the mirror's digests."""
+    paths = {command_path(c)[len(key):] for c in commands
+             if not c.lstrip().startswith("delete") and command_path(c)[:len(key)] == key}
+    # A 'set' of a node that also gets children is not a leaf on the router.
+    prefixes = {p[:i] for p in paths for i in range(len(p))}
+    return digest_leaf_paths(p for p in paths if p not in prefixes)
+
+
+class DriftProvider:
+    def __init__(self, kind: str, parent: ConfigPath, depth: int, load: Callable[[AsyncSession], Awaitable[List[DesiredSubtree]]],
+                 owns: Optional[Callable[[ConfigPath], bool]] = None):
+        self.kind = kind
+        self.parent = parent  # Router subtree holding every key of this kind
+        self.depth = depth  # Number of path tokens below `parent` that make up a key
+        self.load = load
+        self.owns = owns or (lambda key: True)  # Whether a router-only key under `parent` is ours to prune
+
+
+# Map kind to providers here
+drift_providers: Dict[str, DriftProvider] = {}
+
+
+def register_drift_provider(kind: str, parent: Sequence[str], depth: int = 1, owns: Optional[Callable[[ConfigPath], bool]] = None):
+    def decorator(func):
+        drift_providers[kind] = DriftProvider(kind, tuple(parent), depth, func, owns)
+        return func
+    return decorator
+
+
+def _router_keys(node: Any, parent: ConfigPath, depth: int) -> List[ConfigPath]:
+    if depth == 0:
+        return [parent]
+    if not isinstance(node, dict):
+        return []
+    return [key for name, child in node.items() for key in _router_keys(child, parent + (str(name),), depth - 1)]
+
+
+class DriftDetector:
+    """Compares desired and actual subtree digests and queues reconciliation through the outbox."""
+
+    def __init__(self, session_factory=AsyncSessionLocal, interval_seconds: float = 60.0,
+                 auto_reconcile: bool = True, prune_unmanaged: bool = False):
+        self.session_factory = session_factory
+        self.interval = interval_seconds
+        self.auto_reconcile = auto_reconcile
+        self.prune_unmanaged = prune_unmanaged
+        self._task: Optional[asyncio.Task] = None
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._drifted: List[Tuple[DesiredSubtree, str]] = []
+        self._unmanaged: List[Dict[str, Any]] = []
+        # Metrics
+        self.passes = 0
+        self.reconciled_total = 0
+
+    async def _in_flight_paths(self, db: AsyncSession) -> List[ConfigPath]:
+        """Paths touched by outbox entries not yet applied; drift there is expected, not real."""
+        try:
+            result = await db.execute(select(VyOSOutbox.commands).where(VyOSOutbox.status.in_((OUTBOX_PENDING, OUTBOX_SENDING))))
+        except Exception:
+            return []  # Outbox table not created yet
+        return [command_path(c) for (commands,) in result.all() for c in commands or []]
+
+    async def detect(self, db: AsyncSession) -> Dict[str, Any]:
+        """One detection pass; returns a report and keeps the drifted subtrees for reconcile()."""
+        started = time.perf_counter()
+        mirror = get_config_mirror()
+        in_flight = await self._in_flight_paths(db)
+        drifted: List[Tuple[DesiredSubtree, str]] = []
+        unmodeled: List[Dict[str, Any]] = []
+        unmanaged: List[Dict[str, Any]] = []
+        orphaned: List[Dict[str, Any]] = []
+        in_sync = 0
+        skipped = 0
+        for provider in drift_providers.values():
+            desired = {}
+            for subtree in await provider.load(db):
+                if subtree.key in desired:
+                    logger.warning(f"Drift: {provider.kind} subtree {' '.join(subtree.key)} is claimed by more than one DB row; checking the first.")
+                    continue
+                desired[subtree.key] = subtree
+            for key, subtree in desired.items():
+                if any(p[:len(key)] == key or key[:len(p)] == p for p in in_flight):
+                    skipped += 1
+                    continue
+                actual = await mirror.digest(*key)
+                if subtree.orphaned:
+                    # Never reconciled automatically: the row needs fixing (or deleting) in the DB first.
+                    orphaned.append({"kind": subtree.kind, "path": " ".join(key), "resource_id": subtree.resource_id,
+                                     "on_router": actual is not None})
+                    continue
+                if not subtree.modeled:
+                    if actual is None:
+                        unmodeled.append({"kind": subtree.kind, "path": " ".join(key), "resource_id": subtree.resource_id})
+                    continue
+                if actual == subtree.digest:
+                    in_sync += 1
+                else:
+                    drifted.append((subtree, "missing" if actual is None else "modified"))
+            router_tree = await mirror.get(*provider.parent, default={})
+            for key in _router_keys(router_tree, provider.parent, provider.depth):
+                if key not in desired and not any(p[:len(key)] == key or key[:len(p)] == p for p in in_flight):
+                    unmanaged.append({"kind": provider.kind, "path": " ".join(key), "prunable": provider.owns(key)})
+        self._drifted = drifted
+        self._unmanaged = unmanaged
+        self.passes += 1
+        self.last_report = {
+            "checked_at": time.time(),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            "in_sync": in_sync,
+            "skipped_in_flight": skipped,
+            "drifted": [{"kind": s.kind, "path": " ".join(s.key), "resource_id": s.resource_id, "state": state} for s, state in drifted],
+            "unmanaged": unmanaged,
+            "missing_unmodeled": unmodeled,
+            "orphaned": orphaned,
+        }
+        return self.last_report
+
+    async def reconcile(self, db: AsyncSession) -> int:
+        """Queue minimal commands for the subtrees found by the last detect(); returns the number queued."""
+        mirror = get_config_mirror()
+        queued = 0
+        for subtree, _ in self._drifted:
+            actual = await mirror.get(*subtree.key)
+            sparse: Dict[str, Any] = {}
+            if actual is not None:
+                node = sparse
+                for tok in subtree.key[:-1]:
+                    node = node.setdefault(tok, {})
+                node[subtree.key[-1]] = actual
+            commands = compile_minimal_commands(subtree.commands, sparse, scopes=[subtree.key])
+            if enqueue_vyos_commands(db, commands, resource_type=f"drift:{subtree.kind}", resource_id=subtree.resource_id,
+                                     scopes=[subtree.key]):
+                queued += 1
+        if self.prune_unmanaged:
+            for item in self._unmanaged:
+                if item["prunable"] and enqueue_vyos_commands(db, [f"delete {item['path']}"], resource_type=f"drift:{item['kind']}"):
+                    queued += 1
+        await db.commit()
+        self._drifted, self._unmanaged = [], []
+        self.reconciled_total += queued
+        if queued:
+            logger.info(f"Drift: queued {queued} reconciliation(s) in the VyOS outbox.")
+        return queued
+
+    async def run_once(self, reconcile: Optional[bool] = None) -> Dict[str, Any]:
+        async with self.session_factory() as db:
+            report = await self.detect(db)
+            if (self.auto_reconcile if reconcile is None else reconcile) and (report["drifted"] or self.prune_unmanaged):
+                report["queued"] = await self.reconcile(db)
+        return report
+
+    # --- Background loop ---
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                report = await self.run_once()
+                if report["drifted"] or report["unmanaged"] or report["orphaned"]:
+                    logger.warning(f"Drift: {len(report['drifted'])} drifted, {len(report['unmanaged'])} unmanaged and "
+                                   f"{len(report['orphaned'])} orphaned subtrees.")
+            except VyOSAPIError as e:
+                logger.warning(f"Drift detection skipped, router config unavailable: {e.detail}")
+            except Exception as e:
+                logger.error(f"Drift detection error: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval_seconds": self.interval,
+            "auto_reconcile": self.auto_reconcile,
+            "prune_unmanaged": self.prune_unmanaged,
+            "passes": self.passes,
+            "reconciled_total": self.reconciled_total,
+            "last_report": self.last_report,
+        }
+
+
+_drift_detector: Optional[DriftDetector] = None
+
+
+def get_drift_detector() -> DriftDetector:
+    global _drift_detector
+    if _drift_detector is None:
+        settings = get_vyos_drift_config()
+        _drift_detector = DriftDetector(interval_seconds=settings["INTERVAL_SECONDS"], auto_reconcile=settings["AUTO_RECONCILE"],
+                                        prune_unmanaged=settings["PRUNE_UNMANAGED"])
+    return _drift_detector
+
+
+async def start_drift_detector() -> None:
+    if get_vyos_drift_config()["ENABLED"]:
+        await get_drift_detector().start()
+
+
+async def stop_drift_detector() -> None:
+    if _drift_detector is not None:
+        await _drift_detector.stop()
+
+
+# --- Desired-state providers ---
+@register_drift_provider("firewall_policy", ("firewall", "name"))
+async def _firewall_policies(db: AsyncSession) -> List[DesiredSubtree]:
+    from crud import firewall_policy_vyos_commands
+    result = await db.execute(select(FirewallPolicy).options(selectinload(FirewallPolicy.rules)).order_by(FirewallPolicy.id))
+    return [DesiredSubtree("firewall_policy", ("firewall", "name", policy.name), policy.id,
+                           firewall_policy_vyos_commands(policy, sorted(policy.rules, key=lambda r: r.rule_number)))
+            for policy in result.scalars().all()]
+
+
+@register_drift_provider("static_route", ("protocols", "static", "route"), depth=3)
+async def _static_routes(db: AsyncSession) -> List[DesiredSubtree]:
+    from schemas import StaticRouteCreate
+    from vyos_core import generate_static_route_vyos_commands
+    subtrees = []
+    for route in (await db.execute(select(StaticRoute).order_by(StaticRoute.id))).scalars().all():
+        schema = StaticRouteCreate(destination=route.destination, next_hop=route.next_hop,
+                                   description=route.description, distance=route.distance)
+        subtrees.append(DesiredSubtree("static_route", ("protocols", "static", "route", route.destination, "next-hop", route.next_hop),
+                                       route.id, await generate_static_route_vyos_commands(schema, "set")))
+    return subtrees
+
+
+def _owns_nat_rule(key: ConfigPath) -> bool:
+    from utils_port_allocator import NAT_RULE_RANGE
+    return key[-1].isdigit() and NAT_RULE_RANGE[0] <= int(key[-1]) <= NAT_RULE_RANGE[1]
+
+
+@register_drift_provider("nat_rule", ("nat", "destination", "rule"), owns=_owns_nat_rule)
+async def _nat_rules(db: AsyncSession) -> List[DesiredSubtree]:
+    from vyos_core import generate_port_forward_commands
+    result = await db.execute(
+        select(VMPortRule).options(selectinload(VMPortRule.vm))
+        .where(VMPortRule.status == PortStatus.enabled, VMPortRule.nat_rule_number.isnot(None))
+    )
+    subtrees = []
+    for rule in result.scalars().all():
+        key = ("nat", "destination", "rule", rule.nat_rule_number)
+        if rule.vm is None:
+            # A port rule whose VM is gone: reported as orphaned rather than treated as in sync or unmodeled.
+            subtrees.append(DesiredSubtree("nat_rule", key, rule.id, [], orphaned=True))
+            continue
+        commands = generate_port_forward_commands(
+            rule.vm.machine_id, rule.vm.internal_ip, rule.external_port, rule.nat_rule_number, rule.port_type.value, "set",
+            protocol=rule.protocol.value if rule.protocol else None, source_ip=rule.source_ip,
+            custom_description=rule.custom_description
+        )
+        subtrees.append(DesiredSubtree("nat_rule", key, rule.id, commands))
+    return subtrees
+
+
+@register_drift_provider("dhcp_pool", ("service", "dhcp-server", "shared-network-name"))
+async def _dhcp_pools(db: AsyncSession) -> List[DesiredSubtree]:
+    from vyos_core import generate_dhcp_pool_commands
+    result = await db.execute(select(DHCPPool).where(DHCPPool.is_active.is_(True)).order_by(DHCPPool.id))
+    return [DesiredSubtree("dhcp_pool", ("service", "dhcp-server", "shared-network-name", pool.name), pool.id,
+                           generate_dhcp_pool_commands(pool, action="set"))
+            for pool in result.scalars().all()]
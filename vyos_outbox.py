@@ -0,0 +1,386 @@
+# vyos_outbox.py
+# Transactional outbox for router changes.
+# CRUD functions add the VyOS commands for a resource change to the `vyos_outbox` table in the same
+# DB transaction as the change itself, and return without waiting on the router. A background
+# drainer pushes pending entries to VyOS in id order, several entries per router commit, retrying
+# failures with backoff, so the DB and the router converge even across crashes and router outages.
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import AsyncSessionLocal, get_vyos_outbox_config
+from exceptions import VyOSAPIError
+from models import VyOSOutbox
+from vyos_compiler import compile_against_router
+from vyos_config_mirror import ConfigPath, command_path
+from vyos_core import vyos_api_call
+from vyos_plan import current_plan
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_PENDING = "pending"
+OUTBOX_SENDING = "sending"
+OUTBOX_APPLIED = "applied"
+OUTBOX_FAILED = "failed"
+
+PURGE_INTERVAL_SECONDS = 300.0
+
+
+def enqueue_vyos_commands(db: AsyncSession, commands: Iterable[str], resource_type: Optional[str] = None,
+                          resource_id: Optional[Any] = None, scopes: Iterable[Sequence[str]] = (),
+                          operation: str = "set") -> Optional[VyOSOutbox]:
+    """Stage router commands in `db`'s transaction; they reach VyOS after the caller commits."""
+    commands = list(commands)
+    plan = current_plan()
+    if plan is not None and commands:
+        if plan.dry_run:
+            plan.record("outbox", commands, scopes)
+            return None
+        # The stored commands were already compiled against the router, so no scopes are needed.
+        commands, scopes = plan.take("outbox", commands), ()
+    if not commands:
+        return None
+    entry = VyOSOutbox(
+        resource_type=resource_type,
+        resource_id=str(resource_id) if resource_id is not None else None,
+        operation=operation,
+        commands=commands,
+        scopes=[list(scope) for scope in scopes],
+        status=OUTBOX_PENDING,
+        attempts=0,
+        created_at=datetime.utcnow(),
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(entry)
+    _wake_drainer_on_commit(db)
+    return entry
+
+
+class _ClaimedEntry:
+    """Detached snapshot of a claimed outbox row."""
+
+    def __init__(self, entry: VyOSOutbox):
+        self.id = entry.id
+        self.resource_type = entry.resource_type
+        self.resource_id = entry.resource_id
+        self.commands = list(entry.commands or [])
+        self.scopes = list(entry.scopes or [])
+        self.attempts = entry.attempts or 0
+
+
+def _paths_overlap(a: ConfigPath, b: ConfigPath) -> bool:
+    return a[:len(b)] == b or b[:len(a)] == a
+
+
+def _entry_paths(entry: VyOSOutbox) -> List[ConfigPath]:
+    paths = [command_path(c) for c in entry.commands or []]
+    paths.extend(tuple(str(tok) for tok in scope) for scope in entry.scopes or [])
+    return [p for p in paths if p]
+
+
+class VyOSOutboxDrainer:
+    """Background task applying outbox entries to VyOS in order, in batched commits."""
+
+    def __init__(self, session_factory=AsyncSessionLocal, poll_interval: float = 2.0, batch_max_entries: int = 50,
+                 batch_max_commands: int = 200, max_attempts: int = 8, retry_base_seconds: float = 2.0,
+                 retry_max_seconds: float = 300.0, lease_seconds: int = 120, retention_seconds: int = 7 * 86400):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.batch_max_entries = batch_max_entries
+        self.batch_max_commands = batch_max_commands
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base_seconds
+        self.retry_max = retry_max_seconds
+        self.lease = timedelta(seconds=lease_seconds)
+        self.retention = timedelta(seconds=retention_seconds)
+        self.drainer_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._table_ready = False
+        self._last_purge = 0.0
+        # Metrics
+        self.batches_total = 0
+        self.entries_applied = 0
+        self.entries_retried = 0
+        self.entries_failed = 0
+        self.commits_total = 0
+        self.last_error: Optional[str] = None
+
+    # --- Lifecycle ---
+    async def _ensure_table(self) -> None:
+        if self._table_ready:
+            return
+        async with self.session_factory() as db:
+            await db.run_sync(lambda session: VyOSOutbox.__table__.create(session.connection(), checkfirst=True))
+            await db.commit()
+        self._table_ready = True
+
+    async def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        await self._ensure_table()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"VyOS outbox drainer {self.drainer_id} started.")
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def notify(self) -> None:
+        """Wake the drainer after new entries were committed."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                processed = await self.drain_once()
+                now = asyncio.get_running_loop().time()
+                if now - self._last_purge >= PURGE_INTERVAL_SECONDS:
+                    self._last_purge = now
+                    await self.purge_applied()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"VyOS outbox drainer error: {e}")
+                processed = 0
+            if processed:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- Draining ---
+    async def drain_once(self) -> int:
+        """Apply the next batch of due entries; returns the number of entries processed."""
+        await self._ensure_table()
+        batch = await self._claim_batch()
+        if not batch:
+            return 0
+        self.batches_total += 1
+        try:
+            compiled = [await compile_against_router(entry.commands, entry.scopes) for entry in batch]
+            commands = [c for entry_commands in compiled for c in entry_commands]
+            if commands:
+                await vyos_api_call(commands, coalesce=False)
+                self.commits_total += 1
+            await self._mark_applied([entry.id for entry in batch])
+            return len(batch)
+        except VyOSAPIError as e:
+            if len(batch) == 1:
+                await self._mark_failed(batch[0], e.detail)
+                return 1
+            logger.warning(f"Outbox batch of {len(batch)} entries failed ({e.detail}); applying entries one by one.")
+        except Exception:
+            await self._release([entry.id for entry in batch])
+            raise
+        return await self._apply_individually(batch)
+
+    async def _apply_individually(self, batch: List[_ClaimedEntry]) -> int:
+        done = 0
+        for index, entry in enumerate(batch):
+            try:
+                commands = await compile_against_router(entry.commands, entry.scopes)
+                if commands:
+                    await vyos_api_call(commands, coalesce=False)
+                    self.commits_total += 1
+                await self._mark_applied([entry.id])
+                done += 1
+            except VyOSAPIError as e:
+                await self._mark_failed(entry, e.detail)
+                # Later entries must not overtake a failed one; hand them back untouched.
+                await self._release([later.id for later in batch[index + 1:]])
+                return done + 1
+        return done
+
+    async def _claim_batch(self) -> List[_ClaimedEntry]:
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            # Reclaim entries left 'sending' by a drainer that died mid-batch.
+            await db.execute(
+                update(VyOSOutbox).where(VyOSOutbox.status == OUTBOX_SENDING, VyOSOutbox.claimed_at < now - self.lease)
+                .values(status=OUTBOX_PENDING, claimed_by=None, claimed_at=None)
+            )
+            await db.commit()
+            # Only one drainer may be in flight at a time, so entries are applied in order.
+            if await db.scalar(select(func.count(VyOSOutbox.id)).where(VyOSOutbox.status == OUTBOX_SENDING)):
+                return []
+            candidates = (await db.execute(
+                select(VyOSOutbox).where(VyOSOutbox.status == OUTBOX_PENDING)
+                .order_by(VyOSOutbox.id).limit(self.batch_max_entries)
+            )).scalars().all()
+            batch: List[VyOSOutbox] = []
+            seen: List[ConfigPath] = []
+            command_count = 0
+            for entry in candidates:
+                if entry.next_attempt_at and entry.next_attempt_at > now:
+                    break  # Head of the queue is backing off; keep the order.
+                paths = _entry_paths(entry)
+                # Entries touching overlapping paths are diffed against the state left by earlier ones,
+                # so they go in a later batch.
+                if batch and any(_paths_overlap(p, s) for p in paths for s in seen):
+                    break
+                if batch and command_count + len(entry.commands or []) > self.batch_max_commands:
+                    break
+                batch.append(entry)
+                seen.extend(paths)
+                command_count += len(entry.commands or [])
+            if not batch:
+                return []
+            ids = [entry.id for entry in batch]
+            result = await db.execute(
+                update(VyOSOutbox).where(VyOSOutbox.id.in_(ids), VyOSOutbox.status == OUTBOX_PENDING)
+                .values(status=OUTBOX_SENDING, claimed_by=self.drainer_id, claimed_at=now)
+            )
+            if result.rowcount != len(ids):
+                await db.rollback()  # Another drainer got there first
+                return []
+            claimed = [_ClaimedEntry(entry) for entry in batch]
+            await db.commit()
+            return claimed
+
+    async def _mark_applied(self, ids: List[int]) -> None:
+        if not ids:
+            return
+        async with self.session_factory() as db:
+            await db.execute(
+                update(VyOSOutbox).where(VyOSOutbox.id.in_(ids))
+                .values(status=OUTBOX_APPLIED, applied_at=datetime.utcnow(), last_error=None, claimed_by=None, claimed_at=None)
+            )
+            await db.commit()
+        self.entries_applied += len(ids)
+
+    async def _mark_failed(self, entry: _ClaimedEntry, error: str) -> None:
+        attempts = entry.attempts + 1
+        self.last_error = error
+        if attempts >= self.max_attempts:
+            status = OUTBOX_FAILED
+            self.entries_failed += 1
+            logger.error(f"Outbox entry {entry.id} ({entry.resource_type} {entry.resource_id}) failed {attempts} times; giving up: {error}")
+        else:
+            status = OUTBOX_PENDING
+            self.entries_retried += 1
+            logger.warning(f"Outbox entry {entry.id} ({entry.resource_type} {entry.resource_id}) failed (attempt {attempts}): {error}")
+        delay = min(self.retry_max, self.retry_base * (2 ** (attempts - 1)))
+        async with self.session_factory() as db:
+            await db.execute(
+                update(VyOSOutbox).where(VyOSOutbox.id == entry.id)
+                .values(status=status, attempts=attempts, last_error=error, claimed_by=None, claimed_at=None,
+                        next_attempt_at=datetime.utcnow() + timedelta(seconds=delay))
+            )
+            await db.commit()
+
+    async def _release(self, ids: List[int]) -> None:
+        if not ids:
+            return
+        async with self.session_factory() as db:
+            await db.execute(
+                update(VyOSOutbox).where(VyOSOutbox.id.in_(ids), VyOSOutbox.status == OUTBOX_SENDING)
+                .values(status=OUTBOX_PENDING, claimed_by=None, claimed_at=None)
+            )
+            await db.commit()
+
+    # --- Maintenance / inspection ---
+    async def purge_applied(self) -> int:
+        """Delete applied entries older than the retention period."""
+        async with self.session_factory() as db:
+            result = await db.execute(
+                delete(VyOSOutbox).where(VyOSOutbox.status == OUTBOX_APPLIED, VyOSOutbox.applied_at < datetime.utcnow() - self.retention)
+            )
+            await db.commit()
+        return result.rowcount or 0
+
+    async def retry(self, entry_id: int) -> bool:
+        """Put a failed entry back in the queue."""
+        await self._ensure_table()
+        async with self.session_factory() as db:
+            result = await db.execute(
+                update(VyOSOutbox).where(VyOSOutbox.id == entry_id, VyOSOutbox.status == OUTBOX_FAILED)
+                .values(status=OUTBOX_PENDING, attempts=0, next_attempt_at=datetime.utcnow())
+            )
+            await db.commit()
+        self.notify()
+        return bool(result.rowcount)
+
+    async def list_entries(self, status: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        await self._ensure_table()
+        query = select(VyOSOutbox).order_by(VyOSOutbox.id.desc()).limit(limit)
+        if status:
+            query = query.where(VyOSOutbox.status == status)
+        async with self.session_factory() as db:
+            entries = (await db.execute(query)).scalars().all()
+        return [{
+            "id": e.id, "resource_type": e.resource_type, "resource_id": e.resource_id, "status": e.status,
+            "commands": e.commands, "attempts": e.attempts, "last_error": e.last_error,
+            "created_at": e.created_at.isoformat() if e.created_at else None,
+            "applied_at": e.applied_at.isoformat() if e.applied_at else None,
+        } for e in entries]
+
+    async def stats(self) -> Dict[str, Any]:
+        await self._ensure_table()
+        async with self.session_factory() as db:
+            counts = dict((await db.execute(select(VyOSOutbox.status, func.count(VyOSOutbox.id)).group_by(VyOSOutbox.status))).all())
+            oldest = await db.scalar(select(func.min(VyOSOutbox.created_at)).where(VyOSOutbox.status == OUTBOX_PENDING))
+        return {
+            "drainer_id": self.drainer_id,
+            "running": self._task is not None and not self._task.done(),
+            "counts": {s: counts.get(s, 0) for s in (OUTBOX_PENDING, OUTBOX_SENDING, OUTBOX_APPLIED, OUTBOX_FAILED)},
+            "oldest_pending_age_seconds": round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else None,
+            "batches_total": self.batches_total,
+            "commits_total": self.commits_total,
+            "entries_applied": self.entries_applied,
+            "entries_retried": self.entries_retried,
+            "entries_failed": self.entries_failed,
+            "last_error": self.last_error,
+        }
+
+
+_outbox_drainer: Optional[VyOSOutboxDrainer] = None
+
+
+def get_outbox_drainer() -> VyOSOutboxDrainer:
+    global _outbox_drainer
+    if _outbox_drainer is None:
+        settings = get_vyos_outbox_config()
+        _outbox_drainer = VyOSOutboxDrainer(
+            poll_interval=settings["POLL_INTERVAL"], batch_max_entries=settings["BATCH_MAX_ENTRIES"],
+            batch_max_commands=settings["BATCH_MAX_COMMANDS"], max_attempts=settings["MAX_ATTEMPTS"],
+            retry_base_seconds=settings["RETRY_BASE_SECONDS"], retry_max_seconds=settings["RETRY_MAX_SECONDS"],
+            lease_seconds=settings["LEASE_SECONDS"], retention_seconds=settings["RETENTION_SECONDS"],
+        )
+    return _outbox_drainer
+
+
+async def start_outbox_drainer() -> None:
+    await get_outbox_drainer().start()
+
+
+async def stop_outbox_drainer() -> None:
+    if _outbox_drainer is not None:
+        await _outbox_drainer.stop()
+
+
+def _wake_drainer_on_commit(db: AsyncSession) -> None:
+    sync_session = getattr(db, "sync_session", None)
+    if sync_session is None or sync_session.info.get("vyos_outbox_hook"):
+        return
+    sync_session.info["vyos_outbox_hook"] = True
+
+    def _after_commit(session):
+        if _outbox_drainer is not None:
+            _outbox_drainer.notify()
+
+    event.listen(sync_session, "after_commit", _after_commit)
@@ -0,0 +1,416 @@
+# vyos_plan.py
+# Plan/apply (dry-run) mode for router-mutating endpoints.
+# With ?dry_run=true an endpoint that takes its session from get_plannable_db() runs against a DB
+# transaction that is rolled back, while vyos_api_call() and enqueue_vyos_commands() record their
+# commands instead of sending or queueing them. The recorded commands are compiled against the mirrored
+# router config, diffed and costed, and stored as a plan. Applying a plan replays the original request
+# and sends the stored compiled commands as they are, after checking the router has not changed since.
+
+import asyncio
+import contextlib
+import json
+import logging
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+from fastapi import Depends, Query, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import AsyncSessionLocal, get_async_db, get_vyos_plan_config
+from exceptions import PlanError, PlanStaleError
+from models import VyOSPlan
+from utils_unit_of_work import mark_dry_run
+from vyos_compiler import compile_against_router
+from vyos_config_mirror import ConfigPath, command_path, get_config_mirror
+
+logger = logging.getLogger(__name__)
+
+PLAN_PLANNED = "planned"
+PLAN_APPLIED = "applied"
+PLAN_STALE = "stale"
+PLAN_FAILED = "failed"
+
+# Touched subtrees without an explicit scope are cut at this depth (value token excluded),
+# e.g. 'nat destination rule 10001' or 'firewall name WAN_IN rule'.
+SUBTREE_DEPTH = 4
+
+_TRUE_VALUES = ("1", "true", "yes", "on")
+
+_current_plan: ContextVar[Optional["PlanCapture"]] = ContextVar("vyos_plan", default=None)
+
+
+class PlanCapture:
+    """Router changes recorded during a dry run, or the stored ones handed out while a plan is applied."""
+
+    def __init__(self, stored_operations: Optional[List[Dict[str, Any]]] = None):
+        self.dry_run = stored_operations is None
+        self.operations: List[Dict[str, Any]] = []
+        self._stored = list(stored_operations or [])
+        self._release = None  # Rolls back the dry-run DB transaction
+        self.user_id: Optional[int] = None  # Caller of the dry run, recorded by auth (see set_plan_owner)
+
+    def record(self, via: str, commands: Sequence[str], scopes: Sequence[Sequence[str]] = ()) -> None:
+        self.operations.append({"via": via, "commands": list(commands), "scopes": [list(scope) for scope in scopes]})
+
+    def take(self, via: str, commands: Sequence[str]) -> List[str]:
+        """Stored compiled commands for the next operation; the replayed request must still produce the planned ones."""
+        if not self._stored or self._stored[0]["via"] != via or self._stored[0]["commands"] != list(commands):
+            raise PlanStaleError(detail="The request no longer produces the router commands in the plan; plan it again.")
+        operation = self._stored.pop(0)
+        self.operations.append(operation)
+        return list(operation["compiled"])
+
+    @property
+    def unused(self) -> int:
+        return len(self._stored)
+
+    async def release(self) -> None:
+        release, self._release = self._release, None
+        if release is not None:
+            await release()
+
+
+def current_plan() -> Optional[PlanCapture]:
+    return _current_plan.get()
+
+
+def set_plan_owner(user_id: int) -> None:
+    """Record the authenticated caller of the current dry run as the owner of its plan; no-op otherwise."""
+    capture = _current_plan.get()
+    if capture is not None and capture.dry_run:
+        capture.user_id = user_id
+
+
+@contextlib.asynccontextmanager
+async def _rollback_session(engine, capture: PlanCapture):
+    conn = await engine.connect()
+    sqlite = conn.dialect.name == "sqlite"
+    if sqlite:
+        # pysqlite defers BEGIN and does not nest SAVEPOINTs inside it, so drive the outer transaction by hand.
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+    await conn.begin()
+    if sqlite:
+        await conn.exec_driver_sql("BEGIN")
+    # The endpoint's commits only release savepoints inside the outer transaction.
+    session = AsyncSession(bind=conn, join_transaction_mode="create_savepoint", expire_on_commit=False, autoflush=False)
+    mark_dry_run(session)
+
+    async def release():
+        await session.close()
+        if sqlite:
+            await conn.exec_driver_sql("ROLLBACK")
+        await conn.rollback()
+        await conn.close()
+
+    capture._release = release
+    try:
+        yield session
+    finally:
+        await capture.release()
+
+
+async def get_plannable_db(
+    dry_run: bool = Query(False, description="Return the router change plan (commands, diff, cost) instead of applying it"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """DB session for router-mutating endpoints; in a dry run its changes are rolled back."""
+    if not dry_run:
+        yield db
+        return
+    capture = current_plan()
+    if capture is None or not capture.dry_run:
+        raise PlanError(detail="dry_run is not supported on this endpoint")
+    async with _rollback_session(db.bind, capture) as plan_db:
+        yield plan_db
+
+
+def _uses_plannable_db(dependant) -> bool:
+    return any(d.call is get_plannable_db or _uses_plannable_db(d) for d in dependant.dependencies)
+
+
+class PlannableRoute(APIRoute):
+    """Route class answering ?dry_run=true with a stored plan on endpoints that use get_plannable_db."""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        if not _uses_plannable_db(self.dependant):
+            return handler
+
+        async def plannable_handler(request: Request) -> Response:
+            if current_plan() is not None or request.query_params.get("dry_run", "").lower() not in _TRUE_VALUES:
+                return await handler(request)
+            capture = PlanCapture()
+            token = _current_plan.set(capture)
+            try:
+                response = await handler(request)
+            finally:
+                _current_plan.reset(token)
+                await capture.release()
+            if response.status_code >= 400:
+                return response
+            return JSONResponse(await get_plan_store().create(request, capture))
+
+        return plannable_handler
+
+
+def touched_subtrees(operations: List[Dict[str, Any]]) -> List[ConfigPath]:
+    """Outermost router subtrees the compiled commands write to, using operation scopes where given."""
+    found = set()
+    for operation in operations:
+        scopes = [tuple(scope) for scope in operation.get("scopes") or []]
+        for command in operation["compiled"]:
+            path = command_path(command)
+            scope = next((s for s in scopes if path[:len(s)] == s), None)
+            found.add(scope or path[:max(1, min(SUBTREE_DEPTH, len(path) - 1))])
+    return sorted(p for p in found if not any(q != p and p[:len(q)] == q for q in found))
+
+
+async def diff_commands(commands: Sequence[str]) -> List[Dict[str, Any]]:
+    """Classify each command against the mirrored router config: add, change, remove or noop."""
+    mirror = get_config_mirror()
+    diff = []
+    for command in commands:
+        path = command_path(command)
+        if command.lstrip().startswith("delete"):
+            before = await mirror.get(*path)
+            diff.append({"op": "remove" if before is not None else "noop", "path": " ".join(path), "before": before})
+            continue
+        if await mirror.get(*path) is not None:
+            diff.append({"op": "noop", "path": " ".join(path), "before": None})
+            continue
+        before = await mirror.get(*path[:-1]) if len(path) > 1 else None
+        if isinstance(before, list):
+            op = "noop" if path[-1] in before else "add"
+        elif before is not None and not isinstance(before, dict):
+            op = "noop" if str(before) == path[-1] else "change"
+        else:
+            op, before = "add", None
+        diff.append({"op": op, "path": " ".join(path), "before": before})
+    return diff
+
+
+def estimate_cost(operations: List[Dict[str, Any]], subtrees: List[ConfigPath]) -> Dict[str, Any]:
+    commands = [c for operation in operations for c in operation["compiled"]]
+    deletes = sum(1 for c in commands if c.lstrip().startswith("delete"))
+    direct = sum(1 for operation in operations if operation["via"] == "direct" and operation["compiled"])
+    queued = any(operation["via"] == "outbox" and operation["compiled"] for operation in operations)
+    return {
+        "command_count": len(commands),
+        "set_commands": len(commands) - deletes,
+        "delete_commands": deletes,
+        "touched_subtrees": len(subtrees),
+        # Direct calls commit one by one; queued entries are normally drained together in one commit.
+        "estimated_router_commits": direct + (1 if queued else 0),
+        "payload_bytes": len(json.dumps(commands)),
+    }
+
+
+def plan_to_dict(plan: VyOSPlan) -> Dict[str, Any]:
+    return {
+        "plan_id": plan.id,
+        "status": plan.status,
+        "request": {"method": plan.method, "path": plan.path, "query": plan.query or None},
+        "commands": plan.commands,
+        "diff": plan.diff,
+        "cost": plan.cost,
+        "touched_subtrees": [" ".join(path) for path, _ in plan.subtree_digests or []],
+        "result": plan.result,
+        "user_id": plan.user_id,
+        "created_at": plan.created_at.isoformat() if plan.created_at else None,
+        "expires_at": plan.expires_at.isoformat() if plan.expires_at else None,
+        "applied_at": plan.applied_at.isoformat() if plan.applied_at else None,
+    }
+
+
+def _replay_query(request: Request) -> str:
+    return urlencode([(k, v) for k, v in request.query_params.multi_items() if k != "dry_run"])
+
+
+async def _replay(request: Request, plan: VyOSPlan) -> Tuple[int, Any]:
+    """Send the planned request through the app again, authenticated as the caller of `request`."""
+    body = (plan.body or "").encode()
+    headers = [(k, v) for k, v in request.scope["headers"] if k in (b"authorization", b"x-api-key", b"cookie")]
+    headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    scope = {
+        "type": "http", "asgi": request.scope.get("asgi", {"version": "3.0"}), "http_version": "1.1",
+        "method": plan.method, "scheme": request.url.scheme, "root_path": request.scope.get("root_path", ""),
+        "path": plan.path, "raw_path": plan.path.encode(), "query_string": (plan.query or "").encode(),
+        "headers": headers, "client": request.scope.get("client"), "server": request.scope.get("server"),
+    }
+    done = asyncio.Event()
+    sent_body = False
+    status_code = 500
+    chunks: List[bytes] = []
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                done.set()
+
+    await request.app(scope, receive, send)
+    raw = b"".join(chunks)
+    try:
+        return status_code, json.loads(raw) if raw else None
+    except ValueError:
+        return status_code, raw.decode(errors="replace")
+
+
+class PlanStore:
+    """Stores plans and applies them by ID."""
+
+    def __init__(self, session_factory=AsyncSessionLocal, ttl_seconds: int = 3600):
+        self.session_factory = session_factory
+        self.ttl = ttl_seconds
+        self._table_ready = False
+        # Metrics
+        self.plans_created = 0
+        self.plans_applied = 0
+        self.plans_stale = 0
+
+    async def _ensure_table(self) -> None:
+        if self._table_ready:
+            return
+        async with self.session_factory() as db:
+            await db.run_sync(lambda session: VyOSPlan.__table__.create(session.connection(), checkfirst=True))
+            await db.commit()
+        self._table_ready = True
+
+    async def create(self, request: Request, capture: PlanCapture) -> Dict[str, Any]:
+        operations = []
+        for operation in capture.operations:
+            # vyos_api_call() sends its commands as given; outbox entries are compiled by the drainer.
+            compiled = operation["commands"] if operation["via"] == "direct" else \
+                await compile_against_router(operation["commands"], operation["scopes"])
+            operations.append({**operation, "compiled": compiled})
+        commands = [c for operation in operations for c in operation["compiled"]]
+        subtrees = touched_subtrees(operations)
+        mirror = get_config_mirror()
+        now = datetime.utcnow()
+        plan = VyOSPlan(
+            id=str(uuid.uuid4()),
+            method=request.method,
+            path=request.url.path,
+            query=_replay_query(request),
+            body=(await request.body()).decode() or None,
+            status=PLAN_PLANNED,
+            operations=operations,
+            commands=commands,
+            diff=await diff_commands(commands),
+            cost=estimate_cost(operations, subtrees),
+            subtree_digests=[[list(path), await mirror.digest(*path)] for path in subtrees],
+            user_id=capture.user_id,
+            created_at=now,
+            expires_at=now + timedelta(seconds=self.ttl),
+        )
+        result = plan_to_dict(plan)
+        await self._ensure_table()
+        async with self.session_factory() as db:
+            db.add(plan)
+            await db.commit()
+        self.plans_created += 1
+        return result
+
+    async def get(self, plan_id: str) -> Optional[Dict[str, Any]]:
+        await self._ensure_table()
+        async with self.session_factory() as db:
+            plan = await db.get(VyOSPlan, plan_id)
+            return plan_to_dict(plan) if plan else None
+
+    async def _set_status(self, plan_id: str, status: str, result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        async with self.session_factory() as db:
+            plan = await db.get(VyOSPlan, plan_id)
+            plan.status = status
+            plan.result = result
+            if status == PLAN_APPLIED:
+                plan.applied_at = datetime.utcnow()
+            await db.commit()
+            await db.refresh(plan)
+            return plan_to_dict(plan)
+
+    async def apply(self, plan_id: str, request: Request) -> Optional[Dict[str, Any]]:
+        """Replay the planned request with the stored commands; None if the plan does not exist."""
+        await self._ensure_table()
+        async with self.session_factory() as db:
+            plan = await db.get(VyOSPlan, plan_id)
+            if plan is None:
+                return None
+            # Claim the plan so concurrent applies cannot both replay it.
+            claimed = await db.execute(
+                VyOSPlan.__table__.update()
+                .where(VyOSPlan.id == plan_id, VyOSPlan.status == PLAN_PLANNED)
+                .values(status="applying")
+            )
+            await db.commit()
+            if claimed.rowcount != 1:
+                raise PlanError(detail=f"Plan is {plan.status}, only planned plans can be applied", status_code=409)
+
+        if plan.expires_at and plan.expires_at < datetime.utcnow():
+            self.plans_stale += 1
+            await self._set_status(plan_id, PLAN_STALE, {"reason": "expired"})
+            raise PlanStaleError(detail="Plan has expired; plan it again.")
+        mirror = get_config_mirror()
+        changed = []
+        for path, digest in plan.subtree_digests or []:
+            mirror.invalidate(tuple(path))  # Compare with the router as it is now, not a cached copy
+            if await mirror.digest(*path) != digest:
+                changed.append(" ".join(path))
+        if changed:
+            self.plans_stale += 1
+            await self._set_status(plan_id, PLAN_STALE, {"reason": "router_changed", "subtrees": changed})
+            raise PlanStaleError(detail=f"Router config changed since the plan was made: {', '.join(changed)}")
+
+        capture = PlanCapture(stored_operations=plan.operations)
+        token = _current_plan.set(capture)
+        try:
+            status_code, body = await _replay(request, plan)
+        except Exception as e:
+            await self._set_status(plan_id, PLAN_FAILED, {"error": str(e)})
+            raise
+        finally:
+            _current_plan.reset(token)
+        result = {"status_code": status_code, "response": body, "unused_operations": capture.unused}
+        if status_code == 409:
+            # The DB no longer matches the plan (e.g. PlanStaleError from take() or a uniqueness conflict).
+            self.plans_stale += 1
+            return await self._set_status(plan_id, PLAN_STALE, result)
+        if status_code >= 400:
+            return await self._set_status(plan_id, PLAN_FAILED, result)
+        if capture.unused:
+            logger.warning(f"Plan {plan_id} applied, but {capture.unused} planned router operation(s) were not reached.")
+        self.plans_applied += 1
+        return await self._set_status(plan_id, PLAN_APPLIED, result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "plans_created": self.plans_created,
+            "plans_applied": self.plans_applied,
+            "plans_stale": self.plans_stale,
+            "ttl_seconds": self.ttl,
+        }
+
+
+_plan_store: Optional[PlanStore] = None
+
+
+def get_plan_store() -> PlanStore:
+    global _plan_store
+    if _plan_store is None:
+        _plan_store = PlanStore(ttl_seconds=get_vyos_plan_config()["TTL_SECONDS"])
+    return _plan_store